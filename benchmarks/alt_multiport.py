@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: a multi-port alt() under load, in a standalone TE environment
+# (local logger, no Testerman Server, no TACS).
+#
+# PTCs each send a burst of messages to their own MTC port. The MTC
+# consumes them all with a single alt() watching all these ports, with a
+# (never matching) control branch per port, a REPEATing data branch per
+# port, and a guard timer.
+#
+# Reports the number of messages handled per second and the number of
+# times the alt() had to wait for port notifications (select() calls
+# with a timeout).
+#
+# With --burst, the alt() is only entered once all messages were sent.
+#
+# Usage: benchmarks/alt_multiport.py [--ports N] [--count N] [--burst]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import TestermanTCI
+TestermanTCI.initialize(logFilename = None)
+import TestermanSA
+import TestermanPA
+TestermanSA.initialize(None)
+TestermanPA.initialize()
+
+import TestermanTTCN3
+from TestermanTTCN3 import *
+
+import optparse
+import select
+import time
+
+Results = {}
+
+class CountingSelect:
+	"""
+	Replaces the select module in TestermanTTCN3 to count the waits.
+	"""
+	error = select.error
+
+	def __init__(self):
+		self.waits = 0
+
+	def select(self, r, w, e, timeout = None):
+		if timeout != 0:
+			self.waits += 1
+		return select.select(r, w, e, timeout)
+
+class PTC_SENDER(Behaviour):
+	def body(self, count):
+		self['ctl'].receive('go')
+		for i in range(count):
+			self['out'].send({ 'type': 'data', 'seq': i })
+
+class TC_ALT_MULTIPORT(TestCase):
+	def body(self, ports, count, burst):
+		ptcs = []
+		for i in range(ports):
+			ptc = self.create(name = 'sender_%d' % i)
+			connect(ptc['out'], self.mtc['in_%d' % i])
+			connect(self.mtc['ctl_%d' % i], ptc['ctl'])
+			ptc.start(PTC_SENDER(), count = count)
+			ptcs.append(ptc)
+
+		received = [ 0 ]
+		def onData():
+			received[0] += 1
+			if received[0] < ports * count:
+				return REPEAT
+		alternatives = []
+		for i in range(ports):
+			alternatives.append([ self.mtc['in_%d' % i].RECEIVE({ 'type': 'control' }) ])
+		for i in range(ports):
+			alternatives.append([ self.mtc['in_%d' % i].RECEIVE({ 'type': 'data' }), onData ])
+		guard = Timer(120.0, name = 'guard')
+		alternatives.append([ guard.TIMEOUT ])
+
+		for i in range(ports):
+			self.mtc['ctl_%d' % i].send('go')
+		if burst:
+			for ptc in ptcs:
+				ptc.done()
+
+		counter = CountingSelect()
+		TestermanTTCN3.select = counter
+		start = time.time()
+		guard.start()
+		alt(alternatives)
+		Results['duration'] = time.time() - start
+		TestermanTTCN3.select = select
+		guard.stop()
+		Results['waits'] = counter.waits
+		Results['received'] = received[0]
+		for ptc in ptcs:
+			ptc.done()
+		setverdict("pass")
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--ports", dest = "ports", type = "int", default = 4, help = "number of watched ports, i.e. of sending PTCs (default: %default)")
+	parser.add_option("--count", dest = "count", type = "int", default = 5000, help = "number of messages sent per PTC (default: %default)")
+	parser.add_option("--burst", dest = "burst", action = "store_true", default = False, help = "only consume the messages once they were all sent")
+	(options, args) = parser.parse_args()
+
+	TC_ALT_MULTIPORT().execute(ports = options.ports, count = options.count, burst = options.burst)
+	print "received: %8d messages" % Results['received']
+	print "rate:     %8.0f messages/s" % (Results['received'] / Results['duration'])
+	print "waits:    %8d" % Results['waits']
+	TestermanPA.finalize()
+	TestermanSA.finalize()
+	os._exit(0)
+
+if __name__ == "__main__":
+	main()
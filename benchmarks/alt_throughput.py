@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: alt() throughput, in a standalone TE environment
+# (local logger, no Testerman Server, no TACS).
+#
+# A MTC sends structured messages to itself through two connected ports,
+# then consumes them with an alt() whose first branch mismatches and whose
+# second branch matches, i.e. one template mismatch and one template
+# match per message, as in a typical receiving loop.
+#
+# Runs with the default log levels (internal logs disabled), then with
+# all log levels enabled (the local logger discards the events: only the
+# log construction is measured).
+#
+# Usage: benchmarks/alt_throughput.py [--count N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import TestermanTCI
+TestermanTCI.initialize(logFilename = None)
+import TestermanSA
+import TestermanPA
+TestermanSA.initialize(None)
+TestermanPA.initialize()
+
+from TestermanTTCN3 import *
+
+import optparse
+import time
+
+Results = {}
+
+class TC_ALT_THROUGHPUT(TestCase):
+	def body(self, count):
+		source = self.mtc['source']
+		sink = self.mtc['sink']
+		connect(source, sink)
+		for i in range(count):
+			source.send({ 'type': 'data', 'seq': i, 'payload': [ 'item %d' % j for j in range(10) ], 'attributes': { 'a': 'b', 'c': ('choice', 1) } })
+		
+		start = time.time()
+		for i in range(count):
+			alt([
+				[ sink.RECEIVE({ 'type': 'control' }) ],
+				[ sink.RECEIVE({ 'type': 'data', 'payload': [ any_or_none(), 'item 9' ], 'attributes': { 'c': ('choice', any()) } }) ],
+			])
+		Results['alt'] = time.time() - start
+		setverdict("pass")
+
+def run(count):
+	TC_ALT_THROUGHPUT().execute(count = count)
+	return Results['alt']
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 5000, help = "number of received messages (default: %default)")
+	(options, args) = parser.parse_args()
+
+	TestermanTCI.enableLogs()
+	duration = run(options.count)
+	print "default log levels:   %8.0f alt()/s" % (options.count / duration)
+	TestermanTCI.enableDebugLogs()
+	duration = run(options.count)
+	print "all log levels:       %8.0f alt()/s" % (options.count / duration)
+	TestermanPA.finalize()
+	TestermanSA.finalize()
+	os._exit(0)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: BER decoding with Yapasn1 (plugins/codecs/ber).
+#
+# Decodes:
+# - the TCAP and MAP samples from ber/test_tcap.py and ber/test_map.py,
+#   reporting the time per decoded PDU,
+# - a TCAP Begin with an increasing number of components, reporting
+#   the time per component, that should not depend on the PDU size.
+#
+# Usage: benchmarks/ber_decoding.py [--count N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'codecs', 'ber'))
+
+import Yapasn1 as asn1
+import TcapAsn
+import MapAsn
+import TcapDialoguePdusAsn
+
+import binascii
+import optparse
+import time
+
+
+SAMPLES = [
+	# test_tcap.py/test_map.py: TCAP Begin with a dialogue portion and a sendRoutingInfoForSM invoke
+	('TCAP Begin', TcapAsn.TCMessage, "62644804000227846b3e283c060700118605010101a031602fa109060704000001001302be222820060704000001010101a015a01380099622123008016901f98106a807000000016c1ca11a02010102013b301204010f0405a3986c36028006a80700000001"),
+	# test_tcap.py: from gsm_map_with_ussd_string.pcap
+	('TCAP Begin (USSD)', TcapAsn.TCMessage, "626a48042f3b46026b3a2838060700118605010101a02d602b80020780a109060704000001001302be1a2818060704000001010101a00da00b80099656051124006913f66c26a12402010102013b301c04010f040eaa180da682dd6c31192d36bbdd468007917267415827f2"),
+	# test_tcap.py: sendRoutingInfoForSM argument
+	('MAP SRIforSM Arg', MapAsn.RoutingInfoForSM_Arg, "30158007910026151101008101ff820791261010101010"),
+	# test_tcap.py: dialogue portion of the first TCAP Begin sample
+	('TCAP DialoguePDU', TcapDialoguePdusAsn.DialoguePDU, "602fa109060704000001001302be222820060704000001010101a015a01380099622123008016901f98106a807000000016c1ca11a"[:98]),
+]
+
+def measure(pdu, buf, count):
+	start = time.time()
+	for i in xrange(count):
+		asn1.decode(pdu, buf)
+	return (time.time() - start) * 1000000 / count
+
+def tcapBegin(components):
+	invoke = ('invoke', { 'invokeID': 1, 'operationCode': ('localValue', 45), 'parameter': binascii.unhexlify("30158007910026151101008101ff820791261010101010") })
+	return asn1.encode(TcapAsn.TCMessage, ('begin', { 'otid': '\x00\x02\x27\x84', 'components': [ invoke ] * components }))
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 2000, help = "number of decodings per sample (default: %default)")
+	(options, args) = parser.parse_args()
+
+	for (name, pdu, encoded) in SAMPLES:
+		print "%-20s %4d bytes: %8.1f us/decoding" % (name, len(encoded) / 2, measure(pdu, binascii.unhexlify(encoded), options.count))
+
+	for components in [ 10, 100, 1000, 10000, 30000 ]:
+		buf = tcapBegin(components)
+		assert len(asn1.decode(TcapAsn.TCMessage, buf)[1]['components']) == components
+		count = max(1, options.count / components)
+		print "TCAP Begin, %4d components, %6d bytes: %8.1f us/component" % (components, len(buf), measure(TcapAsn.TCMessage, buf, count) / components)
+
+if __name__ == "__main__":
+	main()
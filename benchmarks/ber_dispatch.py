@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: selection of SEQUENCE fields and CHOICE alternatives with
+# tag dispatch tables in Yapasn1 (plugins/codecs/ber).
+#
+# Reports the import time of the compiled ASN.1 modules, then decodes:
+# - a SEQUENCE of --fields optional fields, with only its last field present,
+# - a CHOICE of --fields alternatives, with its last alternative selected,
+# - a TCAP Begin with 1000 components,
+# with the dispatch tables and with the linear tag matching used
+# when no table can be built (ANY fields), checking both decode the same value.
+#
+# Usage: benchmarks/ber_dispatch.py [--count N] [--fields N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'codecs', 'ber'))
+
+import time
+
+start = time.time()
+import Yapasn1 as asn1
+import TcapAsn
+import TcapDialoguePdusAsn
+import MapAsn
+importTime = time.time() - start
+
+import binascii
+import optparse
+
+
+def syntaxNodes(sn, ret):
+	"""
+	Collects the syntax nodes with a dispatch table in a syntax tree.
+	"""
+	if id(sn) in ret:
+		return
+	if isinstance(sn, asn1.SequenceSyntaxNode):
+		ret[id(sn)] = sn
+		for _, field, _, _ in sn._fields:
+			syntaxNodes(field, ret)
+	elif isinstance(sn, asn1.ChoiceSyntaxNode):
+		ret[id(sn)] = sn
+		for _, choice in sn._choices:
+			syntaxNodes(choice, ret)
+	elif isinstance(sn, asn1.SequenceOfSyntaxNode):
+		syntaxNodes(sn._syntaxNode, ret)
+
+def setDispatch(pdu, enabled):
+	"""
+	Resets (enabled) or disables the dispatch tables of a syntax tree.
+	"""
+	nodes = {}
+	syntaxNodes(pdu, nodes)
+	for sn in nodes.values():
+		if enabled:
+			sn._dispatch = None
+		else:
+			sn._dispatch = False
+
+def cases(fields):
+	"""
+	Returns a list of (name, pdu, value).
+	"""
+	seq = asn1.SEQUENCE([ ('f%d' % i, None, asn1.TYPE(asn1.IMPLICIT(i), asn1.OCTSTRING), 1, None) for i in range(fields) ], seq_name = 'Fields')
+	choice = asn1.CHOICE([ ('c%d' % i, None, asn1.TYPE(asn1.IMPLICIT(i), asn1.INTEGER)) for i in range(fields) ])
+	invoke = ('invoke', { 'invokeID': 1, 'operationCode': ('localValue', 45), 'parameter': binascii.unhexlify("30158007910026151101008101ff820791261010101010") })
+	return [
+		('SEQUENCE, last field', seq, { 'f%d' % (fields - 1): 'value' }),
+		('CHOICE, last choice', choice, ('c%d' % (fields - 1), 1)),
+		('TCAP Begin', TcapAsn.TCMessage, ('begin', { 'otid': '\x00\x02\x27\x84', 'components': [ invoke ] * 1000 })),
+	]
+
+def measure(pdu, buf, count):
+	start = time.time()
+	for i in xrange(count):
+		value = asn1.decode(pdu, buf)
+	return (value, (time.time() - start) * 1000000 / count)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 2000, help = "number of decodings per measure (default: %default)")
+	parser.add_option("--fields", dest = "fields", type = "int", default = 30, help = "number of SEQUENCE fields/CHOICE alternatives (default: %default)")
+	(options, args) = parser.parse_args()
+
+	print "ASN.1 modules imported in %.1f ms" % (importTime * 1000)
+	for (name, pdu, value) in cases(options.fields):
+		buf = asn1.encode(pdu, value)
+		count = max(1, options.count / (len(buf) / 100 + 1))
+		setDispatch(pdu, False)
+		(linear, linearTime) = measure(pdu, buf, count)
+		setDispatch(pdu, True)
+		(dispatched, dispatchTime) = measure(pdu, buf, count)
+		assert linear == dispatched == value, "%s: unexpected decoded value" % name
+		print "%-22s %6d bytes - linear matching: %10.1f us, dispatch tables: %10.1f us" % (name, len(buf), linearTime, dispatchTime)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: lazy BER decoding (tcap codec with lazy = True) of large
+# TCAP PDUs, when only a few fields are matched.
+#
+# Decodes a TCAP Begin with an increasing number of components, then
+# matches a template on its transaction ID and first component,
+# with the eager and the lazy decoding modes.
+# Checks the matching results, and that the lazily decoded messages
+# equal the eagerly decoded ones once fully accessed, or once
+# materialized as the TE does before storing a matched message (C-level
+# dict accesses included), and reports the time taken by each mode.
+#
+# Usage: benchmarks/ber_lazy_decoding.py [--count N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'codecs'))
+
+import TestermanTCI
+TestermanTCI.initialize(logFilename = None)
+
+import TestermanTTCN3
+from TestermanTTCN3 import *
+import CodecManager
+import TcapCodec
+
+import binascii
+import optparse
+import pickle
+import time
+
+
+def tcapBegin(components):
+	invoke = ('invoke', { 'invokeID': 1, 'operationCode': ('localValue', 45), 'parameter': binascii.unhexlify("30158007910026151101008101ff820791261010101010") })
+	return CodecManager.encode('tcap', ('begin', { 'otid': '\x00\x02\x27\x84', 'components': [ invoke ] * components }))[0]
+
+TEMPLATE = ('begin', {
+	'otid': '\x00\x02\x27\x84',
+	'components': [ ('invoke', { 'invokeID': 1, 'operationCode': ('localValue', 45) }), any_or_none() ],
+})
+
+def plain(value):
+	"""
+	Copies a decoded value with C-level dict accesses only.
+	"""
+	if isinstance(value, dict):
+		return dict([ (k, plain(v)) for (k, v) in dict(value).iteritems() ])
+	if isinstance(value, (list, tuple)):
+		return value.__class__([ plain(v) for v in value ])
+	return value
+
+def checkMaterialize(buf, eager):
+	lazy = CodecManager.decode('tcap', buf, lazy = True)[0]
+	assert plain(lazy) != eager
+	(result, decoded, _) = TestermanTTCN3.templateMatch(lazy, TEMPLATE)
+	assert result
+	TestermanTTCN3._materialize(decoded)
+	assert plain(decoded) == eager
+	d = {}
+	d.update(decoded[1])
+	assert d == eager[1]
+	assert (lambda **kwargs: kwargs)(**decoded[1]['components'][0][1]) == eager[1]['components'][0][1]
+
+def measure(buf, lazy, count):
+	"""
+	Returns the time per decoding + matching, in us.
+	"""
+	start = time.time()
+	for i in xrange(count):
+		(message, _) = CodecManager.decode('tcap', buf, lazy = lazy)
+		(result, _, _) = TestermanTTCN3.templateMatch(message, TEMPLATE)
+		assert result
+	return (time.time() - start) * 1000000 / count
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 20000, help = "number of decoded components per measure (default: %default)")
+	(options, args) = parser.parse_args()
+
+	for components in [ 1, 10, 100, 1000, 10000 ]:
+		buf = tcapBegin(components)
+		eager = CodecManager.decode('tcap', buf)[0]
+		lazy = CodecManager.decode('tcap', buf, lazy = True)[0]
+		assert lazy == eager
+		assert pickle.loads(pickle.dumps(CodecManager.decode('tcap', buf, lazy = True)[0])) == eager
+		checkMaterialize(buf, eager)
+		count = max(1, options.count / components)
+		print "TCAP Begin, %5d components, %6d bytes - eager: %10.1f us, lazy: %10.1f us" % (components, len(buf), measure(buf, False, count), measure(buf, True, count))
+	TestermanTCI.finalize()
+
+if __name__ == "__main__":
+	main()
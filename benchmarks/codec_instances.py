@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: CodecManager encode/decode calls on small messages, where the
+# codec instance management is significant.
+#
+# Encodes then decodes small messages with the tbcd and gsm.AddressString
+# codecs (plugins/codecs/Telephony.py), with a configured alias, and with
+# overriding properties.
+# Reports the time per encode+decode call pair and the number of codec
+# instances created.
+#
+# With --uncached, the codec instance cache is invalidated before each
+# call, i.e. a codec instance is created for each call, for comparison.
+#
+# Usage: benchmarks/codec_instances.py [--count N] [--uncached]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'codecs'))
+
+import CodecManager
+import Telephony
+
+import optparse
+import time
+
+
+class InstanceCounter:
+	"""
+	Wraps CodecManager._getCodecInstance() to count the created instances.
+	"""
+	def __init__(self, manager, uncached):
+		self.count = 0
+		self._manager = manager
+		self._getCodecInstance = manager._getCodecInstance
+		self._uncached = uncached
+		manager._getCodecInstance = self.getCodecInstance
+
+	def getCodecInstance(self, name):
+		self.count += 1
+		return self._getCodecInstance(name)
+
+	def invalidate(self):
+		if self._uncached:
+			self._manager._generation += 1
+
+def run(name, codec, message, properties, count, counter):
+	counter.count = 0
+	start = time.time()
+	for i in range(count):
+		counter.invalidate()
+		(encoded, _) = CodecManager.encode(codec, message, **properties)
+		counter.invalidate()
+		(decoded, _) = CodecManager.decode(codec, encoded, **properties)
+	duration = time.time() - start
+	assert decoded == message
+	print "%-28s %8.2f us/encode+decode, %6d instances" % (name, duration * 1000000 / count, counter.count)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 100000, help = "number of encode+decode calls per measure (default: %default)")
+	parser.add_option("--uncached", dest = "uncached", action = "store_true", default = False, help = "create a codec instance for each call")
+	(options, args) = parser.parse_args()
+
+	CodecManager.alias('bench.AddressString', 'gsm.AddressString', unused = 'value')
+	counter = InstanceCounter(CodecManager.instance(), options.uncached)
+	address = { 'digits': '9065341287', 'numberingPlanIndicator': 'isdn', 'natureOfAddress': 'international' }
+	run("tbcd", 'tbcd', '0123456789', {}, options.count, counter)
+	run("gsm.AddressString", 'gsm.AddressString', address, {}, options.count, counter)
+	run("alias", 'bench.AddressString', address, {}, options.count, counter)
+	run("overriding properties", 'tbcd', '0123456789', { 'unused': 1 }, options.count, counter)
+
+if __name__ == "__main__":
+	main()
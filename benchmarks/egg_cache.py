@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: TE egg preparation, with and without the egg cache
+# (core/EggCache.py).
+#
+# Builds an egg the way AtsJob.prepare() does (TE syntax check,
+# temporary source tree, deflated zip file) from a generated ATS and
+# --modules userland dependencies, then retrieves it from the cache
+# under the same key.
+# Checks the cache hits, misses and size-bounded eviction, and reports
+# the time taken by a build and by a cache hit.
+#
+# Usage: benchmarks/egg_cache.py [--modules N] [--lines N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import ConfigManager
+import CounterManager
+import EggCache
+
+import compiler
+import optparse
+import parser
+import shutil
+import tempfile
+import time
+import zipfile
+
+
+def generateModule(name, lines):
+	return ''.join([ "def %s_f%d(x):\n\treturn x + %d\n\n" % (name, i, i) for i in range(lines) ])
+
+def buildEgg(directory, te, dependencies):
+	"""
+	Builds directory/ats.egg as AtsJob.prepare() does.
+	"""
+	parser.suite(te).compile()
+	compiler.parse(te)
+	os.mkdir(directory + '/src')
+	sources = [ '__main__.py' ]
+	f = open(directory + '/src/__main__.py', 'w')
+	f.write(te)
+	f.close()
+	for (filename, content) in dependencies:
+		f = open('%s/src/%s' % (directory, filename), 'w')
+		f.write(content)
+		f.close()
+		sources.append(filename)
+	egg = zipfile.ZipFile(directory + '/ats.egg', 'w', zipfile.ZIP_DEFLATED)
+	for s in sources:
+		egg.write('%s/src/%s' % (directory, s), s)
+	egg.close()
+	shutil.rmtree(directory + '/src')
+
+def counter(name):
+	return CounterManager.instance().get("server.ts.eggcache.%s" % name) or 0
+
+def main():
+	parser_ = optparse.OptionParser()
+	parser_.add_option("--modules", dest = "modules", type = "int", default = 50, help = "number of userland dependencies (default: %default)")
+	parser_.add_option("--lines", dest = "lines", type = "int", default = 500, help = "number of functions per module (default: %default)")
+	(options, args) = parser_.parse_args()
+
+	cm = ConfigManager.instance()
+	cm.register("testerman.te.egg_cache.max_size", 256*1024*1024, dynamic = True)
+
+	root = tempfile.mkdtemp()
+	try:
+		cache = EggCache.EggCache(root + '/cache')
+		te = generateModule('ats', options.lines)
+		dependencies = [ ('module%d.py' % i, generateModule('m%d' % i, options.lines)) for i in range(options.modules) ]
+		key = EggCache.getKey([ te ] + [ x for dep in dependencies for x in dep ])
+
+		# Miss, then build and store
+		job = tempfile.mkdtemp(dir = root)
+		start = time.time()
+		assert not cache.get(key, job + '/ats.egg')
+		buildEgg(job, te, dependencies)
+		cache.put(key, job + '/ats.egg')
+		build = time.time() - start
+		assert counter('misses') == 1
+
+		# Hit
+		job2 = tempfile.mkdtemp(dir = root)
+		start = time.time()
+		assert cache.get(key, job2 + '/ats.egg')
+		hit = time.time() - start
+		assert counter('hits') == 1
+		assert open(job2 + '/ats.egg').read() == open(job + '/ats.egg').read()
+		assert sorted(zipfile.ZipFile(job2 + '/ats.egg').namelist()) == sorted([ '__main__.py' ] + [ f for f, c in dependencies ])
+		# The cached egg survives the job egg removal
+		shutil.rmtree(job)
+		shutil.rmtree(job2)
+		job = tempfile.mkdtemp(dir = root)
+		assert cache.get(key, job + '/ats.egg')
+
+		# A cache reloaded from its directory keeps its content
+		cache = EggCache.EggCache(root + '/cache')
+		assert cache.get(key, job + '/ats2.egg')
+
+		# Eviction: room for 2 eggs only, the least recently used is evicted
+		size = os.path.getsize(job + '/ats.egg')
+		cm.set_user("testerman.te.egg_cache.max_size", size * 2 + size / 2)
+		cache.put('b', job + '/ats.egg')
+		time.sleep(0.01)
+		assert cache.get(key, job + '/ats3.egg')
+		cache.put('c', job + '/ats.egg')
+		assert counter('evictions') == 1
+		assert cache.get(key, job + '/ats4.egg')
+		assert not cache.get('b', job + '/ats5.egg')
+		assert cache.get('c', job + '/ats5.egg')
+		assert len(os.listdir(root + '/cache')) == 2
+
+		print "egg: %d modules, %d bytes - build: %8.2f ms, cache hit: %8.2f ms" % (options.modules, size, build * 1000, hit * 1000)
+		print "hits: %d, misses: %d, evictions: %d" % (counter('hits'), counter('misses'), counter('evictions'))
+	finally:
+		shutil.rmtree(root)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: job scheduler (JobManager.Scheduler) and TE admission
+# control (ts.jobscheduler.max_running_tes).
+#
+# Submits ATS jobs whose TEs are simulated (they just sleep), with
+# --retained completed jobs and deferred jobs in the queue.
+# Checks that the jobs start in order of their scheduled start times,
+# that no more than --max-running-tes TEs run at the same time, that
+# rescheduled and cancelled jobs are handled, that jobs cancelled or killed
+# while waiting for a TE slot (as campaign children) stop waiting at once,
+# and reports the delay between the scheduled and the actual start times.
+#
+# Usage: benchmarks/job_scheduler.py [--jobs N] [--retained N] [--max-running-tes N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import ConfigManager
+import JobManager
+
+import logging
+import optparse
+import threading
+import time
+
+
+class SimulatedAtsJob(JobManager.AtsJob):
+	"""
+	An ATS job whose TE just sleeps.
+	"""
+	# Shared by all jobs
+	mutex = threading.RLock()
+	running = 0
+	maxRunning = 0
+	started = []
+
+	def __init__(self, name, duration):
+		JobManager.AtsJob.__init__(self, name, '', '/repository/%s.ats' % name)
+		self.duration = duration
+		self.actualStartTime = None
+
+	def prepare(self):
+		self.setState(self.STATE_WAITING)
+
+	# No event manager, no log file
+	def notifyStateChange(self):
+		pass
+
+	def closeLog(self):
+		pass
+
+	def preRun(self):
+		pass
+
+	def _runTe(self, inputSession):
+		self.actualStartTime = time.time()
+		cls = SimulatedAtsJob
+		cls.mutex.acquire()
+		cls.running += 1
+		cls.maxRunning = max(cls.maxRunning, cls.running)
+		cls.started.append(self)
+		cls.mutex.release()
+		self.setState(self.STATE_RUNNING)
+		time.sleep(self.duration)
+		cls.mutex.acquire()
+		cls.running -= 1
+		cls.mutex.release()
+		self.setResult(0)
+		self.setState(self.STATE_COMPLETE)
+		return 0
+
+def waitFor(predicate, timeout = 30.0):
+	start = time.time()
+	while not predicate():
+		assert time.time() - start < timeout, "timeout"
+		time.sleep(0.01)
+
+def checkBackloggedSignals(manager, maxRunningTes):
+	"""
+	Jobs run by a campaign (directly, not by the scheduler) and cancelled or
+	killed while waiting for a TE slot return without waiting for a slot.
+	"""
+	running = []
+	for i in range(maxRunningTes):
+		job = SimulatedAtsJob('long%d' % i, 2.0)
+		manager.registerJob(job)
+		job.prepare()
+		threading.Thread(target = job.run, args = ({}, )).start()
+		running.append(job)
+	waitFor(lambda: len([ j for j in running if j.getState() == j.STATE_RUNNING ]) == maxRunningTes)
+	for sig in [ JobManager.Job.SIGNAL_CANCEL, JobManager.Job.SIGNAL_KILL ]:
+		child = SimulatedAtsJob('child', 0)
+		manager.registerJob(child)
+		child.prepare()
+		thread = threading.Thread(target = child.run, args = ({}, ))
+		thread.start()
+		waitFor(lambda: manager._admissionControl.getBacklogSize() == 1)
+		start = time.time()
+		manager.sendSignal(child.getId(), sig)
+		thread.join(1.0)
+		assert not thread.isAlive(), "job still waiting for a TE slot after signal %s" % sig
+		assert manager._admissionControl.getBacklogSize() == 0
+		assert not child.actualStartTime
+		print "signal %s to a job waiting for a TE slot handled in %8.2f ms" % (sig, (time.time() - start) * 1000)
+	waitFor(lambda: len([ j for j in running if j.isFinished() ]) == maxRunningTes)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--jobs", dest = "jobs", type = "int", default = 50, help = "number of jobs to run (default: %default)")
+	parser.add_option("--retained", dest = "retained", type = "int", default = 20000, help = "number of completed and deferred jobs in the queue (default: %default)")
+	parser.add_option("--max-running-tes", dest = "maxRunningTes", type = "int", default = 4, help = "maximum number of concurrently running TEs (default: %default)")
+	(options, args) = parser.parse_args()
+
+	logging.basicConfig(level = logging.ERROR)
+	cm = ConfigManager.instance()
+	cm.register("ts.jobscheduler.interval", 1000, dynamic = True)
+	cm.register("ts.jobscheduler.max_running_tes", options.maxRunningTes, dynamic = True)
+	cm.register("testerman.var_root", "")
+	cm.register("testerman.document_root", "/tmp")
+
+	manager = JobManager.instance()
+	manager.start()
+	try:
+		# Retained jobs: half completed, half deferred for a day
+		for i in range(options.retained):
+			job = SimulatedAtsJob('retained%d' % i, 0)
+			if i % 2:
+				job.setState(job.STATE_COMPLETE)
+				manager.registerJob(job)
+			else:
+				job.setScheduledStartTime(time.time() + 86400)
+				manager.submitJob(job)
+
+		# Jobs due in a few ms, in reverse submission order
+		now = time.time()
+		jobs = []
+		for i in range(options.jobs):
+			job = SimulatedAtsJob('job%d' % i, 0.02)
+			job.setScheduledStartTime(now + 0.5 + (options.jobs - i) * 0.001)
+			manager.submitJob(job)
+			jobs.append(job)
+		# A cancelled job never starts
+		cancelled = SimulatedAtsJob('cancelled', 0.02)
+		cancelled.setScheduledStartTime(now + 0.5)
+		manager.submitJob(cancelled)
+		manager.sendSignal(cancelled.getId(), JobManager.Job.SIGNAL_CANCEL)
+		# A job rescheduled to an earlier time starts at the new time
+		rescheduled = SimulatedAtsJob('rescheduled', 0)
+		rescheduled.setScheduledStartTime(now + 3600)
+		manager.submitJob(rescheduled)
+		assert manager.rescheduleJob(rescheduled.getId(), now + 0.2)
+		waitFor(lambda: rescheduled.isFinished())
+		rescheduledDelay = rescheduled.actualStartTime - rescheduled.getScheduledStartTime()
+
+		waitFor(lambda: len([ j for j in jobs if j.isFinished() ]) == len(jobs))
+		assert not cancelled.actualStartTime
+		assert cancelled.getState() == cancelled.STATE_CANCELLED
+		if options.maxRunningTes > 0:
+			assert SimulatedAtsJob.maxRunning <= options.maxRunningTes, "too many running TEs: %d" % SimulatedAtsJob.maxRunning
+			assert SimulatedAtsJob.maxRunning == min(options.maxRunningTes, options.jobs)
+		# FIFO: started in the order they were due (TEs granted at the same time
+		# may start in any order, as they are started from different threads)
+		started = [ j for j in SimulatedAtsJob.started if j in jobs ]
+		due = sorted(jobs, key = lambda j: j.getScheduledStartTime())
+		window = (options.maxRunningTes > 0 and options.maxRunningTes) or len(jobs)
+		assert len(started) == len(jobs)
+		for i in range(len(started)):
+			assert abs(due.index(started[i]) - i) < window, "jobs not started in order"
+		assert manager._admissionControl.getBacklogSize() == 0
+
+		if options.maxRunningTes > 0:
+			checkBackloggedSignals(manager, options.maxRunningTes)
+
+		# Start delays of the jobs that were not delayed by the admission control
+		delays = [ j.actualStartTime - j.getScheduledStartTime() for j in started[:max(options.maxRunningTes, 1)] ]
+		print "%d jobs, %d retained jobs, max %d running TEs (observed: %d)" % (options.jobs, options.retained, options.maxRunningTes, SimulatedAtsJob.maxRunning)
+		print "start delay: %8.2f ms (max %8.2f ms), rescheduled job: %8.2f ms" % (sum(delays) * 1000 / len(delays), max(delays) * 1000, rescheduledDelay * 1000)
+		queue = manager._jobStore.getJobs()
+		start = time.time()
+		filter(lambda x: (x.getParent() is None) and (x.getState() == JobManager.Job.STATE_WAITING), queue)
+		print "queue scan by the former scheduler, on each tick: %8.2f ms" % ((time.time() - start) * 1000)
+	finally:
+		manager.stop()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: job queue lookups (JobManager.JobStore).
+#
+# Fills the job queue with --jobs jobs (root jobs and campaign children,
+# in various states, from several users), then compares the
+# JobManager lookups and getJobInfo() filters and pagination with
+# linear scans of the queue, as done before the job store.
+# Also checks that the indexes survive state changes, purges, and
+# a persist/restore cycle.
+#
+# Usage: benchmarks/job_store.py [--jobs N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import ConfigManager
+import JobManager
+
+import copy_reg
+import logging
+import optparse
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+
+Job = JobManager.Job
+
+class BenchmarkJob(Job):
+	_type = "ats"
+
+	# No event manager, no log file
+	def notifyStateChange(self):
+		pass
+
+	def closeLog(self):
+		pass
+
+def linearGetJobInfo(jobs, id_ = None, filters = None, offset = 0, limit = None):
+	"""
+	getJobInfo() implemented with a queue scan.
+	"""
+	filters = filters or {}
+	states = filters.get('state')
+	if isinstance(states, basestring):
+		states = [ states ]
+	ret = []
+	for job in jobs:
+		if id_ is not None:
+			if job.getId() == id_:
+				ret.append(job)
+			continue
+		if states is not None and not job.getState() in states:
+			continue
+		if filters.get('parent-id') is not None and ((job.getParent() and job.getParent().getId()) or 0) != filters['parent-id']:
+			continue
+		if filters.get('username') is not None and job.getUsername() != filters['username']:
+			continue
+		t = job._startTime or job.getScheduledStartTime()
+		if filters.get('since') is not None and t < filters['since']:
+			continue
+		if filters.get('until') is not None and t >= filters['until']:
+			continue
+		ret.append(job)
+	if limit is None:
+		ret = ret[offset:]
+	else:
+		ret = ret[offset:offset + limit]
+	return [ job.toDict() for job in ret ]
+
+def measure(f, count):
+	start = time.time()
+	for i in range(count):
+		f()
+	return (time.time() - start) * 1000 / count
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--jobs", dest = "jobs", type = "int", default = 20000, help = "number of jobs in the queue (default: %default)")
+	parser.add_option("--count", dest = "count", type = "int", default = 20, help = "number of calls per measure (default: %default)")
+	(options, args) = parser.parse_args()
+
+	logging.basicConfig(level = logging.ERROR)
+	copy_reg.pickle(threading._RLock, lambda x: (threading._RLock, (None,)))
+	cm = ConfigManager.instance()
+	cm.register("ts.jobscheduler.interval", 1000, dynamic = True)
+	cm.register("ts.jobscheduler.max_running_tes", 0, dynamic = True)
+	cm.register("testerman.var_root", "")
+	cm.register("testerman.document_root", "/tmp")
+
+	random.seed(0)
+	manager = JobManager.instance()
+	jobs = []
+	now = time.time()
+	campaign = None
+	for i in range(options.jobs):
+		job = BenchmarkJob('job%d' % i)
+		job.setUsername(random.choice([ 'alice', 'bob', 'carol' ]))
+		# Past start times (setScheduledStartTime() would reset them to now)
+		job._scheduledStartTime = now - 86400 + i
+		if i % 10 == 0:
+			campaign = job
+		elif i % 10 < 4:
+			campaign.addChild(job, Job.BRANCH_SUCCESS)
+		manager.registerJob(job)
+		jobs.append(job)
+	# State changes after registration
+	for job in jobs:
+		state = random.choice([ Job.STATE_COMPLETE ] * 8 + [ Job.STATE_WAITING, Job.STATE_RUNNING, Job.STATE_ERROR ])
+		if state != Job.STATE_WAITING:
+			job.setState(Job.STATE_RUNNING)
+			job._startTime = job.getScheduledStartTime() + 1
+		job.setState(state)
+
+	someId = jobs[len(jobs) / 2].getId()
+	queries = [
+		('getJobInfo(id)', dict(id_ = someId)),
+		('getJobInfo()', dict()),
+		('running jobs', dict(filters = { 'state': Job.STATE_RUNNING })),
+		('waiting root jobs of bob', dict(filters = { 'state': [ Job.STATE_WAITING ], 'parent-id': 0, 'username': 'bob' })),
+		('children of a campaign', dict(filters = { 'parent-id': jobs[10].getId() })),
+		('last hour, page 2', dict(filters = { 'since': now - 3600, 'until': now }, offset = 50, limit = 50)),
+	]
+
+	def check():
+		for (name, kwargs) in queries:
+			assert manager.getJobInfo(**kwargs) == linearGetJobInfo(jobs, **kwargs), "%s: different results" % name
+		assert manager.getWaitingRootJobs() == [ j for j in jobs if j.getParent() is None and j.getState() == Job.STATE_WAITING ]
+		job = jobs[len(jobs) / 2]
+		assert manager.getJob(job.getId()) is job
+		assert manager.getJob(-1) is None
+	check()
+
+	print "%d jobs in queue" % len(jobs)
+	print "%-28s %10s %10s" % ('', 'scan', 'indexed')
+	for (name, kwargs) in queries:
+		print "%-28s %7.3f ms %7.3f ms" % (name, measure(lambda: linearGetJobInfo(jobs, **kwargs), options.count), measure(lambda: manager.getJobInfo(**kwargs), options.count))
+	print "%-28s %7.3f ms %7.3f ms" % ('getWaitingRootJobs()',
+		measure(lambda: [ j for j in jobs if j.getParent() is None and j.getState() == Job.STATE_WAITING ], options.count),
+		measure(lambda: manager.getWaitingRootJobs(), options.count))
+	print "%-28s %7.3f ms %7.3f ms" % ('getJob(id)',
+		measure(lambda: [ j for j in jobs if j.getId() == someId ], options.count),
+		measure(lambda: manager.getJob(someId), options.count))
+
+	# Purge: only completed trees
+	older_than = now - 86400 + len(jobs) / 2 + 1
+	for j in jobs:
+		# Stop times in the past, as the jobs were created
+		if j._stopTime:
+			j._stopTime = j.getScheduledStartTime() + 2
+	expected = [ j for j in jobs if not (manager.isBottomUpTreeCompleted(j) and j._stopTime < older_than) ]
+	assert len(expected) < len(jobs)
+	assert manager.purgeJobs(older_than) == len(jobs) - len(expected)
+	jobs = expected
+	check()
+
+	# Persist/restore
+	directory = tempfile.mkdtemp()
+	try:
+		cm.set_actual("testerman.var_root", directory)
+		manager.persist()
+		JobManager.TheJobManager = None
+		manager = JobManager.instance()
+		manager.restore()
+		restored = dict([ (j.getId(), j) for j in manager._jobStore.getJobs() ])
+		assert sorted(restored.keys()) == [ j.getId() for j in jobs ]
+		# Running jobs are marked as crashed on restore
+		for j in jobs:
+			if j.getState() == Job.STATE_RUNNING:
+				j._state = Job.STATE_CRASHED
+		jobs = [ restored[j.getId()] for j in jobs ]
+		check()
+		print "%d jobs left after purge and restore" % len(jobs)
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: list template matching on long lists, with wildcards (*),
+# ifpresent elements, superset() and subset().
+#
+# Each case is matched with templateMatch() (interpreted) and by a branch
+# condition (compiled template), checking the expected matching result
+# and decoded list, and reports the time taken by each.
+#
+# Usage: benchmarks/list_match.py [--size N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import TestermanTCI
+TestermanTCI.initialize(logFilename = None)
+
+import TestermanTTCN3
+from TestermanTTCN3 import *
+
+import optparse
+import time
+
+
+def cases(n):
+	"""
+	Returns a list of (name, message, template, expected result, expected decoded message).
+	"""
+	message = range(n)
+	return [
+		('exact', message, range(n), True, message),
+		('exact, last mismatch', message, range(n - 1) + [ -1 ], False, message),
+		('[*, last]', message, [ any_or_none(), n - 1 ], True, message),
+		('[first, *]', message, [ 0, any_or_none() ], True, message),
+		('[*, middle, *, last]', message, [ any_or_none(), n / 2, any_or_none(), n - 1 ], True, message),
+		('[*, missing, *]', message, [ any_or_none(), -1, any_or_none() ], False, None),
+		('[*, 3, *, missing]', message, [ any_or_none(), 3, any_or_none(), -1 ], False, None),
+		('[*, *, ..., missing]', message, [ any_or_none() ] * 10 + [ -1 ], False, None),
+		('[ifpresent * n]', message, [ ifpresent(i) for i in range(n) ], True, message),
+		('[ifpresent(-1) * n]', [], [ ifpresent(-1) ] * n, True, []),
+		('[*, extract(n/2), *]', message, [ any_or_none(), extract(n / 2, 'middle'), any_or_none() ], True, message),
+		('[with_, *]', message, [ with_(lambda x: x + 1, 1), any_or_none() ], True, [ 1 ] + message[1:]),
+		('superset', message, superset(0, n / 2, n - 1), True, message),
+		('subset', message, subset(any()), True, message),
+	]
+
+def run(name, message, template, expectedResult, expectedDecoded):
+	start = time.time()
+	(result, decoded, _) = TestermanTTCN3.templateMatch(message, template)
+	interpreted = time.time() - start
+	assert result == expectedResult, "%s: unexpected interpreted matching result" % name
+	if expectedDecoded is not None:
+		assert decoded == expectedDecoded, "%s: unexpected interpreted decoded message" % name
+
+	condition = TestermanTTCN3._BranchCondition(None, template)
+	# Compiled on the first match
+	condition.match(message)
+	start = time.time()
+	(result, decoded, _) = condition.match(message)
+	compiled = time.time() - start
+	assert result == expectedResult, "%s: unexpected compiled matching result" % name
+	if expectedDecoded is not None:
+		assert decoded == expectedDecoded, "%s: unexpected compiled decoded message" % name
+
+	print "%-22s %-8s interpreted: %8.2f ms, compiled: %8.2f ms" % (name, result and "match" or "mismatch", interpreted * 1000, compiled * 1000)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--size", dest = "size", type = "int", default = 10000, help = "number of list elements (default: %default)")
+	(options, args) = parser.parse_args()
+
+	for (name, message, template, expectedResult, expectedDecoded) in cases(options.size):
+		run(name, message, template, expectedResult, expectedDecoded)
+	TestermanTCI.finalize()
+
+if __name__ == "__main__":
+	main()
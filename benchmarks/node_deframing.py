@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: node protocol deframing of multi-megabyte frames
+# (large LOG or TRI-ENQUEUE-MSG payloads) received in 64K segments.
+#
+# Compares the previous join+split implementation (rescanning the whole
+# buffer on each segment) with TestermanNodes.PacketDeframer.
+# The deframer time should grow linearly with the frame size.
+#
+# Usage: benchmarks/node_deframing.py [--max-size MB]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import TestermanNodes as Nodes
+
+import optparse
+import socket
+import threading
+import time
+
+SEGMENT_SIZE = 65535
+
+def joinSplitDeframing(segments):
+	"""
+	The previous TcpPacketizer implementation.
+	"""
+	buf = ''
+	packets = []
+	for read in segments:
+		buf = ''.join([buf, read])
+		pdus = buf.split('\x00')
+		packets += pdus[:-1]
+		buf = pdus[-1]
+	return packets
+
+def deframerDeframing(segments):
+	deframer = Nodes.PacketDeframer()
+	packets = []
+	for read in segments:
+		deframer.feed(read)
+		packets += deframer.packets()
+	return packets
+
+def socketDeframing(stream):
+	"""
+	recv_into() path, through a local socket pair.
+	"""
+	a, b = socket.socketpair()
+	def writer():
+		a.sendall(stream)
+		a.close()
+	t = threading.Thread(target = writer)
+	t.start()
+	deframer = Nodes.PacketDeframer()
+	packets = []
+	while deframer.recv(b):
+		packets += deframer.packets()
+	t.join()
+	b.close()
+	return packets
+
+def measure(f, arg):
+	start = time.time()
+	ret = f(arg)
+	return time.time() - start, ret
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--max-size", dest = "maxSize", type = "int", default = 16, help = "largest frame size, in MB (default: %default)")
+	parser.add_option("--skip-legacy-above", dest = "legacyMaxSize", type = "int", default = 8, help = "do not run the legacy implementation for frames larger than this size, in MB (default: %default)")
+	(options, args) = parser.parse_args()
+
+	print "%10s %16s %16s %16s" % ("frame (MB)", "join+split (s)", "deframer (s)", "recv_into (s)")
+	size = 1
+	while size <= options.maxSize:
+		frame = 'x' * (size * 1024 * 1024)
+		stream = frame + '\x00' + frame + '\x00'
+		segments = [ stream[i:i+SEGMENT_SIZE] for i in range(0, len(stream), SEGMENT_SIZE) ]
+		
+		if size <= options.legacyMaxSize:
+			legacy, packets = measure(joinSplitDeframing, segments)
+			assert packets == [ frame, frame ]
+			legacy = "%.3f" % legacy
+		else:
+			legacy = "skipped"
+		deframer, packets = measure(deframerDeframing, segments)
+		assert packets == [ frame, frame ]
+		sock, packets = measure(socketDeframing, stream)
+		assert packets == [ frame, frame ]
+		print "%10d %16s %16.3f %16.3f" % (size, legacy, deframer, sock)
+		size *= 2
+
+if __name__ == "__main__":
+	main()
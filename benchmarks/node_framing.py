@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: legacy (\x00-terminated) vs length-prefixed framing
+# for messages carrying binary payloads (TRI-SEND-like pickled bodies).
+#
+# Measures a full encode, frame, deframe, parse and getApplicationBody()
+# cycle, for increasing payload sizes.
+# Also checks that tracing a request (str()) before sending it, as
+# BaseNode does, does not change its length-prefixed encoding.
+#
+# Usage: benchmarks/node_framing.py [--max-size KB] [--count N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import TestermanNodes as Nodes
+import TestermanMessages as Messages
+
+import optparse
+import time
+
+SEGMENT_SIZE = 65535
+
+def cycle(payload, count, lengthPrefixed):
+	deframer = Nodes.PacketDeframer()
+	start = time.time()
+	for i in range(count):
+		request = Messages.Request("TRI-SEND", "probe:bench@agent", "Ia", "1.0")
+		request.setHeader("Transaction-Id", i)
+		request.setApplicationBody({ 'message': payload, 'sut-address': None }, Messages.Message.CONTENT_TYPE_PYTHON_PICKLE)
+		data = deframer.frame(request.encode(lengthPrefixed), lengthPrefixed)
+		for j in range(0, len(data), SEGMENT_SIZE):
+			deframer.feed(data[j:j+SEGMENT_SIZE])
+			for packet in deframer.packets():
+				assert Messages.parse(packet).getApplicationBody()['message'] == payload
+	return time.time() - start
+
+def checkTrace():
+	request = Messages.Request("TRI-SEND", "probe:bench@agent", "Ia", "1.0")
+	request.setApplicationBody({ 'message': os.urandom(1024) }, Messages.Message.CONTENT_TYPE_PYTHON_PICKLE)
+	expected = request.encode(True)
+	str(request)
+	assert request.encode(True) == expected, "tracing the request changed its encoding"
+	assert request.encode(False) == str(request)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--max-size", dest = "maxSize", type = "int", default = 4096, help = "largest payload size, in KB (default: %default)")
+	parser.add_option("--count", dest = "count", type = "int", default = 20, help = "messages per payload size (default: %default)")
+	(options, args) = parser.parse_args()
+
+	checkTrace()
+	print "%12s %16s %20s" % ("payload (KB)", "legacy (ms/msg)", "length-prefixed (ms/msg)")
+	size = 1
+	while size <= options.maxSize:
+		payload = os.urandom(size * 1024)
+		legacy = cycle(payload, options.count, False)
+		lengthPrefixed = cycle(payload, options.count, True)
+		print "%12d %16.3f %20.3f" % (size, legacy * 1000.0 / options.count, lengthPrefixed * 1000.0 / options.count)
+		size *= 4
+
+if __name__ == "__main__":
+	main()
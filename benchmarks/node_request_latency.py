@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Micro-benchmark: BaseNode.executeRequest() round-trip latency and
+# CPU usage, with several threads executing synchronous requests
+# at the same time (as TE threads do with TRI calls).
+#
+# Also measures the CPU consumed by threads waiting for responses
+# that do not come (server not answering), and checks that the response
+# timeout watchdog does not accumulate the answered requests.
+#
+# Usage: benchmarks/node_request_latency.py [--threads N] [--requests N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import TestermanMessages as Messages
+import TestermanNodes as Nodes
+
+import optparse
+import threading
+import time
+
+
+class EchoServer(Nodes.ListeningNode):
+	def __init__(self, address, answer = True):
+		Nodes.ListeningNode.__init__(self, "Bench/Server", "BenchServer")
+		self._answer = answer
+		self.initialize(address)
+
+	def onRequest(self, channel, transactionId, request):
+		if self._answer:
+			self.sendResponse(channel, transactionId, Messages.Response(200, "OK"))
+
+
+class Client(Nodes.ConnectingNode):
+	def __init__(self, address):
+		Nodes.ConnectingNode.__init__(self, None, "BenchClient")
+		self.initialize(address)
+
+
+def cpuTime():
+	t = os.times()
+	return t[0] + t[1]
+
+def run(port, nbThreads, nbRequests, answer, responseTimeout):
+	server = EchoServer(('127.0.0.1', port), answer)
+	server.start()
+	client = Client(('127.0.0.1', port))
+	client.start()
+	time.sleep(0.5)
+
+	latencies = []
+	mutex = threading.Lock()
+	def worker():
+		local = []
+		for i in range(nbRequests):
+			start = time.time()
+			client.executeRequest(0, Messages.Request("PING", "system:bench", "Bench", "1.0"), responseTimeout = responseTimeout)
+			local.append(time.time() - start)
+		mutex.acquire()
+		latencies.extend(local)
+		mutex.release()
+		
+	threads = [ threading.Thread(target = worker) for i in range(nbThreads) ]
+	cpu = cpuTime()
+	start = time.time()
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	duration = time.time() - start
+	cpu = cpuTime() - cpu
+
+	client.stop()
+	server.stop()
+
+	latencies.sort()
+	return dict(duration = duration, cpu = cpu, count = len(latencies),
+		average = sum(latencies) / len(latencies), median = latencies[len(latencies) / 2],
+		p99 = latencies[int(len(latencies) * 0.99)])
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--threads", dest = "threads", type = "int", default = 8, help = "number of concurrent requesting threads (default: %default)")
+	parser.add_option("--requests", dest = "requests", type = "int", default = 500, help = "number of requests per thread (default: %default)")
+	parser.add_option("--port", dest = "port", type = "int", default = 47001, help = "local port to use (default: %default)")
+	(options, args) = parser.parse_args()
+
+	print "Round-trip: %d threads x %d synchronous requests" % (options.threads, options.requests)
+	r = run(options.port, options.threads, options.requests, True, 10.0)
+	print "  %d requests in %.3fs (%.0f req/s), CPU time %.3fs" % (r['count'], r['duration'], r['count'] / r['duration'], r['cpu'])
+	print "  latency: average %.1fus, median %.1fus, p99 %.1fus" % (r['average'] * 1e6, r['median'] * 1e6, r['p99'] * 1e6)
+	watchdog = Nodes.getResponseWaiterWatchdog()
+	assert watchdog._pending == 0
+	assert len(watchdog._waiters) <= 64, "answered requests accumulate in the watchdog"
+	assert not [ x for x in watchdog._waiters if x[2].response is not None ], "the watchdog keeps responses"
+	print "  watchdog: %d entries left for %d answered requests" % (len(watchdog._waiters), r['count'])
+
+	print "Waiting: %d threads x 1 unanswered request (2s timeout)" % options.threads
+	r = run(options.port + 1, options.threads, 1, False, 2.0)
+	print "  waited %.3fs, CPU time %.3fs (%.1f%% of a core)" % (r['duration'], r['cpu'], 100.0 * r['cpu'] / r['duration'])
+	
+	# Connectors may keep non-daemon threads a bit longer
+	os._exit(0)
+
+if __name__ == "__main__":
+	main()
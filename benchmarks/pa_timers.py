@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: TestermanPA timers, many concurrent timers.
+#
+# Starts N timers with durations spread over [duration, 2*duration] s,
+# stops every other one, then waits for the others to expire.
+# Measures the TRI start/stop costs, the expiry lateness (delay between
+# the expected expiry and the triTimeout() call), and the number of
+# threads used.
+#
+# With --threads, runs the same scenario with one threading.Timer per
+# timer (the previous PA implementation), for comparison.
+#
+# Usage: benchmarks/pa_timers.py [--count N] [--duration S] [--threads]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import TestermanTCI
+TestermanTCI.initialize(logFilename = None)
+import TestermanPA
+import TestermanTTCN3
+
+import optparse
+import threading
+import time
+
+
+class TimeoutRecorder:
+	"""
+	Replaces TestermanTTCN3.triTimeout() to record the timeout times.
+	"""
+	def __init__(self, count):
+		self.lateness = []
+		self.expectedExpiries = {}
+		self._count = count
+		self._mutex = threading.Lock()
+		self._done = threading.Event()
+
+	def triTimeout(self, timerId):
+		t = time.time()
+		self._mutex.acquire()
+		self.lateness.append(t - self.expectedExpiries[timerId])
+		if len(self.lateness) == self._count:
+			self._done.set()
+		self._mutex.release()
+
+	def wait(self, timeout):
+		self._done.wait(timeout)
+
+
+class ThreadedTimers:
+	"""
+	The previous PA timer implementation: one threading.Timer per timer.
+	"""
+	def __init__(self):
+		self._timers = {}
+		self._mutex = threading.RLock()
+
+	def _onTimeout(self, timerId):
+		self._mutex.acquire()
+		if not self._timers.has_key(timerId):
+			self._mutex.release()
+			return
+		del self._timers[timerId]
+		self._mutex.release()
+		TestermanTTCN3.triTimeout(timerId)
+
+	def triStartTimer(self, timerId, duration):
+		self._mutex.acquire()
+		t = threading.Timer(duration, lambda: self._onTimeout(timerId))
+		self._timers[timerId] = { 'timer': t, 'start': time.time() }
+		self._mutex.release()
+		t.start()
+
+	def triStopTimer(self, timerId):
+		self._mutex.acquire()
+		self._timers[timerId]['timer'].cancel()
+		del self._timers[timerId]
+		self._mutex.release()
+
+
+def run(pa, count, duration):
+	recorder = TimeoutRecorder(count - count / 2)
+	TestermanTTCN3.triTimeout = recorder.triTimeout
+
+	durations = [ duration + duration * i / count for i in range(count) ]
+	start = time.time()
+	for i in range(count):
+		recorder.expectedExpiries[i] = time.time() + durations[i]
+		pa.triStartTimer(i, durations[i])
+	startDuration = time.time() - start
+	threadCount = threading.activeCount()
+
+	start = time.time()
+	for i in range(0, count, 2):
+		pa.triStopTimer(i)
+	stopDuration = time.time() - start
+
+	recorder.wait(4 * duration + 30)
+	lateness = recorder.lateness
+	lateness.sort()
+	print "  start:      %8.1f us/timer" % (startDuration * 1000000 / count)
+	print "  stop:       %8.1f us/timer" % (stopDuration * 1000000 / (count / 2))
+	print "  threads:    %8d" % threadCount
+	print "  timeouts:   %8d/%d" % (len(lateness), count - count / 2)
+	if lateness:
+		print "  lateness:   %8.2f ms avg, %.2f ms p99, %.2f ms max" % (sum(lateness) * 1000 / len(lateness), lateness[len(lateness) * 99 / 100] * 1000, lateness[-1] * 1000)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 10000, help = "number of concurrent timers (default: %default)")
+	parser.add_option("--duration", dest = "duration", type = "float", default = 2.0, help = "minimum timer duration, in s (default: %default)")
+	parser.add_option("--threads", dest = "threads", action = "store_true", default = False, help = "also run with one thread per timer, for comparison")
+	(options, args) = parser.parse_args()
+
+	TestermanPA.initialize()
+	print "timer scheduler (%d timers):" % options.count
+	run(TestermanPA, options.count, options.duration)
+	TestermanPA.finalize()
+
+	if options.threads:
+		print "one thread per timer (%d timers):" % options.count
+		run(ThreadedTimers(), options.count, options.duration)
+	os._exit(0)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: probe and codec plugin scan on TE/agent startup,
+# importing all the plugin modules (as done before core/PluginManifest.py),
+# and with the lazy registrations from the plugin manifests.
+#
+# Works on a copy of the plugins/ tree, with a new manifest cache
+# directory, so that the manifests are generated from scratch. Each scan
+# runs in a new interpreter.
+# Checks that the lazy scan exposes the same probe types and codecs,
+# resolving to the same classes (from concurrent threads), as the eager
+# scan, that the manifests are not written to the plugin paths, that a
+# modified plugin is detected, and that a manifest generated at install
+# time is used, then reports the scan times.
+#
+# Usage: benchmarks/plugin_scan.py [--count N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import optparse
+import pickle
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+NEW_PLUGIN = """
+import CodecManager
+
+class BenchmarkCodec(CodecManager.Codec):
+	def encode(self, template):
+		return (template, 'benchmark')
+
+CodecManager.registerCodecClass('benchmark.codec', BenchmarkCodec)
+"""
+
+def eagerScan(paths):
+	"""
+	Imports all the plugins, as the TE did.
+	"""
+	for path in paths:
+		if not path in sys.path:
+			sys.path.append(path)
+	for path in paths:
+		for m in os.listdir(path):
+			if m.startswith('.') or m.startswith('__init__') or not (os.path.isdir(path + '/' + m) or m.endswith('.py')):
+				continue
+			if m.endswith('.py'):
+				m = m[:-3]
+			try:
+				__import__(m)
+			except Exception:
+				pass
+
+def getRegistrations(resolve):
+	"""
+	@rtype: tuple (dict, dict)
+	@returns: the registered probe types and codecs, with their
+	classes if resolve is set
+	"""
+	import CodecManager
+	import ProbeImplementationManager
+
+	probes = {}
+	for type_ in ProbeImplementationManager.getProbeImplementationTypes():
+		probes[type_] = None
+		if resolve:
+			class_ = ProbeImplementationManager.getProbeImplementationClass(type_)
+			probes[type_] = class_ and '%s.%s' % (class_.__module__, class_.__name__)
+	codecs = {}
+	for name in CodecManager.instance().getCodecNames():
+		codecs[name] = None
+		if resolve:
+			codec = CodecManager.instance()._getCodecInstance(name)
+			codecs[name] = codec and '%s.%s %r' % (codec.__class__.__module__, codec.__class__.__name__, sorted(codec._properties.items()))
+	return (probes, codecs)
+
+def child(mode, paths, resolve):
+	"""
+	Runs a scan in the current (new) interpreter, and prints
+	the scan time and the registrations on stdout.
+	The registrations are resolved from concurrent threads.
+	"""
+	import PluginManifest
+
+	start = time.time()
+	if mode == 'eager':
+		eagerScan(paths)
+	else:
+		PluginManifest.scanPlugins(paths)
+	duration = time.time() - start
+	modules = len(sys.modules)
+
+	if not resolve:
+		(probes, codecs) = getRegistrations(False)
+	else:
+		go = threading.Event()
+		results = []
+		def resolveRegistrations():
+			go.wait()
+			results.append(getRegistrations(True))
+		threads = [ threading.Thread(target = resolveRegistrations) for i in range(8) ]
+		for t in threads:
+			t.start()
+		go.set()
+		for t in threads:
+			t.join()
+		assert len(results) == len(threads)
+		for r in results:
+			assert r == results[0], "concurrent lookups returned different registrations"
+		(probes, codecs) = results[0]
+	sys.stdout.write(pickle.dumps((duration, modules, probes, codecs)))
+
+def scan(mode, paths, cache, resolve = False):
+	"""
+	Runs a scan in a new interpreter, with the manifests in cache.
+
+	@rtype: tuple (float, integer, dict, dict)
+	@returns: (scan duration in s, number of loaded modules, probe types, codec names)
+	"""
+	env = dict(os.environ)
+	env['PYTHONDONTWRITEBYTECODE'] = '1'
+	env['TESTERMAN_PLUGIN_CACHE'] = cache
+	args = [ sys.executable, os.path.abspath(__file__), '--child', mode ]
+	if resolve:
+		args.append('--resolve')
+	p = subprocess.Popen(args + paths, stdout = subprocess.PIPE, env = env)
+	output = p.communicate()[0]
+	assert p.returncode == 0, "%s scan failed" % mode
+	return pickle.loads(output)
+
+def average(mode, paths, cache, count):
+	durations = []
+	for i in range(count):
+		(duration, modules, probes, codecs) = scan(mode, paths, cache)
+		durations.append(duration)
+	return (sum(durations) / len(durations), modules)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 10, help = "number of scans per measure (default: %default)")
+	parser.add_option("--child", dest = "child", default = None, help = optparse.SUPPRESS_HELP)
+	parser.add_option("--resolve", dest = "resolve", action = "store_true", default = False, help = optparse.SUPPRESS_HELP)
+	(options, args) = parser.parse_args()
+
+	if options.child:
+		return child(options.child, args, options.resolve)
+
+	directory = tempfile.mkdtemp()
+	try:
+		shutil.copytree("%s/plugins/probes" % ROOT, "%s/probes" % directory)
+		shutil.copytree("%s/plugins/codecs" % ROOT, "%s/codecs" % directory)
+		paths = [ "%s/probes" % directory, "%s/codecs" % directory ]
+		cache = "%s/cache" % directory
+
+		# First scan: generates the manifests, in the cache directory only
+		(firstScan, modules, probes, codecs) = scan('lazy', paths, cache)
+		assert len(os.listdir(cache)) == 2
+		assert not os.path.exists("%s/probes/.plugins.manifest" % directory)
+		assert not os.path.exists("%s/codecs/.plugins.manifest" % directory)
+
+		# Same registrations, same classes and codec properties
+		(d, m, eagerProbes, eagerCodecs) = scan('eager', paths, cache, resolve = True)
+		(d, m, lazyProbes, lazyCodecs) = scan('lazy', paths, cache, resolve = True)
+		assert eagerProbes == lazyProbes, "probe registrations differ"
+		assert eagerCodecs == lazyCodecs, "codec registrations differ"
+		assert sorted(probes.keys()) == sorted(eagerProbes.keys())
+		assert sorted(codecs.keys()) == sorted(eagerCodecs.keys())
+
+		# A new plugin is detected
+		f = open("%s/codecs/BenchmarkCodec.py" % directory, 'w')
+		f.write(NEW_PLUGIN)
+		f.close()
+		assert 'benchmark.codec' in scan('lazy', paths, cache)[3]
+		assert 'benchmark.codec' in scan('lazy', paths, cache)[3]
+		# A modified plugin is detected (mtime)
+		f = open("%s/codecs/BenchmarkCodec.py" % directory, 'w')
+		f.write(NEW_PLUGIN.replace('benchmark.codec', 'benchmark.codec2'))
+		f.close()
+		os.utime("%s/codecs/BenchmarkCodec.py" % directory, (time.time() + 10, time.time() + 10))
+		(d, m, p, codecs) = scan('lazy', paths, cache, resolve = True)
+		assert 'benchmark.codec2' in codecs and not 'benchmark.codec' in codecs
+		assert codecs['benchmark.codec2'].startswith('BenchmarkCodec.BenchmarkCodec')
+		os.remove("%s/codecs/BenchmarkCodec.py" % directory)
+		scan('lazy', paths, cache)
+
+		# Manifests generated at install time, used without cache
+		env = dict(os.environ)
+		env['PYTHONDONTWRITEBYTECODE'] = '1'
+		env['TESTERMAN_PLUGIN_CACHE'] = "%s/empty" % directory
+		p = subprocess.Popen([ sys.executable, "%s/core/PluginManifest.py" % ROOT ] + paths, stdout = subprocess.PIPE, env = env)
+		p.communicate()
+		assert p.returncode == 0
+		assert os.path.isfile("%s/probes/.plugins.manifest" % directory)
+		assert os.path.isfile("%s/codecs/.plugins.manifest" % directory)
+		(d, installedModules, installedProbes, installedCodecs) = scan('lazy', paths, "%s/empty" % directory, resolve = True)
+		assert (installedProbes, installedCodecs) == (eagerProbes, eagerCodecs)
+		# Nothing to update
+		assert not os.path.exists("%s/empty" % directory)
+
+		(eager, eagerModules) = average('eager', paths, cache, options.count)
+		(lazy, lazyModules) = average('lazy', paths, cache, options.count)
+		print "%d probe types, %d codecs" % (len(eagerProbes), len(eagerCodecs))
+		print "eager scan:              %8.2f ms, %d modules loaded" % (eager * 1000, eagerModules)
+		print "manifest generation:     %8.2f ms" % (firstScan * 1000)
+		print "lazy scan from manifest: %8.2f ms, %d modules loaded" % (lazy * 1000, lazyModules)
+		print "startup time saved:      %8.2f ms" % ((eager - lazy) * 1000)
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
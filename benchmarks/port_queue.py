@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: port queue with a large backlog, in a standalone TE
+# environment (local logger, no Testerman Server, no TACS).
+#
+# A MTC enqueues N messages to one of its ports before consuming
+# them, as when a probe delivers a burst of traffic, then drains them
+# with one alt() per message.
+# The drain rate should not depend on the backlog size.
+#
+# Usage: benchmarks/port_queue.py [--count N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import TestermanTCI
+TestermanTCI.initialize(logFilename = None)
+import TestermanSA
+import TestermanPA
+TestermanSA.initialize(None)
+TestermanPA.initialize()
+
+from TestermanTTCN3 import *
+
+import optparse
+import time
+
+Results = {}
+
+class TC_PORT_QUEUE(TestCase):
+	def body(self, count):
+		source = self.mtc['source']
+		sink = self.mtc['sink']
+		connect(source, sink)
+		start = time.time()
+		for i in range(count):
+			source.send(i)
+		Results['enqueue'] = time.time() - start
+
+		start = time.time()
+		for i in range(count):
+			alt([
+				[ sink.RECEIVE(i) ],
+			])
+		Results['drain'] = time.time() - start
+		setverdict("pass")
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 100000, help = "number of enqueued messages (default: %default)")
+	(options, args) = parser.parse_args()
+
+	TC_PORT_QUEUE().execute(count = options.count)
+	print "enqueue: %8.0f messages/s" % (options.count / Results['enqueue'])
+	print "drain:   %8.0f alt()/s" % (options.count / Results['drain'])
+	TestermanPA.finalize()
+	TestermanSA.finalize()
+	os._exit(0)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: decoding of messages received over a stream in small
+# segments, as done by the TCP probe with a default decoder.
+#
+# Each stream is cut into segments of --segment bytes, then decoded:
+# - with the codec stream decoder (CodecManager.createStreamDecoder()),
+# - for single-message streams with an incremental codec, with the
+#   incremental decoder, the way the TCP probe does when no stream decoder
+#   is available (the whole pending data is decoded again on each new
+#   segment).
+# Checks the decoded messages, and reports the time taken by each.
+#
+# Usage: benchmarks/stream_decoding.py [--size N] [--segment N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'codecs'))
+
+import CodecManager
+import Http
+import Sip
+import Rtsp
+
+import optparse
+import time
+
+
+SIP_INVITE = """INVITE sip:bob@example.com SIP/2.0
+Via: SIP/2.0/TCP 192.0.2.1:5060;branch=z9hG4bK776asdhds
+Max-Forwards: 70
+To: Bob <sip:bob@example.com>
+From: Alice <sip:alice@example.com>;tag=1928301774
+Call-ID: a84b4c76e66710@pc33.example.com
+CSeq: 314159 INVITE
+Contact: <sip:alice@192.0.2.1;transport=tcp>
+Content-Type: application/sdp
+Content-Length: %d
+
+%s"""
+
+SDP = """v=0
+o=alice 2890844526 2890844526 IN IP4 192.0.2.1
+s=-
+c=IN IP4 192.0.2.1
+t=0 0
+m=audio 49170 RTP/AVP 0
+a=rtpmap:0 PCMU/8000
+"""
+
+def streams(size):
+	"""
+	Returns a list of (name, codec, message, count): the stream contains
+	count times the encoded message.
+	"""
+	sdp = SDP.replace('\n', '\r\n')
+	sip = (SIP_INVITE.replace('\n', '\r\n') % (len(sdp), sdp))
+	# (the RTSP encoder adds a CRLF after the body)
+	rtsp = CodecManager.encode('rtsp.request', { 'method': 'ANNOUNCE', 'uri': 'rtsp://example.com/', 'body': 'x' * size })[0][:-2]
+	return [
+		('HTTP, large body', 'http.response', CodecManager.encode('http.response', { 'status': 200, 'reason': 'OK', 'body': 'x' * size })[0], 1),
+		('HTTP, chunked body', 'http.response', CodecManager.encode('http.response', { 'status': 200, 'reason': 'OK', 'headers': { 'Transfer-Encoding': 'chunked' }, 'body': 'x' * size })[0], 1),
+		('HTTP, pipelined', 'http.request', CodecManager.encode('http.request', { 'method': 'POST', 'url': '/', 'body': 'x' * 100 })[0], size / 200),
+		('SIP, pipelined', 'sip', sip, size / len(sip)),
+		('RTSP, large body', 'rtsp.request', rtsp, 1),
+	]
+
+def segments(data, size):
+	return [ data[i:i+size] for i in range(0, len(data), size) ]
+
+def streamDecode(codec, segments):
+	decoder = CodecManager.createStreamDecoder(codec)
+	ret = []
+	for segment in segments:
+		for (status, payload, message, summary) in decoder.feed(segment):
+			assert status == CodecManager.Codec.DECODING_OK
+			ret.append(message)
+	for (status, payload, message, summary) in decoder.close():
+		assert status == CodecManager.Codec.DECODING_OK
+		ret.append(message)
+	return ret
+
+def incrementalDecode(codec, segments):
+	"""
+	Decodes the segments as the TCP probe does without a stream decoder.
+	"""
+	ret = []
+	buf = ''
+	for i, segment in enumerate(segments):
+		buf += segment
+		complete = (i == len(segments) - 1)
+		while buf:
+			(status, consumedSize, message, summary) = CodecManager.incrementalDecode(codec, buf, complete = complete)
+			if status != CodecManager.Codec.DECODING_OK:
+				break
+			if consumedSize == 0:
+				consumedSize = len(buf)
+			ret.append(message)
+			buf = buf[consumedSize:]
+	return ret
+
+def run(name, codec, message, count, segmentSize):
+	data = message * count
+	s = segments(data, segmentSize)
+	expected = [ CodecManager.incrementalDecode(codec, message, complete = True)[2] ] * count
+
+	start = time.time()
+	decoded = streamDecode(codec, s)
+	streaming = time.time() - start
+	assert decoded == expected, "%s: unexpected stream decoder output" % name
+	report = "%-20s %5d messages, %7d bytes in %5d segments - stream: %8.2f ms" % (name, count, len(data), len(s), streaming * 1000)
+
+	# Non-incremental codecs cannot identify messages in a stream by themselves,
+	# and incremental ones consume the whole data they decode (no pipelining)
+	if count == 1 and isinstance(CodecManager.instance()._getCodecInstance(codec), CodecManager.IncrementalCodec):
+		start = time.time()
+		decoded = incrementalDecode(codec, s)
+		incremental = time.time() - start
+		assert decoded == expected, "%s: unexpected incremental decoder output" % name
+		report += ", incremental: %8.2f ms" % (incremental * 1000)
+	print report
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--size", dest = "size", type = "int", default = 200000, help = "body or stream size, in bytes (default: %default)")
+	parser.add_option("--segment", dest = "segment", type = "int", default = 1400, help = "segment size, in bytes (default: %default)")
+	(options, args) = parser.parse_args()
+
+	for (name, codec, message, count) in streams(options.size):
+		run(name, codec, message, count, options.segment)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: local connection storm against a listening TCP probe
+# (plugins/probes/TcpProbe.py).
+#
+# Opens --count connections to the probe, sends a message on each
+# of them, waits for the probe to raise all of them, then closes the
+# connections and waits for the probe to process the disconnections.
+# Reports the time taken by each step, and the CPU used by the
+# process while the probe is idle with all connections open.
+#
+# Both ends of the connections are in this process: the open files
+# limit is raised up to its hard limit, and --count reduced if needed.
+#
+# Usage: benchmarks/tcp_connection_storm.py [--count N] [--port N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'probes'))
+
+import ProbeImplementationManager
+import TcpProbe
+
+import optparse
+import resource
+import socket
+import threading
+import time
+
+
+class Adapter(ProbeImplementationManager.IProbeImplementationAdapter):
+	"""
+	Minimal probe adapter: counts the enqueued messages and notifications.
+	"""
+	def __init__(self, properties):
+		self._properties = properties
+		self._mutex = threading.Lock()
+		self.messages = 0
+		self.disconnections = 0
+
+	def getProperty(self, name, defaultValue):
+		return self._properties.get(name, defaultValue)
+
+	def getLogger(self):
+		return ProbeImplementationManager.DummyLogger()
+
+	def triEnqueueMsg(self, message, sutAddress = None):
+		self._mutex.acquire()
+		if isinstance(message, tuple):
+			if message[0] == 'disconnectionNotification':
+				self.disconnections += 1
+		else:
+			self.messages += 1
+		self._mutex.release()
+
+def waitFor(condition, timeout = 60.0):
+	start = time.time()
+	while not condition():
+		if time.time() - start > timeout:
+			raise Exception("Timeout")
+		time.sleep(0.01)
+	return time.time() - start
+
+def cpuTime():
+	t = os.times()
+	return t[0] + t[1]
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 10000, help = "number of connections (default: %default)")
+	parser.add_option("--port", dest = "port", type = "int", default = 40100, help = "probe listening port (default: %default)")
+	(options, args) = parser.parse_args()
+
+	(soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+	if hard != resource.RLIM_INFINITY and soft < hard:
+		resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+		soft = hard
+	count = options.count
+	if soft != resource.RLIM_INFINITY and count > (soft - 100) / 2:
+		count = (soft - 100) / 2
+		print "Open files limit: %d, reducing the number of connections to %d" % (soft, count)
+
+	adapter = Adapter({ 'listening_ip': '127.0.0.1', 'listening_port': options.port, 'enable_notifications': True })
+	probe = TcpProbe.TcpProbe()
+	probe._setAdapter(adapter)
+	probe.onTriMap()
+
+	try:
+		start = time.time()
+		clients = []
+		for i in range(count):
+			s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			s.connect(('127.0.0.1', options.port))
+			s.send('message %d' % i)
+			clients.append(s)
+		connecting = time.time() - start
+		receiving = waitFor(lambda: adapter.messages == count)
+		print "%d connections: opened in %.2f s, all messages raised %.2f s later" % (count, connecting, receiving)
+
+		cpu = cpuTime()
+		time.sleep(1.0)
+		print "Idle with %d connections: %.1f%% CPU" % (count, (cpuTime() - cpu) * 100)
+
+		start = time.time()
+		for s in clients:
+			s.close()
+		waitFor(lambda: adapter.disconnections == count)
+		print "%d connections closed by peer in %.2f s" % (count, time.time() - start)
+	finally:
+		probe.onTriUnmap()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: TCP probe stream reassembly with the size and separator
+# packetization properties (plugins/probes/TcpProbe.py).
+#
+# First checks the packets raised for streams whose packets and
+# separators are split across segments, then feeds the probe with:
+# - --count packets of 100 bytes, terminated by a separator,
+# - --count packets of 100 bytes, with the size property,
+# - a single --size packet, terminated by a separator,
+# in segments of --segment bytes, and reports the time taken by each.
+#
+# Usage: benchmarks/tcp_reassembly.py [--count N] [--size N] [--segment N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugins', 'probes'))
+
+import ProbeImplementationManager
+import TcpProbe
+
+import optparse
+import time
+
+
+ADDRESS = ('127.0.0.1', 40000)
+
+class Adapter(ProbeImplementationManager.IProbeImplementationAdapter):
+	"""
+	Minimal probe adapter: collects the enqueued messages.
+	"""
+	def __init__(self, properties):
+		self._properties = properties
+		self.messages = []
+
+	def getProperty(self, name, defaultValue):
+		return self._properties.get(name, defaultValue)
+
+	def getLogger(self):
+		return ProbeImplementationManager.DummyLogger()
+
+	def triEnqueueMsg(self, message, sutAddress = None):
+		self.messages.append(message)
+
+def feed(properties, segments):
+	"""
+	Feeds a TCP probe connection with segments,
+	returns the raised messages.
+	"""
+	adapter = Adapter(properties)
+	probe = TcpProbe.TcpProbe()
+	probe._setAdapter(adapter)
+	probe._registerIncomingConnection(None, ADDRESS)
+	for segment in segments:
+		probe._feedData(ADDRESS, segment)
+	return adapter.messages
+
+def segments(data, size):
+	return [ data[i:i+size] for i in range(0, len(data), size) ]
+
+CHECKS = [
+	# (name, properties, segments, expected messages)
+	('size', { 'size': 4 }, [ 'abc', 'defghij', 'kl', '' ], [ 'abcd', 'efgh', 'ijkl' ]),
+	('size, exact segments', { 'size': 3 }, [ 'abc', 'def' ], [ 'abc', 'def' ]),
+	('size, byte per byte', { 'size': 2 }, list('abcdef'), [ 'ab', 'cd', 'ef' ]),
+	('separator', { 'separator': '\n' }, [ 'a\nb', 'c\n\nd' ], [ 'a', 'bc', '' ]),
+	('split separator', { 'separator': '\r\n' }, [ 'a\r', '\nb\r\nc', '\r', '\n' ], [ 'a', 'b', 'c' ]),
+	('long separator', { 'separator': '<EOM>' }, [ 'a<E', 'O', 'M', '><EOM', '>b<EOM><EO' ], [ 'a', '', 'b' ]),
+	('no criteria', { }, [ 'abc', 'def' ], [ 'abc', 'def' ]),
+]
+
+def check():
+	for (name, properties, s, expected) in CHECKS:
+		messages = feed(properties, s)
+		assert messages == expected, "%s: unexpected packets %s" % (name, messages)
+	print "%d packetization checks OK" % len(CHECKS)
+
+def run(name, properties, data, segmentSize, expectedCount):
+	s = segments(data, segmentSize)
+	start = time.time()
+	messages = feed(properties, s)
+	duration = time.time() - start
+	assert len(messages) == expectedCount, "%s: unexpected number of packets" % name
+	print "%-28s %8d bytes in %6d segments: %8.2f ms" % (name, len(data), len(s), duration * 1000)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 20000, help = "number of small packets (default: %default)")
+	parser.add_option("--size", dest = "size", type = "int", default = 2000000, help = "large packet size, in bytes (default: %default)")
+	parser.add_option("--segment", dest = "segment", type = "int", default = 1400, help = "segment size, in bytes (default: %default)")
+	(options, args) = parser.parse_args()
+
+	check()
+	run("separator, small packets", { 'separator': '\r\n' }, ('x' * 98 + '\r\n') * options.count, options.segment, options.count)
+	run("size, small packets", { 'size': 100 }, 'x' * 100 * options.count, options.segment, options.count)
+	run("separator, large packet", { 'separator': '\r\n' }, 'x' * options.size + '\r\n', options.segment, 1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: TE start latency, with a fork+exec of a new interpreter
+# per TE (as AtsJob.run() does without TE launcher), and with the TE
+# launcher (core/TeLauncher.py).
+#
+# Builds the TE eggs of short ATSes, then runs them in server-controlled
+# mode, logging to a minimal Il server that records when the first
+# log event (ats-started) is received.
+# Reports the submit to first log event latency and the submit to
+# completion time, and checks that the TE exit statuses are the same in
+# both cases (passed and failed test cases, killed TE), and that a TE
+# whose egg contains a modified core library runs it, and its plugins,
+# and that two TEs do not generate the same random numbers before
+# the TE reseeds the random module.
+#
+# Works on a copy of the plugins/ tree, with a temporary var root,
+# so that the TEs do not write to the source tree.
+#
+# Usage: benchmarks/te_launcher.py [--count N] [--pool-size N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import ConfigManager
+import TEFactory
+import TeLauncher
+
+import optparse
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+import zipfile
+
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+METADATA = """# __METADATA__BEGIN__
+# <?xml version="1.0" encoding="utf-8" ?>
+# <metadata version="1.0">
+# <description>TE launcher benchmark</description>
+# <prerequisites></prerequisites>
+# <api>1</api>
+# <parameters>
+# </parameters>
+# </metadata>
+# __METADATA__END__
+"""
+
+def ats(body):
+	return METADATA + """
+class TC_BENCH(TestCase):
+	def body(self):
+%s
+
+TC_BENCH().execute()
+""" % body
+
+PASSED_ATS = ats("		self.setverdict(PASS)")
+FAILED_ATS = ats("		self.setverdict(FAIL)")
+ENDLESS_ATS = ats("		import time\n		while True:\n			time.sleep(0.1)")
+# Passes if its egg copy of TestermanPA is used, with the codec plugins
+SHADOWING_ATS = ats("""		import TestermanPA
+		import TestermanCD
+		if getattr(TestermanPA, 'BENCHMARK_EGG_COPY', False) and TestermanCD.encode('base64', 'a')[0].strip() == 'YQ==':
+			self.setverdict(PASS)
+		else:
+			self.setverdict(FAIL)""")
+
+# Writes the random number its egg copy of TestermanTCI drew when
+# imported to its working directory
+RANDOM_ATS = ats("""		import TestermanTCI
+		f = open('random.txt', 'w')
+		f.write(repr(TestermanTCI.BENCHMARK_RANDOM))
+		f.close()
+		self.setverdict(PASS)""")
+
+
+class IlServer(threading.Thread):
+	"""
+	Accepts TE log connections, and records when the first
+	log event was received on each of them.
+	"""
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.setDaemon(True)
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.socket.bind(('127.0.0.1', 0))
+		self.socket.listen(5)
+		self.port = self.socket.getsockname()[1]
+		self.firstEvent = threading.Event()
+		self.firstEventTime = None
+
+	def reset(self):
+		self.firstEvent.clear()
+		self.firstEventTime = None
+
+	def run(self):
+		while True:
+			(conn, _) = self.socket.accept()
+			threading.Thread(target = self._read, args = (conn, )).start()
+
+	def _read(self, conn):
+		data = ''
+		while True:
+			d = conn.recv(65536)
+			if not d:
+				break
+			if self.firstEventTime is None:
+				data += d
+				if 'ats-started' in data:
+					self.firstEventTime = time.time()
+					self.firstEvent.set()
+		conn.close()
+
+
+def configure(directory):
+	cm = ConfigManager.instance()
+	cm.register("tacs.ip", "127.0.0.1")
+	# Nothing listens on this port: the TEs do not use any probe
+	cm.register("tacs.port", 1)
+	cm.register("interface.il.ip", "127.0.0.1")
+	cm.register("interface.il.port", 8082)
+	cm.register("ts.name", "benchmark")
+	cm.register("testerman.te.log.max_payload_size", 64*1024)
+	cm.register("testerman.te.log.batch.max_size", 64*1024)
+	cm.register("testerman.te.log.batch.max_delay", 0.0)
+	cm.register("testerman.te.codec_paths", "", xform = lambda x: x.split(','))
+	cm.register("testerman.te.probe_paths", "", xform = lambda x: x.split(','))
+	cm.register("testerman.te.python.interpreter", sys.executable)
+	cm.register("testerman.te.python.ttcn3module", "TestermanTTCN3")
+	cm.register("testerman.te.python.additional_pythonpath", "")
+	cm.set_user("testerman.te.codec_paths", "%s/plugins/codecs" % directory, autoCommit = True)
+	cm.set_user("testerman.te.probe_paths", "%s/plugins/probes" % directory, autoCommit = True)
+	# For the plugin manifests
+	cm.register("testerman.var_root", directory)
+	cm.read("%s/conf/language-apis.conf" % ROOT, autoRegister = True)
+	cm.set_transient("ts.server_root", "%s/core" % ROOT)
+
+def buildEgg(directory, name, source, patches = {}):
+	"""
+	Builds directory/name/ats.egg from an ATS source, with its
+	core dependencies, with patches[dependency] appended to them.
+	"""
+	cm = ConfigManager.instance()
+	os.mkdir("%s/%s" % (directory, name))
+	egg = zipfile.ZipFile("%s/%s/ats.egg" % (directory, name), 'w', zipfile.ZIP_DEFLATED)
+	egg.writestr('__main__.py', TEFactory.createTestExecutable(name, source, atsDirInTePackage = ''))
+	for dep in cm.get("testerman.te.python.dependencies.api.1").split(','):
+		dep = dep.strip()
+		f = open("%s/%s" % (cm.get_transient('ts.server_root'), dep), 'rb')
+		egg.writestr(dep, f.read() + patches.get(dep, ''))
+		f.close()
+	egg.close()
+	return "%s/%s" % (directory, name)
+
+def getCommandLine(packageDirectory, ilServer):
+	cm = ConfigManager.instance()
+	cm.set_actual("interface.il.port", ilServer.port)
+	return TEFactory.createCommandLine(jobId = 1,
+		teFilename = "%s/ats.egg" % packageDirectory,
+		logFilename = "%s/ats.log" % packageDirectory,
+		inputSessionFilename = "%s/input.session" % packageDirectory,
+		outputSessionFilename = "%s/output.session" % packageDirectory)
+
+class ForkedTe:
+	"""
+	Starts a TE as AtsJob.run() does without the TE launcher.
+	"""
+	def __init__(self, executable, args, env, cwd):
+		self.pid = os.fork()
+		if not self.pid:
+			os.chdir(cwd)
+			os.execve(executable, args, env)
+
+	def wait(self):
+		return os.waitpid(self.pid, 0)[1]
+
+def run(launch, packageDirectory, ilServer, kill = False):
+	"""
+	Runs a TE.
+
+	@rtype: tuple (integer, float, float)
+	@returns: (exit status, first log event latency, completion time)
+	"""
+	cmd = getCommandLine(packageDirectory, ilServer)
+	ilServer.reset()
+	start = time.time()
+	te = launch(cmd['executable'], cmd['args'], cmd['env'], packageDirectory)
+	ilServer.firstEvent.wait(30)
+	assert ilServer.firstEventTime, "no log event received"
+	if kill:
+		os.kill(te.pid, signal.SIGKILL)
+	status = te.wait()
+	return (status, ilServer.firstEventTime - start, time.time() - start)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 10, help = "number of TE runs per measure (default: %default)")
+	parser.add_option("--pool-size", dest = "poolSize", type = "int", default = 2, help = "TE launcher pool size (default: %default)")
+	(options, args) = parser.parse_args()
+
+	# Inherited by the TE launcher
+	os.environ['PYTHONDONTWRITEBYTECODE'] = '1'
+	directory = tempfile.mkdtemp()
+	shutil.copytree("%s/plugins/probes" % ROOT, "%s/plugins/probes" % directory)
+	shutil.copytree("%s/plugins/codecs" % ROOT, "%s/plugins/codecs" % directory)
+	configure(directory)
+	ilServer = IlServer()
+	ilServer.start()
+
+	launcher = None
+	try:
+		passed = buildEgg(directory, 'passed', PASSED_ATS)
+		failed = buildEgg(directory, 'failed', FAILED_ATS)
+		endless = buildEgg(directory, 'endless', ENDLESS_ATS)
+		shadowing = buildEgg(directory, 'shadowing', SHADOWING_ATS, { 'TestermanPA.py': '\nBENCHMARK_EGG_COPY = True\n' })
+		randomNumber = buildEgg(directory, 'random', RANDOM_ATS, { 'TestermanTCI.py': '\nimport random\nBENCHMARK_RANDOM = random.random()\n' })
+
+		cmd = getCommandLine(passed, ilServer)
+		launcher = TeLauncher.TeLauncher(socketFilename = "%s/telauncher.sock" % directory,
+			interpreter = cmd['executable'], env = cmd['env'], poolSize = options.poolSize,
+			modules = [ 'TestermanTTCN3' ],
+			probePaths = ConfigManager.instance().get("testerman.te.probe_paths"),
+			codecPaths = ConfigManager.instance().get("testerman.te.codec_paths"))
+		launcher.start()
+		# Waits for the launcher to be ready
+		while not os.path.exists("%s/telauncher.sock" % directory):
+			time.sleep(0.01)
+		run(launcher.launch, passed, ilServer)
+
+		for (name, launch) in [ ('fork+exec', ForkedTe), ('TE launcher', launcher.launch) ]:
+			# Same exit statuses
+			assert run(launch, passed, ilServer)[0] == 0
+			assert run(launch, failed, ilServer)[0] == 4 * 256 # RETURN_CODE_OK_WITH_FAILED_TC
+			assert run(launch, endless, ilServer, kill = True)[0] == signal.SIGKILL
+			assert run(launch, shadowing, ilServer)[0] == 0, "%s: the TE did not run its egg modules" % name
+			# Not affected by the previous TE
+			assert run(launch, passed, ilServer)[0] == 0
+			numbers = []
+			for i in range(2):
+				assert run(launch, randomNumber, ilServer)[0] == 0
+				f = open("%s/random.txt" % randomNumber)
+				numbers.append(f.read())
+				f.close()
+			assert numbers[0] != numbers[1], "%s: the TEs generated the same random numbers" % name
+
+			latencies = []
+			durations = []
+			for i in range(options.count):
+				(status, latency, duration) = run(launch, passed, ilServer)
+				assert status == 0
+				latencies.append(latency)
+				durations.append(duration)
+			print "%-12s first log event: %8.2f ms (min %8.2f ms), completion: %8.2f ms" % (name,
+				sum(latencies) * 1000 / len(latencies), min(latencies) * 1000, sum(durations) * 1000 / len(durations))
+	finally:
+		if launcher:
+			launcher.stop()
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
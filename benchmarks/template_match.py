@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Benchmark: template matching, interpreted (templateMatch()) vs compiled
+# (as used by alt() branch conditions).
+#
+# Matches deep SIP-like and MAP-like messages against templates using
+# wildcards, conditions and extractors, both matching and mismatching
+# (on the last examined field).
+#
+# Reports the time per match for:
+# - the interpreted matching,
+# - the compiled matching, once compiled,
+# - a match by a new branch condition on the same template object, as
+#   port.RECEIVE(template) in each alt() (the compiled templates are
+#   cached by template identity).
+# and checks that both matchings return the same results, and that a
+# template modified after a match is compiled again.
+#
+# Usage: benchmarks/template_match.py [--count N]
+##
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+
+import TestermanTCI
+TestermanTCI.initialize(logFilename = None)
+
+import TestermanTTCN3
+from TestermanTTCN3 import *
+
+import optparse
+import time
+
+
+def sipMessage(status = 200):
+	return {
+		'status': { 'code': status, 'reason': 'OK', 'version': 'SIP/2.0' },
+		'headers': {
+			'via': [
+				{ 'protocol': 'SIP/2.0/UDP', 'host': '10.0.0.%d' % i, 'port': 5060, 'params': { 'branch': 'z9hG4bK%d' % i, 'rport': None } }
+				for i in range(3)
+			],
+			'from': { 'displayName': 'Alice', 'uri': { 'scheme': 'sip', 'user': 'alice', 'host': 'example.com' }, 'params': { 'tag': '1928301774' } },
+			'to': { 'displayName': 'Bob', 'uri': { 'scheme': 'sip', 'user': 'bob', 'host': 'example.com' }, 'params': { 'tag': 'a6c85cf' } },
+			'call-id': 'a84b4c76e66710@pc33.example.com',
+			'cseq': { 'method': 'INVITE', 'seq': 314159 },
+			'contact': [ { 'uri': { 'scheme': 'sip', 'user': 'bob', 'host': '192.0.2.4' }, 'params': {} } ],
+			'content-type': 'application/sdp',
+			'content-length': 131,
+			'allow': [ 'INVITE', 'ACK', 'CANCEL', 'OPTIONS', 'BYE' ],
+			'user-agent': 'Testerman',
+		},
+		'body': 'v=0\r\no=bob 2890844527 2890844527 IN IP4 192.0.2.4\r\ns=-\r\n',
+	}
+
+def sipTemplate(status = 200):
+	return {
+		'headers': {
+			'via': [ any_or_none(), { 'host': '10.0.0.2', 'port': between(1, 65535), 'params': { 'branch': pattern('^z9hG4bK') } }, any_or_none() ],
+			'from': { 'uri': { 'user': 'alice', 'host': any() }, 'params': { 'tag': extract(any(), 'fromTag') } },
+			'to': { 'uri': { 'user': 'bob', 'host': 'example.com' }, 'params': { 'tag': extract(any(), 'toTag') } },
+			'call-id': extract(any(), 'callId'),
+			'cseq': { 'method': 'INVITE', 'seq': greater_than(0) },
+			'contact': [ { 'uri': { 'user': 'bob' } } ],
+			'content-type': ifpresent('application/sdp'),
+			'allow': superset('INVITE', 'BYE'),
+			'record-route': omit(),
+		},
+		'body': any_or_none(),
+		'status': { 'code': status, 'version': 'SIP/2.0' },
+	}
+
+def mapMessage(imsi = '208011234567890'):
+	return ('begin', {
+		'otid': '\x01\x02\x03\x04',
+		'dialoguePortion': { 'applicationContext': '0.4.0.0.1.0.1.3' },
+		'components': [
+			('invoke', {
+				'invokeId': 1,
+				'opCode': ('localValue', 2),
+				'argument': ('updateLocation', {
+					'imsi': imsi,
+					'msc-Number': '\x91\x33\x60\x00\x00\x01',
+					'vlr-Number': '\x91\x33\x60\x00\x00\x02',
+					'vlr-Capability': { 'supportedCamelPhases': (3, '\xe0'), 'solsaSupportIndicator': None },
+				}),
+			}),
+		],
+	})
+
+def mapTemplate(imsi = '208011234567890'):
+	return ('begin', {
+		'otid': extract(any(), 'otid'),
+		'components': [
+			('invoke', {
+				'invokeId': extract(any(), 'invokeId'),
+				'opCode': ('localValue', 2),
+				'argument': ('updateLocation', {
+					'msc-Number': any(),
+					'vlr-Number': any(),
+					'vlr-Capability': ifpresent({ 'supportedCamelPhases': any() }),
+					'imsi': imsi,
+				}),
+			}),
+		],
+	})
+
+def measure(f, count):
+	start = time.time()
+	for i in range(count):
+		f()
+	return (time.time() - start) * 1000000 / count
+
+def run(name, message, template, count):
+	# Sanity check: the compiled and interpreted matchings agree
+	condition = TestermanTTCN3._BranchCondition(None, template)
+	result = TestermanTTCN3.templateMatch(message, template)
+	expected = result[0]
+	assert condition.match(message) == result
+	assert condition._matcher is not None
+	assert condition.match(message) == result
+	# Reused by a new condition on the same template
+	assert TestermanTTCN3._BranchCondition(None, template).match(message) == result
+	# Dynamic templates are evaluated on each match
+	assert TestermanTTCN3._BranchCondition(None, lambda: template).match(message) == result
+	assert TestermanTTCN3._compileTemplate(lambda: template).match(message) == result
+
+	interpreted = measure(lambda: TestermanTTCN3.templateMatch(message, template), count)
+	compiled = measure(lambda: condition.match(message), count)
+	newCondition = measure(lambda: TestermanTTCN3._BranchCondition(None, template).match(message), count)
+	print "%-14s %-8s interpreted: %7.1f us, compiled: %7.1f us (x%.1f), new condition: %7.1f us" % (name, expected and "match" or "mismatch", interpreted, compiled, interpreted / compiled, newCondition)
+
+def checkConsistency():
+	# The decoded messages are the same, too
+	for (message, template) in [ ([0, 1], [ifpresent(1), 0, 1]), ({'a': [0], 'b': 1}, {'a': [any_or_none(), 2], 'b': 2}) ]:
+		result = TestermanTTCN3.templateMatch(message, template)
+		condition = TestermanTTCN3._BranchCondition(None, template)
+		for i in range(2):
+			assert condition.match(message) == result
+			assert TestermanTTCN3._BranchCondition(None, template).match(message) == result
+	# Modified templates are compiled again
+	template = { 'a': 1, 'b': [ 2 ] }
+	assert TestermanTTCN3._BranchCondition(None, template).match({ 'a': 1, 'b': [ 2 ] })[0]
+	template['a'] = 2
+	template['b'].append(3)
+	assert TestermanTTCN3._BranchCondition(None, template).match({ 'a': 2, 'b': [ 2, 3 ] })[0]
+	assert not TestermanTTCN3._BranchCondition(None, template).match({ 'a': 1, 'b': [ 2 ] })[0]
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option("--count", dest = "count", type = "int", default = 10000, help = "number of matches per measure (default: %default)")
+	(options, args) = parser.parse_args()
+
+	checkConsistency()
+	run("SIP response", sipMessage(), sipTemplate(), options.count)
+	run("SIP response", sipMessage(180), sipTemplate(), options.count)
+	run("MAP invoke", mapMessage(), mapTemplate(), options.count)
+	run("MAP invoke", mapMessage('208019999999999'), mapTemplate(), options.count)
+	TestermanTCI.finalize()
+
+if __name__ == "__main__":
+	main()
@@ -243,10 +243,22 @@ class Client(Nodes.ConnectingNode):
 	# Job management
 	##
 	
-	def getJobQueue(self):
+	def getJobQueue(self, filters = None, offset = 0, limit = None):
 		"""
 		Gets the current jobs in the queue, returning several attributes for each of them.
 		
+		Filters and pagination require a server with Ws API >= 1.9.
+		
+		@type  filters: dict, or None
+		@param filters: only returns the jobs matching all these criteria:
+		{'state': string or list of strings, 'username': string,
+		'parent-id': integer (0 for root jobs), 'since': float, 'until': float}
+		(since/until apply to the job start time, or its scheduled start time if not started)
+		@type  offset: integer
+		@param offset: the number of matching jobs to skip
+		@type  limit: integer, or None
+		@param limit: the maximum number of jobs to return, or None for all
+
 		@throws Exception in case of an error.
 		
 		@rtype: a list of dict (see the dict contents in getJobInfo() description)
@@ -254,7 +266,10 @@ class Client(Nodes.ConnectingNode):
 		about the dict.
 		"""
 		self.getLogger().debug("Getting jobs...")
-		jobs = self.__proxy.getJobInfo()
+		if filters or offset or limit is not None:
+			jobs = self.__proxy.getJobInfo(None, filters, offset, limit)
+		else:
+			jobs = self.__proxy.getJobInfo()
 		self.getLogger().debug("%d jobs retrieved" % len(jobs))
 		return jobs
 
@@ -102,6 +102,9 @@ class Message(object):
 	def __init__(self):
 		self.headers = {} # dict of str of unicode
 		self.body = None # unicode or datastring
+		# (body, profile) set by setApplicationBody() and not serialized yet:
+		# the serialization depends on the framing used to send the message.
+		self._applicationBody = None
 
 	def setHeader(self, header, value):
 		if value is None:
@@ -118,29 +121,118 @@ class Message(object):
 		Sets the body directly.
 		"""
 		self.body = body
+		self._applicationBody = None
 	
 	def setApplicationBody(self, body, profile = CONTENT_TYPE_JSON):
 		"""
 		Convenience function: encode the body, sets
 		both Content-Encoding ad Content-Type as JSON or pickle encoding.
+		
+		Pickle and gzip bodies are only serialized when the message is
+		encoded (or when getBody() is called): binary pickles and raw
+		compressed data are used over length-prefixed framings, text-safe
+		encodings over the legacy one.
+		Do not modify body until the message has been sent.
 		"""
 		if profile == self.CONTENT_TYPE_JSON:
 			self.body = JSON.dumps(body)
+			self._applicationBody = None
 			self.setContentEncoding(self.ENCODING_UTF8)
 			self.setContentType(self.CONTENT_TYPE_JSON)
 		elif profile == self.CONTENT_TYPE_PYTHON_PICKLE:
-			self.body = pickle.dumps(body)
+			self.body = None
+			self._applicationBody = (body, profile)
 			self.setContentEncoding(self.ENCODING_NONE)
 			self.setContentType(self.CONTENT_TYPE_PYTHON_PICKLE)
 		elif profile == self.CONTENT_TYPE_GZIP:
-			self.body = base64.encodestring(zlib.compress(body))
+			self.body = None
+			self._applicationBody = (body, profile)
 			self.setContentEncoding(self.ENCODING_BASE64)
 			self.setContentType(self.CONTENT_TYPE_GZIP)
 		else:
 			raise Exception("Invalid application body encoding profile (%s)" % str(profile))
 	
 	def getBody(self):
+		"""
+		Returns the body, as a text-safe string for the application bodies
+		that are not serialized yet.
+		The application body is kept, so that calling this function
+		(for instance to trace the message) does not change the way
+		the message is encoded afterwards.
+		"""
+		if self._applicationBody is not None and self.body is None:
+			# Text-safe serialization, compatible with all framings
+			(body, profile) = self._applicationBody
+			if profile == self.CONTENT_TYPE_PYTHON_PICKLE:
+				self.body = pickle.dumps(body)
+			else:
+				self.body = base64.encodestring(zlib.compress(body))
 		return self.body
+
+	def _getEncodedHeadersAndBody(self, binary):
+		"""
+		Returns the (headers, body) to encode, according to the framing.
+		
+		@type  binary: bool
+		@param binary: True if the body may contain any byte (length-prefixed
+		framing), False if it must not contain any \x00 (legacy framing).
+		
+		@rtype: (dict, string)
+		"""
+		if self._applicationBody is not None:
+			if not binary:
+				return (self.headers, self.getBody())
+			(body, profile) = self._applicationBody
+			if profile == self.CONTENT_TYPE_PYTHON_PICKLE:
+				return (self.headers, pickle.dumps(body, pickle.HIGHEST_PROTOCOL))
+			headers = self.headers.copy()
+			headers["Content-Encoding"] = self.ENCODING_NONE
+			return (headers, zlib.compress(body))
+
+		body = self.body
+		if not binary and body and self.getContentEncoding() == self.ENCODING_NONE and '\x00' in body:
+			# A raw body received through a length-prefixed framing,
+			# forwarded over a legacy one: turn it into a text-safe one.
+			headers = self.headers.copy()
+			if self.getContentType() == self.CONTENT_TYPE_PYTHON_PICKLE:
+				body = pickle.dumps(pickle.loads(body))
+			else:
+				headers["Content-Encoding"] = self.ENCODING_BASE64
+				body = base64.encodestring(body)
+			return (headers, body)
+		return (self.headers, body)
+
+	def _getFirstLine(self):
+		raise NotImplementedError()
+
+	def encode(self, binary = False):
+		"""
+		Encodes a message to a utf-8 string: the first line,
+		the headers, an empty line, then the body.
+		
+		@type  binary: bool
+		@param binary: if True, the body is encoded as raw data that may
+		contain any byte, and the resulting string must be sent over a
+		length-prefixed framing. Otherwise it can be sent over the legacy
+		\x00-terminated framing, too.
+		
+		@rtype: string
+		"""
+		(headers, body) = self._getEncodedHeadersAndBody(binary)
+		ret = [ self._getFirstLine() ]
+		for (h, v) in headers.items():
+			ret.append("%s: %s" % (h, v.encode('utf-8')))
+		ret.append('')
+		if body:
+			ret.append(body)
+		return SEPARATOR.join(ret)
+
+	def __str__(self):
+		"""
+		Encodes a message to a utf-8 string.
+		The final \00 is not part of the message, but just a transport separator.
+		"""
+		return self.encode()
 	
 	def isResponse(self):
 		return False
@@ -216,21 +308,8 @@ class Request(Message):
 		self.version = version
 		self.setHeader('Type', Message.TYPE_REQUEST)
 
-	def __str__(self):
-		"""
-		Encodes a message to a utf-8 string.
-		The final \00 is not part of the message, but just a transport separator.
-		"""
-		ret = [ "%s %s %s/%s" % (self.method, str(self.uri), self.protocol, self.version) ]
-		for (h, v) in self.headers.items():
-			ret.append("%s: %s" % (h, v.encode('utf-8')))
-		ret.append('')
-		if self.body:
-			if self.getContentEncoding() == self.ENCODING_UTF8:
-				ret.append(self.body) #.encode('utf-8')
-			else:
-				ret.append(self.body)
-		return SEPARATOR.join(ret)
+	def _getFirstLine(self):
+		return "%s %s %s/%s" % (self.method, str(self.uri), self.protocol, self.version)
 
 	def getUri(self):
 		return self.uri
@@ -268,21 +347,8 @@ class Response(Message):
 		self.statusCode = int(statusCode)
 		self.reasonPhrase = reasonPhrase
 
-	def __str__(self):
-		"""
-		Encodes a message to a utf-8 string.
-		The final \00 is not part of the message, but just a transport separator.
-		"""
-		ret = [ "%s %s" % (str(self.statusCode), str(self.reasonPhrase)) ]
-		for (h, v) in self.headers.items():
-			ret.append("%s: %s" % (h, v.encode('utf-8')))
-		ret.append("")
-		if self.body:
-			if self.getContentEncoding() == self.ENCODING_UTF8:
-				ret.append(self.body) #.encode('utf-8')
-			else:
-				ret.append(self.body)
-		return SEPARATOR.join(ret)
+	def _getFirstLine(self):
+		return "%s %s" % (str(self.statusCode), str(self.reasonPhrase))
 
 	def getStatusCode(self):
 		return self.statusCode
@@ -301,8 +367,19 @@ def parse(data):
 	"""
 	Parses data into a Message (either a Notification, Request, Response, actually).
 	Raises an exception in case of an invalid message.
+	
+	Only the header block is split and parsed: the body is extracted as is,
+	without being scanned, so that it may be large or contain raw binary data
+	(when received through a length-prefixed framing).
 	"""
-	lines = data.split(SEPARATOR)
+	# The header block ends on the first empty line
+	index = data.find(SEPARATOR + SEPARATOR)
+	if index < 0:
+		lines = data.split(SEPARATOR)
+		body = ''
+	else:
+		lines = data[:index].split(SEPARATOR)
+		body = data[index + 2*len(SEPARATOR):]
 
 	# request line, for request and notifications
 	m = REQUESTLINE_REGEXP.match(lines[0])
@@ -317,22 +394,21 @@ def parse(data):
 		# This is a response
 		message = Response(statusCode = m.group('status'), reasonPhrase = m.group('reason'))
 
-	# Common part: headers parsing, body parsing.
-	i = 1
+	# Common part: headers parsing.
+	# Header values are kept as received (utf-8 strings), as setHeader() would do.
+	headers = message.headers
 	for header in lines[1:]:
-		i += 1
-		l = header.strip()
 		if not header:
-			break # reached body
-		m = HEADERLINE_REGEXP.match(l)
-		if m:
-			message.setHeader(m.group('header'), m.group('value').decode('utf-8'))
-		else:
-			raise Exception("Invalid header in message (%s)" % str(l))
+			continue # trailing separator of a message without body
+		(h, sep, value) = header.partition(':')
+		h = h.strip()
+		if not sep or not h:
+			raise Exception("Invalid header in message (%s)" % str(header.strip()))
+		headers[h] = value.strip()
 	
 	# Body - raw, no additional decoding or interpretation.
 	# use getApplicationBody() for that.
-	message.setBody(SEPARATOR.join(lines[i:]))
+	message.body = body
 
 	# OK, we're done.
 	return message
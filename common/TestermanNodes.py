@@ -29,13 +29,23 @@
 # - send/receive packets (stream + packetizer)
 # - passive keep-alive mechanism (regularly send a KA packet, incoming 
 #   inactivity timeout to detect dropped connections)
-# - provided by TcpPacketizerServerThread and TcpPacketizerClientThread.
+# - provided by TcpPacketizerServerThread and TcpPacketizerClientThread
+#   (one thread per connection), or by their event-driven equivalents
+#   ReactorPacketizerServer and ReactorPacketizerClient (all connections
+#   multiplexed on one or several epoll-based PacketizerReactor threads).
 # - must be reimplemented to provide several callbacks implementations.
 # - these classes are not testerman-tainted and may be reused anywhere else.
 # Connectors:
 # - they are the combination of the untainted network level classes,
 #   but implementing a specific Testerman interface IConnector.
-# - ListeningConnectorThread, ConnectingConnectorThread
+# - ListeningConnectorThread, ConnectingConnectorThread,
+#   ReactorListeningConnector, ReactorConnectingConnector
+# - the connecting side offers a length-prefixed framing (raw binary bodies,
+#   no terminator scanning) when connected; the listening side accepts it.
+#   Peers that do not know the offer ignore it and keep the legacy
+#   \x00-terminated framing.
+# - the transport (threaded or reactor) is selected when initializing
+#   the node, or process-wide with setDefaultTransport()
 # - network handles (socket ids) are here renamed to 'channels'
 # Transaction Manager, Node:
 # - able to encode/decode Testerman Messages, managing transaction Ids,
@@ -56,9 +66,13 @@
 
 import TestermanMessages as Messages
 
+import collections
+import errno
+import heapq
 import threading
 import select
 import socket
+import struct
 import Queue
 import SocketServer
 import time
@@ -67,6 +81,11 @@ import sys
 
 KEEP_ALIVE_PDU = 'KA'
 
+# Length-prefixed frames: marker, 32-bit payload length (network order), payload.
+# A legacy, terminated packet never starts with this marker.
+LENGTH_PREFIXED_FRAME_MARKER = '\x01'
+LENGTH_PREFIXED_FRAME_HEADER = struct.Struct('!I')
+
 ################################################################################
 # Tools
 ################################################################################
@@ -81,6 +100,130 @@ def getBacktrace():
 	return ret
 
 
+################################################################################
+# Stream packetizer
+################################################################################
+
+class PacketDeframer:
+	"""
+	Incremental packetizer for a stream of packets separated with a single
+	terminator character, or sent as length-prefixed frames (see frame()).
+	Both kinds of packets may be mixed on the same stream.
+	
+	Incoming data are received directly into a growable buffer (recv_into),
+	and only newly received bytes are scanned for the terminator:
+	a large packet received in many segments is neither copied nor
+	rescanned again and again (linear time instead of quadratic).
+	Length-prefixed frames are not scanned at all.
+	
+	Usage:
+		n = deframer.recv(socket) # or deframer.feed(data)
+		for packet in deframer.packets():
+			...
+	"""
+	INITIAL_SIZE = 65536
+	
+	def __init__(self, terminator = '\x00'):
+		self.terminator = terminator
+		self._buf = bytearray(self.INITIAL_SIZE)
+		self._start = 0 # start of the current, incomplete packet
+		self._end = 0 # end of the received data
+		self._scanned = 0 # no terminator in _buf[_start:_scanned]
+
+	def recv(self, sock, size = 65535):
+		"""
+		Receives at most size bytes from sock.
+		
+		@rtype: integer
+		@returns: the number of received bytes (0 if the connection was closed)
+		"""
+		self._reserve(size)
+		n = sock.recv_into(memoryview(self._buf)[self._end:self._end + size], size)
+		self._end += n
+		return n
+	
+	def feed(self, data):
+		"""
+		Appends data that were received by other means.
+		"""
+		size = len(data)
+		self._reserve(size)
+		self._buf[self._end:self._end + size] = data
+		self._end += size
+
+	def packets(self):
+		"""
+		Extracts the packets completed since the last call.
+		
+		@rtype: list of strings
+		"""
+		ret = []
+		buf = self._buf
+		headerSize = 1 + LENGTH_PREFIXED_FRAME_HEADER.size
+		while self._start < self._end:
+			if buf[self._start] == 1: # LENGTH_PREFIXED_FRAME_MARKER
+				if self._end - self._start < headerSize:
+					break
+				length = LENGTH_PREFIXED_FRAME_HEADER.unpack_from(buf, self._start + 1)[0]
+				missing = self._start + headerSize + length - self._end
+				if missing > 0:
+					# Make room for the whole frame at once
+					self._reserve(missing)
+					break
+				ret.append(str(buf[self._start + headerSize:self._start + headerSize + length]))
+				self._start = self._scanned = self._start + headerSize + length
+				continue
+			index = buf.find(self.terminator, self._scanned, self._end)
+			if index < 0:
+				self._scanned = self._end
+				break
+			ret.append(str(buf[self._start:index]))
+			self._start = self._scanned = index + 1
+		if self._start == self._end:
+			# Everything consumed: rewind (and release a buffer enlarged by a large packet)
+			self._start = self._end = self._scanned = 0
+			if len(self._buf) > 16 * self.INITIAL_SIZE:
+				self._buf = bytearray(self.INITIAL_SIZE)
+		return ret
+	
+	def reset(self):
+		self._start = self._end = self._scanned = 0
+
+	def frame(self, packet, length_prefixed = False):
+		"""
+		Returns the packet as it should be written to the stream.
+		
+		@type  length_prefixed: bool
+		@param length_prefixed: if True, use a length-prefixed frame
+		(the packet may then contain the terminator), otherwise just append
+		the terminator. Only use length-prefixed frames with a peer that
+		supports them.
+		"""
+		if length_prefixed:
+			return LENGTH_PREFIXED_FRAME_MARKER + LENGTH_PREFIXED_FRAME_HEADER.pack(len(packet)) + packet
+		return packet + self.terminator
+
+	def _reserve(self, size):
+		"""
+		Makes sure size bytes can be appended to the buffer.
+		The pending data are moved to the buffer head if they use less than
+		half of it, otherwise the buffer is doubled, so that each received
+		byte is moved a constant number of times on average.
+		"""
+		if self._end + size <= len(self._buf):
+			return
+		pending = self._end - self._start
+		if pending + size <= len(self._buf) and pending <= len(self._buf) / 2:
+			self._buf[0:pending] = self._buf[self._start:self._end]
+		else:
+			buf = bytearray(max(2 * len(self._buf), pending + size))
+			buf[0:pending] = self._buf[self._start:self._end]
+			self._buf = buf
+		self._scanned -= self._start
+		self._start = 0
+		self._end = pending
+
+
 ################################################################################
 # Reusable Tcp client class
 ################################################################################
@@ -94,7 +237,7 @@ class TcpPacketizerClientThread(threading.Thread):
 	Once constructed, you may use:
 		start()
 		stop()
-		send_packet(packet)
+		send_packet(packet, length_prefixed = False)
 	from any thread,
 	and reimplement:
 		on_connection()
@@ -116,7 +259,7 @@ class TcpPacketizerClientThread(threading.Thread):
 		self.stopEvent = threading.Event()
 		self.reconnectInterval = reconnection_interval
 		self.socket = None
-		self.buf = ''
+		self.deframer = PacketDeframer(self.terminator)
 		self.queue = Queue.Queue(0)
 		self.connected = False
 		self.inactivity_timeout = inactivity_timeout
@@ -140,7 +283,7 @@ class TcpPacketizerClientThread(threading.Thread):
 		self.trace("Tcp client started, connecting from %s to %s" % (str(self.localAddress), str(self.serverAddress)))
 		while not self.stopEvent.isSet():
 			try:
-				self.buf = ''
+				self.deframer.reset()
 				# Keep connected
 				self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 				self.socket.bind(self.localAddress)
@@ -234,11 +377,9 @@ class TcpPacketizerClientThread(threading.Thread):
 
 				# Received a message from the network
 				if self.socket in r:
-					read = self.socket.recv(65535)
-					if not read:
+					if not self.deframer.recv(self.socket):
 						raise EOFError("Nothing to read on read event: disconnecting")
 					self.last_activity_timestamp = current_time
-					self.buf = ''.join([self.buf, read]) # faster than += r
 					self.__on_incoming_data()
 
 				# select timeout - we post a keep_alive right now
@@ -345,11 +486,9 @@ class TcpPacketizerClientThread(threading.Thread):
 				if self.socket in e:
 					raise EOFError("Socket select error: disconnecting")
 				elif self.socket in r:
-					read = self.socket.recv(65535)
-					if not read:
+					if not self.deframer.recv(self.socket):
 						raise EOFError("Nothing to read on read event: disconnecting")
 					self.last_activity_timestamp = time.time()
-					self.buf = ''.join([self.buf, read]) # faster than += r
 					self.__on_incoming_data()
 
 				# Check inactivity timeout 
@@ -395,13 +534,11 @@ class TcpPacketizerClientThread(threading.Thread):
 				pass
 
 	def __on_incoming_data(self):
-		pdus = self.buf.split(self.terminator)
-		for pdu in pdus[:-1]:
+		for pdu in self.deframer.packets():
 			if not pdu == KEEP_ALIVE_PDU:
 				self.handle_packet(pdu)
 			else:
 				self.trace("Received Keep Alive")
-		self.buf = pdus[-1]
 
 	def stop(self):
 		self.stopEvent.set()
@@ -410,8 +547,8 @@ class TcpPacketizerClientThread(threading.Thread):
 			os.write(self.control_write, 'b')
 		self.join()
 
-	def send_packet(self, packet):
-		self.queue.put(packet + self.terminator)
+	def send_packet(self, packet, length_prefixed = False):
+		self.queue.put(self.deframer.frame(packet, length_prefixed))
 		if not self._windowsPlatform:
 			os.write(self.control_write, 'a')
 	
@@ -466,7 +603,7 @@ class TcpPacketizerServerThread(threading.Thread):
 	Once constructed, you may use:
 		start()
 		stop()
-		send_packet(client_address, packet)
+		send_packet(client_address, packet, length_prefixed = False)
 	from any thread,
 	and reimplement:
 		on_connection(client_address)
@@ -512,7 +649,7 @@ class TcpPacketizerServerThread(threading.Thread):
 			self.mutex.release()
 			self.manager.on_disconnection(client.client_address)
 		
-		def send_packet(self, client_address, packet):
+		def send_packet(self, client_address, packet, length_prefixed = False):
 #			self.trace("[DEBUG] sending packet to client: " + str(client_address))
 			self.mutex.acquire()
 			if self.clients.has_key(client_address):
@@ -522,7 +659,7 @@ class TcpPacketizerServerThread(threading.Thread):
 			self.mutex.release()
 			if client:
 #				self.trace("[DEBUG] client found for: " + str(client_address))
-				client.send_packet(packet)
+				client.send_packet(packet, length_prefixed)
 		
 		def trace(self, txt):
 			self.manager.trace(txt)
@@ -558,7 +695,7 @@ class TcpPacketizerServerThread(threading.Thread):
 
 		def __init__(self, request, client_address, server):
 			self.stopEvent = threading.Event()
-			self.buf = ''
+			self.deframer = PacketDeframer(self.terminator)
 			self.queue = Queue.Queue(0)
 			self.socket = None
 			self.last_activity_timestamp = time.time()
@@ -628,11 +765,9 @@ class TcpPacketizerServerThread(threading.Thread):
 					raise EOFError("Socket select error: disconnecting")
 
 				if self.socket in r:
-					read = self.socket.recv(65535)
-					if not read:
+					if not self.deframer.recv(self.socket):
 						raise EOFError("Nothing to read on read event: disconnecting")
 					self.last_activity_timestamp = current_time
-					self.buf = ''.join([self.buf, read]) # faster than += r
 					self.__on_incoming_data()
 
 				if not r and not w and not e:
@@ -720,23 +855,21 @@ class TcpPacketizerServerThread(threading.Thread):
 			"""
 			New internal method.
 			"""
-			# self.buf contains all received data.
+			# self.deframer contains all received data.
 			# Let's check if we can consume them, i.e. PDUs/packets are available.
-			pdus = self.buf.split(self.terminator)
-			for pdu in pdus[:-1]:
+			for pdu in self.deframer.packets():
 				if not pdu == KEEP_ALIVE_PDU:
 					self.handle_packet(pdu)
 				else:
 					self.trace("Received Keep Alive")
-			self.buf = pdus[-1]
 
-		def send_packet(self, packet):
+		def send_packet(self, packet, length_prefixed = False):
 			"""
 			New method.
-			Sends a packet with the terminator.
+			Sends a packet with the terminator, or as a length-prefixed frame.
 			"""
 			# Asynchronous send.
-			self.queue.put(packet + self.terminator)
+			self.queue.put(self.deframer.frame(packet, length_prefixed))
 			os.write(self.control_write, 'a')
 
 		def handle_packet(self, packet):
@@ -781,8 +914,8 @@ class TcpPacketizerServerThread(threading.Thread):
 		self.stopEvent.set()
 		self.join()
 	
-	def send_packet(self, client_address, packet):
-		self.server.send_packet(client_address, packet)
+	def send_packet(self, client_address, packet, length_prefixed = False):
+		self.server.send_packet(client_address, packet, length_prefixed)
 	
 	##
 	# To reimplement
@@ -820,10 +953,767 @@ class TcpPacketizerServerThread(threading.Thread):
 
 
 
+################################################################################
+# Event-driven alternative: epoll-based reactor
+################################################################################
+
+def isReactorSupported():
+	"""
+	Returns True if the platform provides epoll() or poll(),
+	required by the reactor-based transport.
+	"""
+	return hasattr(select, 'epoll') or hasattr(select, 'poll')
+
+class _Poller:
+	"""
+	Thin wrapper over epoll (preferred) or poll, with a timeout in seconds.
+	Event flag values are the same for both implementations.
+	"""
+	READ = select.POLLIN
+	WRITE = select.POLLOUT
+	ERROR = select.POLLERR | select.POLLHUP
+	
+	def __init__(self):
+		if hasattr(select, 'epoll'):
+			self._poller = select.epoll()
+			self._timeoutFactor = 1.0
+		else:
+			self._poller = select.poll()
+			self._timeoutFactor = 1000.0
+
+	def register(self, fd, events):
+		self._poller.register(fd, events)
+	
+	def modify(self, fd, events):
+		self._poller.modify(fd, events)
+	
+	def unregister(self, fd):
+		try:
+			self._poller.unregister(fd)
+		except Exception:
+			pass
+	
+	def poll(self, timeout):
+		"""
+		timeout in s. None or negative to wait forever.
+		"""
+		if timeout is None or timeout < 0:
+			timeout = -1
+		else:
+			timeout = timeout * self._timeoutFactor
+		try:
+			return self._poller.poll(timeout)
+		except (select.error, IOError), e:
+			if e.args[0] == errno.EINTR:
+				return []
+			raise
+
+	def close(self):
+		if hasattr(self._poller, 'close'):
+			self._poller.close()
+
+
+class ReactorChannel:
+	"""
+	A packetized, non-blocking tcp connection managed by a PacketizerReactor.
+	
+	The owner (a ReactorPacketizerServer or a ReactorPacketizerClient)
+	is notified through:
+		channel_connected(channel) (outgoing connections only)
+		channel_packet(channel, packet)
+		channel_closed(channel, reason)
+		trace(txt)
+	All these are called from the reactor thread.
+	
+	send_packet() may be called from any thread.
+	"""
+
+	terminator = '\x00'
+
+	def __init__(self, reactor, sock, owner, address, inactivity_timeout = 30.0, keep_alive_interval = 20.0, connecting = False):
+		self.reactor = reactor
+		self.socket = sock
+		self.fd = sock.fileno()
+		self.owner = owner
+		self.address = address
+		self.inactivity_timeout = inactivity_timeout
+		self.keep_alive_interval = keep_alive_interval
+		self.connecting = connecting
+		self.closed = False
+		self.deframer = PacketDeframer(self.terminator)
+		# Outgoing data, shared between the reactor and sending threads
+		self._mutex = threading.Lock()
+		self._outgoing = collections.deque()
+		self._events = _Poller.READ
+		self.last_activity_timestamp = time.time() # incoming activity only
+		self.last_keep_alive_timestamp = time.time() # outgoing activity
+	
+	def send_packet(self, packet, length_prefixed = False):
+		self._mutex.acquire()
+		self._outgoing.append(self.deframer.frame(packet, length_prefixed))
+		self._mutex.release()
+		self.reactor.requestWrite(self)
+
+	def close(self, reason = "local"):
+		"""
+		Closes the channel. May be called from any thread.
+		"""
+		self.reactor.callInReactor(lambda: self.reactor._close(self, reason))
+
+	def hasPendingData(self):
+		return len(self._outgoing) > 0
+
+	def _on_incoming_data(self):
+		for pdu in self.deframer.packets():
+			if not pdu == KEEP_ALIVE_PDU:
+				self.owner.channel_packet(self, pdu)
+			else:
+				self.owner.trace("Received Keep Alive from %s" % str(self.address))
+
+	def _flush(self):
+		"""
+		Sends as much pending data as the socket accepts.
+		Returns True if everything has been sent.
+		Reactor thread only.
+		"""
+		self._mutex.acquire()
+		try:
+			while self._outgoing:
+				# Coalesce all pending packets into a single send()
+				if len(self._outgoing) > 1:
+					data = ''.join(self._outgoing)
+					self._outgoing.clear()
+					self._outgoing.append(data)
+				data = self._outgoing[0]
+				try:
+					sent = self.socket.send(data)
+				except socket.error, e:
+					if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+						return False
+					raise
+				self.last_keep_alive_timestamp = time.time()
+				if sent < len(data):
+					self._outgoing[0] = data[sent:]
+					return False
+				self._outgoing.popleft()
+			return True
+		finally:
+			self._mutex.release()
+
+
+class PacketizerReactor(threading.Thread):
+	"""
+	A single I/O thread multiplexing any number of packetized tcp channels
+	(listening sockets, incoming or outgoing connections) using epoll,
+	or poll() where epoll is not available.
+	
+	Nothing blocking is ever done in this thread: outgoing packets
+	are queued by any thread and flushed when the sockets are writable,
+	several packets being coalesced into a single send() when possible.
+	
+	Keep-alives and inactivity timeouts are checked for all channels once
+	per tick.
+	
+	Offers:
+		start()
+		stop()
+		addChannel(channel)
+		addListener(sock, callback)
+		callInReactor(callback)
+		callLater(delay, callback)
+	from any thread.
+	"""
+	
+	TICK = 1.0
+	
+	def __init__(self, name = "PacketizerReactor"):
+		threading.Thread.__init__(self, name = name)
+		self.setDaemon(True)
+		self._poller = _Poller()
+		self._stopEvent = threading.Event()
+		self._mutex = threading.Lock()
+		self._channels = {} # channel per fd
+		self._listeners = {} # (sock, callback) per fd
+		self._pendingWrites = {} # channel per fd
+		self._pendingCalls = collections.deque()
+		self._timers = [] # heap of (deadline, seq, callback)
+		self._timerSeq = 0
+		self._wakeupPending = False
+		self._nextTick = time.time() + self.TICK
+		# The control pipe wakes up the poll() when something is queued
+		self._control_read, self._control_write = os.pipe()
+		self._poller.register(self._control_read, _Poller.READ)
+
+	def stop(self):
+		self._stopEvent.set()
+		self.wakeup()
+		if self.isAlive() and threading.currentThread() is not self:
+			self.join()
+	
+	def wakeup(self):
+		self._mutex.acquire()
+		if not self._wakeupPending:
+			self._wakeupPending = True
+			os.write(self._control_write, 'w')
+		self._mutex.release()
+
+	def callInReactor(self, callback):
+		"""
+		Executes callback() in the reactor thread as soon as possible.
+		"""
+		self._mutex.acquire()
+		self._pendingCalls.append(callback)
+		self._mutex.release()
+		self.wakeup()
+
+	def callLater(self, delay, callback):
+		"""
+		Executes callback() in the reactor thread after delay seconds.
+		"""
+		self._mutex.acquire()
+		self._timerSeq += 1
+		heapq.heappush(self._timers, (time.time() + delay, self._timerSeq, callback))
+		self._mutex.release()
+		self.wakeup()
+
+	def requestWrite(self, channel):
+		self._mutex.acquire()
+		self._pendingWrites[channel.fd] = channel
+		self._mutex.release()
+		self.wakeup()
+
+	def addChannel(self, channel):
+		self.callInReactor(lambda: self._addChannel(channel))
+
+	def addListener(self, sock, callback):
+		"""
+		Watches a listening socket.
+		callback(sock) is called in the reactor thread when a connection can be accepted.
+		"""
+		self.callInReactor(lambda: self._addListener(sock, callback))
+	
+	def removeListener(self, sock):
+		self.callInReactor(lambda: self._removeListener(sock))
+
+	##
+	# Reactor thread only
+	##
+	def _addChannel(self, channel):
+		self._channels[channel.fd] = channel
+		if channel.connecting:
+			channel._events = _Poller.WRITE
+		else:
+			channel._events = _Poller.READ
+		self._poller.register(channel.fd, channel._events | _Poller.ERROR)
+		# Some packets may have been queued before the registration
+		if not channel.connecting and channel.hasPendingData():
+			self._write(channel)
+
+	def _addListener(self, sock, callback):
+		self._listeners[sock.fileno()] = (sock, callback)
+		self._poller.register(sock.fileno(), _Poller.READ)
+
+	def _removeListener(self, sock):
+		fd = sock.fileno()
+		if self._listeners.has_key(fd):
+			del self._listeners[fd]
+			self._poller.unregister(fd)
+		try:
+			sock.close()
+		except Exception:
+			pass
+
+	def _setEvents(self, channel, events):
+		if channel._events != events and not channel.closed:
+			channel._events = events
+			self._poller.modify(channel.fd, events | _Poller.ERROR)
+
+	def _write(self, channel):
+		try:
+			if channel._flush():
+				self._setEvents(channel, _Poller.READ)
+			else:
+				self._setEvents(channel, _Poller.READ | _Poller.WRITE)
+		except Exception, e:
+			self._close(channel, "Unable to send data: %s" % str(e))
+
+	def _read(self, channel):
+		try:
+			read = channel.deframer.recv(channel.socket)
+		except socket.error, e:
+			if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				return
+			self._close(channel, "Low level error: %s" % str(e))
+			return
+		if not read:
+			self._close(channel, "Disconnected by peer")
+			return
+		channel.last_activity_timestamp = time.time()
+		channel._on_incoming_data()
+
+	def _connected(self, channel):
+		err = channel.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+		if err:
+			self._close(channel, "Unable to connect: %s" % os.strerror(err))
+			return
+		channel.last_activity_timestamp = time.time()
+		channel.last_keep_alive_timestamp = time.time()
+		self._setEvents(channel, _Poller.READ)
+		# The owner clears channel.connecting once the packets it queued
+		# while connecting are queued to the channel, so that they are sent first
+		channel.owner.channel_connected(channel)
+		channel.connecting = False
+		if channel.hasPendingData():
+			self._write(channel)
+
+	def _close(self, channel, reason):
+		if channel.closed:
+			return
+		# Try to send the remaining data before closing, if we close it on our own.
+		if reason == "local" and not channel.connecting:
+			try:
+				channel._flush()
+			except Exception:
+				pass
+		channel.closed = True
+		if self._channels.get(channel.fd) is channel:
+			del self._channels[channel.fd]
+			self._poller.unregister(channel.fd)
+		try:
+			channel.socket.close()
+		except Exception:
+			pass
+		try:
+			channel.owner.channel_closed(channel, reason)
+		except Exception, e:
+			channel.owner.trace("Exception in close callback: %s" % str(e))
+
+	def _tick(self, now):
+		"""
+		Keep-alive and inactivity timeout management.
+		"""
+		for channel in self._channels.values():
+			if channel.connecting:
+				continue
+			if channel.inactivity_timeout and now - channel.last_activity_timestamp > channel.inactivity_timeout:
+				self._close(channel, "Inactivity timeout")
+			elif channel.keep_alive_interval and now - channel.last_keep_alive_timestamp > channel.keep_alive_interval:
+				channel.owner.trace("Sending Keep Alive to %s" % str(channel.address))
+				channel._outgoing.append(KEEP_ALIVE_PDU + channel.terminator)
+				self._write(channel)
+
+	def _getTimeout(self, now):
+		timeout = self._nextTick - now
+		if self._timers:
+			timeout = min(timeout, self._timers[0][0] - now)
+		return max(timeout, 0)
+
+	def _runPending(self):
+		self._mutex.acquire()
+		calls = self._pendingCalls
+		self._pendingCalls = collections.deque()
+		writes = self._pendingWrites
+		self._pendingWrites = {}
+		now = time.time()
+		timers = []
+		while self._timers and self._timers[0][0] <= now:
+			timers.append(heapq.heappop(self._timers)[2])
+		self._mutex.release()
+
+		for callback in calls:
+			try:
+				callback()
+			except Exception, e:
+				self._trace("Exception in reactor call: %s" % getBacktrace())
+		for channel in writes.values():
+			if not channel.closed and not channel.connecting and self._channels.get(channel.fd) is channel:
+				self._write(channel)
+		for callback in timers:
+			try:
+				callback()
+			except Exception, e:
+				self._trace("Exception in reactor timer: %s" % getBacktrace())
+		
+	def _trace(self, txt):
+		# No owner to report to: dump to stderr, as the thread would do on an uncaught exception.
+		sys.stderr.write("[%s] %s\n" % (self.getName(), txt))
+	
+	def run(self):
+		while not self._stopEvent.isSet():
+			events = self._poller.poll(self._getTimeout(time.time()))
+			for fd, event in events:
+				if fd == self._control_read:
+					self._mutex.acquire()
+					os.read(self._control_read, 4096)
+					self._wakeupPending = False
+					self._mutex.release()
+					continue
+
+				if self._listeners.has_key(fd):
+					sock, callback = self._listeners[fd]
+					try:
+						callback(sock)
+					except Exception, e:
+						self._trace("Exception while accepting a connection: %s" % str(e))
+					continue
+
+				channel = self._channels.get(fd)
+				if not channel:
+					continue
+				if channel.connecting:
+					if event & (_Poller.WRITE | _Poller.ERROR):
+						self._connected(channel)
+					continue
+				if event & _Poller.READ:
+					self._read(channel)
+				if channel.closed:
+					continue
+				if event & _Poller.WRITE:
+					self._write(channel)
+				if event & _Poller.ERROR and not event & _Poller.READ:
+					self._close(channel, "Socket error: disconnecting")
+			
+			self._runPending()
+
+			now = time.time()
+			if now >= self._nextTick:
+				self._nextTick = now + self.TICK
+				self._tick(now)
+		
+		# Cleanup
+		for channel in self._channels.values():
+			self._close(channel, "local")
+		for fd in self._listeners.keys():
+			self._removeListener(self._listeners[fd][0])
+		self._poller.close()
+		os.close(self._control_read)
+		os.close(self._control_write)
+
+
+_SharedReactor = None
+_SharedReactorMutex = threading.Lock()
+
+def getSharedReactor():
+	"""
+	Returns the process-wide reactor used by connecting channels,
+	starting it if needed.
+	"""
+	global _SharedReactor
+	_SharedReactorMutex.acquire()
+	try:
+		if _SharedReactor is None or not _SharedReactor.isAlive():
+			_SharedReactor = PacketizerReactor("SharedPacketizerReactor")
+			_SharedReactor.start()
+		return _SharedReactor
+	finally:
+		_SharedReactorMutex.release()
+
+
+class ReactorPacketizerServer:
+	"""
+	Reactor-based equivalent of TcpPacketizerServerThread:
+	all clients are multiplexed over io_threads reactors
+	instead of using one thread per client.
+	
+	Once constructed, you may use:
+		start()
+		stop()
+		send_packet(client_address, packet, length_prefixed = False)
+		disconnect(client_address)
+	from any thread,
+	and reimplement:
+		on_connection(client_address)
+		on_disconnection(client_address)
+		handle_packet(client_address, packet)
+		trace(txt)
+	"""
+	def __init__(self, listening_address, inactivity_timeout = 30.0, keep_alive_interval = 20.0, io_threads = 1):
+		self.listening_address = listening_address
+		self.inactivity_timeout = inactivity_timeout
+		self.keep_alive_interval = keep_alive_interval
+		self._mutex = threading.RLock()
+		self._clients = {} # channel per client_address
+		self._reactors = [ PacketizerReactor("PacketizerReactor-%d" % i) for i in range(max(1, io_threads)) ]
+		self._nextReactor = 0
+		# Bind now, so that errors are reported at construction time like SocketServer does
+		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.socket.bind(self.listening_address)
+		self.socket.listen(128)
+		self.socket.setblocking(False)
+	
+	def start(self):
+		self.trace("Tcp server started, listening on %s (%d I/O thread(s))" % (str(self.listening_address), len(self._reactors)))
+		for reactor in self._reactors:
+			reactor.start()
+		self._reactors[0].addListener(self.socket, self._accept)
+	
+	def stop(self):
+		self._reactors[0].removeListener(self.socket)
+		for reactor in self._reactors:
+			reactor.stop()
+
+	def send_packet(self, client_address, packet, length_prefixed = False):
+		self._mutex.acquire()
+		channel = self._clients.get(client_address)
+		self._mutex.release()
+		if channel:
+			channel.send_packet(packet, length_prefixed)
+	
+	def disconnect(self, client_address):
+		self._mutex.acquire()
+		channel = self._clients.get(client_address)
+		self._mutex.release()
+		if channel:
+			channel.close()
+
+	def _accept(self, sock):
+		"""
+		Reactor callback, on the listening socket.
+		"""
+		while True:
+			try:
+				s, client_address = sock.accept()
+			except socket.error, e:
+				if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+					return
+				raise
+			s.setblocking(False)
+			s.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+			s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+			# Round-robin over the available reactors
+			reactor = self._reactors[self._nextReactor % len(self._reactors)]
+			self._nextReactor += 1
+			channel = ReactorChannel(reactor, s, self, client_address, self.inactivity_timeout, self.keep_alive_interval)
+			self._mutex.acquire()
+			self._clients[client_address] = channel
+			self._mutex.release()
+			self.trace("[tcphandler] %s new connection" % str(client_address))
+			self.on_connection(client_address)
+			reactor.addChannel(channel)
+
+	##
+	# ReactorChannel owner callbacks
+	##
+	def channel_packet(self, channel, packet):
+		self.handle_packet(channel.address, packet)
+	
+	def channel_closed(self, channel, reason):
+		self.trace("[tcphandler] %s disconnected (%s)" % (str(channel.address), reason))
+		self._mutex.acquire()
+		if self._clients.get(channel.address) is channel:
+			del self._clients[channel.address]
+		self._mutex.release()
+		self.on_disconnection(channel.address)
+
+	def channel_connected(self, channel):
+		pass
+
+	##
+	# To reimplement
+	##
+	def on_connection(self, client_address):
+		pass
+	
+	def on_disconnection(self, client_address):
+		pass
+	
+	def handle_packet(self, client_address, packet):
+		pass
+
+	def trace(self, txt):
+		pass
+
+
+class ReactorPacketizerClient:
+	"""
+	Reactor-based equivalent of TcpPacketizerClientThread:
+	keeps reconnecting to a server, without a dedicated thread.
+	All clients of a process share the same reactor.
+
+	Once constructed, you may use:
+		start()
+		stop()
+		send_packet(packet, length_prefixed = False)
+	from any thread,
+	and reimplement:
+		on_connection()
+		on_disconnection()
+		handle_packet(packet)
+		trace(txt)
+	"""
+	def __init__(self, server_address, local_address = ('', 0), reconnection_interval = 1.0, inactivity_timeout = 30.0, keep_alive_interval = 20.0, reactor = None):
+		self.serverAddress = server_address
+		self.localAddress = local_address or ('', 0)
+		self.reconnectInterval = reconnection_interval
+		self.inactivity_timeout = inactivity_timeout
+		self.keep_alive_interval = keep_alive_interval
+		self.socket = None
+		self.connected = False
+		self._reactor = reactor
+		self._channel = None
+		self._running = False
+		self._mutex = threading.RLock()
+		# Packets sent while not connected yet
+		self._pending = collections.deque()
+	
+	def start(self):
+		if self._reactor is None:
+			self._reactor = getSharedReactor()
+		self.trace("Tcp client started, connecting from %s to %s" % (str(self.localAddress), str(self.serverAddress)))
+		self._running = True
+		self._reactor.callInReactor(self._connect)
+
+	def stop(self):
+		self._mutex.acquire()
+		self._running = False
+		channel = self._channel
+		self._mutex.release()
+		if channel:
+			if threading.currentThread() is self._reactor:
+				self._reactor._close(channel, "local")
+			else:
+				done = threading.Event()
+				def closeAndSignal():
+					self._reactor._close(channel, "local")
+					done.set()
+				self._reactor.callInReactor(closeAndSignal)
+				done.wait(5.0)
+		self.trace("Tcp client stopped.")
+
+	def send_packet(self, packet, length_prefixed = False):
+		self._mutex.acquire()
+		channel = self._channel
+		if not channel or channel.connecting:
+			self._pending.append((packet, length_prefixed))
+			self._mutex.release()
+			return
+		self._mutex.release()
+		channel.send_packet(packet, length_prefixed)
+
+	def disconnect(self):
+		self._mutex.acquire()
+		channel = self._channel
+		self._mutex.release()
+		if channel:
+			channel.close("local")
+
+	def _connect(self):
+		"""
+		Reactor thread.
+		"""
+		if not self._running:
+			return
+		try:
+			s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			s.bind(self.localAddress)
+			s.setblocking(False)
+			try:
+				s.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+			except Exception:
+				pass
+			ret = s.connect_ex(self.serverAddress)
+			if ret and ret not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+				s.close()
+				raise Exception("socket error %d (%s)" % (ret, os.strerror(ret)))
+		except Exception, e:
+			self.trace("Unable to connect: %s. Trying to reconnect in %ds..." % (str(e), self.reconnectInterval))
+			self._reactor.callLater(self.reconnectInterval, self._connect)
+			return
+		self.socket = s
+		channel = ReactorChannel(self._reactor, s, self, self.serverAddress, self.inactivity_timeout, self.keep_alive_interval, connecting = True)
+		self._mutex.acquire()
+		self._channel = channel
+		self._mutex.release()
+		self._reactor._addChannel(channel)
+
+	##
+	# ReactorChannel owner callbacks
+	##
+	def channel_connected(self, channel):
+		self.trace("Connected.")
+		self._mutex.acquire()
+		channel._mutex.acquire()
+		while self._pending:
+			(packet, length_prefixed) = self._pending.popleft()
+			channel._outgoing.append(channel.deframer.frame(packet, length_prefixed))
+		channel._mutex.release()
+		# From now on, send_packet() sends directly, after the pending packets
+		channel.connecting = False
+		self.connected = True
+		self._mutex.release()
+		self.on_connection()
+	
+	def channel_packet(self, channel, packet):
+		self.handle_packet(packet)
+	
+	def channel_closed(self, channel, reason):
+		self._mutex.acquire()
+		wasConnected = self.connected
+		self.connected = False
+		if self._channel is channel:
+			self._channel = None
+		running = self._running
+		self._mutex.release()
+		if wasConnected:
+			self.trace("Disconnected (%s)." % reason)
+			try:
+				self.on_disconnection()
+			except Exception:
+				pass
+		if running:
+			self.trace("Trying to reconnect in %ds..." % self.reconnectInterval)
+			self._reactor.callLater(self.reconnectInterval, self._connect)
+
+	##
+	# To reimplement
+	##
+	def handle_packet(self, packet):
+		pass
+	
+	def on_connection(self):
+		pass
+
+	def on_disconnection(self):
+		pass
+
+	def trace(self, txt):
+		pass
+
+
 ################################################################################
 # Connectors (low-level tcp server or reconnecting client)
 ################################################################################
 
+##
+# Framing negotiation
+##
+
+# Sent by the connecting side (with the legacy framing) right after the
+# connection; the listening side answers with the accept PDU, then both
+# sides send length-prefixed frames only.
+# These PDUs cannot be parsed as messages: older peers just trace and
+# ignore them, and the legacy framing is kept.
+LENGTH_PREFIXED_FRAMING_OFFER_PDU = 'FRAMING-OFFER length-prefixed'
+LENGTH_PREFIXED_FRAMING_ACCEPT_PDU = 'FRAMING-ACCEPT length-prefixed'
+
+_LengthPrefixedFramingEnabled = True
+
+def setLengthPrefixedFramingEnabled(enabled):
+	"""
+	Process-wide switch: when disabled, connecting nodes do not offer
+	the length-prefixed framing and listening nodes do not accept it,
+	i.e. only the legacy \x00-terminated framing is used.
+	
+	@type  enabled: bool
+	"""
+	global _LengthPrefixedFramingEnabled
+	_LengthPrefixedFramingEnabled = enabled
+
+def isLengthPrefixedFramingEnabled():
+	return _LengthPrefixedFramingEnabled
+
+
 class IConnector:
 	"""
 	Connector interface.
@@ -833,6 +1723,8 @@ class IConnector:
 		self._onTraceCallback = None
 		self._onConnectionCallback = None
 		self._onDisconnectionCallback = None
+		# Channels using the length-prefixed framing (channel: True)
+		self._lengthPrefixedChannels = {}
 	
 	def setConnectionCallback(self, callback):
 		"""
@@ -887,6 +1779,56 @@ class IConnector:
 		Returns the local address (address, port)
 		"""
 		return ('', 0)
+
+	##
+	# Framing negotiation, common to all connectors
+	##
+	def _sendPacket(self, channel, packet, lengthPrefixed = False):
+		"""
+		To reimplement: sends a raw packet through the packetizer.
+		"""
+		pass
+
+	def _sendFramedMessage(self, channel, message):
+		"""
+		Encodes and sends a message with the framing negotiated on the channel.
+		"""
+		lengthPrefixed = self._lengthPrefixedChannels.has_key(channel)
+		self._sendPacket(channel, message.encode(lengthPrefixed), lengthPrefixed)
+
+	def _offerLengthPrefixedFraming(self, channel):
+		"""
+		Connecting side, to call on connection.
+		"""
+		self._lengthPrefixedChannels.pop(channel, None)
+		if _LengthPrefixedFramingEnabled:
+			self._sendPacket(channel, LENGTH_PREFIXED_FRAMING_OFFER_PDU)
+
+	def _resetFraming(self, channel):
+		"""
+		To call on disconnection.
+		"""
+		self._lengthPrefixedChannels.pop(channel, None)
+
+	def _handleFramingPacket(self, channel, packet):
+		"""
+		Handles the framing negotiation PDUs.
+		
+		@rtype: bool
+		@returns: True if packet was a negotiation PDU (consumed), False otherwise.
+		"""
+		if packet == LENGTH_PREFIXED_FRAMING_OFFER_PDU:
+			if _LengthPrefixedFramingEnabled:
+				# The accept PDU is the last legacy-framed packet sent on this channel
+				self._sendPacket(channel, LENGTH_PREFIXED_FRAMING_ACCEPT_PDU)
+				self._lengthPrefixedChannels[channel] = True
+				self.trace("Using length-prefixed framing with %s" % str(channel))
+			return True
+		elif packet == LENGTH_PREFIXED_FRAMING_ACCEPT_PDU:
+			self._lengthPrefixedChannels[channel] = True
+			self.trace("Using length-prefixed framing with %s" % str(channel))
+			return True
+		return False
 	
 class ListeningConnectorThread(TcpPacketizerServerThread, IConnector):
 	"""
@@ -915,6 +1857,7 @@ class ListeningConnectorThread(TcpPacketizerServerThread, IConnector):
 		"""
 		Reimplemented from TcpPacketizerServerThread
 		"""
+		self._resetFraming(client_address)
 		if callable(self._onDisconnectionCallback):
 			self._onDisconnectionCallback(client_address)
 
@@ -922,6 +1865,8 @@ class ListeningConnectorThread(TcpPacketizerServerThread, IConnector):
 		"""
 		Reimplemented from TcpPacketizerServerThread
 		"""
+		if self._handleFramingPacket(client_address, packet):
+			return
 		# Tries to parse the packet.
 		# If ok, raise it to higher levels.
 		try:
@@ -943,7 +1888,10 @@ class ListeningConnectorThread(TcpPacketizerServerThread, IConnector):
 		"""
 		Reimplemented for IConnector
 		"""
-		self.send_packet(channel, str(message))
+		self._sendFramedMessage(channel, message)
+
+	def _sendPacket(self, channel, packet, lengthPrefixed = False):
+		self.send_packet(channel, packet, lengthPrefixed)
 
 # TODO
 #	def disconnect(self, channel):
@@ -971,6 +1919,7 @@ class ConnectingConnectorThread(TcpPacketizerClientThread, IConnector):
 		Reimplemented from TcpPacketizerClientThread
 		"""
 		self.trace("connected to server %s (client address %s)" % (str(self.serverAddress), str(self.localAddress)))
+		self._offerLengthPrefixedFraming(0)
 		if callable(self._onConnectionCallback):
 			self._onConnectionCallback(0)
 
@@ -979,6 +1928,7 @@ class ConnectingConnectorThread(TcpPacketizerClientThread, IConnector):
 		Reimplemented from TcpPacketizerServerThread
 		"""
 		self.trace("disconnected from server %s (client address %s)" % (str(self.serverAddress), str(self.localAddress)))
+		self._resetFraming(0)
 		if callable(self._onDisconnectionCallback):
 			self._onDisconnectionCallback(0)
 
@@ -986,6 +1936,8 @@ class ConnectingConnectorThread(TcpPacketizerClientThread, IConnector):
 		"""
 		Reimplemented from TcpPacketizerClientThread
 		"""
+		if self._handleFramingPacket(0, packet):
+			return
 		# Tries to parse the packet.
 		# If ok, raise it to higher levels.
 		try:
@@ -1008,7 +1960,10 @@ class ConnectingConnectorThread(TcpPacketizerClientThread, IConnector):
 		Reimplemented for IConnector
 		"""
 		self.trace("sendMessage from ConnectingThread")
-		self.send_packet(str(message))
+		self._sendFramedMessage(0, message)
+
+	def _sendPacket(self, channel, packet, lengthPrefixed = False):
+		self.send_packet(packet, lengthPrefixed)
 
 	def disconnect(self, channel):
 		return
@@ -1025,7 +1980,317 @@ class ConnectingConnectorThread(TcpPacketizerClientThread, IConnector):
 			except:
 				pass
 		return ret
+
+
+class ReactorListeningConnector(ReactorPacketizerServer, IConnector):
+	"""
+	A IConnector implementation as a listening server, based on the
+	ReactorPacketizerServer: all channels are multiplexed over a fixed
+	number of I/O threads instead of one thread per channel.
+
+	Same callbacks as ListeningConnectorThread.
+	"""
+	def __init__(self, listeningAddress, inactivityTimeout = 30.0, ioThreads = 1):
+		ReactorPacketizerServer.__init__(self, listeningAddress, inactivityTimeout, io_threads = ioThreads)
+		IConnector.__init__(self)
+		self._contact = listeningAddress
+
+	def on_connection(self, client_address):
+		"""
+		Reimplemented from ReactorPacketizerServer
+		"""
+		if callable(self._onConnectionCallback):
+			self._onConnectionCallback(client_address)
+
+	def on_disconnection(self, client_address):
+		"""
+		Reimplemented from ReactorPacketizerServer
+		"""
+		self._resetFraming(client_address)
+		if callable(self._onDisconnectionCallback):
+			self._onDisconnectionCallback(client_address)
+
+	def handle_packet(self, client_address, packet):
+		"""
+		Reimplemented from ReactorPacketizerServer
+		"""
+		if self._handleFramingPacket(client_address, packet):
+			return
+		try:
+			message = Messages.parse(packet)
+			if callable(self._onMessageCallback):
+				self._onMessageCallback(client_address, message)
+		except Exception, e:
+			self.trace("Exception while reading message: " + str(e))
+
+	def trace(self, txt):
+		"""
+		Reimplemented from ReactorPacketizerServer
+		"""
+		if self._onTraceCallback:
+			self._onTraceCallback(txt)
+
+	def sendMessage(self, channel, message):
+		"""
+		Reimplemented for IConnector
+		"""
+		self._sendFramedMessage(channel, message)
+
+	def _sendPacket(self, channel, packet, lengthPrefixed = False):
+		self.send_packet(channel, packet, lengthPrefixed)
+
+	def disconnect(self, channel):
+		"""
+		Reimplemented for IConnector
+		"""
+		ReactorPacketizerServer.disconnect(self, channel)
+
+	def getLocalAddress(self):
+		return self._contact
+
+
+class ReactorConnectingConnector(ReactorPacketizerClient, IConnector):
+	"""
+	A IConnector implementation as a reconnecting client, based on the
+	ReactorPacketizerClient (no dedicated thread, uses the shared reactor).
+
+	Same callbacks as ConnectingConnectorThread.
+	"""
+	def __init__(self, serverAddress, localAddress = None):
+		ReactorPacketizerClient.__init__(self, serverAddress, local_address = localAddress)
+		IConnector.__init__(self)
+
+	def on_connection(self):
+		"""
+		Reimplemented from ReactorPacketizerClient
+		"""
+		self.trace("connected to server %s (client address %s)" % (str(self.serverAddress), str(self.localAddress)))
+		self._offerLengthPrefixedFraming(0)
+		if callable(self._onConnectionCallback):
+			self._onConnectionCallback(0)
+
+	def on_disconnection(self):
+		"""
+		Reimplemented from ReactorPacketizerClient
+		"""
+		self.trace("disconnected from server %s (client address %s)" % (str(self.serverAddress), str(self.localAddress)))
+		self._resetFraming(0)
+		if callable(self._onDisconnectionCallback):
+			self._onDisconnectionCallback(0)
+
+	def handle_packet(self, packet):
+		"""
+		Reimplemented from ReactorPacketizerClient
+		"""
+		if self._handleFramingPacket(0, packet):
+			return
+		try:
+			message = Messages.parse(packet)
+			if callable(self._onMessageCallback):
+				self._onMessageCallback(0, message)
+		except Exception, e:
+			self.trace("Exception while reading message: " + str(e))
+
+	def trace(self, txt):
+		"""
+		Reimplemented from ReactorPacketizerClient
+		"""
+		if self._onTraceCallback:
+			self._onTraceCallback(txt)
+
+	def sendMessage(self, channel, message):
+		"""
+		Reimplemented for IConnector
+		"""
+		self._sendFramedMessage(0, message)
+
+	def _sendPacket(self, channel, packet, lengthPrefixed = False):
+		self.send_packet(packet, lengthPrefixed)
+
+	def disconnect(self, channel):
+		# Same behaviour as ConnectingConnectorThread: the node keeps reconnecting.
+		return
+
+	def getLocalAddress(self):
+		ret = self.localAddress
+		s = self.socket
+		if s:
+			try:
+				ret = s.getsockname()
+			except:
+				pass
+		return ret
+
+
+##
+# Transport selection
+##
+
+# One thread per channel (TcpPacketizer*Thread based connectors)
+TRANSPORT_THREADED = 'threaded'
+# All channels multiplexed on epoll reactors (Reactor* connectors)
+TRANSPORT_REACTOR = 'reactor'
+
+_DefaultTransport = TRANSPORT_THREADED
+_DefaultIoThreads = 1
+
+def setDefaultTransport(transport, ioThreads = 1):
+	"""
+	Sets the transport used by nodes that do not explicitly
+	select one in their initialize().
+
+	@type  transport: string in TRANSPORT_THREADED, TRANSPORT_REACTOR
+	@type  ioThreads: integer
+	@param ioThreads: the number of reactor threads for listening nodes
+	(ignored in threaded mode)
+	"""
+	global _DefaultTransport, _DefaultIoThreads
+	_DefaultTransport = _getTransport(transport)
+	_DefaultIoThreads = max(1, ioThreads)
+
+def _getTransport(transport):
+	if transport is None:
+		transport = _DefaultTransport
+	if not transport in [ TRANSPORT_THREADED, TRANSPORT_REACTOR ]:
+		raise Exception("Invalid node transport '%s' (expected: %s or %s)" % (transport, TRANSPORT_THREADED, TRANSPORT_REACTOR))
+	if transport == TRANSPORT_REACTOR and not isReactorSupported():
+		# Windows, basically
+		transport = TRANSPORT_THREADED
+	return transport
+
+
+################################################################################
+# Synchronous requests: response waiters
+################################################################################
+
+class ResponseWaiter(object):
+	"""
+	A waiter slot for a synchronous transaction.
+	
+	The requesting thread blocks on a plain lock that is released directly by
+	the thread that receives the response, or by the ResponseWaiterWatchdog
+	when the response timeout expires:
+	no polling, and an immediate wake-up.
+	"""
+	def __init__(self):
+		self.response = None
+		self._lock = threading.Lock()
+		self._lock.acquire()
+		self._guard = threading.Lock()
+		self._done = False
+		# The watchdog watching this waiter, if any
+		self._watchdog = None
 	
+	def wake(self, response = None):
+		"""
+		Wakes the waiting thread up with a response (None on timeout).
+		Returns False if it has already been woken up.
+		"""
+		self._guard.acquire()
+		if self._done:
+			self._guard.release()
+			return False
+		self._done = True
+		self.response = response
+		watchdog = self._watchdog
+		self._guard.release()
+		self._lock.release()
+		if watchdog:
+			watchdog._onWoken()
+		return True
+	
+	def wait(self):
+		"""
+		Blocks until woken up.
+		Returns the response, or None on timeout.
+		"""
+		self._lock.acquire()
+		# Not kept by the watchdog until the waiter deadline
+		response = self.response
+		self.response = None
+		return response
+
+
+class ResponseWaiterWatchdog(threading.Thread):
+	"""
+	A single thread that wakes up the response waiters whose timeout expired.
+	Only active when at least one synchronous request is pending.
+	
+	The waiters woken up by their response are left in the heap: their
+	entries are discarded when popped, or when the heap is compacted.
+	"""
+	def __init__(self):
+		threading.Thread.__init__(self, name = "ResponseWaiterWatchdog")
+		self.setDaemon(True)
+		self._condition = threading.Condition()
+		self._waiters = [] # heap of (deadline, seq, waiter)
+		self._seq = 0
+		# Number of watched waiters not woken up yet
+		self._pending = 0
+	
+	def watch(self, waiter, deadline):
+		self._condition.acquire()
+		waiter._guard.acquire()
+		if waiter._done:
+			# Response already received
+			waiter._guard.release()
+			self._condition.release()
+			return
+		waiter._watchdog = self
+		waiter._guard.release()
+		self._pending += 1
+		self._seq += 1
+		heapq.heappush(self._waiters, (deadline, self._seq, waiter))
+		# Too many entries for woken up waiters: rebuild the heap from the pending ones
+		if len(self._waiters) > 2 * self._pending + 64:
+			self._waiters = [ x for x in self._waiters if not x[2]._done ]
+			heapq.heapify(self._waiters)
+		# Only wake the watchdog up if its next deadline changed
+		if self._waiters[0][2] is waiter:
+			self._condition.notify()
+		self._condition.release()
+
+	def _onWoken(self):
+		"""
+		Called when a watched waiter has been woken up.
+		"""
+		self._condition.acquire()
+		self._pending -= 1
+		self._condition.release()
+
+	def run(self):
+		while True:
+			expired = []
+			self._condition.acquire()
+			# Discards the waiters already woken up by their response
+			while self._waiters and self._waiters[0][2]._done:
+				heapq.heappop(self._waiters)
+			if not self._waiters:
+				self._condition.wait()
+			else:
+				now = time.time()
+				while self._waiters and self._waiters[0][0] <= now:
+					waiter = heapq.heappop(self._waiters)[2]
+					if not waiter._done:
+						expired.append(waiter)
+				if not expired and self._waiters:
+					self._condition.wait(self._waiters[0][0] - now)
+			self._condition.release()
+			for waiter in expired:
+				waiter.wake(None)
+
+_ResponseWaiterWatchdog = None
+_ResponseWaiterWatchdogMutex = threading.Lock()
+
+def getResponseWaiterWatchdog():
+	global _ResponseWaiterWatchdog
+	_ResponseWaiterWatchdogMutex.acquire()
+	if _ResponseWaiterWatchdog is None:
+		_ResponseWaiterWatchdog = ResponseWaiterWatchdog()
+		_ResponseWaiterWatchdog.start()
+	_ResponseWaiterWatchdogMutex.release()
+	return _ResponseWaiterWatchdog
+
 
 ################################################################################
 # The Peer Node.
@@ -1161,19 +2426,18 @@ class BaseNode(object):
 			transactionId = message.getTransactionId()
 			self.__mutex.acquire()
 			if self.__outgoingTransactions.has_key(transactionId):
-				entry = self.__outgoingTransactions[transactionId]
-				# Synchronous call ?
-				if entry['event']:
-					# Yes: notify the caller, let him purge the transaction with the response.
-					self.__outgoingTransactions[transactionId]['response'] = message
-					entry['event'].set()
-				else:
-					# No: purge the transaction, then call onResponse()
-					del self.__outgoingTransactions[transactionId]
+				# Purge the transaction
+				entry = self.__outgoingTransactions.pop(transactionId)
 				self.__mutex.release()
 				self.__trace("%d <-- received response - took %fs" % (transactionId, time.time() - entry['timestamp']))
 				self.__trace("\n" + repr(message))
-				if not entry['event']:
+				# Synchronous call ?
+				if entry['waiter']:
+					# Yes: wake the caller up directly from this thread.
+					if not entry['waiter'].wake(message):
+						self.__trace("%d <-- response received after the synchronous request timeout - discarding" % transactionId)
+				else:
+					# No: call onResponse()
 					self.__onResponse(channel, transactionId, message)
 			else:
 				self.__mutex.release()
@@ -1242,7 +2506,7 @@ class BaseNode(object):
 		request.setHeader("Contact", self.getContact())
 		# Register the request
 		self.__mutex.acquire()
-		self.__outgoingTransactions[transactionId] = { 'request': request, 'timestamp': time.time(), 'channel': channel, 'event': None }
+		self.__outgoingTransactions[transactionId] = { 'request': request, 'timestamp': time.time(), 'channel': channel, 'waiter': None }
 		self.__mutex.release()
 		# Send the message
 		self.__trace("%d --> sending request" % (transactionId))
@@ -1262,11 +2526,11 @@ class BaseNode(object):
 		request.setHeader("Transaction-Id", transactionId)
 		request.setHeader("User-Agent", self.getUserAgent())
 		request.setHeader("Contact", self.getContact())
-		event = threading.Event()
+		waiter = ResponseWaiter()
 		startTime = time.time()
 		# Register the request
 		self.__mutex.acquire()
-		self.__outgoingTransactions[transactionId] = { 'request': request, 'timestamp': startTime, 'channel': channel, 'event': event }
+		self.__outgoingTransactions[transactionId] = { 'request': request, 'timestamp': startTime, 'channel': channel, 'waiter': waiter }
 		self.__mutex.release()
 		# Send the message
 		self.__trace("%d --> sending request" % (transactionId))
@@ -1287,24 +2551,23 @@ class BaseNode(object):
 		# Yet, this is about 25s on perf_test.ats.
 
 		# Implementation #3: ugly loop, waiting for the event: ref test (perf_test.ats): 20s
-		timeout = False
-		while (not event.isSet()) and (not timeout):
-			time.sleep(0.00001)
-			if (time.time() - startTime) >= responseTimeout:
-				timeout = True
-		if not timeout:
-			self.__trace("%d --- response received" % (transactionId))
-			self.__mutex.acquire()
-			response = self.__outgoingTransactions[transactionId]['response']
-			ts = self.__outgoingTransactions[transactionId]['timestamp']
-			del self.__outgoingTransactions[transactionId]
-			self.__mutex.release()
-			self.__trace("%d === response received on time on synchronous request (took %fs)" % (transactionId, time.time() - ts))
+		# Fast, but burns a lot of CPU when several threads are waiting for a response.
+		
+		# Implementation #4: a waiter slot per transaction, i.e. a plain lock
+		# released by the receiving thread (timeouts are managed by a single
+		# watchdog thread). Event.wait(timeout) was slow because of its internal
+		# sleep-based polling; blocking on a lock without timeout is not.
+		# See benchmarks/node_request_latency.py.
+		getResponseWaiterWatchdog().watch(waiter, startTime + responseTimeout)
+		response = waiter.wait()
+		if response is not None:
+			self.__trace("%d === response received on time on synchronous request (took %fs)" % (transactionId, time.time() - startTime))
 			return response
 		else:
 			# Purge the transaction
 			self.__mutex.acquire()
-			del self.__outgoingTransactions[transactionId]
+			if self.__outgoingTransactions.has_key(transactionId):
+				del self.__outgoingTransactions[transactionId]
 			self.__mutex.release()
 			self.__trace("%d === timeout on synchronous request, purging" % transactionId)
 			return None
@@ -1408,9 +2671,18 @@ class ConnectingNode(BaseNode):
 	def __init__(self, name, userAgent): # also manages protocol ?
 		BaseNode.__init__(self, name, userAgent)
 	
-	def initialize(self, serverAddress, localAddress = ('', 0)):
-		self.trace("Initializing connecting node %s: %s -> %s..." % (self.getNodeName(), localAddress, serverAddress))
-		connector = ConnectingConnectorThread(serverAddress, localAddress)
+	def initialize(self, serverAddress, localAddress = ('', 0), transport = None):
+		"""
+		@type  transport: string, or None
+		@param transport: TRANSPORT_THREADED or TRANSPORT_REACTOR. If None, use the
+		default transport (see setDefaultTransport())
+		"""
+		transport = _getTransport(transport)
+		self.trace("Initializing connecting node %s: %s -> %s (%s transport)..." % (self.getNodeName(), localAddress, serverAddress, transport))
+		if transport == TRANSPORT_REACTOR:
+			connector = ReactorConnectingConnector(serverAddress, localAddress)
+		else:
+			connector = ConnectingConnectorThread(serverAddress, localAddress)
 		self._setConnector(connector)
 		BaseNode.initialize(self)
 	
@@ -1440,8 +2712,20 @@ class ListeningNode(BaseNode):
 	def __init__(self, name, userAgent): # also manages protocol ?
 		BaseNode.__init__(self, name, userAgent)
 	
-	def initialize(self, listeningAddress):
-		self.trace("Initializing listening node %s on %s..." % (self.getNodeName(), listeningAddress))
-		connector = ListeningConnectorThread(listeningAddress)
+	def initialize(self, listeningAddress, transport = None, ioThreads = None):
+		"""
+		@type  transport: string, or None
+		@param transport: TRANSPORT_THREADED or TRANSPORT_REACTOR. If None, use the
+		default transport (see setDefaultTransport())
+		@type  ioThreads: integer, or None
+		@param ioThreads: the number of reactor threads to shard the channels on,
+		in reactor mode only. If None, use the default value.
+		"""
+		transport = _getTransport(transport)
+		self.trace("Initializing listening node %s on %s (%s transport)..." % (self.getNodeName(), listeningAddress, transport))
+		if transport == TRANSPORT_REACTOR:
+			connector = ReactorListeningConnector(listeningAddress, ioThreads = ioThreads or _DefaultIoThreads)
+		else:
+			connector = ListeningConnectorThread(listeningAddress)
 		self._setConnector(connector)
 		BaseNode.initialize(self)
@@ -21,6 +21,9 @@
 #
 ##
 
+import imp
+import threading
+
 
 ##
 # Codec-related exceptions
@@ -125,7 +128,7 @@ class Codec:
 		"""
 		return self._properties.get(name, None)
 	
-	def log(self, message):
+	def log(self, message, *args):
 		"""
 		Call this function to log something.
 		Depending on the codec adapter, leads to different log traces.
@@ -133,9 +136,19 @@ class Codec:
 		- tli logger as "internal" class level when used in a TE
 		
 		@type  message: string/unicode
-		@param message: the message to log
+		@param message: the message to log. If args are provided, a format
+		string only formatted (message % args) if logs are enabled.
+		"""
+		instance().log(message, *args)
+
+	def isLogEnabled(self):
 		"""
-		instance().log(message)
+		Call this function before computing costly log arguments.
+		
+		@rtype: bool
+		@returns: False if log() calls are discarded in this context.
+		"""
+		return instance().isLogEnabled()
 
 	def incrementalDecode(self, data, complete):
 		"""
@@ -154,6 +167,21 @@ class Codec:
 			return (self.DECODING_ERROR, 0, None, None)
 		# We assume that the whole data was consumed.
 		return (self.DECODING_OK, len(data), message, summary)
+
+	def createStreamDecoder(self):
+		"""
+		Returns a new stateful StreamDecoder for this codec, configured
+		with this codec instance, or None if the codec does not provide
+		any (default).
+		
+		Reimplement it in codecs that are able to decode a stream without
+		re-parsing their whole input on each new segment, as
+		incrementalDecode() does.
+		
+		@rtype: StreamDecoder, or None
+		@returns: a new stream decoder, or None if not supported
+		"""
+		return None
 		
 
 	# To reimplement in your own codecs
@@ -296,6 +324,52 @@ class IncrementalCodec(Codec):
 		else:
 			return (None, None)
 
+class StreamDecoder:
+	"""
+	Stateful decoder for stream transports (TCP, SCTP), created by
+	Codec.createStreamDecoder(), one per stream.
+	
+	Unlike incrementalDecode(), it is fed with each new segment
+	of the stream only, and keeps its parsing state between two feed()
+	calls, so that the bytes already analyzed are never parsed again.
+	
+	To implement in your codec as a subclass, with a feed()
+	and, if needed, close() reimplementations.
+	The codec instance the decoder was created by is available
+	as self.codec.
+	"""
+	def __init__(self, codec):
+		self.codec = codec
+
+	def feed(self, data):
+		"""
+		To implement in your StreamDecoder subclass.
+		
+		Appends data to the stream and returns the messages that
+		could be completed with it.
+		
+		@type  data: string (as a buffer)
+		@param data: the next segment of the stream
+		
+		@rtype: list of tuple (int, string, obj, string)
+		@returns: a list of (status, payload, message, summary), in stream order, where:
+		  status = Codec.DECODING_OK: payload was decoded to message, with an optional summary
+		  status = Codec.DECODING_ERROR: payload could not be decoded and was dropped.
+		  message and summary are None.
+		"""
+		raise Exception("Stream decoding method not implemented")
+
+	def close(self):
+		"""
+		Notifies the end of the stream.
+		Returns the messages that could be completed by this event,
+		and a DECODING_ERROR for the remaining incomplete data, if any.
+
+		@rtype: list of tuple (int, string, obj, string)
+		@returns: a list of (status, payload, message, summary), as feed().
+		"""
+		return []
+
 ##
 # Internal class - do not use
 ##
@@ -304,23 +378,94 @@ class CodecManager(object):
 	A CodecManager is adapted according to the
 	target context (a TE or a PyAgent) via the following methods:
 	- setLogCallback(): enables to implement logging according to the target context
+	
+	Configured codec instances are cached per thread, so that they
+	are created once, then reused by the next encode/decode calls on the
+	same thread with the same codec name and overriding properties.
 	"""
 	def __init__(self):
 		#: dict[codec/aliasname] = (codec class, params)
 		self._codecs = {}
+		#: dict[codec/aliasname] = name of the module registering it, not imported yet
+		self._lazyCodecs = {}
 		self._logCallback = None
+		self._logEnabledCallback = None
+		#: thread local: instances = dict[cache key] = codec instance, generation = int
+		self._instanceCache = threading.local()
+		# Incremented on each codec (re)configuration, to invalidate the cached instances
+		self._generation = 0
+	
+	def isLogEnabled(self):
+		if not self._logCallback:
+			return False
+		if self._logEnabledCallback:
+			return self._logEnabledCallback()
+		return True
 	
-	def log(self, txt):
-		if self._logCallback:
+	def log(self, txt, *args):
+		if self.isLogEnabled():
+			if args:
+				txt = txt % args
 			self._logCallback(txt)
 	
-	def setLogCallback(self, cb):
+	def setLogCallback(self, cb, enabledCb = None):
+		"""
+		@type  cb: function(unicode)
+		@param cb: the function called to log something
+		@type  enabledCb: function() returning a bool
+		@param enabledCb: if set, called before formatting and logging anything:
+		nothing is logged if it returns False.
+		"""
 		self._logCallback = cb
+		self._logEnabledCallback = enabledCb
 	
 	def registerCodecClass(self, name, class_):
 		if not self._codecs.has_key(name):
 			self._codecs[name] = (class_, {})
-			self.log("Codec class %s registered as codec %s" % (class_.__name__, name))
+			self.log("Codec class %s registered as codec %s", class_.__name__, name)
+	
+	def registerLazyCodec(self, name, moduleName):
+		"""
+		Declares that moduleName registers (or aliases) the codec name when imported,
+		so that it is imported only when the codec is actually needed.
+		Ignored if the codec is already registered.
+		"""
+		if not self._codecs.has_key(name) and not self._lazyCodecs.has_key(name):
+			self._lazyCodecs[name] = moduleName
+	
+	def _loadLazyCodec(self, name):
+		"""
+		Imports the module declared as registering the codec name, if any.
+		
+		The lookup, the import and the registration are done with the
+		(reentrant) import lock held, so that a concurrent lookup of the codec
+		waits for its registration. The lazy entry is only removed once the
+		module has been imported, so that a failed import is retried.
+		"""
+		if not self._lazyCodecs.has_key(name):
+			return
+		imp.acquire_lock()
+		try:
+			moduleName = self._lazyCodecs.get(name)
+			if moduleName and not self._codecs.has_key(name):
+				self.log("Importing module %s for codec %s", moduleName, name)
+				try:
+					__import__(moduleName)
+				except Exception, e:
+					self.log("Unable to import module %s for codec %s: %s", moduleName, name, str(e))
+					return
+			self._lazyCodecs.pop(name, None)
+		finally:
+			imp.release_lock()
+	
+	def getCodecNames(self):
+		"""
+		Returns the registered codec and alias names, including the lazily registered ones.
+		"""
+		# Lazy entries first: they are only removed once registered
+		lazyCodecs = self._lazyCodecs.keys()
+		codecs = self._codecs.keys()
+		return codecs + [ x for x in lazyCodecs if not x in codecs ]
 	
 	def alias(self, name, codec, **kwargs):
 		"""
@@ -329,6 +474,8 @@ class CodecManager(object):
 		that we can create different specialized configurations based on
 		the same alias.
 		"""
+		if not self._codecs.has_key(codec):
+			self._loadLazyCodec(codec)
 		if not self._codecs.has_key(codec):
 			raise Exception("Unable to alias codec %s to %s: codec %s is not registered" % (codec, name, codec))
 		(codecClass, properties) = self._codecs[codec]
@@ -338,11 +485,14 @@ class CodecManager(object):
 		for n, p in kwargs.items():
 			mergedProperties[n] = p
 		self._codecs[name] = (codecClass, mergedProperties)
+		self._generation += 1
 
 	def _getCodecInstance(self, name):
 		"""
 		Creates and returns configured codec instance.
 		"""
+		if not self._codecs.has_key(name):
+			self._loadLazyCodec(name)
 		if not self._codecs.has_key(name):
 			return None
 		else:
@@ -351,44 +501,105 @@ class CodecManager(object):
 			for n, p in properties.items():
 				c._setProperty(n, p)
 			return c
-	
-	def encode(self, name, template, **properties):
-		# NB: we instantiate a codec each type to be thread safe and parallel.
-		# This is not optimized, we may use a TLS one day.
+
+	def _getCacheKey(self, name, properties):
+		"""
+		Returns the instance cache key for a codec name and overriding properties.
+		The key is not hashable if a property value is not.
+		"""
+		if not properties:
+			return name
+		return (name, tuple(sorted(properties.items())))
+
+	def _acquireCodecInstance(self, name, properties):
+		"""
+		Returns a configured codec instance, with the overriding properties
+		applied, for exclusive use by the current thread until it is released
+		with _releaseCodecInstance().
+		
+		The instance is taken from the current thread cache, if available.
+		Since it is removed from the cache until released, nested calls for
+		the same codec (from the codec itself, for instance) get a new instance.
+		
+		@rtype: Codec instance, or None
+		@returns: the codec instance, or None if the codec is not registered
+		"""
+		cache = self._instanceCache
+		instances = getattr(cache, 'instances', None)
+		if instances is None or cache.generation != self._generation:
+			# First use on this thread, or codecs reconfigured since the instances were created
+			instances = cache.instances = {}
+			cache.generation = self._generation
+		try:
+			codec = instances.pop(self._getCacheKey(name, properties), None)
+		except TypeError:
+			# Unhashable overriding property values: not cached
+			codec = None
+		if codec is not None:
+			return codec
 		codec = self._getCodecInstance(name)
-		if codec:
+		if codec is not None:
 			for k, v in properties.items():
 				codec._setProperty(k, v)
-			return codec.encode(template)
-		else:
+		return codec
+
+	def _releaseCodecInstance(self, name, properties, codec):
+		"""
+		Puts back a codec instance returned by _acquireCodecInstance()
+		into the current thread cache.
+		"""
+		cache = self._instanceCache
+		if cache.generation != self._generation:
+			# Codecs reconfigured in the meantime: this instance may be outdated
+			return
+		try:
+			cache.instances[self._getCacheKey(name, properties)] = codec
+		except TypeError:
+			pass
+	
+	def encode(self, name, template, **properties):
+		codec = self._acquireCodecInstance(name, properties)
+		if codec is None:
 			# Unable to find the codec
 			raise CodecNotFoundException("Codec '%s' not found" % name)
+		try:
+			return codec.encode(template)
+		finally:
+			self._releaseCodecInstance(name, properties, codec)
 
 	def decode(self, name, data,  **properties):
-		# NB: we instantiate a codec each type to be thread safe and parallel
-		codec = self._getCodecInstance(name)
-		if codec:
-			for k, v in properties.items():
-				codec._setProperty(k, v)
-			return codec.decode(data)
-		else:
+		codec = self._acquireCodecInstance(name, properties)
+		if codec is None:
 			# Unable to find the codec
 			raise CodecNotFoundException("Codec '%s' not found" % name)
+		try:
+			return codec.decode(data)
+		finally:
+			self._releaseCodecInstance(name, properties, codec)
 
 	def incrementalDecode(self, name, data, complete, **properties):
-		# NB: we instantiate a codec each type to be thread safe and parallel
-		codec = self._getCodecInstance(name)
-		if codec:
-			for k, v in properties.items():
-				codec._setProperty(k, v)
+		codec = self._acquireCodecInstance(name, properties)
+		if codec is None:
+			# Unable to find the codec
+			raise CodecNotFoundException("Codec '%s' not found" % name)
+		try:
 			(ret, a, b, c) = codec.incrementalDecode(data, complete)
-			# If the codec expects more data and we can't provide mode: decoding error
-			if ret == codec.DECODING_NEED_MORE_DATA and complete:
-				ret = codec.DECODING_ERROR
-			return (ret, a, b, c)
-		else:
+		finally:
+			self._releaseCodecInstance(name, properties, codec)
+		# If the codec expects more data and we can't provide mode: decoding error
+		if ret == codec.DECODING_NEED_MORE_DATA and complete:
+			ret = codec.DECODING_ERROR
+		return (ret, a, b, c)
+
+	def createStreamDecoder(self, name, **properties):
+		# Not a cached instance: the stream decoder keeps it for the stream lifetime
+		codec = self._getCodecInstance(name)
+		if codec is None:
 			# Unable to find the codec
 			raise CodecNotFoundException("Codec '%s' not found" % name)
+		for k, v in properties.items():
+			codec._setProperty(k, v)
+		return codec.createStreamDecoder()
 
 
 TheInstance = None
@@ -408,6 +619,9 @@ def alias(name, codec, **kwargs):
 def registerCodecClass(name, class_):
 	return instance().registerCodecClass(name, class_)
 
+def registerLazyCodec(name, moduleName):
+	return instance().registerLazyCodec(name, moduleName)
+
 def encode(name, template, **properties):
 	"""
 	@type  name: string
@@ -452,3 +666,18 @@ def incrementalDecode(name, data, complete, **properties):
 	"""
 	return instance().incrementalDecode(name, data, complete, **properties)
 
+def createStreamDecoder(name, **properties):
+	"""
+	@type  name: string
+	@param name: the codec name
+	@type  properties: keyword args of objects
+	@param properties: overriding properties for the decoder
+
+	@throws CodecNotFoundException if the codec was not found
+	
+	@rtype: StreamDecoder, or None
+	@returns: a new stateful stream decoder, or None if the codec
+	does not support stream decoding: incrementalDecode() should be
+	used instead.
+	"""
+	return instance().createStreamDecoder(name, **properties)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2013 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# TE Egg Cache:
+# a content-addressed store of the TE eggs prepared by ATS jobs.
+#
+# Eggs are indexed by a key computed from everything the egg
+# depends on (ATS source, dependency contents, adapter API, server version, ...),
+# so that resubmitting an unchanged ATS reuses the egg prepared
+# for a previous job instead of building it again.
+#
+# The cache is a flat directory of <key>.egg files, bounded in size:
+# the least recently used eggs are evicted first.
+##
+
+import ConfigManager
+import CounterManager
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+
+
+cm = ConfigManager.instance()
+
+def getLogger():
+	return logging.getLogger('TS.EggCache')
+
+
+def getKey(parts):
+	"""
+	Computes a cache key from a list of strings.
+
+	@type  parts: list of strings (unicode strings are utf-8 encoded)
+	@param parts: everything the cached egg depends on
+
+	@rtype: string
+	@returns: the key, as an hex digest
+	"""
+	h = hashlib.sha1()
+	for part in parts:
+		if isinstance(part, unicode):
+			part = part.encode('utf-8')
+		# Length-prefixed, so that the parts cannot be shifted
+		h.update('%d:' % len(part))
+		h.update(part)
+	return h.hexdigest()
+
+def _link(source, destination):
+	"""
+	Hard-links source to destination, or copies it
+	if the filesystem does not support it (or if they are on
+	different filesystems).
+	"""
+	try:
+		os.link(source, destination)
+	except (OSError, AttributeError):
+		shutil.copyfile(source, destination)
+
+
+class EggCache:
+	"""
+	A size-bounded, LRU store of prepared TE eggs.
+
+	Thread-safe.
+	"""
+	def __init__(self, path):
+		self._path = path
+		self._mutex = threading.RLock()
+		# Cached eggs: key: [size, last use]
+		self._entries = {}
+		self._size = 0
+		try:
+			if not os.path.isdir(path):
+				os.makedirs(path)
+			for filename in os.listdir(path):
+				filename = os.path.join(path, filename)
+				if filename.endswith('.egg'):
+					key = os.path.basename(filename)[:-4]
+					st = os.stat(filename)
+					self._entries[key] = [ st.st_size, st.st_mtime ]
+					self._size += st.st_size
+				else:
+					# Temporary files from an interrupted put()
+					os.remove(filename)
+		except Exception, e:
+			getLogger().warning("Unable to initialize the egg cache in %s: %s" % (path, str(e)))
+		getLogger().info("Egg cache in %s: %d eggs, %d bytes" % (path, len(self._entries), self._size))
+		self._evict()
+
+	def _getFilename(self, key):
+		return os.path.join(self._path, '%s.egg' % key)
+
+	def _getMaxSize(self):
+		return cm.get("testerman.te.egg_cache.max_size")
+
+	def get(self, key, filename):
+		"""
+		Retrieves a cached egg.
+
+		@type  key: string
+		@param key: the egg key, as returned by getKey()
+		@type  filename: string
+		@param filename: the local filename to create with the egg, if cached
+
+		@rtype: bool
+		@returns: True if the egg was cached (and created as filename), False otherwise
+		"""
+		self._mutex.acquire()
+		try:
+			entry = self._entries.get(key)
+			if entry and self._getMaxSize() > 0:
+				cachedFilename = self._getFilename(key)
+				try:
+					_link(cachedFilename, filename)
+					# The last use survives restarts
+					os.utime(cachedFilename, None)
+					entry[1] = os.stat(cachedFilename).st_mtime
+				except Exception, e:
+					getLogger().warning("Unable to retrieve cached egg %s: %s" % (key, str(e)))
+					self._remove(key)
+				else:
+					CounterManager.instance().inc("server.ts.eggcache.hits")
+					return True
+		finally:
+			self._mutex.release()
+		CounterManager.instance().inc("server.ts.eggcache.misses")
+		return False
+
+	def put(self, key, filename):
+		"""
+		Adds an egg to the cache, evicting the least recently used ones
+		if the cache becomes too large.
+
+		@type  key: string
+		@param key: the egg key, as returned by getKey()
+		@type  filename: string
+		@param filename: the local filename of the egg to cache. Left unchanged.
+		"""
+		if self._getMaxSize() <= 0:
+			return
+		# Created under a temporary name, so that an interrupted copy
+		# is never seen as a valid cached egg
+		temporaryFilename = '%s.%d.tmp' % (self._getFilename(key), threading.currentThread().ident or 0)
+		try:
+			_link(filename, temporaryFilename)
+			size = os.path.getsize(temporaryFilename)
+		except Exception, e:
+			getLogger().warning("Unable to cache egg %s: %s" % (key, str(e)))
+			try:
+				os.remove(temporaryFilename)
+			except:
+				pass
+			return
+
+		self._mutex.acquire()
+		try:
+			if key in self._entries:
+				self._remove(key)
+			try:
+				os.rename(temporaryFilename, self._getFilename(key))
+			except Exception, e:
+				getLogger().warning("Unable to cache egg %s: %s" % (key, str(e)))
+				os.remove(temporaryFilename)
+				return
+			self._entries[key] = [ size, os.stat(self._getFilename(key)).st_mtime ]
+			self._size += size
+			self._evict()
+		finally:
+			self._mutex.release()
+
+	def _remove(self, key):
+		(size, lastUse) = self._entries.pop(key)
+		self._size -= size
+		try:
+			os.remove(self._getFilename(key))
+		except Exception, e:
+			getLogger().warning("Unable to remove cached egg %s: %s" % (key, str(e)))
+
+	def _evict(self):
+		"""
+		Removes the least recently used eggs until the cache fits its max size.
+		"""
+		maxSize = self._getMaxSize()
+		if self._size <= maxSize:
+			return
+		entries = [ (lastUse, key) for key, (size, lastUse) in self._entries.items() ]
+		entries.sort()
+		for (lastUse, key) in entries:
+			if self._size <= maxSize:
+				break
+			getLogger().debug("Evicting cached egg %s" % key)
+			self._remove(key)
+			CounterManager.instance().inc("server.ts.eggcache.evictions")
+
+
+################################################################################
+# Main
+################################################################################
+
+TheEggCache = None
+
+def instance():
+	"""
+	@rtype: EggCache, or None
+	@returns: the egg cache, or None if disabled
+	"""
+	return TheEggCache
+
+def initialize():
+	"""
+	Creates the egg cache in testerman.te.egg_cache.path,
+	or in ${testerman.var_root}/eggcache by default.
+	Without any of them, the cache is disabled.
+	"""
+	global TheEggCache
+	path = cm.get("testerman.te.egg_cache.path")
+	if not path and cm.get("testerman.var_root"):
+		path = cm.get("testerman.var_root") + "/eggcache"
+	if path:
+		TheEggCache = EggCache(path)
+	else:
+		getLogger().info("No egg cache path, egg cache disabled")
+
+def finalize():
+	pass
@@ -24,6 +24,7 @@
 
 import ConfigManager
 import CounterManager
+import LogWriter
 import TestermanMessages as Messages
 import TestermanNodes as Nodes
 import Versions
@@ -46,7 +47,7 @@ class XcServer(Nodes.ListeningNode):
 	def __init__(self, manager, xcAddress):
 		Nodes.ListeningNode.__init__(self, "TS/Xc", "XcServer/%s" % Versions.getServerVersion())
 		self._manager = manager
-		self.initialize(xcAddress)
+		self.initialize(xcAddress, transport = cm.get("ts.nodes.transport"), ioThreads = cm.get("ts.nodes.io_threads"))
 
 	def getLogger(self):
 		return logging.getLogger('TS.XcServer')
@@ -87,7 +88,7 @@ class IlServer(Nodes.ListeningNode):
 	def __init__(self, manager, ilAddress):
 		Nodes.ListeningNode.__init__(self, "TS/Il", "IlServer/%s" % Versions.getServerVersion())
 		self._manager = manager
-		self.initialize(ilAddress)
+		self.initialize(ilAddress, transport = cm.get("ts.nodes.transport"), ioThreads = cm.get("ts.nodes.io_threads"))
 	
 	def getLogger(self):
 		return logging.getLogger('TS.IlServer')
@@ -115,10 +116,12 @@ class Manager:
 	The Manager manages the subscriptions.
 	It is interfaces through the WebServices.
 	"""
-	def __init__(self, xcAddress, ilAddress):
+	def __init__(self, xcAddress, ilAddress, logWriter):
 		self._mutex = threading.RLock()
 		self._xcServer = XcServer(self, xcAddress)
 		self._ilServer = IlServer(self, ilAddress)
+		# Job log files, kept open and buffered while their jobs are running
+		self._logWriter = logWriter
 	
 		# The subscription mapping is a list of Xc channels objects per uri (jobid:<id>, system:jobs, ...).
 		self._subscriptions = {}
@@ -138,6 +141,7 @@ class Manager:
 
 	def start(self):
 		self.getLogger().info("Starting...")
+		self._logWriter.start()
 		self._xcServer.start()
 		self._ilServer.start()
 		self.getLogger().info("Started")
@@ -148,6 +152,7 @@ class Manager:
 		self._xcServer.finalize()
 		self._ilServer.stop()
 		self._ilServer.finalize()
+		self._logWriter.stop()
 		self.getLogger().info("Stopped")
 	
 	def subscribe(self, channel, uri):
@@ -218,15 +223,45 @@ class Manager:
 		if not self._subscriptions.has_key(uri):
 			self._unlock()
 			return
+		if notification.getMethod() == "LOG-BATCH":
+			# Xc clients only know individual LOG notifications
+			notifications = self._unpackLogBatch(notification)
+		else:
+			notifications = [ notification ]
 		for channel in self._subscriptions[uri]:
 			try:
-				self._xcServer.sendNotification(channel, notification)
+				for n in notifications:
+					self._xcServer.sendNotification(channel, n)
 				nbClients += 1
 			except:
 				self.getLogger().warning("Unable to send event to a client")
 		self._unlock()
 		self.getLogger().debug("Notification dispatched to %d Xc clients" % nbClients)
 	
+	def _unpackLogBatch(self, notification):
+		"""
+		Turns a LOG-BATCH notification into the equivalent list of LOG notifications.
+		
+		@type  notification: Notification message
+		@param notification: a LOG-BATCH notification
+		
+		@rtype: list of Notification messages
+		"""
+		ret = []
+		uri = notification.getUri()
+		filename = notification.getHeader('Log-Filename')
+		for (logClass, timestamp, xml) in notification.getApplicationBody():
+			n = Messages.Notification("LOG", uri, "Il", "1.0")
+			if filename:
+				n.setHeader("Log-Filename", filename)
+			n.setHeader("Log-Class", logClass)
+			n.setHeader("Log-Timestamp", timestamp)
+			n.setHeader("Content-Encoding", "utf-8")
+			n.setHeader("Content-Type", "application/xml")
+			n.setBody(xml)
+			ret.append(n)
+		return ret
+	
 	def getLogger(self):
 		return logging.getLogger('TS.TL')
 
@@ -237,9 +272,16 @@ class Manager:
 			filename = notification.getHeader('Log-Filename')
 			if filename:
 				try:
-					f = open(filename, 'a')
-					f.write('%s\n' % notification.getBody())
-					f.close()
+					self._logWriter.write(filename, '%s\n' % notification.getBody())
+				except Exception, e:
+					self.getLogger().error("Unable to write log for %s: %s" % (notification.getUri(), str(e)))		
+		elif method == "LOG-BATCH":
+			# Several LOG events sent at once: a single write for all of them
+			filename = notification.getHeader('Log-Filename')
+			if filename:
+				try:
+					events = notification.getApplicationBody()
+					self._logWriter.write(filename, ''.join([ '%s\n' % xml for (logClass, timestamp, xml) in events ]))
 				except Exception, e:
 					self.getLogger().error("Unable to write log for %s: %s" % (notification.getUri(), str(e)))		
 		else:
@@ -248,6 +290,26 @@ class Manager:
 		# Dispath
 		self.dispatchNotification(notification)
 
+	def flushLog(self, filename):
+		"""
+		Makes sure that all the log events received so far for a log file
+		are written to it.
+		
+		@type  filename: string
+		@param filename: the log filename (absolute local path)
+		"""
+		self._logWriter.flush(filename)
+	
+	def closeLog(self, filename):
+		"""
+		Flushes and closes a log file, typically when its job is complete.
+		It is transparently reopened if new events are received for it.
+		
+		@type  filename: string
+		@param filename: the log filename (absolute local path)
+		"""
+		self._logWriter.close(filename)
+
 
 ################################################################################
 # Main module functions
@@ -264,7 +326,8 @@ def initialize():
 	global TheManager
 	xcAddress = (cm.get("interface.xc.ip"), cm.get("interface.xc.port"))
 	ilAddress = (cm.get("interface.il.ip"), cm.get("interface.il.port"))
-	TheManager = Manager(xcAddress, ilAddress)
+	logWriter = LogWriter.LogWriter(maxOpenFiles = cm.get("ts.log_writer.max_open_files"), bufferSize = cm.get("ts.log_writer.buffer_size"), flushInterval = cm.get("ts.log_writer.flush_interval"))
+	TheManager = Manager(xcAddress, ilAddress, logWriter)
 	TheManager.initialize()
 	TheManager.start()
 
@@ -27,18 +27,22 @@
 
 import ConfigManager
 import DependencyResolver
+import EggCache
 import EventManager
 import FileSystemManager
 import TestermanMessages as Messages
 import TEFactory
+import TeLauncher
 import Tools
 import Versions
 
 import base64
+import collections
 import compiler
 import cPickle as pickle
 import copy_reg
 import fcntl
+import heapq
 import logging
 import os
 import os.path
@@ -392,6 +396,35 @@ class Job(object):
 		"""
 		return self._logFilename
 
+	def getLocalLogFilename(self):
+		"""
+		Returns the job's log filename as an absolute local path.
+		
+		@rtype: string, or None
+		@returns: the absolute local path to the job's log filename,
+		or None if the job has no log filename yet
+		"""
+		if not self._logFilename:
+			return None
+		return os.path.normpath("%s%s" % (cm.get("testerman.document_root"), self._logFilename))
+
+	def flushLog(self):
+		"""
+		Makes sure that the log events received so far for this job
+		are written to its log file.
+		"""
+		filename = self.getLocalLogFilename()
+		if filename:
+			EventManager.instance().flushLog(filename)
+
+	def closeLog(self):
+		"""
+		Flushes and releases the log file, once the job is complete.
+		"""
+		filename = self.getLocalLogFilename()
+		if filename:
+			EventManager.instance().closeLog(filename)
+
 	def _lock(self):
 		self._mutex.acquire()
 	
@@ -422,6 +455,8 @@ class Job(object):
 			return
 		
 		self._state = state
+		# Updated with the job lock held, so that the state changes are indexed in order
+		instance()._jobStore.updateState(self, state)
 		self._unlock()
 		getLogger().info("%s changed state to %s" % (str(self), state))
 		
@@ -437,8 +472,11 @@ class Job(object):
 				# Always set a stop time, including for failed jobs - this is their failure time
 				if not self._stopTime:
 					self._stopTime = time.time()
+			self.closeLog()
 			self.postRun()
 			self.cleanup()
+			# Cancelled or killed while waiting for a TE slot
+			instance()._admissionControl.discard(self)
 		
 		self.notifyStateChange()
 
@@ -705,6 +743,10 @@ self._baseDirectory, self._tePackageDirectory, self._teCommandLine, self._teFile
 					os.kill(self._tePid, signal.SIGINT)
 			elif sig == self.SIGNAL_CANCEL and state == self.STATE_WAITING:
 				self.setState(self.STATE_CANCELLED)
+			
+			elif sig == self.SIGNAL_KILL and state == self.STATE_WAITING:
+				# Not started yet (possibly waiting for a TE slot)
+				self.setState(self.STATE_KILLED)
 				
 			elif sig == self.SIGNAL_PAUSE and state == self.STATE_RUNNING and self._tePid:
 				os.kill(self._tePid, signal.SIGSTOP)
@@ -809,6 +851,26 @@ self._baseDirectory, self._tePackageDirectory, self._teCommandLine, self._teFile
 		if atsDirInTePackage.startswith('/'):
 			atsDirInTePackage = atsDirInTePackage[1:]
 
+		# Reuse the egg prepared for a previous job if nothing it depends on changed
+		eggCache = EggCache.instance()
+		eggKey = None
+		dependencyContents = {}
+		if eggCache:
+			try:
+				for filename in userlandDependencies:
+					dependencyContents[filename] = FileSystemManager.instance().read(filename)
+				eggKey = self._getEggKey(packagePath, atsDirInTePackage, adapterDependencies, dependencyContents)
+			except Exception, e:
+				# Let the usual preparation report the error, if any
+				getLogger().debug("%s: unable to compute the egg cache key: %s" % (str(self), str(e)))
+			if eggKey:
+				self._tePreparedPackageDirectory = tempfile.mkdtemp()
+				if eggCache.get(eggKey, "%s/ats.egg" % self._tePreparedPackageDirectory):
+					getLogger().info("%s: reusing cached TE egg %s" % (str(self), eggKey))
+					self.setState(self.STATE_WAITING)
+					return
+				os.rmdir(self._tePreparedPackageDirectory)
+
 		try:
 			te = TEFactory.createTestExecutable(self.getName(), self._source, atsDirInTePackage = atsDirInTePackage)
 		except Exception, e:
@@ -874,7 +936,9 @@ self._baseDirectory, self._tePackageDirectory, self._teCommandLine, self._teFile
 			for filename in userlandDependencies:
 				# filename is a docroot-path
 
-				depContent = FileSystemManager.instance().read(filename)
+				depContent = dependencyContents.get(filename)
+				if depContent is None:
+					depContent = FileSystemManager.instance().read(filename)
 				# Alter the content (additional includes, etc)
 				depContent = TEFactory.createDependency(depContent)
 
@@ -998,10 +1062,47 @@ Platform: UNKNOWN
 			shutil.rmtree("%s/src" % self._tePreparedPackageDirectory, ignore_errors = True)
 		except Exception, e:
 			getLogger().warning("%s: unable to clean up temporary files after creating egg: %s" % (str(self), str(e)))
+
+		if eggKey:
+			eggCache.put(eggKey, "%s/ats.egg" % self._tePreparedPackageDirectory)
 		
 		# OK, we're ready. The egg is waiting as ${self._tePreparedPackagedDirectory}/ats.egg.
 		self.setState(self.STATE_WAITING)
 
+	def _getEggKey(self, packagePath, atsDirInTePackage, adapterDependencies, dependencyContents):
+		"""
+		Computes the egg cache key for this ATS, from everything
+		its TE egg is built from.
+		
+		@type  packagePath: string, or None
+		@param packagePath: the docroot-path of the package containing the ATS, if any
+		@type  atsDirInTePackage: string
+		@param atsDirInTePackage: the ATS directory, relative to the egg root
+		@type  adapterDependencies: list of strings
+		@param adapterDependencies: the core dependencies (server_root-relative filenames)
+		@type  dependencyContents: dict[string] of strings
+		@param dependencyContents: the raw userland dependencies, indexed by their docroot-path
+		
+		@rtype: string
+		@returns: the egg cache key
+		"""
+		parts = [
+			Versions.getServerVersion(),
+			# The TE, including the ATS, the language API and the TE configuration
+			TEFactory.getTestExecutableSignature(self.getName(), self._source, atsDirInTePackage),
+			# Used by TEFactory.createDependency()
+			cm.get("testerman.te.python.ttcn3module"),
+			packagePath or '',
+			]
+		for coreDep in adapterDependencies:
+			st = os.stat("%s/%s" % (cm.get_transient('ts.server_root'), coreDep))
+			parts += [ coreDep, '%s:%s' % (st.st_size, st.st_mtime) ]
+		filenames = dependencyContents.keys()
+		filenames.sort()
+		for filename in filenames:
+			parts += [ filename, dependencyContents[filename] ]
+		return EggCache.getKey(parts)
+
 	def preRun(self):
 		"""
 		Called by the scheduler when just about to call run() in a dedicated thread.
@@ -1056,12 +1157,27 @@ Platform: UNKNOWN
 		- then 'repository'
 		- then the Testerman system include paths
 		
+		The TE is started once the job is granted a TE slot by the admission control.
+		
 		@type  inputSession: dict[unicode] of unicode
 		@param inputSession: the session parameters for this run.
 		
 		@rtype: int
 		@returns: the TE return code
 		"""
+		instance().acquireTeSlot(self)
+		try:
+			if self.getState() != self.STATE_WAITING:
+				getLogger().info("%s: not started, cancelled while waiting for a TE slot" % str(self))
+				return self.getResult()
+			return self._runTe(inputSession)
+		finally:
+			instance().releaseTeSlot(self)
+
+	def _runTe(self, inputSession):
+		"""
+		Actually runs the TE, once the job holds a TE slot.
+		"""
 		baseDocRootDirectory = self._baseDocRootDirectory
 		baseDirectory = self._baseDirectory
 		tePackageDirectory = self._tePackageDirectory
@@ -1136,17 +1252,31 @@ Platform: UNKNOWN
 		self._teFilename = teFilename[len(cm.get('testerman.document_root')):] # fill a teFilename that is relative to the docroot
 		getLogger().info("%s: executing TE using:\n%s\nEnvironment variables:%s" % (str(self), cmdLine, '\n'.join(['%s=%s' % x for x in env.items()])))
 
-		# Fork and run it
+		# Start it from the TE launcher, if available
+		launchedTe = None
+		if TeLauncher.instance():
+			try:
+				launchedTe = TeLauncher.instance().launch(executable, args, env, tePackageDirectory)
+			except Exception, e:
+				getLogger().warning("%s: unable to start TE from the TE launcher, forking it: %s" % (str(self), str(e)))
+
+		# Or fork and run it
 		try:
-			pid = os.fork()
+			if launchedTe:
+				pid = launchedTe.pid
+			else:
+				pid = os.fork()
 			if pid:
 				# Wait for the child to finish
 				self._tePid = pid
 				self.setState(self.STATE_RUNNING)
 				# actual retcode (< 256), killing signal, if any
 				getLogger().info("%s: Waiting for TE to complete (pid %s)..." % (str(self), pid))
-				res = os.waitpid(pid, 0)
-				(retcode, sig) = divmod(res[1], 256)
+				if launchedTe:
+					status = launchedTe.wait()
+				else:
+					status = os.waitpid(pid, 0)[1]
+				(retcode, sig) = divmod(status, 256)
 				self._tePid = None
 			else:
 				# forked child: exec with the TE once moved to the correct dir
@@ -1217,8 +1347,9 @@ Platform: UNKNOWN
 		if self._logFilename:
 			try:
 				# Logs are locally generated, so no need to access them through the FileSystemManager.
-				absoluteLogFilename = os.path.normpath("%s%s" % (cm.get("testerman.document_root"), self._logFilename))
-				f = open(absoluteLogFilename, 'r')
+				# Make sure the events received so far are in the file
+				self.flushLog()
+				f = open(self.getLocalLogFilename(), 'r')
 				fcntl.flock(f.fileno(), fcntl.LOCK_EX)
 				res = '<?xml version="1.0" encoding="utf-8" ?>\n<ats>\n%s</ats>' % f.read()
 				f.close()
@@ -1451,6 +1582,8 @@ class CampaignJob(Job):
 			self.setResult(1)
 			self.setState(self.STATE_CANCELLED)
 		self._logEvent('event', 'campaign-stopped', {'id': self._name, 'result': self.getResult()})
+		# Logged after the campaign was complete: release the log file again
+		self.closeLog()
 		
 		return self.getResult()
 
@@ -1706,6 +1839,7 @@ class CampaignJob(Job):
 		Returns the current known log.
 		"""
 		if self._logFilename:
+			self.flushLog()
 			f = open(self._absoluteLogFilename, 'r')
 			fcntl.flock(f.fileno(), fcntl.LOCK_EX)
 			# FIXME: we generate a 'ats' root element. Is that correct ?
@@ -1721,44 +1855,349 @@ class CampaignJob(Job):
 
 class Scheduler(threading.Thread):
 	"""
-	A Background thread that regularly checks the main job queue for job to start (job in STATE_WAITING).
-	
-	We should have a dedicated heap for that.
-	However, since we won't have thousands of waiting jobs, a first straightforward implementation
-	may be enough.
+	A Background thread that starts the waiting root jobs when their
+	scheduled start time is reached.
+
+	The scheduled jobs are kept in a heap ordered by their scheduled
+	start times. The thread sleeps until the next scheduled start time,
+	and is woken up when a job is scheduled or rescheduled.
+	It still wakes up every ts.jobscheduler.interval at most, so that
+	it is not fooled by system clock changes.
 	"""
 	def __init__(self, manager):	
 		threading.Thread.__init__(self)
 		self._manager = manager
-		self._stopEvent = threading.Event()
-		self._notifyEvent = threading.Event()
+		self._stopped = False
+		self._condition = threading.Condition()
+		# heap of (scheduled start time, sequence, job)
+		self._heap = []
+		self._sequence = 0
+		# The scheduled start time of the valid heap entry for each job, indexed by job id.
+		# Rescheduling a job adds a new entry: the previous one is ignored when popped.
+		self._scheduledStartTimes = {}
+	
+	def schedule(self, job):
+		"""
+		Schedules a waiting root job to start at its scheduled start time,
+		or updates its start time if already scheduled.
+		"""
+		at = job.getScheduledStartTime()
+		self._condition.acquire()
+		try:
+			if self._scheduledStartTimes.get(job.getId()) == at:
+				return
+			self._scheduledStartTimes[job.getId()] = at
+			heapq.heappush(self._heap, (at, self._sequence, job))
+			self._sequence += 1
+			if self._heap[0][2] is job:
+				# New earliest job
+				self._condition.notify()
+		finally:
+			self._condition.release()
+	
+	def _getDueJobs(self):
+		"""
+		Pops the jobs whose scheduled start time is reached.
+		Must be called with the condition acquired.
+		"""
+		ret = []
+		now = time.time()
+		while self._heap and self._heap[0][0] <= now:
+			(at, sequence, job) = heapq.heappop(self._heap)
+			if self._scheduledStartTimes.get(job.getId()) != at:
+				# Rescheduled job: obsolete entry
+				continue
+			del self._scheduledStartTimes[job.getId()]
+			# Cancelled jobs are just forgotten
+			if job.getState() == Job.STATE_WAITING:
+				ret.append(job)
+		return ret
 	
 	def run(self):
 		getLogger().info("Job scheduler started.")
-		while not self._stopEvent.isSet():
-			# this delay is dynamic - re-read at each iterations
-			delay = float(cm.get('ts.jobscheduler.interval')) / 1000.0
-			self._notifyEvent.wait(delay)
-			self._notifyEvent.clear()
-			self.check()
+		while True:
+			self._condition.acquire()
+			try:
+				jobs = self._getDueJobs()
+				while not jobs and not self._stopped:
+					# this delay is dynamic - re-read at each iterations
+					delay = float(cm.get('ts.jobscheduler.interval')) / 1000.0
+					if self._heap:
+						delay = min(delay, self._heap[0][0] - time.time())
+					self._condition.wait(max(delay, 0.0))
+					jobs = self._getDueJobs()
+				if self._stopped:
+					break
+			finally:
+				self._condition.release()
+			for job in jobs:
+				self._manager.startJob(job)
 		getLogger().info("Job scheduler stopped.")
 	
-	def check(self):
-		jobs = self._manager.getWaitingRootJobs()
-		for job in jobs:
-			if job.getScheduledStartTime() < time.time():
-				getLogger().info("Scheduler: starting new job: %s" % str(job))
-				# Prepare a new thread, execute the job
-				job.preRun()
-				jobThread = threading.Thread(target = lambda: job.run(job.getScheduledSession()))
-				jobThread.start()
-
 	def stop(self):
-		self._stopEvent.set()
+		self._condition.acquire()
+		self._stopped = True
+		self._condition.notify()
+		self._condition.release()
 		self.join()
+
+
+class AdmissionControl:
+	"""
+	Limits the number of concurrently running TEs to
+	ts.jobscheduler.max_running_tes (0: unlimited).
+
+	Jobs that cannot run a TE immediately are appended to a FIFO backlog,
+	and are granted a TE slot in order when running TEs complete.
+	"""
+	def __init__(self):
+		self._mutex = threading.RLock()
+		# The ids of the jobs holding a TE slot
+		self._running = set()
+		# FIFO of (job, function called when a TE slot is granted to the job)
+		self._backlog = collections.deque()
+	
+	def _getMaxRunningTes(self):
+		return cm.get('ts.jobscheduler.max_running_tes')
+	
+	def _grant(self):
+		"""
+		Grants TE slots to the jobs at the head of the backlog, as long as
+		there are free slots.
+		Jobs that are not waiting anymore (cancelled while in backlog) are
+		removed from the backlog without consuming any slot.
+		
+		@rtype: list of (job, function)
+		@returns: the backlog entries to notify, outside the mutex
+		"""
+		ret = []
+		self._mutex.acquire()
+		try:
+			while self._backlog:
+				(job, cb) = self._backlog[0]
+				if job.getState() == Job.STATE_WAITING:
+					maxRunningTes = self._getMaxRunningTes()
+					if maxRunningTes > 0 and len(self._running) >= maxRunningTes:
+						break
+					self._running.add(job.getId())
+				self._backlog.popleft()
+				ret.append((job, cb))
+		finally:
+			self._mutex.release()
+		return ret
+	
+	def submit(self, job, cb):
+		"""
+		Requests a TE slot for job.
+		cb(job) is called once the slot is granted - immediately, from the
+		calling thread, if a slot is free, or later, from the thread
+		that releases a slot.
+		"""
+		self._mutex.acquire()
+		try:
+			if job.getId() in self._running:
+				granted = [ (job, cb) ]
+			else:
+				self._backlog.append((job, cb))
+				granted = []
+		finally:
+			self._mutex.release()
+		for (j, c) in granted + self._grant():
+			c(j)
+	
+	def acquire(self, job):
+		"""
+		Waits for a TE slot for job.
+		Returns immediately if the job already holds one.
+		"""
+		granted = threading.Event()
+		self.submit(job, lambda j: granted.set())
+		granted.wait()
+
+	def release(self, job):
+		"""
+		Releases the TE slot held by job, if any, granting it to the next
+		job in backlog.
+		"""
+		self._mutex.acquire()
+		try:
+			self._running.discard(job.getId())
+		finally:
+			self._mutex.release()
+		for (j, cb) in self._grant():
+			cb(j)
+	
+	def discard(self, job):
+		"""
+		Removes job from the backlog, if it is there (cancelled or killed
+		while waiting for a TE slot), and calls its function, so that
+		its waiter does not wait for another slot release.
+		"""
+		self._mutex.acquire()
+		try:
+			discarded = [ (j, cb) for (j, cb) in self._backlog if j is job ]
+			if discarded:
+				self._backlog = collections.deque([ (j, cb) for (j, cb) in self._backlog if j is not job ])
+		finally:
+			self._mutex.release()
+		for (j, cb) in discarded:
+			cb(j)
+	
+	def getBacklogSize(self):
+		self._mutex.acquire()
+		ret = len(self._backlog)
+		self._mutex.release()
+		return ret
+
+
+class JobStore:
+	"""
+	The jobs known by the job manager, indexed by id, by state,
+	and by parent (root jobs and children of each job).
+	
+	Thread-safe.
+	Locking order: a job lock, then the store mutex. The store never
+	calls job methods that acquire the job lock with its mutex held,
+	so that jobs can update the store on state change.
+	"""
+	def __init__(self):
+		self._mutex = threading.RLock()
+		#: dict[job id] = job
+		self._jobs = {}
+		#: dict[job id] = registration order, to list the jobs in the queue order
+		self._sequences = {}
+		self._nextSequence = 0
+		#: dict[job id] = indexed job state
+		self._jobStates = {}
+		#: dict[state] = set of job ids
+		self._states = {}
+		#: set of root job ids
+		self._roots = set()
+		#: dict[parent job id] = list of child job ids
+		self._children = {}
+	
+	def add(self, job):
+		"""
+		Adds a job to the store, indexing it with its current state and parent.
+		"""
+		job._lock()
+		try:
+			self._mutex.acquire()
+			try:
+				id_ = job.getId()
+				if id_ in self._jobs:
+					return
+				self._jobs[id_] = job
+				self._sequences[id_] = self._nextSequence
+				self._nextSequence += 1
+				self._jobStates[id_] = job._state
+				self._states.setdefault(job._state, set()).add(id_)
+				parent = job.getParent()
+				if parent is None:
+					self._roots.add(id_)
+				else:
+					self._children.setdefault(parent.getId(), []).append(id_)
+			finally:
+				self._mutex.release()
+		finally:
+			job._unlock()
+	
+	def remove(self, job):
+		self._mutex.acquire()
+		try:
+			id_ = job.getId()
+			if not id_ in self._jobs:
+				return
+			del self._jobs[id_]
+			del self._sequences[id_]
+			self._states[self._jobStates.pop(id_)].discard(id_)
+			self._roots.discard(id_)
+			parent = job.getParent()
+			if parent is not None and parent.getId() in self._children:
+				self._children[parent.getId()].remove(id_)
+				if not self._children[parent.getId()]:
+					del self._children[parent.getId()]
+		finally:
+			self._mutex.release()
+	
+	def updateState(self, job, state):
+		"""
+		Reindexes a job on state change.
+		Must be called with the job lock held.
+		Jobs that are not in the store are ignored.
+		"""
+		self._mutex.acquire()
+		try:
+			id_ = job.getId()
+			if not id_ in self._jobs:
+				return
+			self._states[self._jobStates[id_]].discard(id_)
+			self._jobStates[id_] = state
+			self._states.setdefault(state, set()).add(id_)
+		finally:
+			self._mutex.release()
+	
+	def get(self, id_):
+		"""
+		@rtype: Job, or None
+		@returns: the job whose id is id_, or None if not found
+		"""
+		self._mutex.acquire()
+		try:
+			return self._jobs.get(id_)
+		finally:
+			self._mutex.release()
+	
+	def find(self, states = None, parentId = None):
+		"""
+		Selects jobs using the indexes.
+		
+		@type  states: list of strings, or None
+		@param states: if set, only selects the jobs in these states
+		@type  parentId: integer, or None
+		@param parentId: if set, only selects the children of this job,
+		or the root jobs if 0
+		
+		@rtype: list of Job instances
+		@returns: the selected jobs, in queue order
+		"""
+		self._mutex.acquire()
+		try:
+			ids = None
+			if states is not None:
+				ids = set()
+				for state in states:
+					ids.update(self._states.get(state, []))
+			if parentId is not None:
+				if parentId == 0:
+					children = self._roots
+				else:
+					children = self._children.get(parentId, [])
+				if ids is None:
+					ids = set(children)
+				else:
+					ids.intersection_update(children)
+			if ids is None:
+				ids = self._jobs.keys()
+			ids = [ (self._sequences[id_], id_) for id_ in ids ]
+			ids.sort()
+			return [ self._jobs[id_] for (sequence, id_) in ids ]
+		finally:
+			self._mutex.release()
 	
-	def notify(self):
-		self._notifyEvent.set()
+	def getJobs(self):
+		"""
+		@rtype: list of Job instances
+		@returns: all the jobs, in queue order
+		"""
+		return self.find()
+	
+	def __len__(self):
+		self._mutex.acquire()
+		try:
+			return len(self._jobs)
+		finally:
+			self._mutex.release()
 
 
 class JobManager:
@@ -1766,9 +2205,9 @@ class JobManager:
 	A Main entry point to the job manager module.
 	"""
 	def __init__(self):
-		self._mutex = threading.RLock()
-		self._jobQueue = []
+		self._jobStore = JobStore()
 		self._scheduler = Scheduler(self)
+		self._admissionControl = AdmissionControl()
 	
 	def start(self):
 		self._scheduler.start()
@@ -1776,21 +2215,13 @@ class JobManager:
 	def stop(self):
 		self._scheduler.stop()
 	
-	def _lock(self):
-		self._mutex.acquire()
-	
-	def _unlock(self):
-		self._mutex.release()
-	
 	def registerJob(self, job):
 		"""
 		Register a new job in the queue.
 		Do not update its state or do anything with it.
 		Typically used by a campaign to register the child jobs it manages.
 		"""
-		self._lock()
-		self._jobQueue.append(job)
-		self._unlock()
+		self._jobStore.add(job)
 
 	def persist(self):
 		"""
@@ -1801,15 +2232,13 @@ class JobManager:
 
 		queueFilename = cm.get('testerman.var_root') + '/jobqueue.dump'
 		getLogger().debug("Persisting queue to %s..." % queueFilename)
-		self._lock()
 		try:
-			dump = pickle.dumps(self._jobQueue)
+			dump = pickle.dumps(self._jobStore.getJobs())
 			f = open(queueFilename, 'w')
 			f.write(dump)
 			f.close()
 		except Exception, e:
 			getLogger().warning("Unable to persist job queue to %s: %s" % (queueFilename, str(e)))
-		self._unlock()
 
 	def restore(self):
 		"""
@@ -1833,8 +2262,10 @@ class JobManager:
 		
 		getLogger().info("Restoring job queue from %s..." % queueFilename)
 		try:
-			self._jobQueue = pickle.loads(dump)
-			for job in self._jobQueue:
+			jobs = pickle.loads(dump)
+			for job in jobs:
+				self._jobStore.add(job)
+			for job in jobs:
 				if job.getState() in [ job.STATE_RUNNING, job.STATE_PAUSED, job.STATE_CANCELLING, job.STATE_INITIALIZING ]:
 					getLogger().info("Job %s marked as being crashed" % job.getId())
 					job.setState(job.STATE_CRASHED)
@@ -1842,7 +2273,9 @@ class JobManager:
 					job.setState(job.STATE_KILLED)
 				if job.getId() > maxId:
 					maxId = job.getId()
-			getLogger().info("Job queue restored: %s jobs recovered." % len(self._jobQueue))
+				if job.getParent() is None and job.getState() == job.STATE_WAITING:
+					self._scheduler.schedule(job)
+			getLogger().info("Job queue restored: %s jobs recovered." % len(jobs))
 			global _GeneratorBaseId
 			_GeneratorBaseId = maxId
 			getLogger().info("Continuing job IDs at %s" % maxId)
@@ -1867,47 +2300,105 @@ class JobManager:
 			raise e
 
 		getLogger().info("JobManager: new job submitted: %s, scheduled to start on %s" % (str(job), time.strftime("%Y%m%d, at %H:%H:%S", time.localtime(job.getScheduledStartTime()))))
-		# Wake up the scheduler. Maybe an instant run is here.
-		self._scheduler.notify()
+		# Root jobs are started by the scheduler; child jobs by their parents
+		if job.getParent() is None:
+			self._scheduler.schedule(job)
 		return job.getId()
 	
+	def startJob(self, job):
+		"""
+		Starts a waiting root job in a new thread.
+		Jobs running a TE are started once granted a TE slot (they
+		wait in the admission control backlog until then).
+		Called by the scheduler.
+		"""
+		if isinstance(job, AtsJob):
+			self._admissionControl.submit(job, self._startJob)
+		else:
+			self._startJob(job)
+	
+	def _startJob(self, job):
+		if job.getState() != job.STATE_WAITING:
+			# Cancelled while in backlog
+			self._admissionControl.release(job)
+			return
+		getLogger().info("Scheduler: starting new job: %s" % str(job))
+		# Prepare a new thread, execute the job
+		job.preRun()
+		jobThread = threading.Thread(target = lambda: job.run(job.getScheduledSession()))
+		jobThread.start()
+	
+	def acquireTeSlot(self, job):
+		"""
+		Waits until the job is allowed to run a TE (admission control).
+		"""
+		self._admissionControl.acquire(job)
+	
+	def releaseTeSlot(self, job):
+		self._admissionControl.release(job)
+	
 	def getWaitingRootJobs(self):
 		"""
 		Only extracts the waiting root jobs subset from the queue.
-		Useful for the scheduler.
 		Non-root (waiting) jobs are started by their parents explicitely,
 		not by the scheduler.
 
 		@rtype: list of Job instances
 		@returns: the list of waiting jobs.
 		"""
-		self._lock()
-		try:
-			ret = filter(lambda x: (x.getParent() is None) and (x.getState() == Job.STATE_WAITING), self._jobQueue)
-		except Exception, e:
-			ret = []
-			getLogger().error("JobManager: unable to get jobs waiting for execution: %s" % str(e))	
-		self._unlock()
-		return ret
+		return self._jobStore.find(states = [ Job.STATE_WAITING ], parentId = 0)
 	
-	def getJobInfo(self, id_ = None):
+	def getJobInfo(self, id_ = None, filters = None, offset = 0, limit = None):
 		"""
 		@type  id_: integer, or None
 		@param id_: the jobId for which we request some info, or None if we want all.
+		@type  filters: dict, or None
+		@param filters: when id_ is None, only selects the jobs matching all these criteria:
+		- 'state': string, or list of strings: the job states
+		- 'username': string: the user who submitted the job
+		- 'parent-id': integer: the parent job id, 0 for root jobs
+		- 'since', 'until': float: the job start time, or its scheduled start time if not started,
+		must be in [since, until[
+		@type  offset: integer
+		@param offset: the number of selected jobs to skip
+		@type  limit: integer, or None
+		@param limit: the maximum number of selected jobs to return, or None for all
 		
 		@rtype: list of dict
-		@returns: a list of job dict representations. May be empty if the id_ was not found.
-		"""
-		ret = []
-		self._lock()
-		try:
-			for job in self._jobQueue:
-				if id_ is None or job.getId() == id_:
-					ret.append(job.toDict())
-		except:
-			pass
-		self._unlock()
-		return ret
+		@returns: a list of job dict representations, in queue order. May be empty if the id_ was not found.
+		"""
+		if id_ is not None:
+			job = self._jobStore.get(id_)
+			if job:
+				return [ job.toDict() ]
+			return []
+
+		filters = filters or {}
+		states = filters.get('state')
+		if isinstance(states, basestring):
+			states = [ states ]
+		jobs = self._jobStore.find(states = states, parentId = filters.get('parent-id'))
+
+		username = filters.get('username')
+		since = filters.get('since')
+		until = filters.get('until')
+		if username is not None or since is not None or until is not None:
+			def match(job):
+				if username is not None and job.getUsername() != username:
+					return False
+				t = job._startTime or job.getScheduledStartTime()
+				if since is not None and t < since:
+					return False
+				if until is not None and t >= until:
+					return False
+				return True
+			jobs = filter(match, jobs)
+
+		if limit is None:
+			jobs = jobs[offset:]
+		else:
+			jobs = jobs[offset:offset + limit]
+		return [ job.toDict() for job in jobs ]
 
 	def getJobDetails(self, id_):
 		"""
@@ -1926,27 +2417,18 @@ class JobManager:
 		"""
 		Kills all existing jobs.
 		"""
-		self._lock()
-		for job in self._jobQueue:
+		for job in self._jobStore.getJobs():
 			try:
 				job.handleSignal(Job.SIGNAL_KILL)
 			except:
 				pass
-		self._unlock()
 
 	def getJob(self, id_):
 		"""
 		Internal only ?
 		Gets a job based on its id.
 		"""
-		j = None
-		self._lock()
-		for job in self._jobQueue:
-			if job.getId() == id_:
-				j = job
-				break
-		self._unlock()
-		return j
+		return self._jobStore.get(id_)
 	
 	def sendSignal(self, id_, signal):
 		job = self.getJob(id_)
@@ -1973,7 +2455,10 @@ class JobManager:
 	def rescheduleJob(self, id_, at):
 		job = self.getJob(id_)
 		if job:
-			return job.reschedule(at)
+			ret = job.reschedule(at)
+			if ret and job.getParent() is None:
+				self._scheduler.schedule(job)
+			return ret
 	
 	def isBottomUpTreeCompleted(self, job):
 		if not job._stopTime: return False
@@ -1991,20 +2476,13 @@ class JobManager:
 		If one of the parent jobs is still running (a campaign, etc),
 		the job is kept even if it was completed before the older_than.
 		"""
-		self._lock()
-		try:
-		
-			keptQueue = []
-			count = len(self._jobQueue)
-			# Let's select kept jobs instead of removing items in the current jobqueue
-			for job in self._jobQueue:
-				if not self.isBottomUpTreeCompleted(job) or not (job._stopTime and job._stopTime < older_than):
-					keptQueue.append(job)
-					count -= 1
-			self._jobQueue = keptQueue
-			return count
-		finally:	
-			self._unlock()
+		count = 0
+		# Only completed jobs have a completion time
+		for job in self._jobStore.find(states = Job.FINAL_STATES):
+			if self.isBottomUpTreeCompleted(job) and job._stopTime and job._stopTime < older_than:
+				self._jobStore.remove(job)
+				count += 1
+		return count
 
 TheJobManager = None
 
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008,2009,2010 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# A buffered writer for job log files.
+#
+# Instead of opening, appending to, then closing a log file for each
+# log event, the LogWriter keeps a few log files open with a write buffer.
+#
+# Buffered data are written to the files:
+# - when the buffer is full (bufferSize, in bytes),
+# - periodically (every flushInterval s) by a flusher thread,
+# - on explicit flush(filename) or close(filename) calls, typically when
+#   a job is complete or when its log is about to be read.
+#
+# At most maxOpenFiles files are kept open. When a new file is needed,
+# the least recently used one is closed. Files that have not been written
+# for idleTimeout s are closed by the flusher thread, too.
+#
+# Used by the Event Manager (TL sub-system) on the server side, and by the
+# LocalIlClient in TestermanTCI for TE local logging.
+##
+
+import os.path
+import threading
+import time
+
+
+class LogFile:
+	"""
+	An open log file, as managed by the LogWriter.
+	"""
+	def __init__(self, filename, bufferSize):
+		# Normalized filename
+		self.filename = filename
+		# The filenames this file was written through (normalized or not)
+		self.keys = []
+		self.file = open(filename, 'a', bufferSize)
+		# Something was written since the last flush
+		self.dirty = False
+		self.lastUse = time.time()
+
+	def write(self, data):
+		self.file.write(data)
+		self.dirty = True
+		self.lastUse = time.time()
+
+	def flush(self):
+		if self.dirty:
+			self.dirty = False
+			self.file.flush()
+
+	def close(self):
+		self.dirty = False
+		self.file.close()
+
+
+class LogWriter:
+	"""
+	Thread-safe writer appending data to (log) files through a pool of
+	buffered file handles.
+
+	Filenames are normalized, so that a write(), flush() or close() with
+	a different but equivalent path targets the same file.
+	"""
+	def __init__(self, maxOpenFiles = 64, bufferSize = 65536, flushInterval = 1.0, idleTimeout = 60.0):
+		"""
+		@type  maxOpenFiles: integer
+		@param maxOpenFiles: the maximum number of files kept open at the same time
+		@type  bufferSize: integer
+		@param bufferSize: the write buffer size per file, in bytes
+		@type  flushInterval: float
+		@param flushInterval: buffered data are flushed at most this delay (in s)
+		after being written. 0 disables the flusher thread: data are only written
+		when the buffer is full or on explicit flush()/close().
+		@type  idleTimeout: float
+		@param idleTimeout: files not written for this delay (in s) are closed
+		by the flusher thread
+		"""
+		self._maxOpenFiles = max(1, maxOpenFiles)
+		self._bufferSize = bufferSize
+		self._flushInterval = flushInterval
+		self._idleTimeout = idleTimeout
+		# LogFile, indexed by the filenames used in write(), as is
+		self._files = {}
+		# The same LogFiles, indexed by normalized filename
+		self._filesByName = {}
+		self._mutex = threading.Lock()
+		self._stopEvent = threading.Event()
+		self._flusherThread = None
+
+	def start(self):
+		"""
+		Starts the flusher thread, if enabled.
+		"""
+		if self._flushInterval > 0 and not self._flusherThread:
+			self._stopEvent.clear()
+			self._flusherThread = threading.Thread(target = self._flushLoop)
+			self._flusherThread.setDaemon(True)
+			self._flusherThread.start()
+
+	def stop(self):
+		"""
+		Stops the flusher thread, then flushes and closes all files.
+		"""
+		if self._flusherThread:
+			self._stopEvent.set()
+			self._flusherThread.join()
+			self._flusherThread = None
+		self.closeAll()
+
+	def write(self, filename, data):
+		"""
+		Appends data to a file, opening it if needed.
+
+		@type  filename: string
+		@param filename: the file to append data to
+		@type  data: string (buffer)
+		@param data: the data to write
+
+		@throws IOError: the file could not be opened or written
+		"""
+		self._mutex.acquire()
+		try:
+			logFile = self._files.get(filename)
+			if logFile is None:
+				logFile = self._open(filename)
+			try:
+				logFile.write(data)
+			except:
+				# Drop the handle: the next write will try to reopen the file
+				self._closeFile(logFile)
+				raise
+		finally:
+			self._mutex.release()
+
+	def flush(self, filename = None):
+		"""
+		Writes the buffered data for a file, or for all files if filename is None.
+
+		@type  filename: string, or None
+		@param filename: the file to flush
+		"""
+		self._mutex.acquire()
+		try:
+			if filename is None:
+				logFiles = self._filesByName.values()
+			else:
+				logFiles = filter(None, [ self._filesByName.get(os.path.normpath(filename)) ])
+			for logFile in logFiles:
+				try:
+					logFile.flush()
+				except:
+					self._closeFile(logFile)
+		finally:
+			self._mutex.release()
+
+	def close(self, filename):
+		"""
+		Flushes and closes a file, if currently open.
+		It will be transparently reopened on next write().
+
+		@type  filename: string
+		@param filename: the file to close
+		"""
+		self._mutex.acquire()
+		try:
+			logFile = self._filesByName.get(os.path.normpath(filename))
+			if logFile:
+				self._closeFile(logFile)
+		finally:
+			self._mutex.release()
+
+	def closeAll(self):
+		"""
+		Flushes and closes all open files.
+		"""
+		self._mutex.acquire()
+		try:
+			for logFile in self._filesByName.values():
+				self._closeFile(logFile)
+		finally:
+			self._mutex.release()
+
+	def getOpenFileCount(self):
+		return len(self._filesByName)
+
+	def _open(self, filename):
+		"""
+		Returns the LogFile to write filename to, opening the file if needed.
+		When opening a new file, closes the least recently used one if too
+		many files are already open.
+		Must be called with the mutex held.
+		"""
+		normalizedFilename = os.path.normpath(filename)
+		logFile = self._filesByName.get(normalizedFilename)
+		if logFile is None:
+			if len(self._filesByName) >= self._maxOpenFiles:
+				self._closeFile(min(self._filesByName.values(), key = lambda x: x.lastUse))
+			logFile = LogFile(normalizedFilename, self._bufferSize)
+			self._filesByName[normalizedFilename] = logFile
+		logFile.keys.append(filename)
+		self._files[filename] = logFile
+		return logFile
+
+	def _closeFile(self, logFile):
+		"""
+		Closes a LogFile and forgets about it.
+		Must be called with the mutex held.
+		"""
+		for key in logFile.keys:
+			del self._files[key]
+		del self._filesByName[logFile.filename]
+		try:
+			logFile.close()
+		except:
+			pass
+
+	def _flushLoop(self):
+		"""
+		Flusher thread: periodically writes buffered data and closes idle
+		files.
+		"""
+		while not self._stopEvent.isSet():
+			self._stopEvent.wait(self._flushInterval)
+			self._mutex.acquire()
+			try:
+				now = time.time()
+				for logFile in self._filesByName.values():
+					if now - logFile.lastUse > self._idleTimeout:
+						self._closeFile(logFile)
+					else:
+						try:
+							logFile.flush()
+						except:
+							self._closeFile(logFile)
+			finally:
+				self._mutex.release()
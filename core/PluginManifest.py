@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2013 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Plugin Manifest:
+# lazy loading of the probe and codec plugins.
+#
+# Instead of importing all the modules of the plugin paths on
+# each TE or agent startup, a manifest per plugin path
+# maps the probe types and codec names to the modules that register them.
+# They are declared to the ProbeImplementationManager and CodecManager
+# as lazy registrations, so that a plugin module is only imported
+# when one of its probe types or codecs is actually used.
+#
+# The manifest is generated on first scan, by importing the plugin modules
+# and recording what they register, and is updated for the modules
+# whose modification time changed.
+# It is stored in a cache directory, not in the plugin paths, that may
+# be read-only or shared: $TESTERMAN_PLUGIN_CACHE (set by the server
+# for its TEs), or a per-user directory in the temporary directory.
+#
+# It may also be generated at install time, in the plugin paths:
+#   python PluginManifest.py <plugin path>...
+# This manifest is only read, when there is no manifest in cache.
+#
+# This is a common file to the core and pyagent.
+##
+
+import CodecManager
+import ProbeImplementationManager
+
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+
+
+# The manifest generated at install time, in a plugin path
+MANIFEST_FILENAME = '.plugins.manifest'
+MANIFEST_VERSION = '1'
+
+# Serializes the scans within a process
+_mutex = threading.RLock()
+
+
+def _getModuleMtime(filename):
+	"""
+	Returns the modification time of a plugin module, which
+	is the most recent one of its files for a package.
+	"""
+	mtime = os.stat(filename).st_mtime
+	if os.path.isdir(filename):
+		for (dirpath, dirnames, filenames) in os.walk(filename):
+			for f in filenames:
+				if f.endswith('.py'):
+					mtime = max(mtime, os.stat(os.path.join(dirpath, f)).st_mtime)
+	return mtime
+
+def _listModules(path):
+	"""
+	Returns the plugin modules in path, as (module name, filename).
+	"""
+	ret = []
+	for m in os.listdir(path):
+		if m.startswith('.') or m.startswith('__init__') or not (os.path.isdir(path + '/' + m) or m.endswith('.py')):
+			continue
+		filename = path + '/' + m
+		if m.endswith('.py'):
+			m = m[:-3]
+		ret.append((m, filename))
+	return ret
+
+def getCacheDirectory():
+	"""
+	@rtype: string
+	@returns: the directory the manifests are stored in
+	"""
+	directory = os.environ.get('TESTERMAN_PLUGIN_CACHE')
+	if directory:
+		return directory
+	try:
+		user = str(os.getuid())
+	except AttributeError:
+		import getpass
+		user = getpass.getuser()
+	return os.path.join(tempfile.gettempdir(), 'testerman-plugins-%s' % user)
+
+def _isTrustedDirectory(directory):
+	"""
+	Returns True if directory cannot be written by other users,
+	so that the manifests it contains can be trusted.
+	"""
+	if not hasattr(os, 'getuid'):
+		return True
+	s = os.stat(directory)
+	return s.st_uid == os.getuid() and not (s.st_mode & 022)
+
+def _getCachedManifestFilename(path):
+	return os.path.join(getCacheDirectory(), '%s.manifest' % hashlib.sha1(os.path.abspath(path)).hexdigest())
+
+def _readManifestFile(filename):
+	"""
+	@rtype: list of strings, or None
+	@returns: the lines of a valid manifest file, None if not found or invalid
+	"""
+	try:
+		f = open(filename)
+	except IOError:
+		return None
+	try:
+		lines = f.read().split('\n')
+	finally:
+		f.close()
+	if not lines or lines[0] != '# version %s' % MANIFEST_VERSION:
+		return None
+	return lines
+
+def readManifest(path):
+	"""
+	Reads the manifest of a plugin path, from the cache directory,
+	or generated at install time.
+
+	@type  path: string
+	@param path: the plugin path
+
+	@rtype: dict[module name] = (mtime, list of probe types, list of codec names)
+	@returns: the manifest entries, empty if there is no valid manifest
+	"""
+	ret = {}
+	lines = None
+	try:
+		if _isTrustedDirectory(getCacheDirectory()):
+			lines = _readManifestFile(_getCachedManifestFilename(path))
+	except OSError:
+		# No cache directory yet
+		pass
+	if lines is None:
+		lines = _readManifestFile(os.path.join(path, MANIFEST_FILENAME))
+	if lines is None:
+		return ret
+	for line in lines[1:]:
+		if not line or line.startswith('#'):
+			continue
+		try:
+			(m, mtime, probeTypes, codecNames) = line.split('\t')
+			ret[m] = (float(mtime), [ x for x in probeTypes.split(',') if x ], [ x for x in codecNames.split(',') if x ])
+		except ValueError:
+			# Corrupted entry: will be regenerated
+			continue
+	return ret
+
+def writeManifest(path, entries, installed = False):
+	"""
+	Writes the manifest of a plugin path, to the cache directory
+	(created if needed), or to the plugin path itself.
+	The manifest is replaced atomically, so that concurrent scans
+	always read a complete manifest.
+
+	@type  path: string
+	@param path: the plugin path
+	@type  entries: dict[module name] = (mtime, list of probe types, list of codec names)
+	@param entries: the manifest entries
+	@type  installed: bool
+	@param installed: if True, writes the manifest to the plugin path
+	(install time generation)
+	"""
+	lines = [ '# version %s' % MANIFEST_VERSION, '# Generated by Testerman on plugin scan - do not edit' ]
+	modules = entries.keys()
+	modules.sort()
+	for m in modules:
+		(mtime, probeTypes, codecNames) = entries[m]
+		lines.append('%s\t%r\t%s\t%s' % (m, mtime, ','.join(probeTypes), ','.join(codecNames)))
+	if installed:
+		filename = os.path.join(path, MANIFEST_FILENAME)
+	else:
+		directory = getCacheDirectory()
+		if not os.path.isdir(directory):
+			os.makedirs(directory, 0700)
+		if not _isTrustedDirectory(directory):
+			raise Exception("cache directory %s may be written by other users" % directory)
+		filename = _getCachedManifestFilename(path)
+	temporaryFilename = '%s.%d.tmp' % (filename, os.getpid())
+	f = open(temporaryFilename, 'w')
+	try:
+		f.write('\n'.join(lines) + '\n')
+	finally:
+		f.close()
+	try:
+		os.rename(temporaryFilename, filename)
+	except:
+		os.remove(temporaryFilename)
+		raise
+
+def _importModule(m):
+	"""
+	Imports a plugin module, and returns what it registered.
+
+	@rtype: tuple (list of probe types, list of codec names)
+	"""
+	probeTypes = ProbeImplementationManager.getProbeImplementationTypes()
+	codecNames = CodecManager.instance().getCodecNames()
+	__import__(m)
+	return ([ x for x in ProbeImplementationManager.getProbeImplementationTypes() if not x in probeTypes ],
+		[ x for x in CodecManager.instance().getCodecNames() if not x in codecNames ])
+
+def scanPlugins(paths, warningCallback = None, debugCallback = None, installed = False):
+	"""
+	Makes the plugin modules in paths available: adds the paths to sys.path,
+	and registers the probe types and codecs they provide as lazy
+	registrations, based on the plugin path manifests.
+
+	The modules that are not in the manifest, or that were modified
+	since the manifest was generated, are imported, and the manifest
+	is updated accordingly (if the cache directory is writable).
+	The modules imported before the scan cannot be analyzed (their
+	registrations are already done): they are not added to the manifest.
+	The modules imported by other plugins during the scan are added with
+	no registrations: they are recorded for the importing plugin.
+
+	@type  paths: list of strings
+	@param paths: the plugin paths
+	@type  warningCallback: function(string)
+	@param warningCallback: called on errors (failed imports, unreadable paths)
+	@type  debugCallback: function(string)
+	@param debugCallback: called with scan details
+	@type  installed: bool
+	@param installed: if True, the manifest is written to the plugin path
+	instead of the cache directory (install time generation)
+	"""
+	warning = warningCallback or (lambda x: None)
+	debug = debugCallback or (lambda x: None)
+
+	for path in paths:
+		if not path in sys.path:
+			sys.path.append(path)
+
+	_mutex.acquire()
+	try:
+		previousModules = set(sys.modules.keys())
+		for path in paths:
+			try:
+				modules = _listModules(path)
+			except Exception, e:
+				warning("unable to scan plugin path %s: %s" % (path, str(e)))
+				continue
+
+			manifest = readManifest(path)
+			entries = {}
+			for (m, filename) in modules:
+				try:
+					mtime = _getModuleMtime(filename)
+				except Exception, e:
+					warning("unable to stat plugin %s: %s" % (m, str(e)))
+					continue
+				entry = manifest.get(m)
+				if entry and entry[0] == mtime:
+					(probeTypes, codecNames) = entry[1:]
+					for probeType in probeTypes:
+						ProbeImplementationManager.registerLazyProbeImplementation(probeType, m)
+					for codecName in codecNames:
+						CodecManager.registerLazyCodec(codecName, m)
+					debug("registered plugin %s from manifest" % m)
+				elif m in previousModules:
+					debug("plugin %s already imported, not analyzed" % m)
+					continue
+				else:
+					try:
+						(probeTypes, codecNames) = _importModule(m)
+						debug("analyzed plugin %s" % m)
+					except Exception, e:
+						# Not added to the manifest, so that it is retried on next scan
+						warning("unable to import plugin %s: %s" % (m, str(e)))
+						continue
+				entries[m] = (mtime, probeTypes, codecNames)
+
+			if entries != manifest:
+				try:
+					writeManifest(path, entries, installed)
+					debug("updated plugin manifest for %s" % path)
+				except Exception, e:
+					# The changed modules will be imported again on next scan
+					warning("unable to update plugin manifest for %s: %s" % (path, str(e)))
+	finally:
+		_mutex.release()
+
+
+################################################################################
+# Main: manifest generation on install
+################################################################################
+
+def main():
+	import optparse
+	parser = optparse.OptionParser(usage = "%prog <plugin path>...")
+	(options, args) = parser.parse_args()
+	if not args:
+		parser.error("missing plugin path")
+	def log(txt):
+		sys.stdout.write(txt + '\n')
+	scanPlugins([ os.path.abspath(x) for x in args ], warningCallback = log, debugCallback = log, installed = True)
+
+if __name__ == "__main__":
+	main()
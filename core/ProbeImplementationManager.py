@@ -22,6 +22,9 @@
 # 
 ##
 
+import imp
+
+
 ##
 # Probe-related exceptions
 ##
@@ -281,10 +284,82 @@ def getLogger():
 
 # Contains the Class (python obj) of the probe implementation, indexed by its probeType (probeId)
 ProbeImplementationClasses = {}
+# Contains the name of the module implementing a probe type that is not imported yet, indexed by its probeType
+LazyProbeImplementationModules = {}
+
+def _loadLazyProbeImplementation(type_):
+	"""
+	Imports the module declared as implementing type_,
+	which registers the probe implementation class.
+	
+	The lookup, the import and the registration are done with the
+	(reentrant) import lock held, so that a concurrent lookup of type_ waits
+	for the registration. The lazy entry is only removed once the module
+	has been imported, so that a failed import is retried.
+	"""
+	if not LazyProbeImplementationModules.has_key(type_):
+		return
+	imp.acquire_lock()
+	try:
+		moduleName = LazyProbeImplementationModules.get(type_)
+		if moduleName and not ProbeImplementationClasses.has_key(type_):
+			try:
+				__import__(moduleName)
+			except Exception, e:
+				getLogger().warning("Unable to import module %s for probe type %s: %s" % (moduleName, type_, str(e)))
+				return
+			if not ProbeImplementationClasses.has_key(type_):
+				getLogger().warning("Module %s did not register probe type %s" % (moduleName, type_))
+		LazyProbeImplementationModules.pop(type_, None)
+	finally:
+		imp.release_lock()
 
 def getProbeImplementationClasses():
+	"""
+	Returns all the probe implementation classes, importing
+	the lazily registered ones.
+	Prefer getProbeImplementationClass() or getProbeImplementationTypes()
+	that do not import anything they don't need.
+	"""
+	for type_ in LazyProbeImplementationModules.keys():
+		_loadLazyProbeImplementation(type_)
 	return ProbeImplementationClasses
 
+def getProbeImplementationClass(type_):
+	"""
+	@type  type_: string
+	@param type_: the probe type
+
+	@rtype: class, or None
+	@returns: the probe implementation class registered for type_,
+	importing its module if lazily registered, or None if not found
+	"""
+	if not ProbeImplementationClasses.has_key(type_):
+		_loadLazyProbeImplementation(type_)
+	return ProbeImplementationClasses.get(type_)
+
+def getProbeImplementationTypes():
+	"""
+	@rtype: list of strings
+	@returns: the registered probe types, including the lazily registered ones
+	"""
+	# Lazy entries first: they are only removed once registered
+	lazyTypes = LazyProbeImplementationModules.keys()
+	types = ProbeImplementationClasses.keys()
+	for type_ in lazyTypes:
+		if not type_ in types:
+			types.append(type_)
+	return types
+
+def registerLazyProbeImplementation(type_, moduleName):
+	"""
+	Declares that moduleName registers the probe implementation for type_
+	when imported, so that it is imported only when type_ is actually needed.
+	Ignored if type_ is already registered.
+	"""
+	if not ProbeImplementationClasses.has_key(type_) and not LazyProbeImplementationModules.has_key(type_):
+		LazyProbeImplementationModules[type_] = moduleName
+
 def registerProbeImplementationClass(type_, class_):
 	if ProbeImplementationClasses.has_key(type_):
 		getLogger().warning("Not registering class for probe type %s: already registered" % type_)
@@ -104,19 +104,13 @@ def smartReindent(code, indentCharacter = '\t', reindentCount = 1):
 
 	return ''.join(ret)
 
-def createTestExecutable(name, ats, atsDirInTePackage):
+def _getTestExecutableVariables(name, ats, atsDirInTePackage):
 	"""
-	Creates a complete, command-line parameterized TE from a source ATS.
-	This basically replaces specific fields in the TE template with
-	actual values.
+	Returns the TE template and the values to substitute in it,
+	except the generation time and the (reindented) ATS source.
 
-	@type  name: string
-	@param name: the ATS friendly name / identifier	
-	@type  ats: string (utf-8)
-	@param ats: the source ats (contains metadata as Python comments)
-	
-	@rtype: string (utf-8 encoded)
-	@returns: the test executable Python script content.
+	@rtype: tuple (string, dict[string] of objects)
+	@returns: (template, variables)
 	"""
 	# For now, not everythin can be controlled by option flags.
 	tacsIp = cm.get("tacs.ip")
@@ -124,6 +118,8 @@ def createTestExecutable(name, ats, atsDirInTePackage):
 	ilPort = cm.get("interface.il.port")
 	ilIp = cm.get("interface.il.ip")
 	maxLogPayloadSize = cm.get("testerman.te.log.max_payload_size")
+	logBatchMaxSize = cm.get("testerman.te.log.batch.max_size")
+	logBatchMaxDelay = cm.get("testerman.te.log.batch.max_delay")
 	
 	codecPaths = cm.get("testerman.te.codec_paths")
 	probePaths = cm.get("testerman.te.probe_paths")
@@ -149,6 +145,56 @@ def createTestExecutable(name, ats, atsDirInTePackage):
 	except:
 		raise Exception("Unable to build Test Executable: Test Executable template %s not found" % templateFilename)
 
+	variables = dict(
+		il_ip = ilIp, il_port = ilPort, 
+		tacs_ip = tacsIp, tacs_port = tacsPort,
+    max_log_payload_size = maxLogPayloadSize, 
+		log_batch_max_size = logBatchMaxSize, log_batch_max_delay = logBatchMaxDelay,
+		probe_paths = probePaths, codec_paths = codecPaths,
+		adapter_module_name = adapterModuleName, 
+		metadata = metadata.toDict(),
+		ats_id = name,
+		ts_version = Versions.TESTERMAN_SERVER_VERSION,
+		ts_name = cm.get('ts.name'),
+		atsDirInTePackage = atsDirInTePackage,
+		)
+	return (template, variables)
+
+def getTestExecutableSignature(name, ats, atsDirInTePackage):
+	"""
+	Returns a string that changes whenever the TE created by
+	createTestExecutable() with the same arguments would change
+	(ATS, template, configuration), except for its generation time.
+
+	@type  name: string
+	@param name: the ATS friendly name / identifier	
+	@type  ats: string (utf-8)
+	@param ats: the source ats (contains metadata as Python comments)
+	
+	@rtype: string
+	@returns: the TE signature
+	"""
+	(template, variables) = _getTestExecutableVariables(name, ats, atsDirInTePackage)
+	variables = variables.items()
+	variables.sort()
+	return '%r\n%s\n%s' % (variables, template, ats)
+
+def createTestExecutable(name, ats, atsDirInTePackage):
+	"""
+	Creates a complete, command-line parameterized TE from a source ATS.
+	This basically replaces specific fields in the TE template with
+	actual values.
+
+	@type  name: string
+	@param name: the ATS friendly name / identifier	
+	@type  ats: string (utf-8)
+	@param ats: the source ats (contains metadata as Python comments)
+	
+	@rtype: string (utf-8 encoded)
+	@returns: the test executable Python script content.
+	"""
+	(template, variables) = _getTestExecutableVariables(name, ats, atsDirInTePackage)
+
 	# Continue with variable substitution	
 	def substituteVariables(s, values):
 		"""
@@ -164,21 +210,9 @@ def createTestExecutable(name, ats, atsDirInTePackage):
 		return re.sub(r'\$\{([a-zA-Z_0-9-]+)\}', _subst, s)
 
 	now = time.time()
-	variables = dict(
-		il_ip = ilIp, il_port = ilPort, 
-		tacs_ip = tacsIp, tacs_port = tacsPort,
-    max_log_payload_size = maxLogPayloadSize, 
-		probe_paths = probePaths, codec_paths = codecPaths,
-		adapter_module_name = adapterModuleName, 
-		metadata = metadata.toDict(),
-		source_ats = smartReindent(ats),
-		ats_id = name,
-		ts_version = Versions.TESTERMAN_SERVER_VERSION,
-		ts_name = cm.get('ts.name'),
-		gen_timestamp = now,
-		gen_time = time.strftime('%Y%m%d %H:%M:%S UTC', time.gmtime(now)),
-		atsDirInTePackage = atsDirInTePackage,
-		)
+	variables['source_ats'] = smartReindent(ats)
+	variables['gen_timestamp'] = now
+	variables['gen_time'] = time.strftime('%Y%m%d %H:%M:%S UTC', time.gmtime(now))
 	try:
 		te = substituteVariables(template, variables)
 	except Exception, e:
@@ -215,16 +249,7 @@ def createCommandLine(jobId, teFilename, logFilename, inputSessionFilename, outp
 	ret['executable'] = pythonInterpreter
 
 	#	Env
-	# shared "administrative" modules are in server_root/modules
-	pythonPath = '%(root)s/modules' % dict(
-		root = cm.get_transient("ts.server_root"),
-		egg = teFilename)
-	additionalPythonPath = cm.get("testerman.te.python.additional_pythonpath")
-	if additionalPythonPath:
-		pythonPath += ':' + additionalPythonPath
-
-	libraryPath = '%(root)s:$LD_LIBRARY_PATH' % dict(root = cm.get_transient("ts.server_root"))
-	ret['env'] = { 'LD_LIBRARY_PATH': libraryPath, 'PYTHONPATH': pythonPath }
+	ret['env'] = getEnvironment()
 
 	# Executable arguments: note: python egg execution by filename requires Python 2.6+
 	# Alternative to support previous Python versions: PYTHONPATH=/path/to/egg python -m ats
@@ -232,6 +257,24 @@ def createCommandLine(jobId, teFilename, logFilename, inputSessionFilename, outp
 
 	return ret
 
+def getEnvironment():
+	"""
+	@rtype: dict[string] of strings
+	@returns: the environment variables to execute the TE with.
+	"""
+	# shared "administrative" modules are in server_root/modules
+	pythonPath = '%(root)s/modules' % dict(root = cm.get_transient("ts.server_root"))
+	additionalPythonPath = cm.get("testerman.te.python.additional_pythonpath")
+	if additionalPythonPath:
+		pythonPath += ':' + additionalPythonPath
+
+	libraryPath = '%(root)s:$LD_LIBRARY_PATH' % dict(root = cm.get_transient("ts.server_root"))
+	env = { 'LD_LIBRARY_PATH': libraryPath, 'PYTHONPATH': pythonPath }
+	# The plugin manifests (see PluginManifest)
+	if cm.get("testerman.var_root"):
+		env['TESTERMAN_PLUGIN_CACHE'] = cm.get("testerman.var_root") + "/plugins"
+	return env
+
 def dumpSession(session):
 	"""
 	@type  session: dict[unicode] of python objects
@@ -0,0 +1,585 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2013 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# TE Launcher:
+# starts TEs from a pool of pre-warmed processes, instead of a
+# fork+exec of a new interpreter for each job.
+#
+# The launcher service is a separate process, started by the server
+# with the TE interpreter, that imports the TE core libraries
+# (TTCN-3 adapters, TCI/SA/PA) and all the probe and codec plugins once,
+# then forks a pool of workers. The workers receive the TE command lines
+# over a local socket, and fork a process per TE, that runs the TE egg
+# as python would, with everything already imported.
+#
+# For each TE, the launcher sends back its pid once started, then its
+# exit status (as returned by waitpid()) once completed.
+#
+# The TE egg contains its own copies of the core libraries (and possibly
+# modules named as plugins): the TE only keeps the modules imported by the
+# launcher if the egg copies are identical to them. Otherwise, they are
+# all unloaded, and the TE imports its modules as a new interpreter would.
+# The state the launcher process shares with all its TEs (random module
+# state, logging configuration set up by the unloaded modules) is reset
+# in each TE, too.
+#
+# This module provides both the server-side interface (TeLauncher) and the
+# launcher service (main()).
+##
+
+import cPickle as pickle
+import errno
+import hashlib
+import imp
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+import traceback
+import zipfile
+import zipimport
+
+
+def getLogger():
+	return logging.getLogger('TS.TeLauncher')
+
+
+################################################################################
+# Server-side interface
+################################################################################
+
+class LaunchedTe:
+	"""
+	A TE started by the launcher.
+	"""
+	def __init__(self, sock, pid):
+		self._socket = sock
+		self._file = sock.makefile('r')
+		self.pid = pid
+
+	def wait(self):
+		"""
+		Waits for the TE to complete.
+
+		@rtype: integer
+		@returns: the TE exit status, as returned by os.waitpid()
+		"""
+		try:
+			line = self._file.readline()
+		finally:
+			self._file.close()
+			self._socket.close()
+		if not line:
+			raise Exception("Lost connection with the TE launcher")
+		return int(line)
+
+
+class TeLauncher:
+	"""
+	Starts, stops and submits TEs to the launcher service.
+	"""
+	def __init__(self, socketFilename, interpreter, env, poolSize, modules, probePaths, codecPaths):
+		"""
+		@type  socketFilename: string
+		@param socketFilename: the Unix socket the launcher listens on
+		@type  interpreter: string
+		@param interpreter: the Python interpreter to run the launcher with
+		@type  env: dict[string] of strings
+		@param env: the environment variables for the launcher and its TEs,
+		in addition to the current process ones
+		@type  poolSize: integer
+		@param poolSize: the number of pre-forked workers
+		@type  modules: list of strings
+		@param modules: the (adapter) modules to import in the launcher
+		@type  probePaths: list of strings
+		@param probePaths: the paths to import probe plugins from
+		@type  codecPaths: list of strings
+		@param codecPaths: the paths to import codec plugins from
+		"""
+		self._socketFilename = socketFilename
+		self._interpreter = interpreter
+		self._env = env
+		self._poolSize = poolSize
+		self._modules = modules
+		self._probePaths = probePaths
+		self._codecPaths = codecPaths
+		self._process = None
+
+	def start(self):
+		import subprocess
+		args = [ self._interpreter, os.path.splitext(os.path.abspath(__file__))[0] + '.py',
+			'--socket', self._socketFilename,
+			'--pool-size', str(self._poolSize),
+			'--modules', ','.join(self._modules),
+			'--probe-paths', ','.join(self._probePaths),
+			'--codec-paths', ','.join(self._codecPaths) ]
+		env = dict(os.environ)
+		env.update(self._env)
+		getLogger().info("Starting TE launcher: %s" % ' '.join(args))
+		self._process = subprocess.Popen(args, env = env, close_fds = True)
+
+	def stop(self):
+		if self._process:
+			getLogger().info("Stopping TE launcher...")
+			try:
+				os.kill(self._process.pid, signal.SIGTERM)
+				self._process.wait()
+			except Exception, e:
+				getLogger().warning("Unable to stop the TE launcher: %s" % str(e))
+			self._process = None
+
+	def launch(self, executable, args, env, cwd):
+		"""
+		Starts a TE, the same way as os.execve(executable, args, env)
+		from cwd would.
+
+		@type  executable: string
+		@param executable: the Python interpreter
+		@type  args: list of strings
+		@param args: the interpreter arguments, starting with the
+		             interpreter itself, then the TE egg
+		@type  env: dict[string] of strings
+		@param env: the TE environment variables
+		@type  cwd: string
+		@param cwd: the TE working directory
+
+		@raises Exception: if the TE cannot be started by the launcher, typically
+		because it is not running, or was started with another interpreter or
+		environment (configuration changed since then).
+
+		@rtype: LaunchedTe
+		@returns: the started TE
+		"""
+		if executable != self._interpreter or env != self._env:
+			raise Exception("TE launcher started with another interpreter or environment")
+		if self._process is None or self._process.poll() is not None:
+			raise Exception("TE launcher not running")
+
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(self._socketFilename)
+			sock.sendall(pickle.dumps(dict(args = args, cwd = cwd)))
+			sock.shutdown(socket.SHUT_WR)
+			line = sock.makefile('r').readline()
+			if not line:
+				raise Exception("no TE pid received")
+			return LaunchedTe(sock, int(line))
+		except:
+			sock.close()
+			raise
+
+
+################################################################################
+# Launcher service
+################################################################################
+
+# Core, adapter and plugin modules imported by the launcher,
+# indexed by name: (module, digest of its source file)
+_PrewarmedModules = {}
+
+# The logging configuration before pre-warming:
+# (root handlers, root level, logger names)
+_LoggingState = None
+
+def _getDigest(source):
+	return hashlib.sha1(source).hexdigest()
+
+def _scanPlugins(paths):
+	"""
+	Imports all the plugins from paths, as the TE does.
+	"""
+	for path in paths:
+		if not path in sys.path:
+			sys.path.append(path)
+	for path in paths:
+		try:
+			for m in os.listdir(path):
+				if m.startswith('.') or m.startswith('__init__') or not (os.path.isdir(path + '/' + m) or m.endswith('.py')):
+					continue
+				if m.endswith('.py'):
+					m = m[:-3]
+				try:
+					__import__(m)
+				except Exception, e:
+					# The TE will report it on its own import attempt
+					pass
+		except Exception, e:
+			sys.stderr.write("TE launcher: unable to scan plugin path %s: %s\n" % (path, str(e)))
+
+def _recordPrewarmedModules(previousModules, paths):
+	"""
+	Records the modules imported since previousModules from
+	the paths (not the standard library ones), with the digest of their
+	source files.
+	"""
+	paths = [ os.path.join(os.path.abspath(x), '') for x in paths if x ]
+	for (name, module) in sys.modules.items():
+		if name in previousModules or module is None or not getattr(module, '__file__', None):
+			continue
+		filename = os.path.abspath(module.__file__)
+		if not [ x for x in paths if filename.startswith(x) ]:
+			continue
+		if filename[-4:] in ('.pyc', '.pyo'):
+			filename = filename[:-1]
+		try:
+			f = open(filename, 'rb')
+			try:
+				digest = _getDigest(f.read())
+			finally:
+				f.close()
+		except Exception:
+			# Not a python source (extension module...): always reloaded
+			# if the egg contains a module with the same name
+			digest = None
+		_PrewarmedModules[name] = (module, digest)
+
+def _saveLoggingState():
+	global _LoggingState
+	_LoggingState = (logging.root.handlers[:], logging.root.level, set(logging.Logger.manager.loggerDict.keys()))
+
+def _restoreLoggingState():
+	"""
+	Removes the loggers and the root handlers created by the modules
+	imported while pre-warming, that the TE imports again once unloaded.
+	"""
+	if _LoggingState is None:
+		return
+	(handlers, level, names) = _LoggingState
+	for handler in logging.root.handlers:
+		if not handler in handlers:
+			try:
+				handler.close()
+			except Exception:
+				pass
+	logging.root.handlers = handlers[:]
+	logging.root.setLevel(level)
+	for name in logging.Logger.manager.loggerDict.keys():
+		if not name in names:
+			del logging.Logger.manager.loggerDict[name]
+
+def _getModuleName(filename):
+	"""
+	Returns the name of the module an egg file provides, or None.
+	"""
+	parts = filename.split('/')
+	if parts[-1] == '__init__.py':
+		parts = parts[:-1]
+	elif parts[-1].endswith('.py'):
+		parts[-1] = parts[-1][:-3]
+	else:
+		name = parts[-1].split('.')[0]
+		if not name or parts[-1].endswith('.pyc') or parts[-1].endswith('.pyo'):
+			return None
+		# Extension modules, data files: compared by name only
+		parts[-1] = name
+	return '.'.join(parts) or None
+
+def _unloadPrewarmedModules(egg):
+	"""
+	Unloads all the modules imported by the launcher if any module contained
+	in the egg differs from the one the launcher imported with the same
+	name (other core library version, ATS module named as a plugin...),
+	so that the TE imports its own modules, as if nothing had been
+	imported yet.
+	
+	The modules that depend on the shadowed ones (the plugins register to
+	the core libraries) are unloaded, too: unloading only the shadowed ones
+	would mix modules from the egg and from the launcher, and so is the
+	logging configuration they set up when imported.
+	"""
+	eggFile = zipfile.ZipFile(egg)
+	try:
+		shadowed = False
+		for filename in eggFile.namelist():
+			name = _getModuleName(filename)
+			if not name in _PrewarmedModules:
+				continue
+			digest = _PrewarmedModules[name][1]
+			if digest is None or not filename.endswith('.py') or _getDigest(eggFile.read(filename)) != digest:
+				shadowed = True
+				break
+	finally:
+		eggFile.close()
+	if not shadowed:
+		return
+	for (name, (module, digest)) in _PrewarmedModules.items():
+		if sys.modules.get(name) is module:
+			del sys.modules[name]
+	_restoreLoggingState()
+
+def _getExitStatus(code):
+	"""
+	Converts a SystemExit code to a process exit status, as python does.
+	"""
+	if code is None:
+		return 0
+	if isinstance(code, (int, long)):
+		return code
+	sys.stderr.write("%s\n" % code)
+	return 1
+
+def _runTe(request):
+	"""
+	Runs a TE egg in the current process, as
+	'python ats.egg options' would do.
+	Never returns.
+	"""
+	status = 1
+	# Keeps the launcher main module alive when replaced by the TE one
+	launcherModule = sys.modules.get('__main__')
+	try:
+		for sig in [ signal.SIGINT, signal.SIGTERM, signal.SIGCHLD ]:
+			signal.signal(sig, signal.SIG_DFL)
+		os.chdir(request['cwd'])
+		egg = request['args'][1]
+		sys.argv = request['args'][1:]
+		# The egg replaces the launcher as the script
+		sys.path[0] = egg
+		# The random module was imported and seeded by the launcher:
+		# all its TEs would generate the same sequences
+		random.seed()
+		_unloadPrewarmedModules(egg)
+		importer = zipimport.zipimporter(egg)
+		code = importer.get_code('__main__')
+		module = imp.new_module('__main__')
+		module.__file__ = '%s/__main__.py' % egg
+		module.__loader__ = importer
+		sys.modules['__main__'] = module
+		try:
+			exec code in module.__dict__
+			status = 0
+		except SystemExit, e:
+			status = _getExitStatus(e.code)
+	except SystemExit, e:
+		status = _getExitStatus(e.code)
+	except:
+		traceback.print_exc()
+
+	# What the interpreter does on exit
+	try:
+		import threading
+		threading._shutdown()
+	except:
+		pass
+	try:
+		if hasattr(sys, 'exitfunc'):
+			sys.exitfunc()
+	except:
+		traceback.print_exc()
+	try:
+		sys.stdout.flush()
+		sys.stderr.flush()
+	except:
+		pass
+	os._exit(status & 0xff)
+
+def _handleRequest(conn, request):
+	"""
+	Forks the TE process, sends its pid, waits for it to complete, then sends
+	its exit status.
+	Never returns.
+	"""
+	try:
+		signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+		pid = os.fork()
+		if not pid:
+			conn.close()
+			_runTe(request)
+		conn.sendall('%d\n' % pid)
+		while True:
+			try:
+				(_, status) = os.waitpid(pid, 0)
+				break
+			except OSError, e:
+				if e.errno != errno.EINTR:
+					raise
+		conn.sendall('%d\n' % status)
+	except Exception, e:
+		sys.stderr.write("TE launcher: unable to run TE: %s\n" % str(e))
+	os._exit(0)
+
+def _receive(conn):
+	data = []
+	while True:
+		d = conn.recv(65536)
+		if not d:
+			break
+		data.append(d)
+	return pickle.loads(''.join(data))
+
+def _work(listeningSocket):
+	"""
+	Worker main loop: accepts TE requests, and forks a process
+	to handle each of them.
+	Never returns.
+	"""
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	# Auto-reaps the request handling processes
+	signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+	while True:
+		try:
+			(conn, _) = listeningSocket.accept()
+		except socket.error, e:
+			if e.args[0] == errno.EINTR:
+				continue
+			os._exit(1)
+		try:
+			request = _receive(conn)
+			pid = os.fork()
+			if not pid:
+				listeningSocket.close()
+				_handleRequest(conn, request)
+		except Exception, e:
+			sys.stderr.write("TE launcher: invalid request: %s\n" % str(e))
+		conn.close()
+
+def serve(socketFilename, poolSize, modules, probePaths, codecPaths):
+	"""
+	Launcher service main loop: imports everything a TE
+	needs, then maintains the pool of workers, until terminated.
+	"""
+	if os.path.exists(socketFilename):
+		os.unlink(socketFilename)
+	listeningSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	listeningSocket.bind(socketFilename)
+	listeningSocket.listen(socket.SOMAXCONN)
+
+	# Ctrl+C on the server is not for us
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	stopped = []
+	def onTerminate(sig, frame):
+		stopped.append(True)
+	signal.signal(signal.SIGTERM, onTerminate)
+
+	# Pre-warming
+	previousModules = sys.modules.keys()
+	_saveLoggingState()
+	for m in [ 'TestermanTCI', 'TestermanSA', 'TestermanPA' ] + modules:
+		try:
+			__import__(m)
+		except Exception, e:
+			sys.stderr.write("TE launcher: unable to import %s: %s\n" % (m, str(e)))
+	_scanPlugins(probePaths)
+	_scanPlugins(codecPaths)
+	# Not from the standard library
+	_recordPrewarmedModules(set(previousModules), [ os.path.dirname(os.path.abspath(__file__)) ] + os.environ.get('PYTHONPATH', '').split(':') + probePaths + codecPaths)
+
+	parentPid = os.getppid()
+	workers = []
+	while not stopped and os.getppid() == parentPid:
+		while len(workers) < poolSize:
+			pid = os.fork()
+			if not pid:
+				_work(listeningSocket)
+			workers.append(pid)
+		# Respawns the workers that died
+		for pid in workers[:]:
+			try:
+				if os.waitpid(pid, os.WNOHANG)[0]:
+					workers.remove(pid)
+			except OSError:
+				workers.remove(pid)
+		time.sleep(0.5)
+
+	for pid in workers:
+		try:
+			os.kill(pid, signal.SIGTERM)
+			os.waitpid(pid, 0)
+		except OSError:
+			pass
+	listeningSocket.close()
+	try:
+		os.unlink(socketFilename)
+	except OSError:
+		pass
+
+def main():
+	import optparse
+	parser = optparse.OptionParser()
+	parser.add_option("--socket", dest = "socketFilename", metavar = "FILE", help = "listen on Unix socket FILE")
+	parser.add_option("--pool-size", dest = "poolSize", metavar = "N", type = "int", default = 2, help = "number of pre-forked workers (default: %default)")
+	parser.add_option("--modules", dest = "modules", metavar = "MODULE[,MODULE]", default = "", help = "additional modules to import")
+	parser.add_option("--probe-paths", dest = "probePaths", metavar = "PATH[,PATH]", default = "", help = "probe plugins paths")
+	parser.add_option("--codec-paths", dest = "codecPaths", metavar = "PATH[,PATH]", default = "", help = "codec plugins paths")
+	(options, args) = parser.parse_args()
+	if not options.socketFilename:
+		parser.error("a socket filename is required")
+	split = lambda x: [ y for y in x.split(',') if y ]
+	serve(options.socketFilename, options.poolSize, split(options.modules), split(options.probePaths), split(options.codecPaths))
+
+
+################################################################################
+# Main
+################################################################################
+
+TheTeLauncher = None
+
+def instance():
+	"""
+	@rtype: TeLauncher, or None
+	@returns: the TE launcher, or None if disabled
+	"""
+	return TheTeLauncher
+
+def initialize():
+	"""
+	Starts the TE launcher service, unless testerman.te.launcher.pool_size is 0.
+	Its socket is ${testerman.var_root}/telauncher.sock, or in a
+	temporary directory without var root.
+	"""
+	global TheTeLauncher
+	import ConfigManager
+	import TEFactory
+	import tempfile
+	cm = ConfigManager.instance()
+
+	poolSize = cm.get("testerman.te.launcher.pool_size")
+	if poolSize <= 0:
+		getLogger().info("TE launcher disabled")
+		return
+	if cm.get("testerman.var_root"):
+		socketFilename = cm.get("testerman.var_root") + "/telauncher.sock"
+	else:
+		socketFilename = tempfile.mkdtemp() + "/telauncher.sock"
+
+	# The language API adapters
+	modules = [ cm.get("testerman.te.python.ttcn3module") ]
+	for key in cm.getKeys():
+		if key.startswith("testerman.te.python.module.api.") and not cm.get(key) in modules:
+			modules.append(cm.get(key))
+
+	launcher = TeLauncher(socketFilename = socketFilename,
+		interpreter = cm.get("testerman.te.python.interpreter"),
+		env = TEFactory.getEnvironment(),
+		poolSize = poolSize, modules = modules,
+		probePaths = cm.get("testerman.te.probe_paths"), codecPaths = cm.get("testerman.te.codec_paths"))
+	try:
+		launcher.start()
+	except Exception, e:
+		getLogger().warning("Unable to start the TE launcher, TEs will be forked: %s" % str(e))
+		return
+	TheTeLauncher = launcher
+
+def finalize():
+	if TheTeLauncher:
+		TheTeLauncher.stop()
+
+
+if __name__ == "__main__":
+	main()
@@ -22,6 +22,7 @@ import TestermanMessages as Messages
 import TestermanNodes as Nodes
 
 import threading
+import time
 
 class TaccException(Exception): pass
 
@@ -47,10 +48,16 @@ class IaClient(Nodes.ConnectingNode):
 		self.receivedNotificationCallback = None # on TRI-ENQUEUE-MSG
 		self.logNotificationCallback = None # on LOG
 		self.probeNotificationCallback = None # on PROBE
+		self.triSendErrorCallback = None # on pipelined TRI-SEND error
 		self._logger = DummyLogger()
 		self._subscriptions =[]
 		self._mutex = threading.RLock()
 		self._connected = False
+		# Pipelined TRI-SENDs management
+		self._pendingTriSends = {} # probeUri, indexed by transactionId
+		self._pendingTriSendCounts = {} # number of unacknowledged TRI-SENDs, indexed by probeUri
+		self._triSendErrors = {} # first unreported TRI-SEND error, indexed by probeUri
+		self._triSendCondition = threading.Condition(self._mutex)
 	
 	def lock(self):
 		self._mutex.acquire()
@@ -89,6 +96,12 @@ class IaClient(Nodes.ConnectingNode):
 	def onDisconnection(self, channel):
 		self.lock()
 		self._connected = False
+		# Pending pipelined TRI-SENDs won't be acknowledged anymore
+		for probeUri in self._pendingTriSendCounts.keys():
+			self._setTriSendError(probeUri, TaccException("Connection to the TACS lost while sending messages through %s" % probeUri))
+		self._pendingTriSends = {}
+		self._pendingTriSendCounts = {}
+		self._triSendCondition.notifyAll()
 		self.unlock()
 	
 	def isConnected(self):
@@ -111,8 +124,43 @@ class IaClient(Nodes.ConnectingNode):
 			self.probeNotificationCallback(notification)
 	
 	def onResponse(self, channel, transactionId, response):
-		self.getLogger().warning("Unexpected asynchronous response received, discarding.")
-		
+		self.lock()
+		probeUri = self._pendingTriSends.pop(transactionId, None)
+		if probeUri is None:
+			self.unlock()
+			self.getLogger().warning("Unexpected asynchronous response received, discarding.")
+			return
+		# Response to a pipelined TRI-SEND
+		count = self._pendingTriSendCounts.get(probeUri, 1) - 1
+		if count > 0:
+			self._pendingTriSendCounts[probeUri] = count
+		elif self._pendingTriSendCounts.has_key(probeUri):
+			del self._pendingTriSendCounts[probeUri]
+		if response.getStatusCode() != 200:
+			self._setTriSendError(probeUri, TaccException("Error while sending a message through %s:\n%d %s\nDetailled error:\n%s" % (probeUri, response.getStatusCode(), response.getReasonPhrase(), response.getBody())))
+		self._triSendCondition.notifyAll()
+		self.unlock()
+	
+	def _setTriSendError(self, probeUri, error):
+		"""
+		Keeps the first error for a probe, until reported.
+		To call with the lock held.
+		"""
+		if not self._triSendErrors.has_key(probeUri):
+			self._triSendErrors[probeUri] = error
+			if self.triSendErrorCallback:
+				try:
+					self.triSendErrorCallback(probeUri, error)
+				except Exception, e:
+					self.getLogger().warning("Exception in TRI-SEND error callback: %s" % str(e))
+	
+	def _raiseTriSendError(self, probeUri):
+		self.lock()
+		error = self._triSendErrors.pop(probeUri, None)
+		self.unlock()
+		if error:
+			raise error
+
 	def setLogNotificationCallback(self, cb):
 		self.logNotificationCallback = cb
 
@@ -122,6 +170,12 @@ class IaClient(Nodes.ConnectingNode):
 	def setProbeNotificationCallback(self, cb):
 		self.probeNotificationCallback = cb
 
+	def setTriSendErrorCallback(self, cb):
+		"""
+		cb(probeUri, exception) is called when a pipelined TRI-SEND failed.
+		"""
+		self.triSendErrorCallback = cb
+
 	# High level functions callable from an IaClient
 	# FIXME: temporarly set the default profile to PICKLE instead of CONTENT_TYPE_JSON 
 	# (binary payload encoding problems)
@@ -138,6 +192,58 @@ class IaClient(Nodes.ConnectingNode):
 				raise TaccException("Error while sending a message through %s:\n%d %s\nDetailled error:\n%s" % (probeUri, response.getStatusCode(), response.getReasonPhrase(), response.getBody()))
 		else:
 			raise TaccException("Timeout while sending a message through %s. Please check that the probe (or the hosting agent) still works and the TACS is still online." % (probeUri))
+
+	def triSendPipelined(self, probeUri, message, sutAddress, profile = Messages.Message.CONTENT_TYPE_PYTHON_PICKLE):
+		"""
+		Sends a TRI-SEND request without waiting for its response.
+		
+		Requests are sent over a single Ia connection and processed in order
+		by the TACS, so the message ordering is kept for a probe.
+		
+		Errors are reported asynchronously: the first error for a probe is
+		passed to the TRI-SEND error callback, if any, and raised by the next
+		triSendPipelined() or flushTriSend() call for this probe.
+		
+		@throws: TaccException if a previous pipelined TRI-SEND through this probe failed.
+		"""
+		self._raiseTriSendError(probeUri)
+		request = Messages.Request("TRI-SEND", probeUri, "Ia", "1.0")
+		request.setHeader("SUT-Address", sutAddress)
+		request.setApplicationBody(message, profile)
+		# The response may arrive before sendRequest() returns:
+		# keep the lock so that onResponse() finds the transaction.
+		self.lock()
+		try:
+			transactionId = self.sendRequest(0, request)
+			self._pendingTriSends[transactionId] = probeUri
+			self._pendingTriSendCounts[probeUri] = self._pendingTriSendCounts.get(probeUri, 0) + 1
+		finally:
+			self.unlock()
+		return True
+	
+	def flushTriSend(self, probeUri, timeout = 10.0):
+		"""
+		Waits until all pipelined TRI-SENDs through a probe have been acknowledged.
+		
+		@throws: TaccException if one of them failed, or on timeout.
+		"""
+		deadline = time.time() + timeout
+		self.lock()
+		while self._pendingTriSendCounts.get(probeUri):
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				break
+			self._triSendCondition.wait(remaining)
+		pending = self._pendingTriSendCounts.pop(probeUri, 0)
+		if pending:
+			# Late responses will be discarded
+			for transactionId, uri in self._pendingTriSends.items():
+				if uri == probeUri:
+					del self._pendingTriSends[transactionId]
+		self.unlock()
+		self._raiseTriSendError(probeUri)
+		if pending:
+			raise TaccException("Timeout while waiting for %d pipelined message(s) to be sent through %s. Please check that the probe (or the hosting agent) still works and the TACS is still online." % (pending, probeUri))
 	
 	def triSAReset(self, probeUri):
 		request = Messages.Request("TRI-SA-RESET", probeUri, "Ia", "1.0")
@@ -374,6 +480,7 @@ class DisabledIaClient:
 	def setLogNotificationCallback(self, cb): pass
 	def setReceivedNotificationCallback(self, cb): pass
 	def setProbeNotificationCallback(self, cb): pass
+	def setTriSendErrorCallback(self, cb): pass
 	def stop(self): pass
 	def finalize(self): pass
 	def __getattr__(self, name):
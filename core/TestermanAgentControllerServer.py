@@ -117,7 +117,7 @@ class XaServer(Nodes.ListeningNode):
 	def __init__(self, controller, xaAddress):
 		Nodes.ListeningNode.__init__(self, "TACS/Xa", "XaServer/%s" % Versions.getAgentControllerVersion())
 		self._controller = controller
-		self.initialize(xaAddress)
+		self.initialize(xaAddress, transport = cm.get("tacs.nodes.transport"), ioThreads = cm.get("tacs.nodes.io_threads"))
 	
 	def getLogger(self):
 		return logging.getLogger('TACS.XaServer')
@@ -338,7 +338,7 @@ class IaServer(Nodes.ListeningNode):
 	def __init__(self, controller, iaAddress):
 		Nodes.ListeningNode.__init__(self, "TACS/Ia", "IaServer/%s" % Versions.getAgentControllerVersion())
 		self._controller = controller
-		self.initialize(iaAddress)
+		self.initialize(iaAddress, transport = cm.get("tacs.nodes.transport"), ioThreads = cm.get("tacs.nodes.io_threads"))
 	
 	def getLogger(self):
 		return logging.getLogger('TACS.IaServer')
@@ -1032,6 +1032,8 @@ def main():
 	cm.register("tacs.debug", False)
 	cm.register("tacs.log_filename", "", xform = expandPath)
 	cm.register("tacs.pid_filename", "", xform = expandPath)
+	cm.register("tacs.nodes.transport", "threaded") # Xa/Ia servers: threaded (one thread per client) or reactor (epoll-based)
+	cm.register("tacs.nodes.io_threads", 1) # number of reactor I/O threads per listening interface, in reactor mode
 	cm.register("testerman.document_root", "/tmp", xform = expandPath, dynamic = True)
 	cm.register("testerman.var_root", "", xform = expandPath)
 
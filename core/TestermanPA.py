@@ -14,20 +14,24 @@
 
 ##
 # -*- coding: utf-8 -*-
-# First implementation:
-# Using Threading.Timer.
-# Not scalable (max ~ 30 timers).
-#
 # Testerman TRI implementation - Platform Interface part.
 #
+# Timers are managed by a single scheduler thread, waiting for the next
+# expiry in a heap of running timers (O(log n) start, O(1) stop).
+#
 ##
 
 
 import TestermanTCI
 import TestermanTTCN3 as Testerman
 
+import errno
+import heapq
+import itertools
 import threading
+import select
 import signal
+import socket
 import os
 import re
 import glob
@@ -37,14 +41,22 @@ import time
 TRI_OK = 1
 TRI_Error = 0
 
-def log(message):
-	TestermanTCI.logInternal("PA: %s" % str(message))
+def log(message, *args):
+	"""
+	message % args is only formatted if internal logs are enabled.
+	"""
+	if args:
+		TestermanTCI.logInternal("PA: " + message, *args)
+	else:
+		TestermanTCI.logInternal("PA: %s", message)
 
 
 
 PaMutex = None
 
-CurrentTimers = {} # { 'timer': threading.Timer, 'start': timestamp } indexed by the TE timerId
+CurrentTimers = {} # (start timestamp, sequence number) indexed by the TE timerId
+
+TheTimerScheduler = None
 
 def _lock():
 	PaMutex.acquire()
@@ -52,15 +64,121 @@ def _lock():
 def _unlock():
 	PaMutex.release()
 
-def _onTimeout(timerId):
-	_lock()
-	if not CurrentTimers.has_key(timerId):
+def _socketPair():
+	"""
+	Returns a pair of connected sockets.
+	socket.socketpair() is not available on Windows, where select()
+	only supports sockets anyway: a loopback TCP connection is used instead.
+	"""
+	if hasattr(socket, 'socketpair'):
+		return socket.socketpair()
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	try:
+		listener.bind(('127.0.0.1', 0))
+		listener.listen(1)
+		writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		writer.connect(listener.getsockname())
+		(reader, address) = listener.accept()
+	finally:
+		listener.close()
+	return (reader, writer)
+
+class TimerScheduler(threading.Thread):
+	"""
+	The thread that calls Testerman.triTimeout() when a timer expires.
+	
+	Running timers are stored in CurrentTimers, and their expiry in a
+	heap of (expiry timestamp, sequence number, timerId).
+	Stopping a timer only removes it from CurrentTimers: its heap entry
+	is discarded when popped, or when the heap is compacted.
+	The sequence number identifies a timer start, so that the heap entry
+	of a stopped then restarted timerId is not taken for the current one.
+	
+	The thread waits for the next expiry with a select() on a socket pair,
+	so that it can be woken up when an earlier timer is started.
+	"""
+	def __init__(self):
+		threading.Thread.__init__(self)
+		self.setDaemon(True)
+		self._heap = []
+		self._sequence = itertools.count()
+		self._stopped = False
+		(self._wakeUpReader, self._wakeUpWriter) = _socketPair()
+		self._wakeUpWriter.setblocking(False)
+	
+	def startTimer(self, timerId, duration):
+		"""
+		Must be called with the PA mutex held.
+		"""
+		now = time.time()
+		seq = self._sequence.next()
+		expiry = now + duration
+		CurrentTimers[timerId] = (now, seq)
+		wakeUp = not self._heap or expiry < self._heap[0][0]
+		heapq.heappush(self._heap, (expiry, seq, timerId))
+		# Too many entries for stopped timers: rebuild the heap from the running ones
+		if len(self._heap) > 2 * len(CurrentTimers) + 64:
+			self._heap = [ x for x in self._heap if CurrentTimers.get(x[2], (None, None))[1] == x[1] ]
+			heapq.heapify(self._heap)
+		if wakeUp:
+			self._wakeUp()
+	
+	def stop(self):
+		_lock()
+		self._stopped = True
+		self._wakeUp()
 		_unlock()
-		log("Timeout received on unexisting timerId. Ignoring")
-		return
-	del CurrentTimers[timerId]
-	_unlock()
-	Testerman.triTimeout(timerId)
+		self.join()
+		self._wakeUpReader.close()
+		self._wakeUpWriter.close()
+	
+	def _wakeUp(self):
+		try:
+			self._wakeUpWriter.send('w')
+		except socket.error, e:
+			# Full buffer: the thread has not woken up yet anyway
+			if not e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+				raise
+	
+	def run(self):
+		while 1:
+			expired = []
+			_lock()
+			if self._stopped:
+				_unlock()
+				break
+			# The heap may have been rebuilt by startTimer()
+			heap = self._heap
+			now = time.time()
+			while heap and heap[0][0] <= now:
+				(expiry, seq, timerId) = heapq.heappop(heap)
+				current = CurrentTimers.get(timerId)
+				if current is not None and current[1] == seq:
+					del CurrentTimers[timerId]
+					expired.append(timerId)
+			if heap:
+				timeout = heap[0][0] - now
+			else:
+				timeout = None
+			_unlock()
+			
+			if expired:
+				for timerId in expired:
+					try:
+						Testerman.triTimeout(timerId)
+					except Exception, e:
+						log("Unable to notify timeout for timerId %s: %s", timerId, e)
+				# Some time elapsed: check for new expiries before waiting
+				continue
+
+			try:
+				r, w, e = select.select([ self._wakeUpReader ], [], [], timeout)
+			except select.error, e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+			if r:
+				self._wakeUpReader.recv(4096)
 
 ################################################################################
 # tri interface: PA-provided (TE -> PA)
@@ -76,15 +194,12 @@ def triStartTimer(timerId, duration):
 	"""
 	Returns 1 (TRI_OK) or 0 (TRI_Error)
 	"""
-	log("triStartTimer(%s, duration %f)" % (str(timerId), duration))
+	log("triStartTimer(%s, duration %f)", timerId, duration)
 	
-	# We should check that timerId is not already used
+	# A timerId that is already used is restarted
 	_lock()
-	
-	t = threading.Timer(duration, lambda: _onTimeout(timerId))
-	CurrentTimers[timerId] = { 'timer': t, 'start': time.time() }
+	TheTimerScheduler.startTimer(timerId, duration)
 	_unlock()
-	t.start()
 	
 	return TRI_OK
 	
@@ -96,10 +211,7 @@ def triStopTimer(timerId):
 	if not CurrentTimers.has_key(timerId):
 		_unlock()
 		return TRI_Error
-	try:
-		CurrentTimers[timerId]['timer'].cancel()
-	except:
-		pass
+	# The scheduler will ignore its expiry
 	del CurrentTimers[timerId]
 	_unlock()
 	return TRI_OK
@@ -124,7 +236,7 @@ def triReadTimer(timerId):
 	ret = 0.0
 	_lock()
 	if CurrentTimers.has_key(timerId):
-		ret = time.time() - CurrentTimers[timerId]['start']
+		ret = time.time() - CurrentTimers[timerId][0]
 	_unlock()
 	return ret
 
@@ -210,16 +322,26 @@ def initialize():
 	Initialize the PA
 	"""
 	global PaMutex
+	global TheTimerScheduler
 
 	log("Initializating PA...")
-	PaMutex = threading.RLock()	
+	PaMutex = threading.Lock()
+	TheTimerScheduler = TimerScheduler()
+	TheTimerScheduler.start()
 	log("PA initialized")
 	
 def finalize():
 	"""
-	TODO
+	Stops the timer engine. Running timers won't expire.
 	"""
+	global TheTimerScheduler
 	log("finalizing timer engine...")
+	if TheTimerScheduler:
+		TheTimerScheduler.stop()
+		TheTimerScheduler = None
+	_lock()
+	CurrentTimers.clear()
+	_unlock()
 	log("timer engine finalized.")
 	
 
@@ -56,15 +56,26 @@ TR_OK = 1
 # The usual shortcuts
 ################################################################################
 
-def log(msg):
-	TestermanTCI.logInternal("SA: %s" % msg)
+def log(msg, *args):
+	"""
+	msg % args is only formatted if internal logs are enabled.
+	"""
+	if args:
+		TestermanTCI.logInternal("SA: " + msg, *args)
+	else:
+		TestermanTCI.logInternal("SA: %s", msg)
 
 class TliLogger:
-	def warning(self, txt): TestermanTCI.logInternal("SA: %s" % txt)
-	def error(self, txt): TestermanTCI.logInternal("SA: %s" % txt)
-	def debug(self, txt): TestermanTCI.logInternal("SA: %s" % txt)
-	def critical(self, txt): TestermanTCI.logInternal("SA: %s" % txt)
-	def info(self, txt): TestermanTCI.logInternal("SA: %s" % txt)
+	"""
+	logging.Logger-like interface for probes, including the deferred
+	formatting of txt % args and isEnabledFor().
+	"""
+	def warning(self, txt, *args): log(txt, *args)
+	def error(self, txt, *args): log(txt, *args)
+	def debug(self, txt, *args): log(txt, *args)
+	def critical(self, txt, *args): log(txt, *args)
+	def info(self, txt, *args): log(txt, *args)
+	def isEnabledFor(self, level): return TestermanTCI.isLogLevelEnabled('internal')
 
 
 ################################################################################
@@ -89,6 +100,36 @@ def registerTriEnqueueMsgFunction(func):
 
 class TestermanSAException(Exception): pass
 
+
+################################################################################
+# TRI-SEND modes (remote probes only)
+################################################################################
+
+# Each TRI-SEND waits for the probe acknowledgement, errors are raised immediately
+TRI_SEND_SYNCHRONOUS = 'synchronous'
+# TRI-SENDs are pipelined towards the TACS without waiting for their acknowledgement.
+# Errors are reported asynchronously: logged as soon as they are known,
+# and raised on the next send through the same probe.
+TRI_SEND_PIPELINED = 'pipelined'
+
+_DefaultTriSendMode = TRI_SEND_SYNCHRONOUS
+
+def _checkTriSendMode(mode):
+	if not mode in [ TRI_SEND_SYNCHRONOUS, TRI_SEND_PIPELINED ]:
+		raise TestermanSAException("Invalid TRI-SEND mode '%s' (expected: %s or %s)" % (mode, TRI_SEND_SYNCHRONOUS, TRI_SEND_PIPELINED))
+
+def setDefaultTriSendMode(mode):
+	"""
+	Sets the TRI-SEND mode for remote probes whose binding
+	does not set one explicitly.
+	"""
+	global _DefaultTriSendMode
+	_checkTriSendMode(mode)
+	_DefaultTriSendMode = mode
+
+def getDefaultTriSendMode():
+	return _DefaultTriSendMode
+
 ################################################################################
 # The TRI interface - SA Provided
 ################################################################################
@@ -108,7 +149,7 @@ def triSAReset():
 		try:
 			probe.onTriSAReset()
 		except Exception, e:
-			log("triSAReset: error on probe %s during onTriSAReset(): %s" % (probe.getUri(), str(e)))
+			log("triSAReset: error on probe %s during onTriSAReset(): %s", probe.getUri(), e)
 		if probe.isRemote():
 			# Actually, we sould only do this on probes that were actually locked, i.e.
 			# not necessarely all of them if we stop our testcase because we were not able
@@ -143,7 +184,7 @@ def triExecuteTestCase(testCaseId, tsiPortList):
 			try:
 				probe.onTriExecuteTestCase()
 			except Exception, e:
-				log("triExecuteTestCase: error on probe %s onTriExecuteTestCase(): %s" % (probe.getUri(), str(e)))
+				log("triExecuteTestCase: error on probe %s onTriExecuteTestCase(): %s", probe.getUri(), e)
 		else:
 			# No implementation available
 			# TODO: provides a default impl ?
@@ -221,7 +262,7 @@ def triMap(compPortId, tsiPortId):
 	currentMappingCount += 1
 	TsiPortMappings[tsiPortId] = currentMappingCount
 	
-	log("triMap: %s mapping OK, existing binding" % tsiPortId)
+	log("triMap: %s mapping OK, existing binding", tsiPortId)
 	return TR_OK
 
 def triUnmap(compPortId, tsiPortId):
@@ -246,10 +287,10 @@ def triUnmap(compPortId, tsiPortId):
 			probe.onTriUnmap()
 		except:
 			pass
-		log("triMap: %s unmapping OK, no more other mapping" % tsiPortId)
+		log("triMap: %s unmapping OK, no more other mapping", tsiPortId)
 	else:
 		TsiPortMappings[tsiPortId] = currentMappingCount
-		log("triMap: %s unmapping OK, remaining mapping: %d" % (tsiPortId, currentMappingCount))
+		log("triMap: %s unmapping OK, remaining mapping: %d", tsiPortId, currentMappingCount)
 		
 	return TR_OK
 
@@ -266,6 +307,7 @@ def initialize(tacsAddress):
 	TACC.initialize("TE", tacsAddress)
 	TACC.instance().setReceivedNotificationCallback(onTriEnqueueMsgNotification)
 	TACC.instance().setLogNotificationCallback(onLogNotification)
+	TACC.instance().setTriSendErrorCallback(onTriSendError)
 
 def finalize():
 	log("finalizing...")
@@ -308,7 +350,14 @@ def onLogNotification(probeUri, logClass, logInfo):
 			TestermanTCI.logSystemReceived(tsiPort = probeUri, label = label, payload = payload, sutAddress = sutAddress)
 
 	except Exception, e:
-		log("Exception in onLogNotification: %s" % str(e))
+		log("Exception in onLogNotification: %s", e)
+
+def onTriSendError(probeUri, error):
+	"""
+	Called when a pipelined TRI-SEND failed.
+	The error will also be raised on the next send through this probe.
+	"""
+	TestermanTCI.logUser("Unable to send a message through %s (pipelined TRI-SEND): %s" % (probeUri, str(error)))
 
 def onTriEnqueueMsgNotification(probeUri, message, sutAddress):
 	"""
@@ -321,7 +370,7 @@ def onTriEnqueueMsgNotification(probeUri, message, sutAddress):
 			probeAdapter.triEnqueueMsg(message, sutAddress)
 
 	except Exception, e:
-		log("Exception in onTriEnqueueMsgNotification: %s" % str(e))
+		log("Exception in onTriEnqueueMsgNotification: %s", e)
 
 ################################################################################
 # Test Adapters configuration management (bindings)
@@ -357,7 +406,7 @@ class TestAdapterConfiguration(object):
 	def _declareBinding(self, tsiPort, uri, type_, **kwargs):
 		if self._declaredBindings.has_key(tsiPort):
 			raise TestermanSAException("Test system interface port %s is already bound to a Test Adapter." % tsiPort)
-		log("Declaring binding: test adapter %s for tsiPort %s..." % (uri, tsiPort))
+		log("Declaring binding: test adapter %s for tsiPort %s...", uri, tsiPort)
 		transient = False
 		u = Messages.Uri(uri)
 		if u.getUser() and u.getUser() == '_': # Wildcard for automatic, transient probe naming
@@ -365,7 +414,17 @@ class TestAdapterConfiguration(object):
 			transient = True
 			uri = str(u)
 
-		self._declaredBindings[tsiPort] = { 'uri': uri, 'properties': kwargs, 'type': type_, 'transient': transient }
+		self._declaredBindings[tsiPort] = { 'uri': uri, 'properties': kwargs, 'type': type_, 'transient': transient, 'triSendMode': None }
+	
+	def setTriSendMode(self, tsiPort, mode):
+		"""
+		Sets the TRI-SEND mode for the probe bound to tsiPort,
+		overriding the default one.
+		"""
+		if not self._declaredBindings.has_key(tsiPort):
+			raise TestermanSAException("Test system interface port %s is not bound to any Test Adapter." % tsiPort)
+		_checkTriSendMode(mode)
+		self._declaredBindings[tsiPort]['triSendMode'] = mode
 	
 	def _install(self):
 		"""
@@ -377,18 +436,19 @@ class TestAdapterConfiguration(object):
 		if we cannot autodeploy it.
 		"""
 		for tsiPort, binding in self._declaredBindings.items():
-			log("Installing binding: test adapter %s for tsiPort %s..." % (binding['uri'], tsiPort))
+			log("Installing binding: test adapter %s for tsiPort %s...", binding['uri'], tsiPort)
 			probe = createProbe(binding['uri'], binding['type'], binding['transient'])
 
 			for name, value in binding['properties'].items():
-				log(u"Setting property %s to %s for test adapter %s..." % (name, unicode(value), probe.getUri()))
+				log(u"Setting property %s to %s for test adapter %s...", name, unicode(value), probe.getUri())
 				probe.setProperty(name, value)
+			probe.setTriSendMode(binding['triSendMode'])
 			# Declare the binding in the current TTCN3 world
 			bind(tsiPort, probe)
 
 	def _uninstall(self):
 		for tsiPort, binding in self._declaredBindings.items():
-			log("Uninstalling binding: test adapter %s for tsiPort %s..." % (binding['uri'], tsiPort))
+			log("Uninstalling binding: test adapter %s for tsiPort %s...", binding['uri'], tsiPort)
 			unbind(tsiPort)				
 
 def bind(tsiPortId, probe):
@@ -450,6 +510,7 @@ class ProbeAdapter(ProbeImplementationManager.IProbeImplementationAdapter):
 		self._tsiPortId = None
 		self._properties = {}
 		self._transient = False
+		self._triSendMode = None
 
 	##
 	# For Probe manager
@@ -460,6 +521,16 @@ class ProbeAdapter(ProbeImplementationManager.IProbeImplementationAdapter):
 	def setTransient(self, transient):
 		self._transient = transient
 	
+	def setTriSendMode(self, mode):
+		"""
+		None to use the default mode.
+		Only meaningful for remote probes.
+		"""
+		self._triSendMode = mode
+	
+	def getTriSendMode(self):
+		return self._triSendMode or _DefaultTriSendMode
+	
 	def unbind(self):
 		pass
 
@@ -617,16 +688,33 @@ class RemoteProbeAdapter(ProbeAdapter):
 		TACC.instance().triExecuteTestCase(self.getUri(), self._properties)
 	
 	def onTriSAReset(self):
-		TACC.instance().triSAReset(self.getUri())
+		try:
+			self._flushTriSend()
+		finally:
+			TACC.instance().triSAReset(self.getUri())
 
 	def onTriMap(self):
 		TACC.instance().triMap(self.getUri())
 
 	def onTriUnmap(self):
-		TACC.instance().triUnmap(self.getUri())
+		try:
+			self._flushTriSend()
+		finally:
+			TACC.instance().triUnmap(self.getUri())
 	
 	def onTriSend(self, message, sutAddress):
-		TACC.instance().triSend(self.getUri(), message, sutAddress)
+		if self.getTriSendMode() == TRI_SEND_PIPELINED:
+			TACC.instance().triSendPipelined(self.getUri(), message, sutAddress)
+		else:
+			TACC.instance().triSend(self.getUri(), message, sutAddress)
+	
+	def _flushTriSend(self):
+		"""
+		Makes sure all pipelined messages have been sent before
+		unmapping/resetting the probe.
+		"""
+		if self.getTriSendMode() == TRI_SEND_PIPELINED:
+			TACC.instance().flushTriSend(self.getUri())
 
 
 ################################################################################
@@ -665,8 +753,9 @@ def createProbe(uri, type_, transient = False):
 	else:
 		# We're looking for a local probe only.
 		# Search for an implementation in local plugin space
-		if ProbeImplementationManager.getProbeImplementationClasses().has_key(type_):
-			probeImplementation = ProbeImplementationManager.getProbeImplementationClasses()[type_]()
+		probeImplementationClass = ProbeImplementationManager.getProbeImplementationClass(type_)
+		if probeImplementationClass:
+			probeImplementation = probeImplementationClass()
 			adapter = LocalProbeAdapter(probeImplementation)
 
 	if adapter:
@@ -20,10 +20,12 @@
 ##
 
 import ConfigManager
+import EggCache
 import EventManager
 import FileSystemManager
 import JobManager
 import ProbeManager
+import TeLauncher
 import Tools
 import Versions
 import WebServices
@@ -313,6 +315,12 @@ def main():
 	cm.register("ts.pid_filename", "")
 	cm.register("ts.name", socket.gethostname(), dynamic = True)
 	cm.register("ts.jobscheduler.interval", 1000, dynamic = True)
+	cm.register("ts.jobscheduler.max_running_tes", 0, dynamic = True) # maximum number of concurrently running TEs, 0 for unlimited
+	cm.register("ts.nodes.transport", "threaded") # Xc/Il servers: threaded (one thread per client) or reactor (epoll-based)
+	cm.register("ts.nodes.io_threads", 1) # number of reactor I/O threads per listening interface, in reactor mode
+	cm.register("ts.log_writer.max_open_files", 64) # maximum number of job log files kept open by the TL sub-system
+	cm.register("ts.log_writer.buffer_size", 64*1024) # write buffer size per job log file, in bytes
+	cm.register("ts.log_writer.flush_interval", 1.0) # buffered log events are written at most this delay (in s) after their reception
 	cm.register("testerman.document_root", "/tmp", xform = expandPath, dynamic = True)
 	cm.register("testerman.var_root", "", xform = expandPath)
 	cm.register("testerman.web.document_root", "%s/web" % testerman_home, xform = expandPath, dynamic = False)
@@ -326,6 +334,11 @@ def main():
 	cm.register("testerman.te.python.ttcn3module", "TestermanTTCN3", dynamic = True) # TTCN3 adaptation lib (enable the easy use of previous versions to keep script compatibility)
 	cm.register("testerman.te.python.additional_pythonpath", "", dynamic = True) # Additional search paths for system-wide modules (non-userland/in repository)
 	cm.register("testerman.te.log.max_payload_size", 64*1024, dynamic = True) # the maximum dumpable payload in log (as a single value). Bigger payloads are truncated to this size, in bytes.
+	cm.register("testerman.te.log.batch.max_size", 64*1024, dynamic = True) # log events are sent by batches of at most this size, in bytes...
+	cm.register("testerman.te.log.batch.max_delay", 0.1, dynamic = True) # ... or after this delay, in s, whichever comes first. 0 disables batching (one LOG notification per event)
+	cm.register("testerman.te.egg_cache.path", "", xform = expandPath) # where prepared TE eggs are cached. Defaults to ${testerman.var_root}/eggcache
+	cm.register("testerman.te.egg_cache.max_size", 256*1024*1024, dynamic = True) # the maximum total size of the cached TE eggs, in bytes. 0 disables the cache
+	cm.register("testerman.te.launcher.pool_size", 2) # number of pre-warmed processes TEs are forked from. 0 disables the TE launcher (one interpreter started per TE)
 	cm.register("ts.webui.theme", "default", dynamic = True)
 	cm.register("wcs.webui.theme", "default", dynamic = True)
 
@@ -494,8 +507,10 @@ def main():
 	try:
 		serverThread = XmlRpcServerThread() # Ws server
 		FileSystemManager.initialize()
+		EggCache.initialize()
 		EventManager.initialize() # Xc server, Ih server [TSE:CH], Il server [TSE:TL]
 		ProbeManager.initialize() # Ia client
+		TeLauncher.initialize() # TE pre-warmed processes
 		JobManager.initialize() # Job scheduler
 		serverThread.start()
 		getLogger().info("Started.")
@@ -509,8 +524,10 @@ def main():
 
 	serverThread.stop()
 	JobManager.finalize()
+	TeLauncher.finalize()
 	ProbeManager.finalize()
 	EventManager.finalize()
+	EggCache.finalize()
 	FileSystemManager.finalize()
 	getLogger().info("Shut down.")
 	logging.shutdown()
@@ -29,6 +29,10 @@
 # Log levels are configurable from the userland. However, some levels cannot
 # be deactivated ('core', 'action').
 #
+# All log*() functions check their log level before building their XML
+# representation, so that disabled levels cost (almost) nothing.
+# Use isLogLevelEnabled() before computing costly arguments.
+#
 ##
 
 class LogLevelDocumentation:
@@ -44,6 +48,7 @@ class LogLevelDocumentation:
 	|| `internal` || `internal` || Internal/debug logs ||
 	"""
 
+import LogWriter
 import TestermanMessages as Messages
 import TestermanNodes as Nodes
 
@@ -83,7 +88,15 @@ def getBacktrace():
 ################################################################################
 
 class IlClient(Nodes.ConnectingNode):
-	def __init__(self, jobId, serverAddress, localAddress = ('', 0), logFilename = None):
+	"""
+	Sends log events to the EventManager/TL, through the Il interface.
+	
+	When batching is enabled (batchMaxDelay > 0), events are coalesced into
+	LOG-BATCH notifications, sent as soon as batchMaxSize bytes are pending,
+	or at most batchMaxDelay seconds after the first pending event.
+	Otherwise, a LOG notification is sent per event.
+	"""
+	def __init__(self, jobId, serverAddress, localAddress = ('', 0), logFilename = None, batchMaxSize = 65536, batchMaxDelay = 0.0):
 		Nodes.ConnectingNode.__init__(self, "TE job:%s" % str(jobId), "TestermanTCI/IlClient")
 		
 		self.logFilename = logFilename
@@ -92,10 +105,52 @@ class IlClient(Nodes.ConnectingNode):
 		self.localAddress = localAddress
 		self.initialize(serverAddress, self.localAddress)
 
+		self._batchMaxSize = batchMaxSize
+		self._batchMaxDelay = batchMaxDelay
+		# Pending events, as (log class, timestamp, utf-8 xml)
+		self._batch = []
+		self._batchSize = 0
+		self._batchCondition = threading.Condition(threading.Lock())
+		self._batchStopped = False
+		self._batchThread = None
+
+	def start(self):
+		Nodes.ConnectingNode.start(self)
+		if self._batchMaxDelay > 0 and not self._batchThread:
+			self._batchStopped = False
+			self._batchThread = threading.Thread(target = self._batchLoop, name = "IlClient batch flusher")
+			self._batchThread.setDaemon(True)
+			self._batchThread.start()
+	
+	def stop(self):
+		# Pending events must be sent before disconnecting
+		if self._batchThread:
+			self._batchCondition.acquire()
+			self._batchStopped = True
+			self._batchCondition.notify()
+			self._batchCondition.release()
+			self._batchThread.join()
+			self._batchThread = None
+		self.flushLogNotifications()
+		Nodes.ConnectingNode.stop(self)
+
 	def sendLogNotification(self, logClass, xml):
 		"""
 		Creates a notification and send it to the EventManager/TL, through the Il interface.
 		"""
+		if self._batchThread:
+			data = xml.encode('utf-8')
+			self._batchCondition.acquire()
+			self._batch.append((logClass, time.time(), data))
+			self._batchSize += len(data)
+			if len(self._batch) == 1:
+				# Starts the flusher's delay
+				self._batchCondition.notify()
+			if self._batchSize >= self._batchMaxSize:
+				self._flushBatch()
+			self._batchCondition.release()
+			return
+
 		try:	
 			notification = Messages.Notification("LOG", "job:%s" % self.jobId, "Il", "1.0")
 			if self.logFilename:
@@ -111,6 +166,56 @@ class IlClient(Nodes.ConnectingNode):
 			# Logging fallback to stderr
 			print >> sys.stdout, "WARNING: unable to send LOG notification: " + getBacktrace()
 
+	def flushLogNotifications(self):
+		"""
+		Sends the pending log events now, if any.
+		"""
+		self._batchCondition.acquire()
+		self._flushBatch()
+		self._batchCondition.release()
+
+	def _flushBatch(self):
+		"""
+		Sends the pending events as a LOG-BATCH notification.
+		Its body is a pickled list of (log class, timestamp, utf-8 xml) events,
+		unpacked into LOG notifications by the EventManager.
+		
+		To call with the batch condition acquired, so that batches are
+		sent in order.
+		"""
+		if not self._batch:
+			return
+		events = self._batch
+		self._batch = []
+		self._batchSize = 0
+		try:
+			notification = Messages.Notification("LOG-BATCH", "job:%s" % self.jobId, "Il", "1.0")
+			if self.logFilename:
+				notification.setHeader("Log-Filename", self.logFilename)
+			notification.setHeader("Log-Count", len(events))
+			notification.setApplicationBody(events, Messages.Message.CONTENT_TYPE_PYTHON_PICKLE)
+
+			self.sendNotification(0, notification)
+		except Exception:
+			# Logging fallback to stderr
+			print >> sys.stdout, "WARNING: unable to send LOG-BATCH notification: " + getBacktrace()
+
+	def _batchLoop(self):
+		"""
+		Flusher thread: sends the pending events batchMaxDelay seconds
+		after the first one was queued.
+		"""
+		self._batchCondition.acquire()
+		while not self._batchStopped:
+			if not self._batch:
+				self._batchCondition.wait()
+				continue
+			self._batchCondition.release()
+			time.sleep(self._batchMaxDelay)
+			self._batchCondition.acquire()
+			self._flushBatch()
+		self._batchCondition.release()
+
 ##################################################################################
 # A fake Il Client that write logs locally instead of sending log notifications
 # to a Il Server
@@ -120,6 +225,17 @@ class LocalIlClient:
 	def __init__(self, logFilename = None):
 		self.logFilename = logFilename
 		self.mutex = threading.RLock()
+		# The log file is kept open and buffered until stop()
+		self.logWriter = LogWriter.LogWriter(maxOpenFiles = 1)
+	
+	def start(self):
+		self.logWriter.start()
+	
+	def stop(self):
+		self.logWriter.stop()
+	
+	def finalize(self):
+		pass
 	
 	def sendLogNotification(self, logClass, xml):
 		"""
@@ -128,22 +244,27 @@ class LocalIlClient:
 		if not self.logFilename:
 			return
 			
-		self.mutex.acquire()
 		if self.logFilename == '-':
+			self.mutex.acquire()
 			print xml
+			self.mutex.release()
 		else:
 			try:
-				f = open(self.logFilename, 'a')
-				f.write('%s\n' % xml.encode('utf-8'))
-				f.close()
+				self.logWriter.write(self.logFilename, '%s\n' % xml.encode('utf-8'))
 			except:
 				pass
-		self.mutex.release()
 
-def initialize(logFilename, ilServerAddress = None, jobId = None, maxPayloadSize = 65535):
+def initialize(logFilename, ilServerAddress = None, jobId = None, maxPayloadSize = 65535, batchMaxSize = 65536, batchMaxDelay = 0.0):
 	"""
 	Sets module variables, starts connecting the IlClient to the TL subsystem
 	or initializes the logger for local logging only
+	
+	@type  batchMaxSize: integer
+	@param batchMaxSize: when batching log events, send them as soon as
+	this size (in bytes) is reached
+	@type  batchMaxDelay: float
+	@param batchMaxDelay: when batching log events, send them at most this
+	delay (in s) after the first one was queued. 0 disables batching.
 	"""
 	global TheIlClient
 	global MaxLogPayloadSize
@@ -151,10 +272,11 @@ def initialize(logFilename, ilServerAddress = None, jobId = None, maxPayloadSize
 	MaxLogPayloadSize = maxPayloadSize
 
 	if ilServerAddress and jobId:
-		TheIlClient = IlClient(jobId, serverAddress = ilServerAddress, logFilename = logFilename)
+		TheIlClient = IlClient(jobId, serverAddress = ilServerAddress, logFilename = logFilename, batchMaxSize = batchMaxSize, batchMaxDelay = batchMaxDelay)
 		TheIlClient.start()
 	else:
 		TheIlClient = LocalIlClient(logFilename)
+		TheIlClient.start()
 
 def finalize():
 	"""
@@ -179,6 +301,19 @@ def setExcludedLogLevels(levels):
 def getExcludedLogLevels():
 	return ExcludedLogLevels
 
+def isLogLevelEnabled(level):
+	"""
+	Cheap check, to call before building costly log arguments, for instance:
+	if isLogLevelEnabled('mismatch'):
+		logTemplateMismatch(..., template = _expandTemplate(template), ...)
+	
+	@type  level: string
+	@param level: a log level (see LogLevelDocumentation)
+	
+	@rtype: bool
+	"""
+	return not level in ExcludedLogLevels
+
 def enableDebugLogs():
 	setExcludedLogLevels([])
 
@@ -217,15 +352,28 @@ def logAtsStopped(id_, result, message = ''):
 	tliLog('core', toXml('ats-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'result': str(result) }, cgi.escape(message)))
 
 def logUser(message, tc = None):
+	if 'user' in ExcludedLogLevels:
+		return
 	if tc is None:
 		tliLog('user', toXml('user', { 'class': 'user', 'timestamp': time.time() }, cgi.escape(message)))
 	else:
 		tliLog('user', toXml('user', { 'class': 'user', 'timestamp': time.time(), 'tc': tc }, cgi.escape(message)))
 
-def logInternal(message):
+def logInternal(message, *args):
+	"""
+	If args are provided, message is a format string, only formatted
+	(message % args) when the internal level is enabled:
+	prefer logInternal("got %r", obj) to logInternal("got %r" % obj) in hot paths.
+	"""
+	if 'internal' in ExcludedLogLevels:
+		return
+	if args:
+		message = message % args
 	tliLog('internal', toXml('internal', { 'class': 'internal', 'timestamp': time.time() }, cgi.escape(message)))
 	
 def logMessageSent(fromTc, fromPort, toTc, toPort, message, address = None):
+	if 'event' in ExcludedLogLevels:
+		return
 	if not address:
 		address = ''
 	try:
@@ -244,30 +392,48 @@ def logTestcaseStopped(id_, verdict, description):
 	tliLog('core', toXml('testcase-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'verdict': verdict }, u"<![CDATA[%s]]>" % description))
 
 def logTimerStarted(id_, tc, duration):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('timer-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'duration': str(duration), 'tc': tc }))
 
 def logTimerStopped(id_, tc, runningTime):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('timer-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'running-time': str(runningTime), 'tc': tc }))
 
 def logTimerExpiry(id_, tc):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('timer-expiry', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'tc': tc }))
 
 def logTestComponentCreated(id_):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('tc-created', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
 
 def logTestComponentStarted(id_, behaviour):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('tc-started', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'behaviour': behaviour }))
 
 def logTestComponentStopped(id_, verdict, message = ''):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('tc-stopped', { 'class': 'event', 'timestamp': time.time(), 'id': id_, 'verdict': verdict }, cgi.escape(message)))
 
 def logTestComponentKilled(id_, message = ''):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('tc-killed', { 'class': 'event', 'timestamp': time.time(), 'id': id_, }, cgi.escape(message)))
 
 def logVerdictUpdated(tc, verdict):
+	if 'event' in ExcludedLogLevels:
+		return
 	tliLog('event', toXml('verdict-updated', { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'verdict': verdict }))
 
 def logTemplateMatch(tc, port, message, template, encodedMessage = None):
+	if 'match' in ExcludedLogLevels:
+		return
 	try:
 		# Should we call a tliMatch/tliMisMatch ?
 		if encodedMessage:
@@ -279,6 +445,8 @@ def logTemplateMatch(tc, port, message, template, encodedMessage = None):
 		logUser(unicode(e) + u'\n' + unicode(ret))
 
 def logTemplateMismatch(tc, port, message, template, encodedMessage = None, mismatchedPath = None):
+	if 'mismatch' in ExcludedLogLevels:
+		return
 	attributes = { 'class': 'event', 'timestamp': time.time(), 'tc': tc, 'port': port }
 	if mismatchedPath:
 		attributes['path'] = mismatchedPath 
@@ -293,22 +461,32 @@ def logTemplateMismatch(tc, port, message, template, encodedMessage = None, mism
 		logUser(unicode(e) + u'\n' + unicode(ret))
 
 def logTimeoutBranchSelected(id_):
+	if 'match' in ExcludedLogLevels:
+		return
 	# in a alt, we selected a timer.TIMEOUT where the timer's id is id_
 	tliLog('match', toXml('timeout-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
 
 def logDoneBranchSelected(id_):
+	if 'match' in ExcludedLogLevels:
+		return
 	# in a alt, we selected a tc.DONE where the tc's id is id_
 	tliLog('match', toXml('done-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
 
 def logKilledBranchSelected(id_):
+	if 'match' in ExcludedLogLevels:
+		return
 	# in a alt, we selected a tc.KILLED where the tc's id is id_
 	tliLog('match', toXml('killed-branch', { 'class': 'event', 'timestamp': time.time(), 'id': id_ }))
 
 def logSystemSent(tsiPort, label, payload, sutAddress = None):
+	if 'system' in ExcludedLogLevels:
+		return
 	if sutAddress is None: sutAddress = ''
 	tliLog('system', toXml('system-sent', { 'class': 'system', 'timestamp': time.time(), 'tsi-port': tsiPort }, '%s%s%s' % (testermanToXml(label, 'label'), testermanToXml(payload, 'payload'), testermanToXml(sutAddress, 'sut-address'))))
 
 def logSystemReceived(tsiPort, label, payload, sutAddress = None):
+	if 'system' in ExcludedLogLevels:
+		return
 	if sutAddress is None: sutAddress = ''
 	tliLog('system', toXml('system-received', { 'class': 'system', 'timestamp': time.time(), 'tsi-port': tsiPort }, '%s%s%s' % (testermanToXml(label, 'label'), testermanToXml(payload, 'payload'), testermanToXml(sutAddress, 'sut-address'))))
 
@@ -319,7 +497,7 @@ def logActionCleared(reason, tc):
 	tliLog('action', toXml('action-cleared', { 'class': 'action', 'timestamp': time.time(), 'tc': tc, 'reason': reason }))
 
 def tliLog(level, xml):
-	if not level in getExcludedLogLevels():
+	if not level in ExcludedLogLevels:
 		# Fire a log event
 		TheIlClient.sendLogNotification(level, xml)
 	
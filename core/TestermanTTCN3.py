@@ -31,6 +31,7 @@ from TestermanTCI import *
 import TestermanTCI
 
 import binascii
+import collections
 import random
 import re
 import threading
@@ -186,19 +187,19 @@ class TestermanContext:
 		# something it brings.
 		for alternative in altstep:
 			self._defaultAlternatives.append(alternative)
-		TestermanTCI.logInternal("Activated default altstep %s" % altstepReference)
+		TestermanTCI.logInternal("Activated default altstep %s", altstepReference)
 		return altstepReference
 
 	def removeDefaultAltstep(self, ref):
 		if not ref in self._defaultAltsteps:
-			TestermanTCI.logInternal("Unable to deactivate altstep %s: not activated" % ref)
+			TestermanTCI.logInternal("Unable to deactivate altstep %s: not activated", ref)
 			return False
 		altstep = self._defaultAltsteps[ref]
 		for alternative in altstep:
 			# This 'if' should be useless.
 			if alternative in self._defaultAlternatives:
 				self._defaultAlternatives.remove(alternative)
-		TestermanTCI.logInternal("Default altstep %s deactivated" % ref)
+		TestermanTCI.logInternal("Default altstep %s deactivated", ref)
 		return True
 	
 	def getDefaultAlternatives(self):
@@ -228,7 +229,7 @@ class TestermanContext:
 				pass
 			self._systemQueueNotifierUserCount = 0
 			self._systemQueueNotifier = None
-			logInternal("tc %s does not use the system queue notifier any more - cleaned up" % self._tc)
+			logInternal("tc %s does not use the system queue notifier any more - cleaned up", self._tc)
 	
 def getLocalContext():
 	"""
@@ -276,9 +277,45 @@ def _clearLocalContexts():
 	_ContextMapMutex.release()
 
 
+# Compiled branch condition templates, by template identity:
+# id(template) -> (template, matcher, template state).
+# The template is kept so that its id cannot be reused while cached,
+# and its state so that a modified template is compiled again.
+_CompiledTemplates = {}
+_CompiledTemplatesMutex = threading.RLock()
+# Flushed when full, so that the templates built on the fly
+# (as returned by template functions) do not accumulate.
+_CompiledTemplatesMaxSize = 1024
+
+def _getCompiledTemplate(template):
+	"""
+	Returns the compiled template for a branch condition template,
+	compiled if not cached yet, or if modified since cached.
+	
+	@rtype: _Matcher
+	"""
+	_CompiledTemplatesMutex.acquire()
+	try:
+		entry = _CompiledTemplates.get(id(template))
+		if entry is not None and entry[0] is template and _isTemplateUnchanged(entry[2]):
+			return entry[1]
+		if entry is None and len(_CompiledTemplates) >= _CompiledTemplatesMaxSize:
+			_CompiledTemplates.clear()
+		matcher = _compileTemplate(template)
+		_CompiledTemplates[id(template)] = (template, matcher, _getTemplateState(template))
+		return matcher
+	finally:
+		_CompiledTemplatesMutex.release()
+
 class _BranchCondition:
 	"""
 	This class represents a branch condition in an alternative.
+	
+	Its template is compiled on first match, then the compiled template is
+	cached by template identity, so that it is reused by the next alt()
+	that use the same template object (port.RECEIVE(template) creates a
+	new condition on each alt()), unless the template was modified in
+	the meantime.
 	"""
 	def __init__(self, port, template = None, value = None, sender = None, from_ = None):
 		self.port = port
@@ -286,6 +323,28 @@ class _BranchCondition:
 		self.value = value
 		self.sender = sender
 		self.from_ = from_
+		self._matcher = None
+
+	def match(self, message):
+		"""
+		Matches a message against the condition template.
+		Same as templateMatch(message, self.template), but with a compiled
+		template.
+
+		@rtype: (bool, object, string)
+		@returns: (a, b, path) as templateMatch()
+		"""
+		if self._matcher is None:
+			if self.template is None or callable(self.template):
+				# Nothing to compile
+				return templateMatch(message, self.template)
+			self._matcher = _getCompiledTemplate(self.template)
+		try:
+			return self._matcher.match(message)
+		except Exception:
+			# Actually, this is for debug purposes
+			logUser("Exception while trying to match a template:\n%s" % getBacktrace())
+			return (False, message, self._matcher.path)
 
 ################################################################################
 # ATS Context: ATS-wide 
@@ -375,7 +434,7 @@ class Timer:
 		getLocalContext().registerTimer(self)
 		self._tc = getLocalContext().getTc()
 
-		logInternal("%s created" % str(self))
+		logInternal("%s created", self)
 	
 	def __str__(self):
 		return self._name
@@ -562,7 +621,7 @@ class TestComponent:
 		self._lock()
 		self._state = state
 		self._unlock()
-		logInternal("%s switched its state to %s" % (str(self), str(state)))
+		logInternal("%s switched its state to %s", self, state)
 	
 	def _getState(self):
 		self._lock()
@@ -575,7 +634,7 @@ class TestComponent:
 		Prepares the TC for discarding: purge all port queues.
 		"""
 		for port in self._ports.values():
-			logInternal("Finalizing port %s" % port)
+			logInternal("Finalizing port %s", port)
 			port.stop()
 			port._finalize()
 	
@@ -844,7 +903,7 @@ class TestComponent:
 		_removeSystemEvent(self._DONE_EVENT, self)
 		_removeSystemEvent(self._ALL_DONE_EVENT, None)
 
-		logInternal("Starting %s..." % str(self))
+		logInternal("Starting %s...", self)
 		self._setState(self.STATE_RUNNING)
 		# Attach the PTC to this behaviour
 		behaviour._setPtc(self)
@@ -865,7 +924,7 @@ class TestComponent:
 			raise TestermanStopException()
 		else:
 			if self._getState() == self.STATE_RUNNING:
-				logInternal("Stopping %s..." % str(self))
+				logInternal("Stopping %s...", self)
 				# Let's post a system event to manage inter-thread communications
 				_postSystemEvent(self._STOP_COMMAND, self)
 
@@ -926,10 +985,11 @@ class Port:
 		self._name = name
 		if not self._name:
 			self._name = "port_%d" % _getNewId()
-		self._mutex = threading.RLock()
+		# Not reentrant: port operations never call each other with the lock held
+		self._mutex = threading.Lock()
 
-		# The internal port's message queue
-		self._messageQueue = []
+		# The internal port's message queue, of (message, from_)
+		self._messageQueue = collections.deque()
 
 		# The port state. Automatically started() when accessed for the first type ( via tc[port])
 		self._started = False
@@ -946,6 +1006,7 @@ class Port:
 		
 		# a pipe ((r, w) fds) to notify that the port has something new in it.
 		# Enables to implement a poll/select on multiple ports in alt()
+		# It contains a single byte as long as the message queue is not empty.
 		self._notifier = None
 	
 	def getNotifierFd(self):
@@ -982,15 +1043,66 @@ class Port:
 		self._lock()
 		if self._started:
 			self._messageQueue.append((message, from_))
-			try:
-				os.write(self._notifier[1], 'r')
-				logInternal("port %s: notifying a new message for reader on %s" % (self, self._notifier[0]))
-			except Exception, e:
-				logInternal("port %s: async notifier error %s" % (self, e))
-				pass
+			# Only notify when the queue is no longer empty, so that
+			# the notifier pipe never fills up
+			if len(self._messageQueue) == 1:
+				try:
+					os.write(self._notifier[1], 'r')
+					logInternal("port %s: notifying a new message for reader on %s", self, self._notifier[0])
+				except Exception, e:
+					logInternal("port %s: async notifier error %s", self, e)
+					pass
 		# else not started: not enqueueing anything.
 		self._unlock()
 
+	def _getQueueLength(self):
+		return len(self._messageQueue)
+
+	def _peek(self):
+		"""
+		Returns the first message in the queue, if any, without consuming it.
+		
+		@rtype: tuple (message, from_), or None
+		@returns: the first message in the queue and its sender, or None
+		if the queue is empty.
+		"""
+		self._lock()
+		try:
+			if not self._messageQueue:
+				return None
+			return self._messageQueue[0]
+		finally:
+			self._unlock()
+
+	def _dequeue(self):
+		"""
+		Pops the first message in the queue, if any.
+		
+		@rtype: tuple (message, from_), or None
+		@returns: the first message in the queue and its sender, or None
+		if the queue is empty.
+		"""
+		self._lock()
+		try:
+			if not self._messageQueue:
+				return None
+			ret = self._messageQueue.popleft()
+			if not self._messageQueue:
+				self._purgeNotifier()
+			return ret
+		finally:
+			self._unlock()
+
+	def _purgeNotifier(self):
+		"""
+		Purges the notifier pipe once the queue is empty.
+		Must be called with the port lock held.
+		"""
+		try:
+			os.read(self._notifier[0], 1)
+		except:
+			pass
+
 
 	# TTCN-3 compliant operations
 	def send(self, message, to = None):
@@ -1007,9 +1119,12 @@ class Port:
 		@returns: True if the message has been sent (i.e. if the port has not been connected or mapped),
 		          False if not (port stopped)
 		"""
-		logInternal("sending a message through %s" % str(self))
+		logInternal("sending a message through %s", self)
 		if self._started:
-			messageToLog = _expandTemplate(message)
+			if isLogLevelEnabled('event'):
+				messageToLog = _expandTemplate(message)
+			else:
+				messageToLog = None # not logged anyway
 			messageToSend = _encodeTemplate(message)
 
 			# Mapped port first.
@@ -1063,7 +1178,7 @@ class Port:
 		"""
 		self._lock()
 		if not self._started:
-			self._messageQueue = []
+			self._messageQueue.clear()
 			self._started = True
 			try:
 				self._notifier = os.pipe()
@@ -1071,7 +1186,7 @@ class Port:
 				self._unlock()
 				raise Exception("Unable to start port %s: %s" % (str(self), e))
 		self._unlock()
-		logInternal("%s started" % str(self))
+		logInternal("%s started", self)
 
 	def stop(self):
 		"""
@@ -1088,16 +1203,19 @@ class Port:
 				pass
 			self._notifier = None
 		self._unlock()			
-		logInternal("%s stopped" % str(self))
+		logInternal("%s stopped", self)
 
 	def clear(self):
 		"""
 		Purges the internal queue, without stopping the port.
 		"""
 		self._lock()
-		self._messageQueue = []
+		if self._messageQueue:
+			self._messageQueue.clear()
+			if self._started:
+				self._purgeNotifier()
 		self._unlock()
-		logInternal("%s cleared" % str(self))
+		logInternal("%s cleared", self)
 
 	def RECEIVE(self, template = None, value = None, sender = None, from_ = None):
 		"""
@@ -1343,7 +1461,7 @@ class TestCase:
 			self._finalize()
 		except Exception:
 			# Nothing particular to do in case of an error here...
-			logInternal("Exception while finalizing testcase:\n%s" % getBacktrace())
+			logInternal("Exception while finalizing testcase:\n%s", getBacktrace())
 
 		# Final static connection reset
 		TestermanSA.triSAReset()
@@ -1592,7 +1710,7 @@ def connect(portA, portB):
 	"""
 	# Does not reconnect connected ports:
 	if portA._isConnectedTo(portB): # The reciprocity should be True, too (normally)
-		logInternal("Multiple connection attempts between %s and %s. Discarding." % (str(portA), str(portB)))
+		logInternal("Multiple connection attempts between %s and %s. Discarding.", portA, portB)
 		return
 
 	# TTCN-3 restriction: "A port that is mapped shall not be connected"
@@ -1707,11 +1825,32 @@ def octetstring(s):
 # alt() management
 ################################################################################
 
+def _materialize(message):
+	"""
+	Fully decodes, in place, the lazily decoded parts of a message
+	(such as the BER codec sequences in lazy mode, that provide a
+	materialize() method), so that they can be used as plain python values
+	by the userland.
+	
+	@rtype: object
+	@returns: message
+	"""
+	if isinstance(message, dict):
+		if hasattr(message, 'materialize'):
+			message.materialize()
+		else:
+			for m in message.itervalues():
+				_materialize(m)
+	elif isinstance(message, (list, tuple)):
+		for m in message:
+			_materialize(m)
+	return message
+
 def _setValue(name, message):
 	"""
 	Called by alt() to store a message to a variable.
 	"""
-	getLocalContext().setValue(name, message)
+	getLocalContext().setValue(name, _materialize(message))
 
 def value(name):
 	"""
@@ -1810,9 +1949,7 @@ def alt(alternatives):
 	  They must be lambda or callable() to be executed only if the branch is selected.
 	
 	This implementation is not TTCN-3 compliant because:
-	- it does not take a snapshot at each iteration, meaning that messages may arrive on port2 just
-	  before analyzing it, while something arrives on port1 just after, leading to incorrect alt branching
-	  in the case of port1.RECEIVE() is before port2.RECEIVE() (in "order of appearance")
+	- messages that do not match any alternative are consumed (discarded), instead of blocking their port.
 	- altstep-branches are not implemented. Only timeout-, receiving-, killed-, done- branches are.
 	- there is no mechanism to trigger an exception if the alt is completely blocked.
 	  As a consequence, the user must carefully design his/her alt() (especially with watchdog timers)
@@ -1835,20 +1972,28 @@ def alt(alternatives):
 	The guard is detected if the first object in the list is callable. If it is, this is a guard. If not, no guard available.
 	"""
 	# Algorithm:
-	# 1. First, we group alternatives per port (ordered).
-	# 2. Then, we look messages port by port:
-	#  2.1 Pop the first message in its queue (if any)
-	#  2.2 Compare it to the templates contained in its associated alternative's conditions, once we checked that the guard was satisfied
-	#  2.3 If we have a template match (the first one for the list of alternatives)
-	#      - select the branch: execute the associated actions. If an action evaluates to RETURN, stop executing further actions,
-	#        and leave the alt. If one evaluates to REPEAT, stop executing further actions, and repeat the alt() from start.
-	#        If we have no other actions to execute, leave the alt.
-	#      If this is a mismatch, do nothing, just compare to the next alternative's conditions.
-	#  2.4 in any case (even if we leave or repeat the alt, match or mismatch), the current popped message is consumed.
-	# 3. Once we looped once without a match, repeat from 2 until we have a match.
+	# 1. First, we list the alternatives (in order of appearance) and the ports they watch.
+	# 2. Then, we take a snapshot of the watched ports: only the messages that are in their queues
+	#    at this time are considered, until the next snapshot.
+	#  2.1 Evaluate each alternative in order of appearance, once we checked that the guard was satisfied:
+	#      a receiving-branch is compared to the first message of its port in the snapshot,
+	#      a timeout-, done-, killed- branch is looked up in the system queue.
+	#  2.2 On the first match, select the branch: the matched message is consumed, and the associated actions executed.
+	#      If an action evaluates to RETURN, stop executing further actions, and leave the alt.
+	#      If one evaluates to REPEAT, stop executing further actions, and repeat the alt() from 2 (new snapshot).
+	#      If we have no other actions to execute, leave the alt.
+	#      A message that does not match an alternative is not compared to it again.
+	#  2.3 If no alternative matched, the first message of each port in the snapshot is consumed, and we
+	#      evaluate the alternatives again (2.1) over the next messages of the snapshot.
+	# 3. Once the snapshot is exhausted without a match, wait for something new on one of the watched ports,
+	#    and repeat from 2.
 	# 
+	# A burst of messages is thus handled without waiting for port notifications, one alternative
+	# evaluation pass per message.
+	#
 	# The system queue is handled differently:
 	# - unmatched messages are not consumed, but kept in the queue. This is not the case for "userland ports".
+	# - it is not frozen by the snapshot. It is only looked up again when something new is posted to it.
 
 	# Gets some basic things to intercept whenever we enter an alt, such as STOP_COMMAND and KILL_COMMAND
 	# through the system queue.	
@@ -1860,17 +2005,20 @@ def alt(alternatives):
 	for a in getLocalContext().getDefaultAlternatives():
 		alternatives.append(a)
 
-	logInternal("Number of alternatives for this alt: %s" % str(len(alternatives)))
+	logInternal("Number of alternatives for this alt: %s", len(alternatives))
 	
 #	logInternal("Entering alt():\n%s" % alternatives)
 	
 	# Step 1. Preparation.
-	# Alternatives per port
-	portAlternatives = {}
+	# (guard, condition, actions, index), in order of appearance
+	orderedAlternatives = []
+	# The watched standard ports
+	watchedPorts = []
 	# And prepare a list of watched fds (pipes) to be notified as soon as a
 	# port has something new in it.
 	watchedPortsFds = []
 	
+	systemQueue = _getSystemQueue()
 	systemQueueWatched = False
 		
 	for alternative in alternatives:
@@ -1885,200 +2033,120 @@ def alt(alternatives):
 			condition = alternative[0]
 			actions = alternative[1:]
 		
- 		if not portAlternatives.has_key(condition.port) and condition.port._started:
-			portAlternatives[condition.port] = []
-			if condition.port is _getSystemQueue():
+		port = condition.port
+		if not port._started:
+			# Won't receive anything
+			continue
+		if port is systemQueue:
+			if not systemQueueWatched:
 				# Register ourselves as a listener on the system port
-				condition.port._registerListener()
+				port._registerListener()
 				systemQueueWatched = True
-			watchedPortsFds.append(condition.port.getNotifierFd())
-		portAlternatives[condition.port].append((guard, condition, actions))
-	
-	logInternal("alt: tc %s is watching the following fds: %s - watching the system queue: %s" % (getLocalContext().getTc(), watchedPortsFds, systemQueueWatched))
+				watchedPortsFds.append(port.getNotifierFd())
+		elif not port in watchedPorts:
+			watchedPorts.append(port)
+			watchedPortsFds.append(port.getNotifierFd())
+		orderedAlternatives.append((guard, condition, actions, len(orderedAlternatives)))
+	
+	logInternal("alt: tc %s is watching the following fds: %s - watching the system queue: %s", getLocalContext().getTc(), watchedPortsFds, systemQueueWatched)
+
+	# The first message of each port, as (message, from_), once looked up
+	heads = {}
+	# The indexes of the alternatives this first message was compared to without a match, per port
+	mismatches = {}
+	for port in watchedPorts:
+		mismatches[port] = set()
+	# The system queue version, and the indexes of the alternatives that were
+	# looked up in the system queue without a match at this version
+	systemQueueVersion = None
+	systemQueueMismatches = set()
 
-	# Step 2.
-	matchedInfo = None # tuple (guard, template, asValue, actions, message, decodedMessage)
-	repeat = False
 	try:
-		while (not matchedInfo) or repeat:
-			# Reset info in case of a repeat
-			matchedInfo = None
-			repeat = False
-
-			for (port, alternatives) in portAlternatives.items():
-
-				# Special handling for system queue: messages are NOT popped if not matching anything.
-				# Instead, they are kept in the queue for other consumers (other TCs, or in a next alt()
-				# in the current TC).
-				if port is _getSystemQueue():
-					port._lock()
-					try:
-						# Make sure that we don't loop forever here because we did not remove our notification
-						# from the notification pipe.
-						port._acknowledgeNotification()
-						for (message, from_) in port._messageQueue:
-							# We ignore the 'from' in systemQueue
-							for (guard, condition, actions) in alternatives:
-								# Guard is ignored for internal messages (we shouldn't have one, anyway)
-	
-								# Special message matches (NB: we're suppose to have only dict messages in the system queue)
-								if isinstance(message, dict) and condition.template['event'].startswith('any.'):
-									# "Wildcard"-based match: we do not expect this exact event in the queue.
-									# Instead, we match any 'ressembling' event.
-									if condition.template['event'] == 'any.c.done':
-										# We match is we have any 'done' in our queue
-										if message.get('event') == 'done':
-											match = True
-									elif condition.template['event'] == 'any.c.killed':
-										# We match is we have any 'killed' in our queue
-										if message.get('event') == 'killed':
-											match = True
-	
-									if match:
-										matchedInfo = (guard, condition, actions, message, None) # None: decodedMessage
-										# In this case, we do NOT consume the message: left for
-										# other ptc.KILLED, or other any component killed, ...
-										break
-
-								# Standard system message matches - consumed if matched
-								else:
-									# Ignore the decoded message: must be the same as encoded for internal events.
-									(match, _, _) = templateMatch(message, condition.template)
-									if match:
-										matchedInfo = (guard, condition, actions, message, None) # None: decodedMessage
-										# Consume the message
-										port._remove(message, from_)
-										# Exit the port alternative loop, with matchedInfo
-										break
-	
-							if matchedInfo:
-								# Exit the loop on messages directly.
-								break
-					except Exception, e:
-						port._unlock()
-						logInternal("Exception while analyzing system events: %s" % str(e))
-						raise
-					port._unlock()
-					if matchedInfo:
-						(guard, condition, actions, message, _) = matchedInfo
-						# OK, we have some actions to trigger (outside the critical section)
-						# According to the event type we matched, log it (or not)
-						# system queue events are always formatted as a dict { 'event': string } and 'ptc' or 'timer' dependending on the event.
-						branch = condition.template['event']
-						if branch == 'timeout':
-							# timeout-branch selected
-							logTimeoutBranchSelected(id_ = str(condition.template['timer']))
-						elif branch == 'done':
-							# done-branch selected
-							logDoneBranchSelected(id_ = str(condition.template['ptc']))
-						elif branch == 'killed':
-							# killed-branch selected
-							logKilledBranchSelected(id_ = str(condition.template['ptc']))
-						elif branch == 'all.c.done':
-							# all component-done branch selected
-							logDoneBranchSelected(id_ = 'all')
-						elif branch == 'all.c.killed':
-							# all component-killed branch selected
-							logKilledBranchSelected(id_ = 'all')
-						elif branch == 'any.c.done':
-							# any component-done branch selected
-							logDoneBranchSelected(id_ = 'any')
-						elif branch == 'any.c.killed':
-							# all component-killed branch selected
-							logKilledBranchSelected(id_ = 'any')
-						else:
-							# Other system messages are for internal purpose only and does not have TTCN-3 branch equivalent
-							logInternal('system event received in system queue: %s' % repr(condition.template))
-
-						for action in actions:
-							# Minimal command management for internal messages
-							if callable(action):
-								action = action()
-							if action == REPEAT:
-								repeat = True
-								break
-							elif action == RETURN:
-								return
-						if repeat:
-							# Break the loop on system messages
+		while 1:
+			# Step 2. Snapshot: the number of messages to consider in each port's queue.
+			snapshot = {}
+			for port in watchedPorts:
+				snapshot[port] = port._getQueueLength()
+				# Branch actions may have cleared the port: the known mismatches
+				# only remain valid for the same first message
+				head = port._peek()
+				if head is not heads.get(port):
+					heads[port] = head
+					mismatches[port].clear()
+
+			selected = None # tuple (guard, condition, actions, message, decodedMessage, from_)
+			while selected is None:
+				# 2.1 Evaluate the alternatives in order
+				for (guard, condition, actions, index) in orderedAlternatives:
+					port = condition.port
+					if port is systemQueue:
+						# Guard is ignored for internal messages (we shouldn't have one, anyway)
+						if systemQueue._version != systemQueueVersion:
+							systemQueueVersion = systemQueue._version
+							systemQueueMismatches.clear()
+						elif index in systemQueueMismatches:
+							# Nothing new since the last lookup
+							continue
+						if systemQueue._match(condition):
+							selected = (guard, condition, actions, None, None, None)
 							break
-
+						systemQueueMismatches.add(index)
+						continue
+
+					if not snapshot[port] or index in mismatches[port] or (guard and not guard()):
+						continue
+					head = heads.get(port)
+					if head is None:
+						head = port._peek()
+						if head is None:
+							# Cleared in the meantime
+							snapshot[port] = 0
+							continue
+						heads[port] = head
+					(message, from_) = head
+					# Only try to match messages from the expected sender
+					if condition.from_ and condition.from_ != from_:
+						logInternal("not matching condition: not received from the expected address (expected: %s, got: %s)", condition.from_, from_)
+						match = False
+						# In this case, we don't even attempt to decode the message. So we assign a default decoded one for logging purpose
+						decodedMessage = message
 					else:
-						# no match, nothing to do.
-						pass
-
-				else:
-					# This is a normal port. We always consume the popped message, 
-					# support for RETURN and REPEAT "keywords" in actions, etc.
-					message = None
-					port._lock()
-					try:
-						if port._messageQueue:
-							# 2.1 Let's pop the first message in the queue (will be consumed whatever happens since not kept in queue)
-							# FIXME: flawn implementation: we shoud not consume only one message per port per pass.
-							# We should really take a "snapshot" (ie freezing ports) and considering timestamped messages...
-							(message, from_) = port._messageQueue[0]
-							port._messageQueue = port._messageQueue[1:]
-							# FIXME - must be hidden in the port class
-							try:
-								os.read(port._notifier[0], 1)
-							except:
-								pass
-					except Exception, e:
-						port._unlock()
-						logInternal("Exception while consuming standard port message: %s" % str(e))
-						raise e
-					port._unlock()
-					if message is not None: # And what is we want to send "None" ? should be considered as a non-message, ie a non-send ?
-						# 2.2: For each existing satisfied conditions for this port (x[0] is the guard)
-						for (guard, condition, actions) in filter(lambda x: (x[0] and x[0]()) or (x[0] is None), alternatives):
-							# Only try to match messages from the expected sender
-							if condition.from_ and condition.from_ != from_:
-								logInternal("not matching condition: not received from the expected address (expected: %s, got: %s)" % (condition.from_, from_))
-								match = False
-								# In this case, we don't even attempt to decode the message. So we assign a default decoded one for logging purpose
-								decodedMessage = message
-							else:
-								(match, decodedMessage, mismatchedPath) = templateMatch(message, condition.template)
-							# Now handle the matching result
-							if not match:
-								# 2.3 - Mismatch, we should log it.
-								logTemplateMismatch(tc = port._tc, port = port._name, message = decodedMessage, template = _expandTemplate(condition.template), encodedMessage = message, mismatchedPath = mismatchedPath)
-							else:
-								# 2.3 - Match
-								matchedInfo = (guard, condition, actions, message, decodedMessage)
-								logTemplateMatch(tc = port._tc, port = port._name, message = decodedMessage, template = _expandTemplate(condition.template), encodedMessage = message)
-								# Store the message as value, if needed
-								if condition.value:
-									_setValue(condition.value, decodedMessage)
-								if condition.sender:
-									_setSender(condition.sender, from_)
-								# Then execute actions
-								for action in actions:
-									if callable(action):
-										action = action()
-									if action == REPEAT:
-										repeat = True
-										break
-									elif action == RETURN:
-										return
-								# Break the loop on guard-validated alternatives for this port
-								break
-						if matchedInfo:
-							# We left the loop on guard-validated alternatives for this port because of a match,
-							# Let's break the main loop on ports
-							break
-						else:
-							# No match for this port: nothing to do
-							pass
+						(match, decodedMessage, mismatchedPath) = condition.match(message)
+					# Now handle the matching result
+					if not match:
+						mismatches[port].add(index)
+						# Mismatch, we should log it.
+						if isLogLevelEnabled('mismatch'):
+							logTemplateMismatch(tc = port._tc, port = port._name, message = decodedMessage, template = _expandTemplate(condition.template), encodedMessage = message, mismatchedPath = mismatchedPath)
 					else:
-						# no message for this port: nothing to do
-						pass
+						selected = (guard, condition, actions, message, decodedMessage, from_)
+						break
 
-			# Now wait until another message arrives on one of our watched ports (if we have to wait)
-			if (not matchedInfo) or repeat:
+				if selected is None:
+					# 2.3 No match: consume the first message of each port in the snapshot
+					consumed = False
+					for port in watchedPorts:
+						if snapshot[port]:
+							port._dequeue()
+							snapshot[port] -= 1
+							heads.pop(port, None)
+							mismatches[port].clear()
+							consumed = True
+					if not consumed:
+						# The snapshot is exhausted
+						break
+			
+			if selected is None:
+				# Step 3. Now wait until something new arrives on one of our watched ports
+				if systemQueueWatched:
+					# Make sure that we don't loop forever here because we did not remove our notification
+					# from the notification pipe.
+					systemQueue._acknowledgeNotification()
+					if systemQueue._version != systemQueueVersion:
+						# Something was posted before the acknowledgement: look it up first
+						continue
 				try:
-					logInternal("alt: tc %s is renewing its subscription on the following fds: %s" % (getLocalContext().getTc(), watchedPortsFds))
+					logInternal("alt: tc %s is renewing its subscription on the following fds: %s", getLocalContext().getTc(), watchedPortsFds)
 					r, w, e = select.select(watchedPortsFds, [], [], 1)
 				except select.error, e:
 					if e.args[0] == 4:
@@ -2086,16 +2154,85 @@ def alt(alternatives):
 						stop()
 					else:
 						raise
-					
-	#			if r: logInternal("activity detected on port(s) %s" % r)
+				continue
+	
+			# 2.2 A branch was selected
+			repeat = False
+			(guard, condition, actions, message, decodedMessage, from_) = selected
+			port = condition.port
+			if port is systemQueue:
+				# A matched message may have been left in the queue
+				systemQueueVersion = None
+				# According to the event type we matched, log it (or not)
+				# system queue events are always formatted as a dict { 'event': string } and 'ptc' or 'timer' dependending on the event.
+				branch = condition.template['event']
+				if branch == 'timeout':
+					# timeout-branch selected
+					logTimeoutBranchSelected(id_ = str(condition.template['timer']))
+				elif branch == 'done':
+					# done-branch selected
+					logDoneBranchSelected(id_ = str(condition.template['ptc']))
+				elif branch == 'killed':
+					# killed-branch selected
+					logKilledBranchSelected(id_ = str(condition.template['ptc']))
+				elif branch == 'all.c.done':
+					# all component-done branch selected
+					logDoneBranchSelected(id_ = 'all')
+				elif branch == 'all.c.killed':
+					# all component-killed branch selected
+					logKilledBranchSelected(id_ = 'all')
+				elif branch == 'any.c.done':
+					# any component-done branch selected
+					logDoneBranchSelected(id_ = 'any')
+				elif branch == 'any.c.killed':
+					# all component-killed branch selected
+					logKilledBranchSelected(id_ = 'any')
+				else:
+					# Other system messages are for internal purpose only and does not have TTCN-3 branch equivalent
+					logInternal('system event received in system queue: %r', condition.template)
+
+				for action in actions:
+					# Minimal command management for internal messages
+					if callable(action):
+						action = action()
+					if action == REPEAT:
+						repeat = True
+						break
+					elif action == RETURN:
+						return
+			
+			else:
+				# Consume the matched message
+				port._dequeue()
+				del heads[port]
+				mismatches[port].clear()
+				if isLogLevelEnabled('match'):
+					logTemplateMatch(tc = port._tc, port = port._name, message = decodedMessage, template = _expandTemplate(condition.template), encodedMessage = message)
+				# Store the message as value, if needed
+				if condition.value:
+					_setValue(condition.value, decodedMessage)
+				if condition.sender:
+					_setSender(condition.sender, from_)
+				# Then execute actions
+				for action in actions:
+					if callable(action):
+						action = action()
+					if action == REPEAT:
+						repeat = True
+						break
+					elif action == RETURN:
+						return
+
+			if not repeat:
+				return
+
 	except Exception, e:
-		logInternal("exception in alt(): %s (%s)" % (str(e), repr(e)))
-		if systemQueueWatched:
-			_getSystemQueue()._unregisterListener()
-		raise e
+		logInternal("exception in alt(): %s (%r)", e, e)
+		raise
 
-	if systemQueueWatched:
-		_getSystemQueue()._unregisterListener()
+	finally:
+		if systemQueueWatched:
+			systemQueue._unregisterListener()
 
 # Control "Keywords" for alt().
 # May be used as is directly, in a lambda, or returned from an altstep or a function called
@@ -2137,6 +2274,9 @@ class SystemQueue(Port):
 	def __init__(self):
 		Port.__init__(self, tc = None, name = '__system_queue__')
 		self._pipes = []
+		# Incremented each time a message is enqueued, so that
+		# alt() can tell whether something new may match
+		self._version = 0
 
 	def _registerListener(self):
 		pipe = getLocalContext().getSystemQueueNotifier()
@@ -2144,7 +2284,7 @@ class SystemQueue(Port):
 		if not pipe in self._pipes:
 			self._pipes.append(pipe)
 		self._unlock()
-		logInternal("system queue: tc %s registered as a listener (fd %s)" % (getLocalContext().getTc(), pipe[0]))
+		logInternal("system queue: tc %s registered as a listener (fd %s)", getLocalContext().getTc(), pipe[0])
 		return pipe
 	
 	def getNotifierFd(self):
@@ -2160,7 +2300,7 @@ class SystemQueue(Port):
 			pass
 		self._unlock()
 		getLocalContext().cleanSystemQueueNotifier()
-		logInternal("system queue: tc %s unregistered as a listener (fd %s)" % (getLocalContext().getTc(), pipe[0]))
+		logInternal("system queue: tc %s unregistered as a listener (fd %s)", getLocalContext().getTc(), pipe[0])
 	
 	def _notifyListeners(self):
 		"""
@@ -2169,9 +2309,9 @@ class SystemQueue(Port):
 		for p in self._pipes:
 			try:
 				os.write(p[1], 'r')
-				logInternal("system queue: notifying a new message for reader on %s" % (p[0]))
+				logInternal("system queue: notifying a new message for reader on %s", p[0])
 			except Exception, e:
-				logInternal("system queue: async notifier error %s" % (e))
+				logInternal("system queue: async notifier error %s", e)
 				pass
 
 	def _enqueue(self, message, from_):
@@ -2179,9 +2319,10 @@ class SystemQueue(Port):
 		The system queue implementation for enqueue is to enqueue the message,
 		then send a notification through the notifier pipe only if
 		"""
-		logInternal("system queue: enqueuing message from %s" % (str(from_)))
+		logInternal("system queue: enqueuing message from %s", from_)
 		self._lock()
 		self._messageQueue.append((message, from_))
+		self._version += 1
 		self._notifyListeners()
 		self._unlock()
 
@@ -2198,10 +2339,54 @@ class SystemQueue(Port):
 			r, w, e = select.select([f], [], [], 0)
 			if f in r:
 				os.read(f, 1000)
-				logInternal("system queue: tc %s acknowledged new message notification on fd %s" % (getLocalContext().getTc(), f))
+				logInternal("system queue: tc %s acknowledged new message notification on fd %s", getLocalContext().getTc(), f)
 		except:
 			pass
 	
+	def _match(self, condition):
+		"""
+		Looks for a message matching a timeout-, done-, killed- (or internal)
+		branch condition.
+		A matched message is consumed, except for any component-done/killed
+		conditions: the message is left for other ptc.KILLED, or other any
+		component killed, ...
+		
+		@type  condition: _BranchCondition
+		@param condition: the branch condition, whose template is a dict ({ 'event': string, ... })
+		
+		@rtype: bool
+		@returns: True if a message matched the template.
+		"""
+		template = condition.template
+		self._lock()
+		try:
+			for (message, from_) in self._messageQueue:
+				# We ignore the 'from' in systemQueue
+				# Special message matches (NB: we're suppose to have only dict messages in the system queue)
+				if isinstance(message, dict) and template['event'].startswith('any.'):
+					# "Wildcard"-based match: we do not expect this exact event in the queue.
+					# Instead, we match any 'ressembling' event.
+					if template['event'] == 'any.c.done':
+						# We match is we have any 'done' in our queue
+						if message.get('event') == 'done':
+							return True
+					elif template['event'] == 'any.c.killed':
+						# We match is we have any 'killed' in our queue
+						if message.get('event') == 'killed':
+							return True
+
+				# Standard system message matches - consumed if matched
+				else:
+					# Ignore the decoded message: must be the same as encoded for internal events.
+					(match, _, _) = condition.match(message)
+					if match:
+						# We stop iterating over the queue right now
+						self._messageQueue.remove((message, from_))
+						return True
+			return False
+		finally:
+			self._unlock()
+
 	def _remove(self, message, from_):
 		"""
 		Consumes a particular message from the system queue.
@@ -2272,6 +2457,13 @@ class TestAdapterConfiguration:
 		"""
 		return self._tac.bindByUri(tsiPort, uri, type_, **kwargs)
 	
+	def setTriSendMode(self, tsiPort, mode):
+		"""
+		Sets the TRI-SEND mode ('synchronous' or 'pipelined') for
+		the remote probe bound to tsiPort. See set_tri_send_mode().
+		"""
+		return self._tac.setTriSendMode(tsiPort, mode)
+	
 	def _getTsiPortList(self):
 		return self._tac.getTsiPortList()
 
@@ -2929,12 +3121,12 @@ class CodecTemplate:
 			except TestermanCD.CodecNotFoundException:
 				raise TestermanException('Decoding error: codec %s not found' % self._codec)
 			except Exception:
-				logInternal('Decoding error: could not decode message with codec %s:\n%s' % (self._codec, getBacktrace()))
+				logInternal('Decoding error: could not decode message with codec %s:\n%s', self._codec, getBacktrace())
 				# Unable to decode: leave the buffer as is - it will lead to a match error probably.
 				# Leaving it as is enables to convey the payload all along the flow for further analysis.
 				return encodedMessage
 			if decodedMessage is None:
-				logInternal('Decoding error: could not decode message with codec %s' % self._codec)
+				logInternal('Decoding error: could not decode message with codec %s', self._codec)
 				return encodedMessage
 			else:
 				# Summary if FFU.
@@ -2975,9 +3167,11 @@ def match(message, template):
 	"""
 	ret, decodedMessage, mismatchedPath = templateMatch(message, template)
 	if not ret:
-		logTemplateMismatch(tc = getLocalContext().getTc(), port = "", message = decodedMessage, template = _expandTemplate(template), encodedMessage = message, mismatchedPath = mismatchedPath)
+		if isLogLevelEnabled('mismatch'):
+			logTemplateMismatch(tc = getLocalContext().getTc(), port = "", message = decodedMessage, template = _expandTemplate(template), encodedMessage = message, mismatchedPath = mismatchedPath)
 	else:
-		logTemplateMatch(tc = getLocalContext().getTc(), port = "", message = decodedMessage, template = _expandTemplate(template), encodedMessage = message)
+		if isLogLevelEnabled('match'):
+			logTemplateMatch(tc = getLocalContext().getTc(), port = "", message = decodedMessage, template = _expandTemplate(template), encodedMessage = message)
 	return ret
 
 def _templateMatch(message, template, path):
@@ -3012,10 +3206,10 @@ def _templateMatch(message, template, path):
 		try:
 			decodedMessage = template.decode(message)
 		except Exception, e:
-			logInternal("mismatch: unable to decode message part with codec %s: %s" % (template._codec, str(e) + getBacktrace()))
+			logInternal("mismatch: unable to decode message part with codec %s: %s", template._codec, str(e) + getBacktrace())
 			return (False, message, path)
 		# TODO: handle decoding error here ?
-		logInternal("_templateMatch: message part %s decoded with codec %s: %s" % (path, template._codec, repr(decodedMessage)))
+		logInternal("_templateMatch: message part %s decoded with codec %s: %r", path, template._codec, decodedMessage)
 		# Now match the decoded message against the proxied template (not expanded, because it should contain other proxies, if any)
 		return _templateMatch(decodedMessage, template._template, path)
 	
@@ -3023,7 +3217,7 @@ def _templateMatch(message, template, path):
 	# all entries in template dict must match ; extra message entries are ignored (but kept in "decoded dict")
 	if isinstance(template, dict):
 		if not isinstance(message, dict):
-			logInternal("mismatch: %s: expected a dict << %s >>, got << %s >>" % (path, repr(template), repr(message)))
+			logInternal("mismatch: %s: expected a dict << %r >>, got << %r >>", path, template, message)
 			return (False, message, path)
 		# Existing entries in template dict must be matched (excepting 'omit' entries, which must not be present...)
 		decodedDict = {}
@@ -3037,22 +3231,22 @@ def _templateMatch(message, template, path):
 				(ret, decodedField, p) = _templateMatch(message[key], tmplt, u"%s.{%s}" % (path, unicode(key)))
 				decodedDict[key] = decodedField
 				if not ret:
-					logInternal("mismatch: %s: mismatched dict entry %s" % (path, unicode(key)))
+					logInternal("mismatch: %s: mismatched dict entry %s", path, unicode(key))
 					result = False
 					mismatchedPath = p
 					# continue to traverse the dict to perform "maximum" message decoding
 			elif isinstance(tmplt, (omit, any_or_none, ifpresent)) or (isinstance(tmplt, extract) and isinstance(tmplt._template, (omit, any_or_none, ifpresent))):
 				# if the missing keys are omit(), that's ok.
-				logInternal("omit: %s: omitted value %s not found, or optional value not found. OK." % (path, repr(key)))
+				logInternal("omit: %s: omitted value %r not found, or optional value not found. OK.", path, key)
 				continue
 			else:
 				# if it's something else, missing key, so no match.
-				logInternal("mismatch: %s: missing dict entry %s" % (path, repr(key)))
+				logInternal("mismatch: %s: missing dict entry %r", path, key)
 				result = False
 				mismatchedPath = path
-		# Now, add message keys that were not in template to the decoded dict
+		# Now, add message keys that were not matched (not in template, or any value) to the decoded dict
 		for key, m in message.items():
-			if not key in template:
+			if not key in decodedDict:
 				decodedDict[key] = m
 		return (result, decodedDict, mismatchedPath)
 	
@@ -3060,11 +3254,11 @@ def _templateMatch(message, template, path):
 	# Must be the same choice name (ie tupe[0]) and matching value
 	if isinstance(template, tuple):
 		if not isinstance(message, tuple):
-			logInternal("mismatch: %s: expected a tuple << %s >>, got << %s >>" % (path, repr(template), repr(message)))
+			logInternal("mismatch: %s: expected a tuple << %r >>, got << %r >>", path, template, message)
 			return (False, message, path)
 		# Check choice
 		if not message[0] == template[0]:
-			logInternal("mismatch: %s: tuple choices differ (message: %s, template %s)" % (path, repr(message[0]), repr(template[0])))
+			logInternal("mismatch: %s: tuple choices differ (message: %r, template %r)", path, message[0], template[0])
 			return (False, message, path)
 		# Check value
 		(ret, decoded, path) = _templateMatch(message[1], template[1], u"%s.(%s)" % (path, unicode(message[0])))
@@ -3076,7 +3270,7 @@ def _templateMatch(message, template, path):
 	# unless we have some * in template.
 	if isinstance(template, list):
 		if not isinstance(message, list):
-			logInternal("mismatch: %s: expected a list" % path)
+			logInternal("mismatch: %s: expected a list", path)
 			return (False, message, path)
 		
 		# Wildcard (*) support:
@@ -3112,112 +3306,470 @@ def _is_any_or_none(template):
 def _templateMatch_list(message, template, path):
 	"""
 	both message and template are lists.
-	
-	Semi-recursive implementation.
-	De-recursived on wildcard * only.
 	"""
-	logInternal("Trying to match %s with %s" % (repr(message), repr(template)))
-	# match(message, *|template) =
-	#  matched = False
-	#  i = 0
-	#  while not matched and message[i:]:
-	#   matched = match(message[i:], template)
+	logInternal("Trying to match %r with %r", message, template)
+	elementPath = u'%s.*' % path
+	elements = [ (lambda e, t = t: _templateMatch(e, t, elementPath), _is_any_or_none(t), isinstance(t, ifpresent)) for t in template ]
+	return _matchList(message, elements, path)
+
+def _matchList(message, elements, path):
+	"""
+	Matches a list against a list template, whose elements are provided
+	as matching functions.
+	
+	The template is walked element by element:
+	- an element matching the current message element consumes it,
+	- a mismatched ifpresent element is skipped,
+	- a wildcard (*) tries to let the trailing template match from each
+	  message position in turn, from the current one; a trailing wildcard
+	  matches all remaining message elements, and a wildcard matches an
+	  exhausted message.
 	
-	# An empty template can only match an empty message
-	if not template:
-		if not message:
-			return (True, [], path)
+	Iterative implementation over (message index, template index) states,
+	with backtracking on wildcards only. Since the outcome from a state
+	does not depend on how it was reached, a state is never explored
+	twice and each message element is matched at most once against each
+	template element: O(len(message) * len(template)).
+	
+	@type  message: list
+	@param message: the message to match
+	@type  elements: list of (callable, bool, bool)
+	@param elements: for each template element, (f, isAnyOrNone, isIfPresent),
+	where f(messageElement) returns a (bool, object, string) tuple as _templateMatch()
+	@type  path: string
+	@param path: the human readable path of the list template
+	
+	@rtype: tuple (bool, list, string)
+	@returns: (a, b, path) as _templateMatch().
+	The decoded list contains the decoded message elements attempted against
+	the template elements, in order, completed with the undecoded message
+	elements that were not attempted.
+	"""
+	messageLength = len(message)
+	templateLength = len(elements)
+	# States (mi, ti) are identified by an integer, mi * width + ti
+	# (no tuples: they would trigger garbage collections on long lists)
+	width = templateLength + 1
+	# State -> element matching result, for each attempted element
+	elementResults = {}
+	# Explored states
+	explored = set()
+	# Wildcard states whose trailing template did not match from the current message index
+	skipped = set()
+	# Wildcard states with untried message positions
+	choicePoints = []
+
+	mi, ti = 0, 0
+	while True:
+		state = mi * width + ti
+		if state in explored:
+			# Already explored from another wildcard position, without success
+			matched = False
 		else:
-			return (False, [], path)
-
-	# The contrary is false. A non-empty template
-	# may match an empty message (wilcards, ifpresent elements, etc)
-
-	# template header|trail	
-	th, tt = (template[0], template[1:])
-	
-	if not message:
-		if _is_any_or_none(th):
-			# matched
-			logInternal("_templateMatch_list matched: [] against [*]")
-			return (True, [], path)
-		elif isinstance(th, ifpresent):
-			# discard the optional element, check with the others
-			ret, decoded, path = _templateMatch_list(message, tt, path)
-			return (ret, decoded, path)
+			explored.add(state)
+			if ti == templateLength:
+				# An empty template can only match an empty message
+				matched = (mi == messageLength)
+			else:
+				(matchElement, isAnyOrNone, isIfPresent) = elements[ti]
+				if mi == messageLength:
+					if isIfPresent and not isAnyOrNone:
+						# discard the optional element, check with the others
+						ti += 1
+						continue
+					matched = isAnyOrNone
+				elif isAnyOrNone:
+					if ti + 1 == templateLength:
+						matched = True
+					else:
+						if mi + 1 < messageLength:
+							choicePoints.append(state)
+						ti += 1
+						continue
+				else:
+					ret = matchElement(message[mi])
+					elementResults[state] = ret
+					if ret[0]:
+						mi += 1
+						ti += 1
+						continue
+					elif isIfPresent:
+						ti += 1
+						continue
+					matched = False
+		if matched or not choicePoints:
+			break
+		# Backtrack: the wildcard consumes one more message element
+		state = choicePoints.pop()
+		skipped.add(state)
+		mi, ti = divmod(state, width)
+		mi += 1
+
+	# Now replay the retained (matching, or last attempted) path to build
+	# the decoded list and get the mismatched path
+	decodedList = []
+	mismatchedPath = path
+	mi, ti = 0, 0
+	while ti < templateLength:
+		(_, isAnyOrNone, isIfPresent) = elements[ti]
+		if mi == messageLength:
+			if isIfPresent and not isAnyOrNone:
+				ti += 1
+				continue
+			break
+		state = mi * width + ti
+		if isAnyOrNone:
+			if ti + 1 == templateLength:
+				decodedList += message[mi:]
+				break
+			if state in skipped:
+				decodedList.append(message[mi])
+				mi += 1
+			else:
+				if not matched:
+					# Last message position: the trailing template did not match from here either
+					decodedList.append(message[mi])
+				ti += 1
+			continue
+		(ret, decodedElement, p) = elementResults[state]
+		# Display why we didn't match our element, too.
+		# In case of optional elements, this may cause duplicated list elements
+		# in the decoded message, as the same element is attempted against
+		# each optional template element in a row.
+		decodedList.append(decodedElement)
+		if ret:
+			mi += 1
+			ti += 1
+		elif isIfPresent:
+			ti += 1
 		else:
-			# Other templates: no match, missing mandatory elements to match
-			return (False, [], path)
-	
-	# message header|trail
-	mh, mt = (message[0], message[1:])
-
-	if _is_any_or_none(th):
-		if not tt:
-			logInternal("_templateMatch_list matched: %s against %s ([*])" % (repr(message), repr(template)))
-			return (True, message, path)
-		matched = False
-		decodedList = []
-		trailingDecodedList = []
-		i = 0
-		mismatchedPath = path
-		while not matched and message[i:]:
-			(matched, trailingDecodedList, p) = _templateMatch_list(message[i:], tt, path)
-			if not matched:
-				mismatchedPath = p
-				decodedList.append(message[i])
-			i += 1
-		logInternal("_templateMatch_list res %s: %s against %s ([*])" % (matched, repr(message), repr(template)))
-		# decodedList += trailingDecodedList
-		for e in trailingDecodedList:
-			decodedList.append(e)
-		return (matched, decodedList, mismatchedPath)
-	else:
-		# Recursive approach:
-		# we match the same element first element, and the trailing list should match, too
-		decodedList = []
+			# mismatch on non-optional element: complete with undecoded message
+			decodedList += message[mi+1:]
+			mismatchedPath = p
+			break
+
+	logInternal("_matchList res %s: %r", matched, message)
+	return (matched, decodedList, mismatchedPath)
+
+
+##
+# Compiled templates
+#
+# _compileTemplate() turns a template into a tree of matchers, so that the
+# template structure is walked and dispatched once, then matched many times
+# (typically against all the messages an alt() branch condition is
+# evaluated against).
+#
+# A compiled template matches exactly like _templateMatch() does, and
+# returns the same decoded messages and mismatched paths; these paths are
+# computed once, at compilation time.
+# Dynamic templates (callables) are evaluated and interpreted on each match.
+#
+# The template is not copied: _getTemplateState() records the template
+# parts the compiled template depends on, so that _isTemplateUnchanged()
+# can tell if it can still be used.
+##
+
+class _Matcher:
+	"""
+	A compiled template (part).
+	"""
+	def __init__(self, path, template = None):
+		# The human readable path of the matched template part
+		self.path = path
+		self._template = template
+
+	def match(self, message):
+		"""
+		@type  message: any python object, valid for a Testerman fully qualified message
+		@param message: the message to match
+
+		@rtype: tuple (bool, object, string)
+		@returns: (a, b, path), as _templateMatch()
+		"""
+		raise NotImplementedError()
+
+def _safeMatch(matcher, message):
+	"""
+	Same as templateMatch() for a compiled template: exceptions are
+	logged, and mismatch.
+	"""
+	try:
+		return matcher.match(message)
+	except Exception:
+		logUser("Exception while trying to match a template:\n%s" % getBacktrace())
+		return (False, message, matcher.path)
+
+class _AnyMatcher(_Matcher):
+	"""
+	None and any_or_none(): matches everything.
+	"""
+	def match(self, message):
+		return (True, message, self.path)
+
+class _ValueMatcher(_Matcher):
+	"""
+	Simple types: equality.
+	"""
+	def match(self, message):
+		return (message == self._template, message, self.path)
+
+class _DynamicMatcher(_Matcher):
+	"""
+	Dynamic templates: evaluated on each match.
+	"""
+	def match(self, message):
+		return _templateMatch(message, self._template(), self.path)
+
+class _CodecMatcher(_Matcher):
+	"""
+	CodecTemplate: decodes the message, then matches the proxied template.
+	"""
+	def __init__(self, path, template):
+		_Matcher.__init__(self, path, template)
+		self._matcher = _compileTemplate(template._template, path)
+
+	def match(self, message):
+		try:
+			decodedMessage = self._template.decode(message)
+		except Exception, e:
+			logInternal("mismatch: unable to decode message part with codec %s: %s", self._template._codec, str(e) + getBacktrace())
+			return (False, message, self.path)
+		logInternal("_templateMatch: message part %s decoded with codec %s: %r", self.path, self._template._codec, decodedMessage)
+		return self._matcher.match(decodedMessage)
+
+class _DictMatcher(_Matcher):
+	"""
+	Structured type: dict.
+	"""
+	def __init__(self, path, template):
+		_Matcher.__init__(self, path, template)
+		# (key, matcher, optional), for non-None template entries
+		self._entries = []
+		for key, tmplt in template.items():
+			if tmplt is None:
+				continue
+			matcher = _compileTemplate(tmplt, u"%s.{%s}" % (path, unicode(key)))
+			optional = isinstance(tmplt, (omit, any_or_none, ifpresent)) or (isinstance(tmplt, extract) and isinstance(tmplt._template, (omit, any_or_none, ifpresent)))
+			self._entries.append((key, matcher, optional))
+
+	def match(self, message):
+		if not isinstance(message, dict):
+			logInternal("mismatch: %s: expected a dict << %r >>, got << %r >>", self.path, self._template, message)
+			return (False, message, self.path)
+
+		decodedDict = {}
 		result = True
-		(ret, decodedAttemptedElement, mismatchedPath) = _templateMatch(mh, th, u'%s.*' % path)
-
-		if not ret and not isinstance(th, ifpresent):
-			# mismatch on non-optional/if present element
-			logInternal("_templateMatch_list mismatched on first element: %s against %s " % (repr(message), repr(template)))
-			result = False
-			# Display why we didn't match our element
-			decodedList.append(decodedAttemptedElement)
-			# Complete with undecoded message
-			decodedList += mt
-		elif not ret:
-			# not matching, but it was an optional/ifpresent element.
-			# We just bypass this template element and try to match the
-			# trailing template only
-			
-			# Display why we didn't match our element
-			# This may cause duplicated list elements in the 'decoded message',
-			# in particular in the cases where multiple optional matches are 
-			# attempted in a row. Actually, the same element will be matched
-			# against each optional template elements, making it appear multiple
-			# time in the final 'decoded' message used for template matching.
-			
-			# This basically leads to "expand" the message so that it contains
-			# a number of elements that can be mapped with the optional/ifpresent
-			# template elements.
-			decodedList.append(decodedAttemptedElement)
-
-			logInternal("_templateMatch_list mismatched on first optional element: %s against %s " % (repr(message), repr(template)))
-			(ret, decoded, mismatchedPath) = _templateMatch_list(message, tt, path)
-			result = ret
-			decodedList += decoded
-		else:
-			# Display why we didn't match our element
-			decodedList.append(decodedAttemptedElement)
-			logInternal("_templateMatch_list matched on first element: %s against %s " % (repr(message), repr(template)))
-			(ret, decoded, mismatchedPath) = _templateMatch_list(mt, tt, path)
-			result = ret
-			decodedList += decoded
+		mismatchedPath = None
+		for (key, matcher, optional) in self._entries:
+			if key in message:
+				(ret, decodedField, p) = matcher.match(message[key])
+				decodedDict[key] = decodedField
+				if not ret:
+					logInternal("mismatch: %s: mismatched dict entry %s", self.path, unicode(key))
+					result = False
+					mismatchedPath = p
+					# continue to traverse the dict to perform "maximum" message decoding
+			elif not optional:
+				logInternal("mismatch: %s: missing dict entry %r", self.path, key)
+				result = False
+				mismatchedPath = self.path
+		# Now, add message keys that were not matched (not in template, or any value) to the decoded dict
+		for key, m in message.items():
+			if not key in decodedDict:
+				decodedDict[key] = m
+		return (result, decodedDict, mismatchedPath)
 
-#		logInternal("_templateMatch_list res %s: %s against %s ([*])" % (result, repr(message), repr(template)))
-		return (result, decodedList, mismatchedPath)
+class _TupleMatcher(_Matcher):
+	"""
+	Structured type: tuple (choice, value).
+	"""
+	def __init__(self, path, template):
+		_Matcher.__init__(self, path, template)
+		self._choice = template[0]
+		self._matcher = _compileTemplate(template[1], u"%s.(%s)" % (path, unicode(template[0])))
+
+	def match(self, message):
+		if not isinstance(message, tuple):
+			logInternal("mismatch: %s: expected a tuple << %r >>, got << %r >>", self.path, self._template, message)
+			return (False, message, self.path)
+		if not message[0] == self._choice:
+			logInternal("mismatch: %s: tuple choices differ (message: %r, template %r)", self.path, message[0], self._choice)
+			return (False, message, self.path)
+		(ret, decoded, path) = self._matcher.match(message[1])
+		return (ret, (message[0], decoded), path)
+
+class _ListMatcher(_Matcher):
+	"""
+	Structured type: list.
+	"""
+	def __init__(self, path, template):
+		_Matcher.__init__(self, path, template)
+		# (match function, is any_or_none, is ifpresent), for each template element
+		self._elements = []
+		for tmplt in template:
+			matcher = _compileTemplate(tmplt, u'%s.*' % path)
+			self._elements.append((matcher.match, _is_any_or_none(tmplt), isinstance(tmplt, ifpresent)))
+
+	def match(self, message):
+		if not isinstance(message, list):
+			logInternal("mismatch: %s: expected a list", self.path)
+			return (False, message, self.path)
+		return _matchList(message, self._elements, self.path)
+
+class _ConditionMatcher(_Matcher):
+	"""
+	ConditionTemplate: delegates to its match().
+	"""
+	def match(self, message):
+		return (self._template.match(message, self.path), message, self.path)
+
+class _ExtractMatcher(_Matcher):
+	"""
+	extract(): matches its compiled template, then stores the decoded value.
+	"""
+	def __init__(self, path, template):
+		_Matcher.__init__(self, path)
+		self._name = template._name
+		self._matcher = _compileTemplate(template._template, path)
+
+	def match(self, message):
+		(matched, decodedMessage, _) = _safeMatch(self._matcher, message)
+		if matched:
+			_setValue(self._name, decodedMessage)
+		return (matched, message, self.path)
+
+class _IfPresentMatcher(_Matcher):
+	"""
+	ifpresent(): matches its compiled template.
+	"""
+	def __init__(self, path, template):
+		_Matcher.__init__(self, path)
+		self._matcher = _compileTemplate(template._template, path)
+
+	def match(self, message):
+		return (_safeMatch(self._matcher, message)[0], message, self.path)
+
+class _NotMatcher(_Matcher):
+	"""
+	not_(): negates its compiled template.
+	"""
+	def __init__(self, path, template):
+		_Matcher.__init__(self, path)
+		self._matcher = _compileTemplate(template._template, path)
+
+	def match(self, message):
+		return (not _safeMatch(self._matcher, message)[0], message, self.path)
+
+# Condition templates whose match() is compiled, by class.
+# Subclasses that override match() are not concerned.
+_CompiledConditionMatchers = [
+	(any_or_none, _AnyMatcher),
+	(extract, _ExtractMatcher),
+	(ifpresent, _IfPresentMatcher),
+	(not_, _NotMatcher),
+]
+
+def _getCompiledConditionMatcherClass(template):
+	"""
+	Returns the matcher class for a ConditionTemplate,
+	or None if its match() is not compiled.
+	"""
+	for (conditionClass, matcherClass) in _CompiledConditionMatchers:
+		if isinstance(template, conditionClass) and template.__class__.match.im_func is conditionClass.match.im_func:
+			return matcherClass
+	return None
+
+def _compileTemplate(template, path = u'template'):
+	"""
+	Compiles a template into a matcher.
+	The template is not copied: it must not be modified as long as
+	the matcher is used.
+	
+	@type  template: any python object, valid for a Testerman template
+	@param template: the template to compile
+	@type  path: string
+	@param path: the human readable path of the template
+	
+	@rtype: _Matcher
+	@returns: the compiled template
+	"""
+	if callable(template):
+		return _DynamicMatcher(path, template)
+	if template is None:
+		return _AnyMatcher(path)
+	if isinstance(template, CodecTemplate):
+		return _CodecMatcher(path, template)
+	if isinstance(template, dict):
+		return _DictMatcher(path, template)
+	if isinstance(template, tuple):
+		return _TupleMatcher(path, template)
+	if isinstance(template, list):
+		return _ListMatcher(path, template)
+	if isinstance(template, ConditionTemplate):
+		matcherClass = _getCompiledConditionMatcherClass(template)
+		if matcherClass is None:
+			return _ConditionMatcher(path, template)
+		return matcherClass(path, template)
+	return _ValueMatcher(path, template)
+
+def _getTemplateState(template, state = None):
+	"""
+	Returns the state of the template parts a compiled template depends on:
+	the items of its dicts and lists, and the proxied templates of its
+	CodecTemplates and compiled ConditionTemplates.
+	Only the item identities are compared by _isTemplateUnchanged(), so
+	that the state is not a copy of the template.
+	
+	@rtype: list of (object, object)
+	@returns: a list of (template part, items or proxied template)
+	"""
+	if state is None:
+		state = []
+	if callable(template) or template is None:
+		# Not compiled
+		pass
+	elif isinstance(template, dict):
+		items = template.items()
+		state.append((template, items))
+		for (_, tmplt) in items:
+			_getTemplateState(tmplt, state)
+	elif isinstance(template, list):
+		items = template[:]
+		state.append((template, items))
+		for tmplt in items:
+			_getTemplateState(tmplt, state)
+	elif isinstance(template, tuple):
+		for tmplt in template:
+			_getTemplateState(tmplt, state)
+	elif isinstance(template, CodecTemplate) or (isinstance(template, ConditionTemplate) and hasattr(template, '_template') and _getCompiledConditionMatcherClass(template)):
+		state.append((template, template._template))
+		_getTemplateState(template._template, state)
+	return state
+
+def _isTemplateUnchanged(state):
+	"""
+	Tells if a template has not been modified since its state was
+	returned by _getTemplateState().
+	
+	@rtype: bool
+	"""
+	for (template, items) in state:
+		if isinstance(template, dict):
+			if len(template) != len(items):
+				return False
+			for (key, tmplt) in items:
+				if not key in template or template[key] is not tmplt:
+					return False
+		elif isinstance(template, list):
+			if len(template) != len(items):
+				return False
+			for i in xrange(len(items)):
+				if template[i] is not items[i]:
+					return False
+		elif template._template is not items:
+			return False
+	return True
 
 
 ################################################################################
@@ -3248,11 +3800,11 @@ def triEnqueueMsg(tsiPortId, sutAddress = None, componentId = None, message = No
 	_TsiPortsLock.release()
 	
 	if tsiPort:
-		logInternal("triEnqueueMsg: received a message for tsiPort %s from %s. Enqueing it." % (str(tsiPort), str(sutAddress)))
+		logInternal("triEnqueueMsg: received a message for tsiPort %s from %s. Enqueing it.", tsiPort, sutAddress)
 		tsiPort._enqueue(message, sutAddress)
 	else:
 		# Late message ? just discard it.
-		logInternal("triEnqueueMsg: received a message for unmapped tsiPortId %s. Not delivering to userland, discarding." % str(tsiPortId))
+		logInternal("triEnqueueMsg: received a message for unmapped tsiPortId %s. Not delivering to userland, discarding.", tsiPortId)
 
 TestermanSA.registerTriEnqueueMsgFunction(triEnqueueMsg)
 
@@ -3520,6 +4072,19 @@ def wait(duration, name = "wait"):
 def define_codec_alias(name, codec, **kwargs):
 	TestermanCD.alias(name, codec, **kwargs)
 
+def set_tri_send_mode(mode):
+	"""
+	Sets the default mode used to send messages through remote probes:
+	- 'synchronous' (default): each send waits for the probe acknowledgement,
+	  errors are raised immediately
+	- 'pipelined': sends do not wait, the message ordering per probe is kept;
+	  errors are logged as soon as they are known, and raised on the next
+	  send through the same probe (or when the probe is unmapped)
+	
+	May be overriden per binding with TestAdapterConfiguration.setTriSendMode().
+	"""
+	TestermanSA.setDefaultTriSendMode(mode)
+
 
 ################################################################################
 # Additional init/finalization fonctions
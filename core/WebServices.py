@@ -52,7 +52,7 @@ import zlib
 #: API versions: major.minor
 #: major += 1 if not backward compatible,
 #: minor += 1 if feature-enriched, backward compatible
-WS_VERSION = '1.8'
+WS_VERSION = '1.9'
 
 
 ################################################################################
@@ -247,14 +247,24 @@ def scheduleCampaign(source, campaignId, username, session, at, path = None):
 	getLogger().info("<< scheduleCampaign(...): %s" % str(res))
 	return res
 
-def getJobInfo(jobId = None):
+def getJobInfo(jobId = None, filters = None, offset = 0, limit = None):
 	"""
 	Gets a job or all jobs information.
 
-	@since: 1.0
+	@since: 1.0 (filters, offset, limit: 1.9)
 
 	@type  jobId: integer, or None
 	@param jobId: the job ID identifying the job whose status should be retrieved, or None for all jobs.
+	@type  filters: dict, or None
+	@param filters: when jobId is None, only returns the jobs matching all these criteria:
+	                {'state': string or list of strings, 'username': string,
+	                 'parent-id': integer (0 for root jobs),
+	                 'since': float, 'until': float (the job start time, or its scheduled
+	                 start time if not started, must be in [since, until[)}
+	@type  offset: integer
+	@param offset: the number of matching jobs to skip
+	@type  limit: integer, or None
+	@param limit: the maximum number of jobs to return, or None for all
 	
 	@throws Exception: in case of an internal error.
 
@@ -266,14 +276,15 @@ def getJobInfo(jobId = None):
 	        'type': string in ['ats', 'campaign'],
 					'path': string (docroot-based path for jobs whose source is in docroot) or None (client-based source)
 	       }
-	@returns: a list of info for the given job, or for all jobs in the queue if jobId is None.
+	@returns: a list of info for the given job, or for all (matching) jobs in the queue,
+	in queue order, if jobId is None.
 
 	@throws Exception: when the job was not found, or when the job file was removed.
 	"""
-	getLogger().info(">> getJobInfo(%s)" % str(jobId))
+	getLogger().info(">> getJobInfo(%s, %s, %s, %s)" % (str(jobId), str(filters), offset, str(limit)))
 	res = []
 	try:
-		res = JobManager.instance().getJobInfo(jobId)
+		res = JobManager.instance().getJobInfo(jobId, filters, offset, limit)
 	except Exception, e:
 		e =  Exception("Unable to complete getJobInfo operation: %s\n%s" % (str(e), Tools.getBacktrace()))
 		getLogger().info("<< getJobInfo(...): Fault:\n%s" % str(e))
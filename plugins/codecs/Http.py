@@ -18,6 +18,7 @@
 ##
 
 import CodecManager
+import StreamFraming
 
 import re
 
@@ -31,6 +32,32 @@ def chunk(body):
 	"""
 	return "%x\r\n%s\r\n0\r\n" % (len(body), body)
 
+def decodeHeaders(lines):
+	"""
+	Decodes header lines to a dict of lower-case header names/values.
+	"""
+	headers = {}
+	for header in lines:
+		l = header.strip()
+		m = HEADERLINE_REGEXP.match(l)
+		if m:
+			headers[m.group('header').lower()] = m.group('value')
+		else:
+			raise Exception("Invalid header in message (%s)" % str(l))
+	return headers
+
+def getBodyLength(headers, default):
+	"""
+	Returns the body length of a message to decode from a stream,
+	as expected by StreamFraming.HeaderFramedStreamDecoder.
+	"""
+	if headers.get('transfer-encoding', None) == 'chunked':
+		return StreamFraming.CHUNKED
+	contentLength = headers.get('content-length', None)
+	if contentLength is not None:
+		return int(contentLength)
+	return default
+
 
 class HttpRequestCodec(CodecManager.IncrementalCodec):
 	"""
@@ -60,7 +87,8 @@ class HttpRequestCodec(CodecManager.IncrementalCodec):
 	
 	...
 	
-	This is an incremental decoder.
+	This is an incremental decoder, that also provides a stream decoder
+	(used by stream transport probes, such as `tcp`, when available).
 
 	It automatically waits for a complete payload before passing it to
 	your application, supporting content-length header (if present)
@@ -255,6 +283,23 @@ class HttpRequestCodec(CodecManager.IncrementalCodec):
 		
 		return self.decoded(ret, self.getSummary(ret))
 
+	def createStreamDecoder(self):
+		return StreamFraming.HeaderFramedStreamDecoder(self)
+
+	def decodeStreamHead(self, head):
+		lines = head.split('\r\n')
+		m = REQUESTLINE_REGEXP.match(lines[0])
+		if not m:
+			raise Exception("Invalid request line (%s)"% lines[0])
+		ret = { 'method': m.group('method'), 'url': m.group('url'), 'version': m.group('version') }
+		ret['headers'] = decodeHeaders(lines[1:])
+		# No body without a content-length or a transfer-encoding
+		return (ret, getBodyLength(ret['headers'], 0))
+
+	def decodeStreamBody(self, ret, body):
+		ret['body'] = body
+		return (ret, self.getSummary(ret))
+
 	def getSummary(self, template):
 		"""
 		Returns the summary of the template representing an RTSP message.
@@ -293,7 +338,8 @@ class HttpResponseCodec(CodecManager.IncrementalCodec):
 	
 	...
 	
-	This is an incremental decoder.
+	This is an incremental decoder, that also provides a stream decoder
+	(used by stream transport probes, such as `tcp`, when available).
 
 	It automatically waits for a complete payload before passing it to
 	your application, supporting content-length header (if present)
@@ -488,6 +534,25 @@ class HttpResponseCodec(CodecManager.IncrementalCodec):
 		
 		return self.decoded(ret, self.getSummary(ret))
 
+	def createStreamDecoder(self):
+		return StreamFraming.HeaderFramedStreamDecoder(self)
+
+	def decodeStreamHead(self, head):
+		lines = head.split('\r\n')
+		m = STATUSLINE_REGEXP.match(lines[0])
+		if not m:
+			raise Exception("Invalid status line")
+		ret = { 'version': m.group('version'), 'status': int(m.group('status')), 'reason': m.group('reason') }
+		ret['headers'] = decodeHeaders(lines[1:])
+		# No chunk, no content-length: maybe this is normal (204, 304 and 1xx) or the body ends with the connection
+		if ret['status'] in [204, 304] or ret['status'] <= 199:
+			return (ret, getBodyLength(ret['headers'], 0))
+		return (ret, getBodyLength(ret['headers'], StreamFraming.UNTIL_CLOSE))
+
+	def decodeStreamBody(self, ret, body):
+		ret['body'] = body
+		return (ret, self.getSummary(ret))
+
 	def getSummary(self, template):
 		"""
 		Returns the summary of the template representing an RTSP message.
@@ -18,6 +18,7 @@
 ##
 
 import CodecManager
+import StreamFraming
 
 import re
 
@@ -58,6 +59,10 @@ automatically. If the length is not valid, the decoding attempt fails.
 
 These codecs are usually used with :doc:`the UDP probe <ProbeUdp>` to implement solutions that can test an RTSP implementation.
 
+They also provide a stream decoder, so that they can be used as the ``default_decoder``
+of :doc:`the TCP probe <ProbeTcp>`: messages are then delimited according to their
+Content-Length header (no body if not present).
+
 Availability
 ~~~~~~~~~~~~
 
@@ -157,6 +162,15 @@ TTCN-3 Types Equivalence
 		
 		return (ret, self.getSummary(ret))
 
+	def createStreamDecoder(self):
+		return StreamFraming.HeaderFramedStreamDecoder(self)
+
+	def decodeStreamHead(self, head):
+		return (head, StreamFraming.getContentLength(head) or 0)
+
+	def decodeStreamBody(self, head, body):
+		return self.decode(head + '\r\n\r\n' + body)
+
 	def getSummary(self, template):
 		"""
 		Returns the summary of the template representing an RTSP message.
@@ -257,6 +271,15 @@ class RtspResponseCodec(CodecManager.Codec):
 		
 		return (ret, self.getSummary(ret))
 
+	def createStreamDecoder(self):
+		return StreamFraming.HeaderFramedStreamDecoder(self)
+
+	def decodeStreamHead(self, head):
+		return (head, StreamFraming.getContentLength(head) or 0)
+
+	def decodeStreamBody(self, head, body):
+		return self.decode(head + '\r\n\r\n' + body)
+
 	def getSummary(self, template):
 		"""
 		Returns the summary of the template representing an RTSP message.
@@ -355,6 +355,7 @@ type record Response {
 """
 
 import CodecManager
+import StreamFraming
 
 
 import re
@@ -887,6 +888,17 @@ class SipCodec(CodecManager.Codec):
 	def decode(self, data):
 		return (decodeMessage(data), 'SIP message')
 
+	# Stream decoding (SIP over TCP): messages are delimited by their Content-Length,
+	# mandatory on stream transports (RFC 3261, 18.3)
+	def createStreamDecoder(self):
+		return StreamFraming.HeaderFramedStreamDecoder(self)
+
+	def decodeStreamHead(self, head):
+		return (head, StreamFraming.getContentLength(head, ('content-length', 'l')) or 0)
+
+	def decodeStreamBody(self, head, body):
+		return self.decode(head + '\r\n\r\n' + body)
+
 if __name__ != '__main__':
 	CodecManager.registerCodecClass('sip', SipCodec)
 
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Resumable message framing for stream decoders
+# (see CodecManager.StreamDecoder).
+#
+# Not a codec by itself: provides stream decoder base classes
+# to the codecs that support stream decoding.
+##
+
+import CodecManager
+
+
+class BufferedStreamDecoder(CodecManager.StreamDecoder):
+	"""
+	Base class for stream decoders that accumulate the stream in a buffer,
+	and identify the messages it contains by scanning it from the
+	position they stopped at on the previous feed().
+
+	Subclasses implement _parse(), that consumes the buffered bytes
+	from self._start, and calls _complete(), _invalid() or _error() for each
+	identified message (or garbage).
+	"""
+	def __init__(self, codec):
+		CodecManager.StreamDecoder.__init__(self, codec)
+		self._buffer = bytearray()
+		# Start of the current message in the buffer
+		self._messageStart = 0
+		# Current parsing position in the buffer
+		self._start = 0
+		self._results = []
+
+	def feed(self, data):
+		self._buffer.extend(data)
+		self._results = []
+		self._parse()
+		# Drops the bytes of the completed messages, once per feed
+		if self._messageStart:
+			del self._buffer[:self._messageStart]
+			self._rebase(self._messageStart)
+			self._messageStart = 0
+		return self._results
+
+	def close(self):
+		self._results = []
+		self._parse()
+		self._close()
+		self._reset()
+		return self._results
+
+	def _rebase(self, offset):
+		"""
+		Called when the first offset bytes of the buffer are dropped.
+		Reimplement it to update the positions that are kept
+		across feeds, in addition to _start.
+		"""
+		self._start -= offset
+
+	def _reset(self):
+		"""
+		Drops the whole buffer and resets the parsing state.
+		"""
+		self._buffer = bytearray()
+		self._messageStart = 0
+		self._start = 0
+
+	def _complete(self, message, summary):
+		"""
+		The current message ends at self._start and was decoded to message.
+		"""
+		self._results.append((CodecManager.Codec.DECODING_OK, str(self._buffer[self._messageStart:self._start]), message, summary))
+		self._messageStart = self._start
+
+	def _invalid(self):
+		"""
+		The current message ends at self._start, but cannot be decoded:
+		drops it, and goes on with the next one.
+		"""
+		self._results.append((CodecManager.Codec.DECODING_ERROR, str(self._buffer[self._messageStart:self._start]), None, None))
+		self._messageStart = self._start
+
+	def _error(self):
+		"""
+		The current message cannot be decoded: drops the whole buffer,
+		as we cannot know where the next message starts.
+		"""
+		self._results.append((CodecManager.Codec.DECODING_ERROR, str(self._buffer[self._messageStart:]), None, None))
+		self._reset()
+
+	def _parse(self):
+		raise Exception("Stream parsing method not implemented")
+
+	def _close(self):
+		"""
+		Called on end of stream, once everything that could be
+		was parsed. By default, any remaining data is a decoding error.
+		"""
+		if self._messageStart < len(self._buffer):
+			self._error()
+
+
+# Body lengths returned by a codec's decodeStreamHead(), besides an actual number of bytes
+CHUNKED = -1
+UNTIL_CLOSE = -2
+
+# HeaderFramedStreamDecoder states
+_HEAD = 0
+_BODY = 1
+_CHUNK_SIZE = 2
+_CHUNK_DATA = 3
+_TRAILER = 4
+_UNTIL_CLOSE = 5
+
+class HeaderFramedStreamDecoder(BufferedStreamDecoder):
+	"""
+	Stream decoder for text protocols whose messages are made of
+	a start line and header lines, terminated by an empty line, followed
+	by a body (HTTP, RTSP, SIP).
+
+	The codec creating this decoder must implement:
+
+	decodeStreamHead(head): returns (context, bodyLength), where
+	head is the start line and header lines (without the final empty line),
+	context is anything decodeStreamBody() will need, and bodyLength
+	is the number of bytes of the body, or CHUNKED for a chunked
+	transfer-encoding, or UNTIL_CLOSE for a body terminated by the end of the
+	stream.
+
+	decodeStreamBody(context, body): returns (message, summary),
+	where body is the complete (de-chunked) body.
+
+	Both may raise exceptions in case of decoding errors.
+	"""
+	def __init__(self, codec):
+		BufferedStreamDecoder.__init__(self, codec)
+		self._state = _HEAD
+		# Where to resume looking for a line terminator
+		self._scan = 0
+		self._remaining = 0
+		self._context = None
+		self._chunks = []
+
+	def _rebase(self, offset):
+		BufferedStreamDecoder._rebase(self, offset)
+		self._scan -= offset
+
+	def _reset(self):
+		BufferedStreamDecoder._reset(self)
+		self._state = _HEAD
+		self._scan = 0
+		self._context = None
+		self._chunks = []
+
+	def _findLine(self, terminator):
+		"""
+		Returns the position of the next terminator after self._start,
+		or -1 if not received yet.
+		"""
+		i = self._buffer.find(terminator, max(self._start, self._scan))
+		if i < 0:
+			self._scan = max(self._start, len(self._buffer) - len(terminator) + 1)
+		return i
+
+	def _completeBody(self, body):
+		try:
+			(message, summary) = self.codec.decodeStreamBody(self._context, body)
+		except Exception:
+			self._invalid()
+		else:
+			self._complete(message, summary)
+		self._state = _HEAD
+		self._context = None
+		self._chunks = []
+
+	def _parse(self):
+		while True:
+			buf = self._buffer
+			if self._state == _HEAD:
+				# Empty lines between messages (keep-alives) are ignored
+				while buf[self._start:self._start+2] == '\r\n':
+					self._start += 2
+					self._messageStart = self._start
+				i = self._findLine('\r\n\r\n')
+				if i < 0:
+					return
+				head = str(buf[self._start:i])
+				self._start = i + 4
+				try:
+					(self._context, length) = self.codec.decodeStreamHead(head)
+				except Exception:
+					# Resumes on the next message head
+					self._invalid()
+					continue
+				if length == CHUNKED:
+					self._state = _CHUNK_SIZE
+				elif length == UNTIL_CLOSE:
+					self._state = _UNTIL_CLOSE
+				else:
+					self._state = _BODY
+					self._remaining = length
+
+			elif self._state == _BODY:
+				if len(buf) - self._start < self._remaining:
+					return
+				body = str(buf[self._start:self._start+self._remaining])
+				self._start += self._remaining
+				self._completeBody(body)
+
+			elif self._state == _CHUNK_SIZE:
+				i = self._findLine('\r\n')
+				if i < 0:
+					return
+				try:
+					# Ignores chunk extensions, if any
+					size = int(str(buf[self._start:i]).split(';')[0].strip(), 16)
+				except ValueError:
+					self._error()
+					return
+				self._start = i + 2
+				if size:
+					self._state = _CHUNK_DATA
+					self._remaining = size
+				else:
+					self._state = _TRAILER
+
+			elif self._state == _CHUNK_DATA:
+				# The chunk data, followed by an empty line
+				if len(buf) - self._start < self._remaining + 2:
+					return
+				end = self._start + self._remaining
+				if buf[end:end+2] != '\r\n':
+					self._error()
+					return
+				self._chunks.append(str(buf[self._start:end]))
+				self._start = end + 2
+				self._state = _CHUNK_SIZE
+
+			elif self._state == _TRAILER:
+				# Trailer header lines (ignored), up to an empty line
+				i = self._findLine('\r\n')
+				if i < 0:
+					return
+				empty = (i == self._start)
+				self._start = i + 2
+				if empty:
+					self._completeBody(''.join(self._chunks))
+
+			else: # _UNTIL_CLOSE
+				return
+
+	def _close(self):
+		if self._state == _UNTIL_CLOSE:
+			body = str(self._buffer[self._start:])
+			self._start = len(self._buffer)
+			self._completeBody(body)
+		elif self._state == _TRAILER:
+			# Tolerates a missing final empty line after the last chunk
+			self._start = len(self._buffer)
+			self._completeBody(''.join(self._chunks))
+		BufferedStreamDecoder._close(self)
+
+
+def getContentLength(head, names = ('content-length', )):
+	"""
+	Returns the value of the first Content-Length header
+	(or any other header from names, case insensitive) in a message head,
+	or None if there is none.
+
+	@type  head: string
+	@param head: the start line and header lines of a message
+	@type  names: list of strings
+	@param names: the lower-case names of the content-length header
+
+	@rtype: integer, or None
+	@returns: the header value
+	"""
+	for line in head.split('\r\n')[1:]:
+		if ':' in line:
+			(name, value) = line.split(':', 1)
+			if name.strip().lower() in names:
+				return int(value.strip())
+	return None
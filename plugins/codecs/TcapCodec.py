@@ -33,6 +33,7 @@ class TcapCodec(BerCodec.BerCodec):
 	
 	Properties:
 	|| '''Name''' || '''Type''' || '''Default value''' || '''Description''' ||
+	|| `lazy` || boolean || `False` || If set, SEQUENCE values (dialogue portion, components, their parameters...) are only decoded when accessed, for instance when matched against a template. Useful to match a few fields of large PDUs. Decoding errors are then raised on access ||
 	
 	= Overview =
 	
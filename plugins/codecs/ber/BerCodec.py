@@ -22,6 +22,7 @@
 ##
 
 import CodecManager
+import StreamFraming
 
 import Yapasn1 as asn1
 
@@ -34,18 +35,31 @@ class BerCodec(CodecManager.Codec):
 	
 	You may also reimplement getSummary if
 	you have more accurate message summaries to provide.
+	
+	Properties:
+	 * lazy (bool, default False): if set, decoded SEQUENCE/SET values
+	   are only decoded on first access (see Yapasn1.LazySequence), so that
+	   matching a few fields of a large PDU does not decode all of it.
+	   Decoding errors in such values are then raised on access.
 	"""
 	PDU = None
 	
+	def __init__(self):
+		CodecManager.Codec.__init__(self)
+		self.setDefaultProperty('lazy', False)
+	
 	def encode(self, template):
 		summary = self.getSummary(template)
 		e = asn1.encode(self.PDU, template)
 		return (e, summary)
 	
 	def decode(self, data):
-		d = asn1.decode(self.PDU, data)
+		d = asn1.decode(self.PDU, data, lazy = self['lazy'])
 		summary = self.getSummary(d)
 		return (d, summary)
+
+	def createStreamDecoder(self):
+		return BerStreamDecoder(self)
 	
 	def getSummary(self, message):
 		"""
@@ -56,6 +70,109 @@ class BerCodec(CodecManager.Codec):
 		"""
 		return str(self.PDU.__class__)
 
+class BerStreamDecoder(StreamFraming.BufferedStreamDecoder):
+	"""
+	Identifies the successive BER-encoded PDUs in a stream from
+	their tag and length octets, and decodes each of them with the codec
+	once complete.
+	
+	Indefinite-length PDUs are delimited by walking their nested encodings,
+	up to their end-of-contents octets.
+	"""
+	def __init__(self, codec):
+		StreamFraming.BufferedStreamDecoder.__init__(self, codec)
+		# Nesting level of the indefinite-length encodings being walked
+		self._depth = 0
+		# End of the definite-length encoding being skipped, if any
+		self._end = None
+
+	def _rebase(self, offset):
+		StreamFraming.BufferedStreamDecoder._rebase(self, offset)
+		if self._end is not None:
+			self._end -= offset
+
+	def _reset(self):
+		StreamFraming.BufferedStreamDecoder._reset(self)
+		self._depth = 0
+		self._end = None
+
+	def _readHeader(self, pos):
+		"""
+		Reads the identifier and length octets at pos.
+		
+		@rtype: tuple (bool, integer, integer), or None
+		@returns: (constructed, length, contents position), length being None
+		for an indefinite length, or None if more octets are needed.
+		"""
+		buf = self._buffer
+		n = len(buf)
+		if pos >= n:
+			return None
+		identifier = buf[pos]
+		pos += 1
+		if identifier & 0x1f == 0x1f:
+			# High tag number, on as many octets as needed
+			while True:
+				if pos >= n:
+					return None
+				pos += 1
+				if not buf[pos - 1] & 0x80:
+					break
+		if pos >= n:
+			return None
+		l = buf[pos]
+		pos += 1
+		if l == 0x80:
+			return (bool(identifier & 0x20), None, pos)
+		if l & 0x80:
+			count = l & 0x7f
+			if pos + count > n:
+				return None
+			l = 0
+			for b in buf[pos:pos + count]:
+				l = (l << 8) | b
+			pos += count
+		return (bool(identifier & 0x20), l, pos)
+
+	def _decode(self):
+		try:
+			(message, summary) = self.codec.decode(str(self._buffer[self._messageStart:self._start]))
+		except Exception:
+			self._invalid()
+		else:
+			self._complete(message, summary)
+
+	def _parse(self):
+		while True:
+			if self._end is not None:
+				# Skipping a definite-length contents
+				if len(self._buffer) < self._end:
+					return
+				self._start = self._end
+				self._end = None
+				if not self._depth:
+					self._decode()
+			elif self._depth and self._buffer[self._start:self._start + 2] == '\x00\x00':
+				# End-of-contents of an indefinite-length encoding
+				self._start += 2
+				self._depth -= 1
+				if not self._depth:
+					self._decode()
+			else:
+				header = self._readHeader(self._start)
+				if header is None:
+					return
+				(constructed, length, pos) = header
+				if length is None:
+					if not constructed:
+						# Indefinite length is for constructed encodings only
+						self._error()
+						return
+					self._depth += 1
+					self._start = pos
+				else:
+					self._end = pos + length
+
 """
 # Example:
 
@@ -75,7 +75,7 @@
 # octetstring -> string (buffer)
 # enumerated -> string (if well known) or integer
 # null -> None
-# sequence value -> dict {'fieldName': value}
+# sequence value -> dict {'fieldName': value} (a LazySequence in lazy decoding mode)
 # sequence of value -> list
 # set -> same as sequence
 # set of -> same as sequenceof
@@ -89,6 +89,19 @@
 # NumericString -> string
 # *String -> NOT IMPLEMENTED for now
 
+# BER decoding is performed over the whole PDU buffer, with (start, end)
+# offsets delimiting the contents to decode: the buffer is never sliced
+# except to return leaf values (octet strings, any).
+#
+# Sequence fields and choices are selected from the decoded tags with
+# dispatch tables (tag key -> candidate indexes), computed from the syntax tree
+# on first use, instead of matching each candidate tag in turn.
+#
+# In lazy decoding mode (decode(..., lazy = True)), sequence values
+# are LazySequence dicts that only decode their fields on first access,
+# so that only the parts of a large PDU that are actually used
+# (template matching, user code) are decoded.
+
 # BER Encoding strategies (since multiple options are available):
 # - length byte: definite length form (both definite and undefinite forms
 #   are supported on decoding) (this is DER/CER compliant, incidentaly)
@@ -169,6 +182,30 @@ def match_tag(a, b):
 		return cons_match
 	return a[1] == b[1] and cons_match
 
+def tag_key(tag):
+	"""
+	Returns the key of a tag in dispatch tables, i.e. the tag
+	regardless of its form (primitive/constructed), as compared by match_tag().
+	"""
+	return (tag[0] & ~CONS_FLAG, tag[1])
+
+def build_dispatch_table(syntaxNodes):
+	"""
+	Returns a dict {tag key: [indexes]}, the indexes being the positions,
+	in order, of the syntax nodes that match this tag,
+	or False if a syntax node may match any tag (no table can be used).
+	"""
+	table = {}
+	for i, sn in enumerate(syntaxNodes):
+		tags = sn.possible_tags()
+		if tags is None:
+			return False
+		for tag in tags:
+			indexes = table.setdefault(tag_key(tag), [])
+			if not i in indexes:
+				indexes.append(i)
+	return table
+
 def encode_tag_ber(tag, orig_flags = None):
 	"""
 	Returns a tag (a, b) encoded to BER.
@@ -190,25 +227,22 @@ def encode_tag_ber(tag, orig_flags = None):
 		l += l2
 	return l
 
-def decode_tag_ber(buf):
+def decode_tag_ber(buf, offset = 0):
 	"""
-	Reads the tag at the beginning of buf.
-	Returns the read tag and the number of consumed bytes.
+	Reads the tag at offset in buf.
+	Returns the read tag and the offset of the next byte
+	(i.e. the number of consumed bytes if reading from the beginning of buf).
 	"""
 	if trace_debug:
-		print "DEBUG: decoding tag from %s" % binascii.hexlify(buf)
-	i = 0
-	c = ord(buf[i])
+		print "DEBUG: decoding tag from %s" % binascii.hexlify(buf[offset:])
+	c = ord(buf[offset])
 	flags = c & 0xe0
 	value = c & 0x1f
-	i += 1
+	offset += 1
 	if value == 0x1f:
-		# Needs to read more bytes
-		while c & 0x80:
-			c = ord(buf[i])
-			value = value * 128 + c & 0x7f
-			i += 1
-	return ((flags, value), i)
+		# High tag number, on the next bytes
+		(value, offset) = read_base128(buf, offset)
+	return ((flags, value), offset)
 
 def tag_str(tag, verbose = True):
 	flags, value = tag
@@ -251,15 +285,17 @@ def encode_base128(val):
 	l.reverse()
 	return ''.join(map(chr, l))
 
-def read_base128(buf):
+def read_base128(buf, offset = 0):
 	"""
 	Decodes/reads an integer value coded in pseudo-base128 from a buffer
 	@type  buf: string/buffer
+	@type  offset: integer
+	@param offset: where to start reading in buf
 	@rtype: (integer, integer)
-	@returns: (value, offset) where offset is the number of consumed bytes.
+	@returns: (value, offset) where offset is the offset of the next byte
+	(i.e. the number of consumed bytes if reading from the beginning of buf).
 	"""
 	val = 0
-	offset = 0
 	while 1:
 		b = ord(buf[offset])
 		offset += 1
@@ -307,31 +343,32 @@ def encode_len_ber(mylen):
 		l.reverse ()
 		return ''.join(map(chr, l))
 
-def decode_len_ber(buf):
+def decode_len_ber(buf, offset = 0):
 	"""
-	Reads the len at the beginning of buf.
-	Returns the read len and the number of consumed bytes.
+	Reads the len at offset in buf.
+	Returns the read len and the offset of the next byte
+	(i.e. the number of consumed bytes if reading from the beginning of buf).
 	the read len is None for end-of-content marked contents.
 	"""
-	c = ord(buf[0])
-	if c > 128:
+	c = ord(buf[offset])
+	offset += 1
+	if c & 0x80:
 		# bit 8 was set. Bit 7-1 indicate the number of bytes
 		# coding the len
 		n = c & 0x7f
 		if n == 0: # indefinite form
-			return (None, 1)
+			return (None, offset)
 		else:
 			# let's read n additional bytes
 			value = 0
-			if len(buf) < 1 + n:
-				raise BerDecodingError("Unable to decode length: expected %s bytes to code the length, only %s available" % (n+1, len(buf)))
-			for c in buf[1:1+n]:
-				value = value * 256 + ord(c)
-			return (value, 1 + n)
+			if len(buf) < offset + n:
+				raise BerDecodingError("Unable to decode length: expected %s bytes to code the length, only %s available" % (n+1, len(buf) - offset + 1))
+			for i in xrange(offset, offset + n):
+				value = value * 256 + ord(buf[i])
+			return (value, offset + n)
 	else:
 		# bit 8 not set. Bit 7-1 indicate the length
-		value = c & 0x7f
-		return (value, 1)
+		return (c, offset)
 	
 
 ################################################################################
@@ -438,38 +475,52 @@ class SyntaxNode:
 		else:
 			return match_tag(self._base_tag, tag)
 
-	def extract_element(self, buf):
+	def possible_tags(self):
+		"""
+		Returns the list of the tags that match this node
+		(see match_tag()), or None if any tag may match.
+		"""
+		tag = self._explicit_tag or self._implicit_tag or self._base_tag
+		if tag[1] == ANY_TAG:
+			return None
+		return [ tag ]
+
+	def extract_element(self, buf, offset, end):
 		"""
-		Reads a buffer assumed to start with a tag
-		Returns a tag + content + number of consumed bytes.
+		Reads the element starting with a tag at offset in buf,
+		contained before end.
+		Returns a tag + content start and end offsets + the offset of the
+		next element.
 		Checks the length.
 		"""
 		if trace_extraction:
-			print "%s: extracting element from %s" % (str(self), binascii.hexlify(buf))
-		(tag, tagbytes) = decode_tag_ber(buf)
-		buf = buf[tagbytes:]
-		(length, lenbytes) = decode_len_ber(buf)
-		content = buf[lenbytes:]
+			print "%s: extracting element from %s" % (str(self), binascii.hexlify(buf[offset:end]))
+		try:
+			(tag, start) = decode_tag_ber(buf, offset)
+			(length, start) = decode_len_ber(buf, start)
+		except IndexError:
+			raise BerDecodingError("%s: Missing bytes when decoding identifier and length bytes" % str(self))
 		if length is None:
-			# undefined form. Search an EOC ("\0\0")
-			f = buf.find('\0\0')
-			if f < 0:
-				raise BerDecodingError("%s: no End-Of-Content found in current buffer for undefinite length for tag %s." % (str(self), tag_str(tag)))
-			else:
-				content = content[:f]
-				lenbytes += 2 # the EOC bytes are consumed, too
-		elif length > len(buf):
-			raise BerDecodingError("%s: Missing bytes when decoding tag %s: expected %s, available %s" % (str(self), tag_str(tag), length, len(buf)))
+			# undefined form: the content ends with an EOC ("\0\0"), after its nested elements
+			stop = start
+			while True:
+				if stop + 2 > end:
+					raise BerDecodingError("%s: no End-Of-Content found in current buffer for undefinite length for tag %s." % (str(self), tag_str(tag)))
+				if buf[stop] == '\0' and buf[stop + 1] == '\0':
+					break
+				stop = self.extract_element(buf, stop, end)[3]
+			next = stop + 2 # the EOC bytes are consumed, too
 		else:
-			content = content[:length]
+			stop = start + length
+			if stop > end:
+				raise BerDecodingError("%s: Missing bytes when decoding tag %s: expected %s, available %s" % (str(self), tag_str(tag), length, end - start))
+			next = stop
 
-		totalbytes = tagbytes + lenbytes + len(content)		
-		
 		if trace_extraction:
-			print "%s: extracted element %s, %s bytes consumed, len %s:\n%s" % (str(self), tag_str(tag), totalbytes, len(content), binascii.hexlify(content))
-		return (tag, content, totalbytes)
+			print "%s: extracted element %s, %s bytes consumed, len %s:\n%s" % (str(self), tag_str(tag), next - offset, stop - start, binascii.hexlify(buf[start:stop]))
+		return (tag, start, stop, next)
 		
-	def decode_ber(self, tag, buf, context):
+	def decode_ber(self, tag, buf, start, end, context):
 		"""
 		BER-Decodes a buffer.
 		The buf is assumed to be decodable with this SyntaxNode,
@@ -479,23 +530,26 @@ class SyntaxNode:
 		@type  tag: tuple (flags, value)
 		@param tag: the seen tag
 		@type  buf: string/buffer
-		@param buf: the buffer to decode, already to the correct length (no incremental decoding).
-		This buf does not contain the explicit or implicit tag.
+		@param buf: the buffer containing the contents to decode
+		@type  start: integer
+		@param start: the offset of the contents to decode in buf
+		@type  end: integer
+		@param end: the offset of the end of the contents to decode in buf
+		(no incremental decoding).
+		The contents do not contain the explicit or implicit tag.
 		However, if this syntaxnode is explicitly tagged, you should expect a
-		the base_tag + length as first bytes of the given buf.
+		the base_tag + length as first bytes of the contents.
 		"""
 		if self._explicit_tag:
 			# Check that we have the base tag construct
-			(tag, content, consumedbytes) = self.extract_element(buf)
+			(tag, start, end, _) = self.extract_element(buf, start, end)
 			if not match_tag(tag, self._base_tag):
 				# In some samples, I ran into the following cases: a sequence was both explicit and implicitly tagged.
 				# Normally, since it is explicitly tagged it should be useless to check the base tag.
 				# But when checked, we got this error.
 				raise BerDecodingError("%s: expected base tag %s, got %s" % (str(self), tag_str(self._base_tag), tag_str(tag)))
-		else:
-			content = buf	
 		# OK, now we can decode the content.
-		return self.decode_content_ber(tag, content, context)
+		return self.decode_content_ber(tag, buf, start, end, context)
 	
 	##
 	# To reimplement
@@ -506,12 +560,14 @@ class SyntaxNode:
 		"""
 		raise BerEncodingError("%s: Content encoding not implemented" % str(self))
 	
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		"""
 		To reimplement in each SyntaxNode.
 		@param  tag: the tag that led to this SyntaxNode
-		@param  buf: the content buffer for this SyntaxNode, according to read length bytes.
-		             This buffer does not contain the tag nor the length bytes any more.
+		@param  buf: the buffer containing the content for this SyntaxNode
+		@param  start: the offset of the content in buf
+		@param  end: the offset of the end of the content in buf, according to read length bytes.
+		             The content does not contain the tag nor the length bytes any more.
 		"""
 		raise BerDecodingError("%s: Content decoding not implemented" % str(self))
 
@@ -533,10 +589,10 @@ class BooleanSyntaxNode(SyntaxNode):
 	def __init__(self):
 		SyntaxNode.__init__(self, base_tag = (UNIVERSAL_FLAG, BOOL_TAG))
 	
-	def decode_content_ber(self, tag, buf, context):
-		if len(buf) != 1:
-			raise BerDecodingError("%s: invalid boolean encoding (%s bytes instead of 1)" % (str(self), len(buf)))
-		if ord(buf[0]):
+	def decode_content_ber(self, tag, buf, start, end, context):
+		if end - start != 1:
+			raise BerDecodingError("%s: invalid boolean encoding (%s bytes instead of 1)" % (str(self), end - start))
+		if ord(buf[start]):
 			return True
 		else:
 			return False
@@ -581,15 +637,14 @@ class IntegerSyntaxNode(SyntaxNode):
 		else:
 			return True
 	
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		val = 0
-		if ord(buf[0]) >= 128: sgn = -1
+		if ord(buf[start]) >= 128: sgn = -1
 		else: sgn = 1
-		for b in buf:
-			b = ord(b)
-			val = 256 * val + sgn * b
+		for i in xrange(start, end):
+			val = 256 * val + sgn * ord(buf[i])
 		if sgn == -1:
-			val = - (val + pow (2, 8 * len (buf)))
+			val = - (val + pow (2, 8 * (end - start)))
 			# XXX should be much more efficient decoder here
 		
 		if not self._match_constraint(val):
@@ -640,8 +695,8 @@ class EnumeratedSyntaxNode(IntegerSyntaxNode):
 	def addValue(self, name, value):
 		self._values[name] = value
 	
-	def decode_content_ber(self, tag, buf, context):
-		val = IntegerSyntaxNode.decode_content_ber(self, tag, buf, context)
+	def decode_content_ber(self, tag, buf, start, end, context):
+		val = IntegerSyntaxNode.decode_content_ber(self, tag, buf, start, end, context)
 		for k, v in self._values.items():
 			if v == val:
 				return k
@@ -668,9 +723,9 @@ class RealSyntaxNode(SyntaxNode):
 	def __init__(self):
 		SyntaxNode.__init__(self, base_tag = (UNIVERSAL_FLAG, REAL_TAG))
 
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		# Not implemented yet
-		return buf		
+		return buf[start:end]
 
 	def encode_content_ber(self, content, context):
 		# Not implemented yet
@@ -701,16 +756,17 @@ class BitstringSyntaxNode(SyntaxNode):
 		self._bitmap_by_bit[bit] = name
 		self._bitmap_by_name[name] = bit
 
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		# Not yet implemented
 		if is_construct(tag):
 			raise BerDecodingError("%s: BIT STRING construct decoding it not yet implemented" % str(self))		
 		else:
 			# Read first byte
-			trailing_bit_count = ord(buf[0]) & 0x7f
+			trailing_bit_count = ord(buf[start]) & 0x7f
 			current_bit = 0
 			ret = {}
-			for byte in buf[1:]:
+			for i in xrange(start + 1, end):
+				byte = buf[i]
 				for b in range(0, 8):
 					name = self._bitmap_by_bit.get(current_bit, None)
 					current_bit += 1
@@ -780,16 +836,16 @@ class OctetstringSyntaxNode(SyntaxNode):
 		SyntaxNode.__init__(self, base_tag = base_tag)
 		self._length_constraint = length_constraint
 
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		if is_construct(tag):
 			ret = []
-			while buf:
-				(t, element, length) = self.extract_element(buf)
-				buf = buf[length:]
-				ret.append(self.decode_content_ber(t, element, context))
+			while start < end:
+				(t, s, e, start) = self.extract_element(buf, start, end)
+				ret.append(self.decode_content_ber(t, buf, s, e, context))
 			return ''.join(ret)
 		else:
-			return self.from_buf(buf)
+			# Leaf value: the only place where the buffer is actually sliced
+			return self.from_buf(buf[start:end])
 	
 	def encode_content_ber(self, content, context):
 		if not isinstance(content, basestring):
@@ -847,8 +903,8 @@ class NullSyntaxNode(SyntaxNode):
 	def __init__(self):
 		SyntaxNode.__init__(self, base_tag = (UNIVERSAL_FLAG, NULL_TAG))
 	
-	def decode_content_ber(self, tag, buf, context):
-		if buf:
+	def decode_content_ber(self, tag, buf, start, end, context):
+		if end > start:
 			raise BerDecodingError('%s: non empty content for NULL value' % str(self))
 		return None
 	
@@ -867,39 +923,56 @@ class SequenceSyntaxNode(SyntaxNode):
 	def __init__(self, name):
 		SyntaxNode.__init__(self, base_tag = (UNIVERSAL_FLAG | CONS_FLAG, SEQUENCE_TAG), name = name)
 		self._fields = []
+		# Tag dispatch table to the fields, computed on first decoding
+		self._dispatch = None
 	
 	def addField(self, name, syntaxNode, optional = False, default = None):
 		"""
 		Declare a new field in the sequence.
 		"""
 		self._fields.append((name, syntaxNode, optional, (default is not None and syntaxNode.value_from_str(default)) or None))
+		self._dispatch = None
 	
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
+		if context and context.get('lazy'):
+			return LazySequence(self, tag, buf, start, end, context)
+		return self.decode_fields_ber(tag, buf, start, end, context)
+	
+	def decode_fields_ber(self, tag, buf, start, end, context):
 		"""
 		While contents remain, read the tag + length, call the associated decoder, etc.
 		"""
 		ret = {}
 		last_field_index = 0
+		fields = self._fields
+		table = self._dispatch
+		if table is None:
+			table = self._dispatch = build_dispatch_table([ sn for _, sn, _, _ in fields ])
 		
-		while buf:
-			(tag, content, consumedbytes) = self.extract_element(buf)
-			buf = buf[consumedbytes:]
+		while start < end:
+			(tag, s, e, start) = self.extract_element(buf, start, end)
 			# Now match the tag against one of our possible field - order matters
-			found = False
-			i = 0
-			for name, sn, _, _ in self._fields[last_field_index:]:
-				i += 1
-				if sn.match_tag(tag):
-					if trace_decoding:
-						print "%s: found field '%s', decoding..." % (str(self), name)
-					ret[name] = sn.decode_ber(tag, content, context)
-					if trace_decoding:
-						print "%s: field '%s' decoded" % (str(self), name)
-					found = True
-					last_field_index = last_field_index + i # Make sure we detect the field only once and in the correct order.
-					break
+			index = None
+			if table is not False:
+				for i in table.get((tag[0] & ~CONS_FLAG, tag[1]), ()):
+					if i >= last_field_index:
+						index = i
+						break
+			else:
+				for i in xrange(last_field_index, len(fields)):
+					if fields[i][1].match_tag(tag):
+						index = i
+						break
 
-			if not found:
+			if index is not None:
+				name, sn, _, _ = fields[index]
+				if trace_decoding:
+					print "%s: found field '%s', decoding..." % (str(self), name)
+				ret[name] = sn.decode_ber(tag, buf, s, e, context)
+				if trace_decoding:
+					print "%s: field '%s' decoded" % (str(self), name)
+				last_field_index = index + 1 # Make sure we detect the field only once and in the correct order.
+			else:
 				if trace_decoding:
 					print("%s: INFO: consumed an unexpected field in sequence, tag %s" % (str(self), tag_str(tag)))
 		
@@ -934,6 +1007,89 @@ class SequenceSyntaxNode(SyntaxNode):
 				raise BerEncodingError("%s: missing mandatory field '%s' in sequence" % (str(self), name))
 
 		return ''.join(buf)
+
+
+class LazySequence(dict):
+	"""
+	A sequence value decoded on first access.
+	
+	Holds the sequence contents (buf, start, end) until any dict method is
+	called, then decodes its fields (only this level: nested sequences are
+	LazySequences too) and behaves as a plain dict.
+	
+	Decoding errors are thus raised on first access, not when
+	decoding the PDU.
+	Pickling or copying it returns a plain dict.
+	NB: C-level dict accesses (dict(value), json.dumps(value), f(**value),
+	{}.update(value)...) read the storage directly: they only see the fields
+	once decoded. materialize() must be called before the value is handed
+	over to such code (the TE does it before storing a matched message
+	to the userland).
+	"""
+	def __init__(self, syntaxNode, tag, buf, start, end, context):
+		dict.__init__(self)
+		self._lazy = (syntaxNode, tag, buf, start, end, context)
+	
+	def _materialize(self):
+		(syntaxNode, tag, buf, start, end, context) = self._lazy
+		dict.update(self, syntaxNode.decode_fields_ber(tag, buf, start, end, context))
+		# Only once successfully decoded, so that errors are raised on each access
+		self._lazy = None
+
+	def materialize(self):
+		"""
+		Decodes the sequence and all its nested sequences, so that
+		it can be used as a plain dict, including by C-level accesses.
+		"""
+		if self._lazy is not None:
+			self._materialize()
+		for v in dict.itervalues(self):
+			materialize(v)
+
+	def __eq__(self, other):
+		if self._lazy is not None:
+			self._materialize()
+		if isinstance(other, LazySequence) and other._lazy is not None:
+			other._materialize()
+		return dict.__eq__(self, other)
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __reduce__(self):
+		return (dict, (dict(self.items()), ))
+
+def _materializing(name):
+	method = getattr(dict, name)
+	def f(self, *args, **kwargs):
+		if self._lazy is not None:
+			self._materialize()
+		return method(self, *args, **kwargs)
+	f.__name__ = name
+	return f
+
+for _name in [ '__getitem__', '__contains__', '__iter__', '__len__', '__repr__',
+	'__setitem__', '__delitem__', 'has_key', 'get', 'keys', 'values', 'items',
+	'iterkeys', 'itervalues', 'iteritems', 'viewkeys', 'viewvalues', 'viewitems',
+	'copy', 'update', 'setdefault', 'pop', 'popitem', 'clear' ]:
+	setattr(LazySequence, _name, _materializing(_name))
+
+def materialize(value):
+	"""
+	Decodes the LazySequences contained in a decoded value, in place.
+	
+	@rtype: object
+	@returns: value
+	"""
+	if isinstance(value, LazySequence):
+		value.materialize()
+	elif isinstance(value, dict):
+		for v in value.itervalues():
+			materialize(v)
+	elif isinstance(value, (list, tuple)):
+		for v in value:
+			materialize(v)
+	return value
 		
 		
 ################################################################################
@@ -947,18 +1103,17 @@ class SequenceOfSyntaxNode(SyntaxNode):
 		SyntaxNode.__init__(self, base_tag = (UNIVERSAL_FLAG | CONS_FLAG, SEQUENCE_TAG))
 		self._syntaxNode = syntaxNode
 	
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		"""
 		While contents remain, read the tag + length, call the associated decoder, etc.
 		"""
 		ret = []
 		
-		while buf:
-			(tag, content, consumedbytes) = self.extract_element(buf)
-			buf = buf[consumedbytes:]
+		while start < end:
+			(tag, s, e, start) = self.extract_element(buf, start, end)
 			if not self._syntaxNode.match_tag(tag):
 				raise BerDecodingError("%s: invalid element in SEQUENCE OF: got %s" % (str(self), tag_str(tag)))
-			ret.append(self._syntaxNode.decode_ber(tag, content, context))
+			ret.append(self._syntaxNode.decode_ber(tag, buf, s, e, context))
 		
 		# OK
 		return ret
@@ -983,9 +1138,19 @@ class ChoiceSyntaxNode(SyntaxNode):
 		"""
 		SyntaxNode.__init__(self, base_tag = (0, -1), name = name)
 		self._choices = []
+		self._choicesByName = {}
+		# Tag dispatch table to the choices, computed on first decoding
+		self._dispatch = None
 	
 	def addChoice(self, name, syntaxNode):
 		self._choices.append((name, syntaxNode))
+		self._choicesByName.setdefault(name, syntaxNode)
+		self._dispatch = None
+	
+	def _getDispatchTable(self):
+		if self._dispatch is None:
+			self._dispatch = build_dispatch_table([ sn for _, sn in self._choices ])
+		return self._dispatch
 	
 	def match_tag(self, tag):
 		"""
@@ -994,22 +1159,42 @@ class ChoiceSyntaxNode(SyntaxNode):
 		"""
 		if self._explicit_tag:
 			return match_tag(self._explicit_tag, tag)
-		else:
-			for name, sn in self._choices:
-				if sn.match_tag(tag):
-					return True
-			return False
+		table = self._getDispatchTable()
+		if table is not False:
+			return (tag[0] & ~CONS_FLAG, tag[1]) in table
+		for name, sn in self._choices:
+			if sn.match_tag(tag):
+				return True
+		return False
+	
+	def possible_tags(self):
+		if self._explicit_tag:
+			return [ self._explicit_tag ]
+		ret = []
+		for name, sn in self._choices:
+			tags = sn.possible_tags()
+			if tags is None:
+				return None
+			ret += tags
+		return ret
 	
 	def set_implicit_tag(self, tag):
 		# A choice cannot be implicitly tagged. Even in implicit tag environnments,
 		# this is reverted to an explicit.
 		return self.set_explicit_tag(tag)
 
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		# The tag is the seen (base) tag, i.e. it selects the choice.
-		for name, sn in self._choices:
-			if sn.match_tag(tag):
-				return (name, sn.decode_ber(tag, buf, context))
+		table = self._getDispatchTable()
+		if table is not False:
+			indexes = table.get((tag[0] & ~CONS_FLAG, tag[1]))
+			if indexes:
+				name, sn = self._choices[indexes[0]]
+				return (name, sn.decode_ber(tag, buf, start, end, context))
+		else:
+			for name, sn in self._choices:
+				if sn.match_tag(tag):
+					return (name, sn.decode_ber(tag, buf, start, end, context))
 		# No match - either an invalid choice or an open choice. For now, not open.
 		raise BerDecodingError("%s: Unsupported tag %s in choice" % (str(self), tag_str(tag)))
 	
@@ -1020,22 +1205,20 @@ class ChoiceSyntaxNode(SyntaxNode):
 		if not isinstance(content, tuple) and len(content) == 2 and isinstance(content[0], basestring):
 			raise BerEncodingError("%s: Invalid value to encode, expecting a tuple (string, value)" % (str(self)))
 		name, value = content
-		for n, sn in self._choices:
-			if name == n:
-				# Found corresponding choice
-				c = sn.encode_ber(value, context)
-				if trace_encoding:
-					print "%s: choice branch '%s' encoded as:\n%s" % (str(self), name, binascii.hexlify(c))
-				# encoded, with the choice tag.
-				# Now add our explicit tag if any
-				if self._explicit_tag:
-					l = encode_len_ber(len(c))
-					i = encode_tag_ber(self._explicit_tag)
-					return i + l + c
-				else:
-					return c
-				
-		raise BerEncodingError("%s: Invalid choice %s" % (str(self), name))
+		sn = self._choicesByName.get(name)
+		if sn is None:
+			raise BerEncodingError("%s: Invalid choice %s" % (str(self), name))
+		c = sn.encode_ber(value, context)
+		if trace_encoding:
+			print "%s: choice branch '%s' encoded as:\n%s" % (str(self), name, binascii.hexlify(c))
+		# encoded, with the choice tag.
+		# Now add our explicit tag if any
+		if self._explicit_tag:
+			l = encode_len_ber(len(c))
+			i = encode_tag_ber(self._explicit_tag)
+			return i + l + c
+		else:
+			return c
 		
 	
 ################################################################################
@@ -1063,16 +1246,14 @@ class ObjectIdentifierSyntaxNode(SyntaxNode):
 			print "%s: Encoded OID:\n%s" % (str(self), binascii.hexlify(''.join(encoded)))
 		return ''.join(encoded)
 	
-	def decode_content_ber(self, tag, buf, context):
+	def decode_content_ber(self, tag, buf, start, end, context):
 		if trace_decoding:
-			print "%s: Decoding OID:\n%s" % (str(self), binascii.hexlify(buf))
-		a, b = divmod(ord(buf[0]), 40)
+			print "%s: Decoding OID:\n%s" % (str(self), binascii.hexlify(buf[start:end]))
+		a, b = divmod(ord(buf[start]), 40)
 		oid =  [ a, b ]
-		start = 1
-		mylen = len(buf)
-		while start < mylen:
-			val, consumed = read_base128(buf[start:])
-			start += consumed
+		start += 1
+		while start < end:
+			val, start = read_base128(buf, start)
 			oid.append(val)
 		return '.'.join(map(str, oid))
 
@@ -1099,20 +1280,20 @@ class AnySyntaxNode(SyntaxNode):
 	def __init__(self):
 		SyntaxNode.__init__(self, base_tag = (UNIVERSAL_FLAG, ANY_TAG))
 	
-	def decode_ber(self, tag, buf, context):
+	def decode_ber(self, tag, buf, start, end, context):
 		"""
 		Overrides the SyntaxNode complete decoding. 
-		If we are EXPLICIT tagged, buf contains the base_tag.
-		If not, buf does not contain any tag.
+		If we are EXPLICIT tagged, the contents contain the base_tag.
+		If not, the contents do not contain any tag.
 		In the later case, re-dump the base tag so that the application that will
 		get the raw buffer can manage it.
 		"""
 		if not self._explicit_tag:
-			l = encode_len_ber(len(buf))
+			l = encode_len_ber(end - start)
 			i = encode_tag_ber(tag)
-			return i + l + buf
+			return i + l + buf[start:end]
 		else:
-			return buf
+			return buf[start:end]
 	
 	def encode_ber(self, content, context):
 		"""
@@ -1170,11 +1351,14 @@ class ExternalSyntaxNode(SequenceSyntaxNode):
 def encode(syntax, content):
 	return syntax.encode_ber(content, None)
 
-def decode(syntax, buf):
-	(tag, content, _) = syntax.extract_element(buf)
+def decode(syntax, buf, lazy = False):
+	(tag, start, end, _) = syntax.extract_element(buf, 0, len(buf))
 	if not syntax.match_tag(tag):
 		raise BerDecodingError("The root PDU is incorrect, mismatching tags")
-	return syntax.decode_ber(tag, content, None)
+	context = None
+	if lazy:
+		context = { 'lazy': True }
+	return syntax.decode_ber(tag, buf, start, end, context)
 
 ################################################################################
 # Compatibility with Z3950's ASN.1 compiler's output:
@@ -1194,10 +1378,12 @@ def IMPLICIT(value, cls = CONTEXT_FLAG):
 import copy 
 
 def TYPE(tag, syntaxNode):
-	# creates a copy of the syntax node to turns into a particular tagged syntax node
+	# creates a copy of the syntax node to turns into a particular tagged syntax node.
+	# Only the node itself is tagged: its children (fields, choices...) are
+	# shared with the original syntax node, that is not modified once built.
 	if trace_debug:
 		print "DEBUG: tagging %s with %s..." % (syntaxNode, tag)
-	sn = copy.deepcopy(syntaxNode)
+	sn = copy.copy(syntaxNode)
 	explicit, flags, value = tag
 	if explicit:
 		sn.set_explicit_tag((flags, value))
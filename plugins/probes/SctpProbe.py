@@ -19,8 +19,9 @@
 ##
 
 import ProbeImplementationManager
+import CodecManager
+import SocketPolling
 
-import select
 import socket
 import sys
 import threading
@@ -38,6 +39,8 @@ class Connection:
 		self.socket = None
 		self.incoming = False
 		self.peerAddress = None
+		self.decodingBuffer = '' # accumulation of raw buffers for incremental decoding
+		self.streamDecoder = None # stateful decoder, used instead of incremental decoding when supported by the codec
 
 class SctpProbe(ProbeImplementationManager.ProbeImplementation):
 	"""
@@ -58,12 +61,16 @@ Properties:
    "``style``","string in ``'tcp'``, ``'udp'``","``'tcp'``","SCTP style: UDP or TCP (stream)"
    "``enable_notifications``","boolean","``False``","If set, you may get connection/disconnection notification and connectionConfirm/Error notification messages"
    "``default_sut_address``","string (ip:port)","``None``","If set, used as a default SUT address if none provided by the user"
+   "``default_decoder``","string","``None``","If set, must be a valid codec name. This codec is then used to decode all incoming data, and the probe only raises an incoming message when the codec successfully decoded something, as with :doc:`ProbeTcp`."
 
 Overview
 --------
 
 This probe was used to implement SUA-based testing with a TCPA/MAP stack to simulate HLRs.
 
+If the default decoder provides a stream decoder (such as BER-based codecs), a stateful decoder is used
+for each association. Otherwise, its incremental decoding implementation is used.
+
 Availability
 ~~~~~~~~~~~~
 
@@ -125,6 +132,7 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 		self.setDefaultProperty('style', 'tcp')
 		self.setDefaultProperty('enable_notifications', False)
 		self.setDefaultProperty('default_sut_address', None)
+		self.setDefaultProperty('default_decoder', None)
 
 		# For future use (only datagram mode is supported for now - no context kept per peer address):
 		# || `size` || integer || `0` || Fixed-size packet strategy: if set to non-zero, only raises messages when `size` bytes have been received. All raised messages will hage this constant size. ||
@@ -240,13 +248,29 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 			self.getLogger().info("Connected to %s" % str(to))
 		return conn
 	
+	def _createStreamDecoder(self):
+		"""
+		Returns a new stream decoder for a connection, or None if there is
+		no default decoder or if it does not support stream decoding.
+		"""
+		decoder = self['default_decoder']
+		if not decoder:
+			return None
+		try:
+			return CodecManager.createStreamDecoder(decoder)
+		except Exception, e:
+			self.getLogger().warning("Unable to create a stream decoder for codec %s: %s" % (decoder, str(e)))
+			return None
+
 	def _registerOutgoingConnection(self, sock, addr):
 		c = Connection()
 		c.socket = sock
 		c.peerAddress = addr
 		c.incoming = False
+		c.streamDecoder = self._createStreamDecoder()
 		self._lock()
 		self._connections[addr] = c
+		self._registerSocket(sock)
 		self._unlock()
 		return c
 	
@@ -255,8 +279,10 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 		c.socket = sock
 		c.peerAddress = addr
 		c.incoming = True
+		c.streamDecoder = self._createStreamDecoder()
 		self._lock()
 		self._connections[addr] = c
+		self._registerSocket(sock)
 		self._unlock()
 		return c
 	
@@ -278,6 +304,7 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 		if addr in self._connections:
 			conn = self._connections[addr]
 			del self._connections[addr]
+			self._unregisterSocket(conn.socket)
 		self._unlock()
 
 		conn.socket.close()
@@ -315,7 +342,8 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 			self._listeningSocket = socket.socket(socket.AF_INET, style, IPPROTO_SCTP)
 			self._listeningSocket.bind(addr)
 			self._listeningSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-			self._listeningSocket.listen(10)
+			self._listeningSocket.listen(socket.SOMAXCONN)
+			self._registerSocket(self._listeningSocket)
 		except Exception, e:
 			raise e
 	
@@ -324,19 +352,46 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 		# Should be mutex-protected
 		if self._listeningSocket:
 			self.getLogger().info("Stopping listening...")
+			self._unregisterSocket(self._listeningSocket)
 			self._listeningSocket.close()
 			self._listeningSocket = None
 			self.getLogger().info("Stopped listening")
 	
 	def _startPollingThread(self):
+		# Locked, so that the sockets registered meanwhile are not missed
+		self._lock()
 		if not self._pollingThread:
 			self._pollingThread = PollingThread(self)
 			self._pollingThread.start()
+		self._unlock()
 
 	def _stopPollingThread(self):
+		self._lock()
+		pollingThread = self._pollingThread
+		self._pollingThread = None
+		self._unlock()
+		# Not locked: the thread may need the lock to terminate
+		if pollingThread:
+			pollingThread.stop()
+
+	def _registerSocket(self, sock):
+		"""
+		Makes the polling thread, if any, wait for data on a new socket.
+		"""
+		self._lock()
 		if self._pollingThread:
-			self._pollingThread.stop()
-			self._pollingThread = None
+			self._pollingThread.register(sock)
+		self._unlock()
+
+	def _unregisterSocket(self, sock):
+		"""
+		Makes the polling thread, if any, stop waiting for a socket,
+		before closing it.
+		"""
+		self._lock()
+		if self._pollingThread:
+			self._pollingThread.unregister(sock)
+		self._unlock()
 
 	def _getListeningSockets(self):
 		sockets = []
@@ -351,6 +406,19 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 		sockets = [conn.socket for conn in self._connections.values()]
 		self._unlock()
 		return sockets
+	
+	def _getPeerAddress(self, sock):
+		"""
+		Returns the peer address of the connection using sock, or None.
+		"""
+		addr = None
+		self._lock()
+		for conn in self._connections.values():
+			if conn.socket is sock:
+				addr = conn.peerAddress
+				break
+		self._unlock()
+		return addr
 		
 	def _feedData(self, addr, data):
 		conn = self._getConnection(addr)
@@ -359,8 +427,45 @@ The	test system interface port bound to such a probe complies with the ``Transpo
 		else:
 			# We are suppose to check for packetization criteria here
 			# (maxsize, timeout, ...)
-			self.logReceivedPayload("SCTP data", data, "%s:%s" % addr)
-			self.triEnqueueMsg(data, "%s:%s" % addr)
+			self._preEnqueueMsg(conn, data, "%s:%s" % addr, disconnected = (data == ''))
+
+	def _preEnqueueMsg(self, conn, msg, addr, disconnected):
+		decoder = self['default_decoder']
+		if decoder and conn.streamDecoder:
+			results = conn.streamDecoder.feed(msg)
+			if disconnected:
+				results += conn.streamDecoder.close()
+			for (status, payload, decodedMessage, summary) in results:
+				if status == CodecManager.Codec.DECODING_OK:
+					self.logReceivedPayload(summary, payload, addr)
+					self.triEnqueueMsg(decodedMessage, addr)
+				else:
+					self.getLogger().error("Unable to decode raw data with the default decoder (codec %s). Ignoring %d bytes." % (decoder, len(payload)))
+
+		elif decoder:
+			buf = conn.decodingBuffer + msg
+			# Loop on multiple possible APDUs
+			while buf:
+				(status, consumedSize, decodedMessage, summary) = CodecManager.incrementalDecode(decoder, buf, complete = disconnected)
+				if status == CodecManager.IncrementalCodec.DECODING_NEED_MORE_DATA:
+					# Do nothing. Just wait for new raw data.
+					conn.decodingBuffer = buf
+					break
+				elif status == CodecManager.IncrementalCodec.DECODING_OK:
+					if consumedSize == 0:
+						consumedSize = len(buf)
+					conn.decodingBuffer = buf[consumedSize:]
+					self.logReceivedPayload(summary, buf[:consumedSize], addr)
+					self.triEnqueueMsg(decodedMessage, addr)
+					buf = conn.decodingBuffer
+				else: # status == CodecManager.IncrementalCodec.DECODING_ERROR:
+					self.getLogger().error("Unable to decode raw data with the default decoder (codec %s). Ignoring the data." % decoder)
+					conn.decodingBuffer = ''
+					break
+
+		elif not disconnected:
+			self.logReceivedPayload("SCTP data", msg, addr)
+			self.triEnqueueMsg(msg, addr)
 
 	def _onIncomingConnection(self, sock, addr):
 		self._registerIncomingConnection(sock, addr)
@@ -373,7 +478,10 @@ class PollingThread(threading.Thread):
 	connections, based on their sockets.
 	It also waits for incoming connections on listening sockets.
 	
-	These sockets are extracted from the probe when needed, that's why
+	It blocks until a socket is readable, or until it is stopped.
+	The sockets to wait for are registered by the probe with register()
+	and unregister() when created/closed. The sockets that exist when
+	the thread is created are extracted from the probe, that's why
 	the probe implements the following interface:
 		_getListeningSockets()
 		_getActiveSockets()
@@ -384,20 +492,30 @@ class PollingThread(threading.Thread):
 		threading.Thread.__init__(self)
 		self._probe = probe
 		self._stopEvent = threading.Event()
+		self._poller = SocketPolling.Poller()
+		for s in probe._getListeningSockets() + probe._getActiveSockets():
+			self._poller.register(s)
+	
+	def register(self, sock):
+		self._poller.register(sock)
+	
+	def unregister(self, sock):
+		self._poller.unregister(sock)
 	
 	def stop(self):
 		self._stopEvent.set()
+		self._poller.wakeUp()
 		self.join()
+		self._poller.close()
 	
 	def run(self):
 		# Main poll loop
 		while not self._stopEvent.isSet():
 			try:
+				r = self._poller.poll()
+				if not r:
+					continue
 				listening = self._probe._getListeningSockets()
-				active = self._probe._getActiveSockets()
-				rset = listening + active
-
-				r, w, e = select.select(rset, [], [], 0.001)
 				for s in r:
 					try:
 						if s in listening:
@@ -406,11 +524,22 @@ class PollingThread(threading.Thread):
 							self._probe._onIncomingConnection(sock, addr)
 							# Raise a new connection notification event - soon
 						else:
-							addr = s.getpeername()
-							self._probe.getLogger().debug("New data to read from %s" % str(addr))
-							data = s.recv(65535)
+							try:
+								addr = s.getpeername()
+								self._probe.getLogger().debug("New data to read from %s" % str(addr))
+								data = s.recv(65535)
+							except socket.error, e:
+								# A socket in error would be readable forever
+								addr = self._probe._getPeerAddress(s)
+								self._probe.getLogger().warning("socket error on connection with %s: %s" % (str(addr), str(e)))
+								if addr is None:
+									self._poller.unregister(s)
+								else:
+									self._probe._disconnect(addr, reason = "socket error: %s" % str(e))
+								continue
 							if not data:
 								self._probe.getLogger().debug("%s disconnected by peer" % str(addr))
+								self._probe._feedData(addr, '') # notify the feeder that we won't have more data
 								self._probe._disconnect(addr, reason = "disconnected by peer")
 							else:
 								# New received message.
@@ -421,8 +550,9 @@ class PollingThread(threading.Thread):
 					
 			except Exception, e:
 				self._probe.getLogger().warning("exception while polling active/listening sockets: %s" % str(e))
-				# Avoid 100% CPU usage when select() raised an error
+				# Avoid 100% CPU usage when poll() raises an error
 				time.sleep(0.01)	
 
 
+
 ProbeImplementationManager.registerProbeImplementationClass('sctp', SctpProbe)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+##
+# This file is part of Testerman, a test automation system.
+# Copyright (c) 2008-2012 Sebastien Lefevre and other contributors
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+##
+
+##
+# Socket readiness polling for socket-based probes
+# (TCP, UDP, SCTP probes).
+#
+# Not a probe by itself: provides a poller the probes register
+# their sockets to, instead of building the list of sockets to select()
+# on each polling loop.
+##
+
+import errno
+import os
+import select
+import threading
+import time
+
+
+class Poller:
+	"""
+	Waits for sockets to be readable.
+
+	Sockets are registered/unregistered incrementally, from any thread,
+	while another thread waits for them with poll().
+
+	Uses epoll when available (Linux), poll otherwise, so that the number
+	of sockets is not limited by FD_SETSIZE. A wake-up pipe interrupts
+	a pending poll(), so that it can block until there is something to do.
+
+	On platforms without poll (Windows), falls back to select(), with
+	a short timeout instead of the wake-up pipe.
+	"""
+	# Timeout used with select(), that cannot wait for the wake-up pipe on all platforms
+	SELECT_TIMEOUT = 0.05
+
+	def __init__(self):
+		self._mutex = threading.RLock()
+		# Registered sockets, indexed by their file descriptors
+		self._sockets = {}
+		self._wakeUpPipe = None
+		if hasattr(select, 'epoll'):
+			self._epoll = select.epoll()
+			self._poll = None
+		elif hasattr(select, 'poll'):
+			self._epoll = None
+			self._poll = select.poll()
+		else:
+			self._epoll = None
+			self._poll = None
+		if self._epoll or self._poll:
+			import fcntl
+			self._wakeUpPipe = os.pipe()
+			# Never blocks on wake-up: a single pending byte is enough
+			fcntl.fcntl(self._wakeUpPipe[1], fcntl.F_SETFL, fcntl.fcntl(self._wakeUpPipe[1], fcntl.F_GETFL) | os.O_NONBLOCK)
+			self._register(self._wakeUpPipe[0])
+
+	def _register(self, fd):
+		if self._epoll:
+			self._epoll.register(fd, select.EPOLLIN)
+		elif self._poll:
+			self._poll.register(fd, select.POLLIN)
+
+	def register(self, sock):
+		"""
+		Adds a socket to wait for.
+		Registering a socket twice has no effect.
+
+		@type  sock: socket object
+		@param sock: the socket to register
+		"""
+		self._mutex.acquire()
+		try:
+			fd = sock.fileno()
+			if fd in self._sockets:
+				return
+			self._sockets[fd] = sock
+			self._register(fd)
+		finally:
+			self._mutex.release()
+		if self._poll:
+			# A pending poll() only considers the fds registered when it was called
+			self.wakeUp()
+
+	def unregister(self, sock):
+		"""
+		Removes a socket to wait for.
+		Must be called before closing the socket.
+
+		@type  sock: socket object
+		@param sock: the socket to unregister
+		"""
+		self._mutex.acquire()
+		try:
+			for fd, s in self._fdItems(sock):
+				del self._sockets[fd]
+				try:
+					if self._epoll:
+						self._epoll.unregister(fd)
+					elif self._poll:
+						self._poll.unregister(fd)
+				except (IOError, OSError, KeyError):
+					pass
+		finally:
+			self._mutex.release()
+
+	def _fdItems(self, sock):
+		"""
+		Returns the registered (fd, socket) for sock.
+		"""
+		try:
+			fd = sock.fileno()
+			if self._sockets.get(fd) is sock:
+				return [ (fd, sock) ]
+		except Exception:
+			# Already closed socket
+			pass
+		return [ (fd, s) for fd, s in self._sockets.items() if s is sock ]
+
+	def wakeUp(self):
+		"""
+		Interrupts a pending poll(), from another thread.
+		"""
+		if self._wakeUpPipe:
+			try:
+				os.write(self._wakeUpPipe[1], 'x')
+			except OSError:
+				pass
+
+	def poll(self, timeout = None):
+		"""
+		Waits for registered sockets to be readable (or disconnected,
+		or in error), or for a wakeUp().
+
+		@type  timeout: float, or None
+		@param timeout: the maximum time to wait, in s, or None to wait
+		until something happens
+
+		@rtype: list of socket objects
+		@returns: the readable sockets (empty on wake-up or timeout)
+		"""
+		if self._epoll:
+			if timeout is None:
+				timeout = -1
+			try:
+				events = self._epoll.poll(timeout)
+			except IOError, e:
+				if e.errno == errno.EINTR:
+					return []
+				raise
+			fds = [ fd for fd, _ in events ]
+		elif self._poll:
+			if timeout is not None:
+				timeout = int(timeout * 1000)
+			try:
+				events = self._poll.poll(timeout)
+			except select.error, e:
+				if e.args[0] == errno.EINTR:
+					return []
+				raise
+			fds = [ fd for fd, _ in events ]
+		else:
+			self._mutex.acquire()
+			sockets = self._sockets.values()
+			self._mutex.release()
+			if timeout is None or timeout > self.SELECT_TIMEOUT:
+				timeout = self.SELECT_TIMEOUT
+			if not sockets:
+				# select() does not support empty lists on all platforms
+				time.sleep(timeout)
+				return []
+			r, w, e = select.select(sockets, [], [], timeout)
+			return r
+
+		ret = []
+		self._mutex.acquire()
+		try:
+			for fd in fds:
+				if self._wakeUpPipe and fd == self._wakeUpPipe[0]:
+					os.read(fd, 4096)
+				else:
+					sock = self._sockets.get(fd)
+					# Ignores the sockets that were unregistered in the meantime
+					if sock is not None:
+						ret.append(sock)
+		finally:
+			self._mutex.release()
+		return ret
+
+	def close(self):
+		"""
+		Releases the poller resources.
+		The registered sockets are not closed.
+		"""
+		self._mutex.acquire()
+		try:
+			self._sockets = {}
+			if self._epoll:
+				self._epoll.close()
+			if self._wakeUpPipe:
+				os.close(self._wakeUpPipe[0])
+				os.close(self._wakeUpPipe[1])
+				self._wakeUpPipe = None
+		finally:
+			self._mutex.release()
@@ -20,8 +20,8 @@
 
 import ProbeImplementationManager
 import CodecManager
+import SocketPolling
 
-import select
 import socket
 import sys
 import threading
@@ -75,8 +75,10 @@ class Connection:
 		self.socket = None
 		self.incoming = False
 		self.peerAddress = None
-		self.buffer = '' # raw buffer
-		self.decodingBuffer = '' # accumulation of raw buffers for incremental decoding
+		self.buffer = bytearray() # raw buffer, for size/separator packetization
+		self.separatorScan = 0 # where to resume looking for the separator in buffer
+		self.decodingBuffer = bytearray() # accumulation of raw buffers for incremental decoding
+		self.streamDecoder = None # stateful decoder, used instead of incremental decoding when supported by the codec
 
 class TcpProbe(ProbeImplementationManager.ProbeImplementation):
 	"""
@@ -128,6 +130,10 @@ If none of those properties are set, the probe only considers what it read in th
 Then, the default decoder, if set, tries to decode this first raw segment. If it needs more input, it waits for the next raw segment. If multiple APDUs are detected, multiple incoming messages are raised.
 If undecodable data is detected, the raw segment is ignored.
 
+If the default decoder provides a stream decoder (such as ``http.request``, ``http.response``, ``rtsp.request``, ``rtsp.response``, ``sip``
+and BER-based codecs), a stateful decoder is used for each connection: each raw segment is only parsed once, instead
+of decoding all the accumulated segments again on each new one.
+
 If no decoder is set, the raw segment is raised as raw data.
 
 Basic SSL Support
@@ -416,13 +422,29 @@ The test system interface port bound to such a probe complies with the ``Transpo
 			self.getLogger().info("Connected to %s" % str(to))
 		return conn
 	
+	def _createStreamDecoder(self):
+		"""
+		Returns a new stream decoder for a connection, or None if there is
+		no default decoder or if it does not support stream decoding.
+		"""
+		decoder = self['default_decoder']
+		if not decoder:
+			return None
+		try:
+			return CodecManager.createStreamDecoder(decoder)
+		except Exception, e:
+			self.getLogger().warning("Unable to create a stream decoder for codec %s: %s" % (decoder, str(e)))
+			return None
+
 	def _registerOutgoingConnection(self, sock, addr):
 		c = Connection()
 		c.socket = sock
 		c.peerAddress = addr
 		c.incoming = False
+		c.streamDecoder = self._createStreamDecoder()
 		self._lock()
 		self._connections[addr] = c
+		self._registerSocket(sock)
 		self._unlock()
 		return c
 	
@@ -431,8 +453,10 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		c.socket = sock
 		c.peerAddress = addr
 		c.incoming = True
+		c.streamDecoder = self._createStreamDecoder()
 		self._lock()
 		self._connections[addr] = c
+		self._registerSocket(sock)
 		self._unlock()
 		return c
 	
@@ -463,6 +487,7 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		if addr in self._connections:
 			conn = self._connections[addr]
 			del self._connections[addr]
+			self._unregisterSocket(conn.socket)
 		self._unlock()
 
 		if conn:
@@ -508,7 +533,8 @@ The test system interface port bound to such a probe complies with the ``Transpo
 			self._listeningSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
 			self._listeningSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 			self._listeningSocket.bind(addr)
-			self._listeningSocket.listen(10)
+			self._listeningSocket.listen(socket.SOMAXCONN)
+			self._registerSocket(self._listeningSocket)
 		except Exception, e:
 			self._unlock()
 			raise e
@@ -521,6 +547,7 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		try:
 			if self._listeningSocket:
 				self.getLogger().info("Stopping listening...")
+				self._unregisterSocket(self._listeningSocket)
 				self._listeningSocket.close()
 				self._listeningSocket = None
 				self.getLogger().info("Stopped listening")
@@ -529,14 +556,40 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		self._unlock()
 	
 	def _startPollingThread(self):
+		# Locked, so that the sockets registered meanwhile are not missed
+		self._lock()
 		if not self._pollingThread:
 			self._pollingThread = PollingThread(self)
 			self._pollingThread.start()
+		self._unlock()
 
 	def _stopPollingThread(self):
+		self._lock()
+		pollingThread = self._pollingThread
+		self._pollingThread = None
+		self._unlock()
+		# Not locked: the thread may need the lock to terminate
+		if pollingThread:
+			pollingThread.stop()
+
+	def _registerSocket(self, sock):
+		"""
+		Makes the polling thread, if any, wait for data on a new socket.
+		"""
+		self._lock()
 		if self._pollingThread:
-			self._pollingThread.stop()
-			self._pollingThread = None
+			self._pollingThread.register(sock)
+		self._unlock()
+
+	def _unregisterSocket(self, sock):
+		"""
+		Makes the polling thread, if any, stop waiting for a socket,
+		before closing it.
+		"""
+		self._lock()
+		if self._pollingThread:
+			self._pollingThread.unregister(sock)
+		self._unlock()
 
 	##
 	# Interface to be pluggable on a PollingThread
@@ -554,6 +607,19 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		sockets = [conn.socket for conn in self._connections.values()]
 		self._unlock()
 		return sockets
+	
+	def _getPeerAddress(self, sock):
+		"""
+		Returns the peer address of the connection using sock, or None.
+		"""
+		addr = None
+		self._lock()
+		for conn in self._connections.values():
+			if conn.socket is sock:
+				addr = conn.peerAddress
+				break
+		self._unlock()
+		return addr
 		
 	def _feedData(self, addr, data):
 		conn = self._getConnection(addr)
@@ -562,55 +628,82 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		else:
 			# We are suppose to check for packetization criteria here
 			# (size, timeout, separator)
-			conn.buffer += data
-			msg = None
-			
 			size = self['size']
 			separator = self['separator']
 
+			buf = conn.buffer
 			if size:
-				while len(conn.buffer) >= size:
-					msg = conn.buffer[:size]
-					conn.buffer = conn.buffer[size+1:]
-					self._preEnqueueMsg(conn, msg, "%s:%s" % addr, disconnected = (data == ''))
-
-			elif separator is not None:
-				msgs = conn.buffer.split(separator)
-				for msg in msgs[:-1]:
-					self._preEnqueueMsg(conn, msg, "%s:%s" % addr, disconnected = (data == ''))
+				buf.extend(data)
+				if len(buf) >= size:
+					# Only copied once there are complete packets
+					pending = str(buf)
+					end = len(pending) - len(pending) % size
+					del buf[:end]
+					for start in xrange(0, end, size):
+						self._preEnqueueMsg(conn, pending[start:start+size], "%s:%s" % addr, disconnected = (data == ''))
+
+			elif separator:
+				separator = str(separator)
+				buf.extend(data)
+				# Only looks for the separator in the newly received data
+				i = buf.find(separator, conn.separatorScan)
+				if i < 0:
+					conn.separatorScan = max(0, len(buf) - len(separator) + 1)
+				else:
+					# The first packet may span several segments, the next ones are in data
+					msgs = str(buf[i+len(separator):]).split(separator)
+					msgs.insert(0, str(buf[:i]))
+					conn.buffer = bytearray(msgs.pop())
+					conn.separatorScan = max(0, len(conn.buffer) - len(separator) + 1)
+					for msg in msgs:
+						self._preEnqueueMsg(conn, msg, "%s:%s" % addr, disconnected = (data == ''))
 
-				conn.buffer = msgs[-1]
 			else:
-				msg = conn.buffer
-				conn.buffer = ''
 				# No separator or size criteria -> send to userland what we received according to the tcp stack
-				self._preEnqueueMsg(conn, msg, "%s:%s" % addr, disconnected = (data == ''))
+				self._preEnqueueMsg(conn, data, "%s:%s" % addr, disconnected = (data == ''))
 
 	def _preEnqueueMsg(self, conn, msg, addr, disconnected):
 		decoder = self['default_decoder']
-		if decoder:
-			buf = conn.decodingBuffer + msg
+		if decoder and conn.streamDecoder:
+			results = conn.streamDecoder.feed(msg)
+			if disconnected:
+				results += conn.streamDecoder.close()
+			for (status, payload, decodedMessage, summary) in results:
+				if status == CodecManager.Codec.DECODING_OK:
+					self.logReceivedPayload(summary, payload, addr)
+					self.triEnqueueMsg(decodedMessage, addr)
+				else:
+					self.getLogger().error("Unable to decode raw data with the default decoder (codec %s). Ignoring %d bytes." % (decoder, len(payload)))
+
+		elif decoder:
+			buf = conn.decodingBuffer
+			previousSize = len(buf)
+			buf.extend(msg)
+			# Decoded APDUs are consumed from the buffer up to start,
+			# then dropped at once
+			start = 0
 			# Loop on multiple possible APDUs
-			while buf:
-				(status, consumedSize, decodedMessage, summary) = CodecManager.incrementalDecode(decoder, buf, complete = disconnected)
+			while start < len(buf):
+				data = str(buf[start:])
+				(status, consumedSize, decodedMessage, summary) = CodecManager.incrementalDecode(decoder, data, complete = disconnected)
 				if status == CodecManager.IncrementalCodec.DECODING_NEED_MORE_DATA:
 					# Do nothing. Just wait for new raw segments.
 					self.getLogger().info("Waiting for more raw segments to complete incremental decoding (using codec %s)." % decoder)
-					conn.decodingBuffer = buf
 					break
 				elif status == CodecManager.IncrementalCodec.DECODING_OK:
 					if consumedSize == 0:
-						consumedSize = len(buf)
-					# Store what was not consumed for later
-					conn.decodingBuffer = buf[consumedSize:]
+						consumedSize = len(data)
+					# What was not consumed is kept for later
+					start += consumedSize
 					# And raise the decoded message
-					self.logReceivedPayload(summary, buf[:consumedSize], addr)
+					self.logReceivedPayload(summary, data[:consumedSize], addr)
 					self.triEnqueueMsg(decodedMessage, addr)
-					# make sure we update the local loop buffer, too
-					buf = conn.decodingBuffer 
 				else: # status == CodecManager.IncrementalCodec.DECODING_ERROR:
 					self.getLogger().error("Unable to decode raw data with the default decoder (codec %s). Ignoring the segment." % decoder)
+					if not start:
+						del buf[previousSize:]
 					break
+			del buf[:start]
 
 		else: # No default decoder
 			if not disconnected:
@@ -634,7 +727,10 @@ class PollingThread(threading.Thread):
 	connections, based on their sockets.
 	It also waits for incoming connections on listening sockets.
 	
-	These sockets are extracted from the probe when needed, that's why
+	It blocks until a socket is readable, or until it is stopped.
+	The sockets to wait for are registered by the probe with register()
+	and unregister() when created/closed. The sockets that exist when
+	the thread is created are extracted from the probe, that's why
 	the probe implements the following interface:
 		_getListeningSockets()
 		_getActiveSockets()
@@ -645,20 +741,30 @@ class PollingThread(threading.Thread):
 		threading.Thread.__init__(self)
 		self._probe = probe
 		self._stopEvent = threading.Event()
+		self._poller = SocketPolling.Poller()
+		for s in probe._getListeningSockets() + probe._getActiveSockets():
+			self._poller.register(s)
+	
+	def register(self, sock):
+		self._poller.register(sock)
+	
+	def unregister(self, sock):
+		self._poller.unregister(sock)
 	
 	def stop(self):
 		self._stopEvent.set()
+		self._poller.wakeUp()
 		self.join()
+		self._poller.close()
 	
 	def run(self):
 		# Main poll loop
 		while not self._stopEvent.isSet():
 			try:
+				r = self._poller.poll()
+				if not r:
+					continue
 				listening = self._probe._getListeningSockets()
-				active = self._probe._getActiveSockets()
-				rset = listening + active
-
-				r, w, e = select.select(rset, [], [], 0.001)
 				for s in r:
 					try:
 						if s in listening:
@@ -669,9 +775,19 @@ class PollingThread(threading.Thread):
 							self._probe._onIncomingConnection(sock, addr)
 							# Raise a new connection notification event - soon
 						else:
-							addr = s.getpeername()
-							self._probe.getLogger().debug("New data to read from %s" % str(addr))
-							data = s.recv(65535)
+							try:
+								addr = s.getpeername()
+								self._probe.getLogger().debug("New data to read from %s" % str(addr))
+								data = s.recv(65535)
+							except socket.error, e:
+								# A socket in error would be readable forever
+								addr = self._probe._getPeerAddress(s)
+								self._probe.getLogger().warning("socket error on connection with %s: %s" % (str(addr), str(e)))
+								if addr is None:
+									self._poller.unregister(s)
+								else:
+									self._probe._disconnect(addr, reason = "socket error: %s" % str(e))
+								continue
 							if not data:
 								self._probe.getLogger().debug("%s disconnected by peer" % str(addr))
 								self._probe._feedData(addr, '') # notify the feeder that we won't have more data
@@ -685,9 +801,9 @@ class PollingThread(threading.Thread):
 					
 			except Exception, e:
 				self._probe.getLogger().warning("exception while polling active/listening sockets: %s" % str(e))
-				# Avoid 100% CPU usage when select() raises an error
+				# Avoid 100% CPU usage when poll() raises an error
 				time.sleep(0.01)	
-					
+
 
 
 ProbeImplementationManager.registerProbeImplementationClass('tcp', TcpProbe)
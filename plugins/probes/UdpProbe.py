@@ -19,8 +19,8 @@
 ##
 
 import ProbeImplementationManager
+import SocketPolling
 
-import select
 import socket
 import sys
 import threading
@@ -199,6 +199,7 @@ The test system interface port bound to such a probe complies with the ``Transpo
 					sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 					sock.bind((self['local_ip'], self['local_port']))
 					self._localSocket = sock
+					self._registerSocket(sock)
 				else:
 					# Reuse the local, not listening socket ??
 					sock = self._localSocket
@@ -221,6 +222,7 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		else:
 			try:
 				assert(sock == self._localSocket)
+				self._unregisterSocket(sock)
 				sock.close()
 				self._localSocket = None
 			except:
@@ -257,6 +259,7 @@ The test system interface port bound to such a probe complies with the ``Transpo
 			self._listeningSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
 			self._listeningSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 			self._listeningSocket.bind(addr)
+			self._registerSocket(self._listeningSocket)
 		except Exception, e:
 			self._unlock()
 			raise e
@@ -267,6 +270,7 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		self._lock()
 		if self._listeningSocket:
 			self.getLogger().info("Stopping listening...")
+			self._unregisterSocket(self._listeningSocket)
 			try:
 				self._listeningSocket.close()
 			except:
@@ -276,14 +280,40 @@ The test system interface port bound to such a probe complies with the ``Transpo
 		self._unlock()
 	
 	def _startPollingThread(self):
+		# Locked, so that the sockets registered meanwhile are not missed
+		self._lock()
 		if not self._pollingThread:
 			self._pollingThread = PollingThread(self)
 			self._pollingThread.start()
+		self._unlock()
 
 	def _stopPollingThread(self):
+		self._lock()
+		pollingThread = self._pollingThread
+		self._pollingThread = None
+		self._unlock()
+		# Not locked: the thread may need the lock to terminate
+		if pollingThread:
+			pollingThread.stop()
+
+	def _registerSocket(self, sock):
+		"""
+		Makes the polling thread, if any, wait for data on a new socket.
+		"""
+		self._lock()
+		if self._pollingThread:
+			self._pollingThread.register(sock)
+		self._unlock()
+
+	def _unregisterSocket(self, sock):
+		"""
+		Makes the polling thread, if any, stop waiting for a socket,
+		before closing it.
+		"""
+		self._lock()
 		if self._pollingThread:
-			self._pollingThread.stop()
-			self._pollingThread = None
+			self._pollingThread.unregister(sock)
+		self._unlock()
 
 	def _getListeningSockets(self):
 		sockets = []
@@ -339,7 +369,10 @@ class PollingThread(threading.Thread):
 	connections, based on their sockets.
 	It also waits for incoming connections on listening sockets.
 	
-	These sockets are extracted from the probe when needed, that's why
+	It blocks until a socket is readable, or until it is stopped.
+	The sockets to wait for are registered by the probe with register()
+	and unregister() when created/closed. The sockets that exist when
+	the thread is created are extracted from the probe, that's why
 	the probe implements the following interface:
 		_getListeningSockets()
 		_getActiveSockets()
@@ -350,20 +383,27 @@ class PollingThread(threading.Thread):
 		threading.Thread.__init__(self)
 		self._probe = probe
 		self._stopEvent = threading.Event()
+		self._poller = SocketPolling.Poller()
+		for s in probe._getListeningSockets() + probe._getActiveSockets():
+			self._poller.register(s)
+	
+	def register(self, sock):
+		self._poller.register(sock)
+	
+	def unregister(self, sock):
+		self._poller.unregister(sock)
 	
 	def stop(self):
 		self._stopEvent.set()
+		self._poller.wakeUp()
 		self.join()
+		self._poller.close()
 	
 	def run(self):
 		# Main poll loop
 		while not self._stopEvent.isSet():
-			listening = self._probe._getListeningSockets()
-			active = self._probe._getActiveSockets()
-			rset = listening + active
-			
 			try:
-				r, w, e = select.select(rset, [], [], 0.001)
+				r = self._poller.poll()
 				for s in r:
 					try:
 						localaddr = s.getsockname()
@@ -377,8 +417,9 @@ class PollingThread(threading.Thread):
 			
 			except Exception, e:
 				self._probe.getLogger().warning("exception while polling active/listening sockets: %s" % str(e))
-				# Avoid 100% CPU usage when select() raised an error
+				# Avoid 100% CPU usage when poll() raised an error
 				time.sleep(0.01)	
 
 
+
 ProbeImplementationManager.registerProbeImplementationClass('udp', UdpProbe)
@@ -12,6 +12,7 @@ component_name = "pyagent"
 
 included_files = [
 "../core/CodecManager.py",
+"../core/PluginManifest.py",
 "../core/ProbeImplementationManager.py",
 "../plugins",
 "*.py",
@@ -24,6 +25,7 @@ excluded_files = [
 ".svn",
 "*.pyc",
 "*.asn",
+".plugins.manifest",
 ]
 
 
@@ -0,0 +1 @@
+../core/PluginManifest.py
\ No newline at end of file
@@ -22,6 +22,7 @@
 import TestermanMessages as Messages
 import TestermanNodes as Nodes
 import CodecManager
+import PluginManifest
 import ProbeImplementationManager
 import Version
 
@@ -454,13 +455,14 @@ class Agent(Nodes.ConnectingNode):
 		Raises an exception in case of any error.
 		"""
 		self.getLogger().info("Deploying probe %s, type %s..." % (name, type_))
-		if not ProbeImplementationManager.getProbeImplementationClasses().has_key(type_):
+		probeImplementationClass = ProbeImplementationManager.getProbeImplementationClass(type_)
+		if not probeImplementationClass:
 			raise Exception("No factory registered for probe type %s" % type_)
 		
 		if self.probes.has_key(name):
 			raise Exception("A probe with this name is already deployed on this agent")
 
-		probeImplementation = ProbeImplementationManager.getProbeImplementationClasses()[type_]()
+		probeImplementation = probeImplementationClass()
 		probe = ProbeImplementationAdapter(self, name, type_, probeImplementation)
 		# We reference the probe as deployed, though the registration may fail...
 		self.probes[name] = probe
@@ -530,7 +532,7 @@ class Agent(Nodes.ConnectingNode):
 		self.registered = False
 		req = Messages.Request(method = "REGISTER", uri = self.getUri(), protocol = "Xa", version = "1.0")
 		# we should add a list of supported probe types, os, etc ?
-		req.setHeader("Agent-Supported-Probe-Types", ','.join(ProbeImplementationManager.getProbeImplementationClasses().keys()))
+		req.setHeader("Agent-Supported-Probe-Types", ','.join(ProbeImplementationManager.getProbeImplementationTypes()))
 		response = self.request(req)
 		if not response:
 			raise Exception("Timeout")
@@ -759,22 +761,13 @@ class Agent(Nodes.ConnectingNode):
 ################################################################################
 
 def scanPlugins(paths, label):
+	"""
+	Registers the plugins found in paths.
+	They are only imported when their probes or codecs are used.
+	"""
 	for path in paths:
 		getLogger().info("Looking for %s plugins in %s..." % (label, path))
-		if not path in sys.path:
-			sys.path.append(path)
-		try:
-			for m in os.listdir(path):
-				if m.startswith('__init__') or not (os.path.isdir(path + '/' + m) or m.endswith('.py')) or m.startswith('.'):
-					continue
-				if m.endswith('.py'):
-					m = m[:-3]
-				try:
-					__import__(m)
-				except Exception, e:
-					getLogger().warning("Unable to import %s %s: %s" % (m, label, str(e)))
-		except Exception, e:
-			getLogger().info("Unable to scan %s path for %ss: %s" % (path, label, str(e)))
+	PluginManifest.scanPlugins(paths, warningCallback = getLogger().warning, debugCallback = getLogger().debug)
 
 ################################################################################
 # Main